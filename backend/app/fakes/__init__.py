@@ -0,0 +1,7 @@
+"""
+Offline stand-ins for OpenAI, Pinecone, Supabase and Telegram.
+
+Selected per service with FAKE_SERVICES (see faults). The fakes are only
+imported by the service modules when selected.
+"""
+from app.fakes.faults import fake_enabled, FaultConfig, FaultInjector, InjectedError
@@ -0,0 +1,145 @@
+"""
+faults.py: Fake service selection and fault injection.
+
+FAKE_SERVICES selects which dependencies are replaced by the in-process
+fakes in this package: a comma-separated list of "openai", "pinecone",
+"supabase" and "telegram", or "all". The service modules check it when
+they create their clients, so the whole app runs offline with
+
+    FAKE_SERVICES=all VECTOR_STORE=pinecone uvicorn app.main:app
+
+Each fake call passes through a FaultInjector configured from the
+environment, globally or per service (the per-service variable wins):
+
+- FAKE_LATENCY_MS / FAKE_<SERVICE>_LATENCY_MS: added latency per call
+- FAKE_JITTER_MS / FAKE_<SERVICE>_JITTER_MS: uniform jitter around it
+- FAKE_ERROR_RATE / FAKE_<SERVICE>_ERROR_RATE: fraction of calls that fail
+- FAKE_RATE_LIMIT / FAKE_<SERVICE>_RATE_LIMIT: calls per second before the
+  service answers with its rate-limit error (0 = unlimited)
+
+FAKE_SEED makes injected latencies and errors reproducible.
+"""
+import os
+import time
+import random
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+SERVICES = ("openai", "pinecone", "supabase", "telegram")
+
+FAKE_SERVICES = os.getenv("FAKE_SERVICES", "").lower()
+FAKE_SEED = os.getenv("FAKE_SEED")
+
+def fake_enabled(service: str) -> bool:
+    """Whether the fake of a service is selected by FAKE_SERVICES."""
+    selected = {name.strip() for name in FAKE_SERVICES.split(",") if name.strip()}
+    return "all" in selected or service in selected
+
+@dataclass
+class FaultConfig:
+    """Latency and failures injected into the calls of one fake service."""
+    latency_ms: float = 0.0
+    jitter_ms: float = 0.0
+    error_rate: float = 0.0
+    rate_limit: float = 0.0
+
+    @classmethod
+    def from_env(cls, service: str) -> "FaultConfig":
+        """Configuration of a service from FAKE_<SERVICE>_* falling back to FAKE_*."""
+        def setting(name: str) -> float:
+            value = os.getenv(f"FAKE_{service.upper()}_{name}", os.getenv(f"FAKE_{name}", "0"))
+            return float(value)
+        return cls(
+            latency_ms=setting("LATENCY_MS"),
+            jitter_ms=setting("JITTER_MS"),
+            error_rate=setting("ERROR_RATE"),
+            rate_limit=setting("RATE_LIMIT")
+        )
+
+class InjectedError(Exception):
+    """Failure injected into a fake that has no native exception type."""
+
+    def __init__(self, message: str, status_code: int = 500, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+def _default_error(service: str) -> Exception:
+    return InjectedError(f"Injected {service} failure", status_code=500)
+
+def _default_rate_limit_error(service: str, retry_after: float) -> Exception:
+    return InjectedError(f"Injected {service} rate limit", status_code=429, retry_after=retry_after)
+
+class FaultInjector:
+    """
+    Decides the latency and failure of each fake call.
+
+    Rate limiting is a token bucket holding one second of calls: calls
+    beyond rate_limit per second fail immediately with the service's
+    rate-limit error, carrying the seconds until a call would be admitted.
+    Other calls are delayed by latency ± jitter and fail with probability
+    error_rate after the delay, like a real server error.
+    """
+
+    def __init__(
+        self,
+        service: str,
+        config: Optional[FaultConfig] = None,
+        error: Optional[Callable[[], Exception]] = None,
+        rate_limit_error: Optional[Callable[[float], Exception]] = None,
+        seed: Optional[int] = None,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.service = service
+        self.config = config if config is not None else FaultConfig.from_env(service)
+        self.error = error or (lambda: _default_error(service))
+        self.rate_limit_error = rate_limit_error or (lambda retry_after: _default_rate_limit_error(service, retry_after))
+        if seed is None and FAKE_SEED is not None:
+            seed = int(FAKE_SEED)
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.calls = 0
+        self.failures = 0
+        self._tokens = self.config.rate_limit
+        self._refilled = clock()
+        self._lock = threading.Lock()
+
+    def _outcome(self) -> Tuple[float, Optional[Exception]]:
+        """Delay in seconds and exception (or None) for the next call."""
+        config = self.config
+        with self._lock:
+            self.calls += 1
+            if config.rate_limit > 0:
+                now = self.clock()
+                self._tokens = min(config.rate_limit, self._tokens + (now - self._refilled) * config.rate_limit)
+                self._refilled = now
+                if self._tokens < 1:
+                    self.failures += 1
+                    return 0.0, self.rate_limit_error((1 - self._tokens) / config.rate_limit)
+                self._tokens -= 1
+
+            delay = config.latency_ms
+            if config.jitter_ms:
+                delay += self.random.uniform(-config.jitter_ms, config.jitter_ms)
+            failed = config.error_rate > 0 and self.random.random() < config.error_rate
+            if failed:
+                self.failures += 1
+        return max(delay, 0.0) / 1000, self.error() if failed else None
+
+    async def acall(self) -> None:
+        """Apply the injected latency and failure to an async call."""
+        delay, error = self._outcome()
+        if delay:
+            await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+
+    def call(self) -> None:
+        """Apply the injected latency and failure to a blocking call."""
+        delay, error = self._outcome()
+        if delay:
+            time.sleep(delay)
+        if error is not None:
+            raise error
@@ -0,0 +1,158 @@
+"""
+openai_fake.py: In-process stand-in for the AsyncOpenAI client.
+
+Implements the calls the app makes (embeddings, chat completions with and
+without streaming, moderations, models) with deterministic local results:
+
+- Embeddings hash the words of a text into DIMENSION buckets and mix in a
+  shared component, so texts sharing words are more similar and unrelated
+  texts still score around BASELINE_SIMILARITY, like real ada-002
+  embeddings. The same text always gets the same vector.
+- Completions quote the start of the prompt's context, so answers depend
+  on what was retrieved.
+"""
+import os
+import re
+import time
+import asyncio
+import hashlib
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
+import httpx
+import numpy as np
+from openai import RateLimitError, InternalServerError
+from app.fakes.faults import FaultInjector
+from app.utils.tokens import count_tokens
+
+DIMENSION = 1536
+BASELINE_SIMILARITY = 0.72
+COMPLETION_MODEL = "gpt-3.5-turbo"
+
+# Streaming speed of completions; 0 streams as fast as possible
+TOKENS_PER_SECOND = float(os.getenv("FAKE_OPENAI_TOKENS_PER_SECOND", "0"))
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_API_URL = "https://api.openai.com/v1"
+
+def _bucket(word: str) -> int:
+    return int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+
+def fake_embedding(text: str, dimension: int = DIMENSION) -> List[float]:
+    """Deterministic unit-length embedding of a text."""
+    words = _WORD.findall(text.casefold()) or [text]
+    vector = np.zeros(dimension, dtype=np.float64)
+    for word in words:
+        h = _bucket(word)
+        # Bucket 0 is reserved for the shared component
+        vector[1 + h % (dimension - 1)] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    if norm:
+        vector *= np.sqrt(1 - BASELINE_SIMILARITY) / norm
+    vector[0] = np.sqrt(BASELINE_SIMILARITY)
+    return vector.tolist()
+
+def _request(path: str) -> httpx.Request:
+    return httpx.Request("POST", f"{_API_URL}/{path}")
+
+def _rate_limit_error(retry_after: float) -> Exception:
+    response = httpx.Response(
+        429, request=_request("chat/completions"),
+        headers={"retry-after": f"{retry_after:.3f}"}
+    )
+    return RateLimitError("Rate limit reached (injected)", response=response, body=None)
+
+def _server_error() -> Exception:
+    response = httpx.Response(500, request=_request("chat/completions"))
+    return InternalServerError("The server had an error (injected)", response=response, body=None)
+
+def _answer(prompt: str) -> str:
+    """A short answer quoting the first references of the prompt context."""
+    context = prompt.split("Context:", 1)[-1]
+    references = [line.strip("• ").strip() for line in context.splitlines() if line.startswith("•")]
+    if not references:
+        return "I don't have enough information in the provided context to answer that."
+    quoted = " ".join(ref[:200] for ref in references[:2])
+    return f"Based on the channel's posts: {quoted}"
+
+class _Embeddings:
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+
+    async def create(self, model: str, input: Union[str, List[str]], **kwargs: Any) -> SimpleNamespace:
+        await self.faults.acall()
+        texts = [input] if isinstance(input, str) else list(input)
+        return SimpleNamespace(
+            model=model,
+            data=[SimpleNamespace(index=i, embedding=fake_embedding(t)) for i, t in enumerate(texts)],
+            usage=SimpleNamespace(prompt_tokens=sum(map(count_tokens, texts)),
+                                  total_tokens=sum(map(count_tokens, texts)))
+        )
+
+class _Completions:
+    def __init__(self, faults: FaultInjector, tokens_per_second: float):
+        self.faults = faults
+        self.tokens_per_second = tokens_per_second
+
+    async def create(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        stream: bool = False,
+        **kwargs: Any
+    ) -> Any:
+        await self.faults.acall()
+        prompt = messages[-1]["content"] if messages else ""
+        answer = _answer(prompt)
+        usage = SimpleNamespace(
+            prompt_tokens=sum(count_tokens(m["content"]) for m in messages),
+            completion_tokens=count_tokens(answer),
+            total_tokens=0
+        )
+        usage.total_tokens = usage.prompt_tokens + usage.completion_tokens
+        if stream:
+            return self._stream(model, answer)
+        return SimpleNamespace(
+            id=f"chatcmpl-fake-{int(time.time() * 1000)}",
+            model=model,
+            choices=[SimpleNamespace(index=0, finish_reason="stop",
+                                     message=SimpleNamespace(role="assistant", content=answer))],
+            usage=usage
+        )
+
+    async def _stream(self, model: str, answer: str) -> AsyncIterator[SimpleNamespace]:
+        """Yield the answer word by word at tokens_per_second."""
+        words = re.findall(r"\S+\s*", answer)
+        for i, word in enumerate(words):
+            if self.tokens_per_second:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            yield SimpleNamespace(
+                model=model,
+                choices=[SimpleNamespace(
+                    index=0,
+                    delta=SimpleNamespace(content=word),
+                    finish_reason="stop" if i == len(words) - 1 else None
+                )]
+            )
+
+class _Moderations:
+    def __init__(self, faults: FaultInjector):
+        self.faults = faults
+
+    async def create(self, input: str, **kwargs: Any) -> SimpleNamespace:
+        await self.faults.acall()
+        return SimpleNamespace(results=[SimpleNamespace(flagged=False, categories={}, category_scores={})])
+
+class _Models:
+    async def list(self) -> SimpleNamespace:
+        return SimpleNamespace(data=[SimpleNamespace(id="text-embedding-ada-002"),
+                                     SimpleNamespace(id=COMPLETION_MODEL)])
+
+class FakeAsyncOpenAI:
+    """Drop-in replacement for the parts of AsyncOpenAI the app uses."""
+
+    def __init__(self, faults: Optional[FaultInjector] = None, tokens_per_second: float = TOKENS_PER_SECOND):
+        self.faults = faults or FaultInjector("openai", error=_server_error, rate_limit_error=_rate_limit_error)
+        self.embeddings = _Embeddings(self.faults)
+        self.chat = SimpleNamespace(completions=_Completions(self.faults, tokens_per_second))
+        self.moderations = _Moderations(self.faults)
+        self.models = _Models()
@@ -0,0 +1,162 @@
+"""
+pinecone_fake.py: In-process stand-in for the Pinecone client and index.
+
+Implements the index operations PineconeVectorStore uses (upsert, query,
+fetch, delete by IDs, filter or namespace, list by prefix, index stats) on
+in-memory NumPy matrices, so the Pinecone code path of the app runs
+unchanged without network access. Results mimic the Pinecone client's
+response objects (attributes, not dicts).
+"""
+import threading
+from types import SimpleNamespace
+from typing import Any, Dict, Iterator, List, Optional
+import numpy as np
+from app.fakes.faults import FaultInjector
+from app.services.vector_store import matches_filter, best_first
+
+# IDs per page returned by list(), as in Pinecone
+LIST_PAGE_SIZE = 100
+
+class _Namespace:
+    def __init__(self):
+        self.vectors: Dict[str, np.ndarray] = {}
+        self.metadata: Dict[str, Dict[str, Any]] = {}
+        self._ids: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+
+    def matrix(self) -> np.ndarray:
+        """Unit-normalized vectors as one matrix, rebuilt after writes."""
+        if self._matrix is None:
+            self._ids = list(self.vectors)
+            if self._ids:
+                matrix = np.stack([self.vectors[i] for i in self._ids])
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                self._matrix = matrix / np.where(norms == 0, 1, norms)
+            else:
+                self._matrix = np.zeros((0, 0), dtype=np.float32)
+        return self._matrix
+
+    def invalidate(self) -> None:
+        self._matrix = None
+
+class FakeIndex:
+    """Pinecone index kept in memory, with cosine similarity."""
+
+    def __init__(self, name: str, faults: FaultInjector):
+        self.name = name
+        self.faults = faults
+        self._namespaces: Dict[str, _Namespace] = {}
+        self._lock = threading.Lock()
+
+    def upsert(self, vectors: List[Dict[str, Any]], namespace: str = "") -> SimpleNamespace:
+        self.faults.call()
+        with self._lock:
+            ns = self._namespaces.setdefault(namespace, _Namespace())
+            for record in vectors:
+                ns.vectors[record["id"]] = np.asarray(record["values"], dtype=np.float32)
+                ns.metadata[record["id"]] = dict(record.get("metadata") or {})
+            ns.invalidate()
+        return SimpleNamespace(upserted_count=len(vectors))
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        include_metadata: bool = False,
+        include_values: bool = False,
+        namespace: str = ""
+    ) -> SimpleNamespace:
+        self.faults.call()
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            if ns is None or not ns.vectors:
+                return SimpleNamespace(matches=[], namespace=namespace)
+            matrix = ns.matrix()
+            ids = ns._ids
+            query = np.asarray(vector, dtype=np.float32)
+            norm = np.linalg.norm(query)
+            scores = matrix @ (query / norm if norm else query)
+            accept = (lambda i: matches_filter(ns.metadata[ids[i]], filter)) if filter else None
+            matches = [
+                SimpleNamespace(
+                    id=ids[i],
+                    score=float(scores[i]),
+                    metadata=dict(ns.metadata[ids[i]]) if include_metadata else None,
+                    values=ns.vectors[ids[i]].tolist() if include_values else []
+                )
+                for i in best_first(scores, top_k, accept)
+            ]
+        return SimpleNamespace(matches=matches, namespace=namespace)
+
+    def fetch(self, ids: List[str], namespace: str = "") -> SimpleNamespace:
+        self.faults.call()
+        with self._lock:
+            ns = self._namespaces.get(namespace) or _Namespace()
+            vectors = {
+                id_: SimpleNamespace(id=id_, values=ns.vectors[id_].tolist(), metadata=ns.metadata[id_])
+                for id_ in ids if id_ in ns.vectors
+            }
+        return SimpleNamespace(vectors=vectors, namespace=namespace)
+
+    def delete(
+        self,
+        ids: Optional[List[str]] = None,
+        delete_all: bool = False,
+        filter: Optional[Dict[str, Any]] = None,
+        namespace: str = ""
+    ) -> Dict[str, Any]:
+        self.faults.call()
+        with self._lock:
+            if delete_all:
+                self._namespaces.pop(namespace, None)
+                return {}
+            ns = self._namespaces.get(namespace)
+            if ns is None:
+                return {}
+            if filter:
+                ids = [id_ for id_, meta in ns.metadata.items() if matches_filter(meta, filter)]
+            for id_ in ids or []:
+                ns.vectors.pop(id_, None)
+                ns.metadata.pop(id_, None)
+            ns.invalidate()
+        return {}
+
+    def list(self, prefix: str = "", namespace: str = "") -> Iterator[List[str]]:
+        self.faults.call()
+        with self._lock:
+            ns = self._namespaces.get(namespace)
+            ids = sorted(id_ for id_ in ns.vectors if id_.startswith(prefix)) if ns else []
+        for i in range(0, len(ids), LIST_PAGE_SIZE):
+            yield ids[i:i + LIST_PAGE_SIZE]
+
+    def describe_index_stats(self) -> SimpleNamespace:
+        self.faults.call()
+        with self._lock:
+            namespaces = {
+                name: SimpleNamespace(vector_count=len(ns.vectors))
+                for name, ns in self._namespaces.items() if ns.vectors
+            }
+        return SimpleNamespace(
+            namespaces=namespaces,
+            total_vector_count=sum(ns.vector_count for ns in namespaces.values())
+        )
+
+class FakePinecone:
+    """Stand-in for the Pinecone client; every index lives in this process."""
+
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self.faults = faults or FaultInjector("pinecone")
+        self._indexes: Dict[str, FakeIndex] = {}
+
+    def Index(self, name: str) -> FakeIndex:
+        if name not in self._indexes:
+            self._indexes[name] = FakeIndex(name, self.faults)
+        return self._indexes[name]
+
+    def create_index(self, name: str, **kwargs: Any) -> None:
+        self.Index(name)
+
+    def list_indexes(self) -> List[SimpleNamespace]:
+        self.faults.call()
+        return [SimpleNamespace(name=name) for name in self._indexes]
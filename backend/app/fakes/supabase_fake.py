@@ -0,0 +1,211 @@
+"""
+supabase_fake.py: In-process stand-in for the Supabase client.
+
+Tables are lists of row dicts in memory. The query builder supports the
+subset of the PostgREST API the app uses: select, insert, update, delete,
+the eq/neq/gt/gte/lt/lte/in_ filters, order, limit and single. Inserted rows
+get the defaults of app/db/init.sql (UUID id, created_at, ...). Storage
+buckets keep uploaded objects as bytes.
+"""
+import uuid
+import copy
+import threading
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Union
+from postgrest.exceptions import APIError
+from app.fakes.faults import FaultInjector
+
+PUBLIC_URL = "http://supabase.fake/storage/v1/object/public"
+
+# Column defaults from app/db/init.sql, besides id and created_at
+TABLE_DEFAULTS: Dict[str, Dict[str, Any]] = {
+    "users": {"credits_balance": 0},
+    "agents": {"status": "active"}
+}
+
+def _comparable(value: Any) -> Any:
+    """Timestamps are stored as ISO strings; compare datetimes the same way."""
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def _server_error() -> Exception:
+    return APIError({"message": "Injected Supabase failure", "code": "500"})
+
+def _rate_limit_error(retry_after: float) -> Exception:
+    return APIError({"message": "Too many requests (injected)", "code": "429",
+                     "details": f"retry after {retry_after:.3f}s"})
+
+class _Query:
+    """Chainable query on one table, run by execute()."""
+
+    def __init__(self, client: "FakeSupabase", table: str):
+        self.client = client
+        self.table = table
+        self.action = "select"
+        self.columns: Optional[List[str]] = None
+        self.values: Union[Dict[str, Any], List[Dict[str, Any]], None] = None
+        self.filters: List[Callable[[Dict[str, Any]], bool]] = []
+        self.ordering: List[tuple] = []
+        self.max_rows: Optional[int] = None
+        self.single_row = False
+        self.on_conflict = "id"
+
+    def select(self, columns: str = "*", **kwargs: Any) -> "_Query":
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",")]
+        return self
+
+    def insert(self, values: Union[Dict[str, Any], List[Dict[str, Any]]], **kwargs: Any) -> "_Query":
+        self.action, self.values = "insert", values
+        return self
+
+    def upsert(self, values: Union[Dict[str, Any], List[Dict[str, Any]]], on_conflict: str = "id",
+               **kwargs: Any) -> "_Query":
+        self.action, self.values, self.on_conflict = "upsert", values, on_conflict
+        return self
+
+    def update(self, values: Dict[str, Any], **kwargs: Any) -> "_Query":
+        self.action, self.values = "update", values
+        return self
+
+    def delete(self, **kwargs: Any) -> "_Query":
+        self.action = "delete"
+        return self
+
+    def _filter(self, column: str, test: Callable[[Any], bool]) -> "_Query":
+        self.filters.append(lambda row: test(_comparable(row.get(column))))
+        return self
+
+    def eq(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v == _comparable(value))
+
+    def neq(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v != _comparable(value))
+
+    def gt(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v is not None and v > _comparable(value))
+
+    def gte(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v is not None and v >= _comparable(value))
+
+    def lt(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v is not None and v < _comparable(value))
+
+    def lte(self, column: str, value: Any) -> "_Query":
+        return self._filter(column, lambda v: v is not None and v <= _comparable(value))
+
+    def in_(self, column: str, values: List[Any]) -> "_Query":
+        allowed = [_comparable(v) for v in values]
+        return self._filter(column, lambda v: v in allowed)
+
+    def order(self, column: str, desc: bool = False, **kwargs: Any) -> "_Query":
+        self.ordering.append((column, desc))
+        return self
+
+    def limit(self, count: int, **kwargs: Any) -> "_Query":
+        self.max_rows = count
+        return self
+
+    def single(self) -> "_Query":
+        self.single_row = True
+        return self
+
+    def _project(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        if self.columns is None:
+            return copy.deepcopy(row)
+        return {c: copy.deepcopy(row.get(c)) for c in self.columns}
+
+    def execute(self) -> SimpleNamespace:
+        self.client.faults.call()
+        with self.client._lock:
+            rows = self.client.tables.setdefault(self.table, [])
+            if self.action == "insert":
+                data = [self.client._new_row(self.table, values) for values in
+                        (self.values if isinstance(self.values, list) else [self.values])]
+                rows.extend(data)
+                return SimpleNamespace(data=copy.deepcopy(data), count=None)
+            if self.action == "upsert":
+                data = []
+                by_key = {row.get(self.on_conflict): row for row in rows}
+                for values in (self.values if isinstance(self.values, list) else [self.values]):
+                    existing = by_key.get(values[self.on_conflict])
+                    if existing is None:
+                        existing = by_key[values[self.on_conflict]] = self.client._new_row(self.table, values)
+                        rows.append(existing)
+                    else:
+                        existing.update(copy.deepcopy(values))
+                    data.append(existing)
+                return SimpleNamespace(data=copy.deepcopy(data), count=None)
+
+            matched = [row for row in rows if all(f(row) for f in self.filters)]
+            if self.action == "update":
+                for row in matched:
+                    row.update(copy.deepcopy(self.values))
+                return SimpleNamespace(data=copy.deepcopy(matched), count=None)
+            if self.action == "delete":
+                ids = {id(row) for row in matched}
+                self.client.tables[self.table] = [row for row in rows if id(row) not in ids]
+                return SimpleNamespace(data=copy.deepcopy(matched), count=None)
+
+            for column, desc in reversed(self.ordering):
+                matched.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+            if self.max_rows is not None:
+                matched = matched[:self.max_rows]
+            data = [self._project(row) for row in matched]
+
+        if self.single_row:
+            if len(data) != 1:
+                raise APIError({"message": "JSON object requested, multiple (or no) rows returned",
+                                "code": "PGRST116"})
+            return SimpleNamespace(data=data[0], count=None)
+        return SimpleNamespace(data=data, count=None)
+
+class _Bucket:
+    def __init__(self, client: "FakeSupabase", name: str):
+        self.client = client
+        self.name = name
+
+    def upload(self, path: str, file: Union[bytes, str], file_options: Optional[Dict[str, Any]] = None) -> Any:
+        self.client.faults.call()
+        data = file.encode("utf-8") if isinstance(file, str) else bytes(file)
+        with self.client._lock:
+            self.client.objects.setdefault(self.name, {})[path] = data
+        return SimpleNamespace(path=path, full_path=f"{self.name}/{path}")
+
+    def get_public_url(self, path: str) -> str:
+        return f"{PUBLIC_URL}/{self.name}/{path}"
+
+    def remove(self, paths: List[str]) -> List[Dict[str, Any]]:
+        self.client.faults.call()
+        with self.client._lock:
+            bucket = self.client.objects.get(self.name, {})
+            removed = [path for path in paths if bucket.pop(path, None) is not None]
+        return [{"name": path, "bucket_id": self.name} for path in removed]
+
+class _Storage:
+    def __init__(self, client: "FakeSupabase"):
+        self.client = client
+
+    def from_(self, bucket: str) -> _Bucket:
+        return _Bucket(self.client, bucket)
+
+class FakeSupabase:
+    """Drop-in replacement for the parts of the Supabase client the app uses."""
+
+    def __init__(self, faults: Optional[FaultInjector] = None):
+        self.faults = faults or FaultInjector("supabase", error=_server_error, rate_limit_error=_rate_limit_error)
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.objects: Dict[str, Dict[str, bytes]] = {}
+        self.storage = _Storage(self)
+        self._lock = threading.RLock()
+
+    def table(self, name: str) -> _Query:
+        return _Query(self, name)
+
+    def _new_row(self, table: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        row = {
+            "id": str(uuid.uuid4()),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            **TABLE_DEFAULTS.get(table, {})
+        }
+        row.update(copy.deepcopy(values))
+        return row
@@ -0,0 +1,144 @@
+"""
+telegram_fake.py: In-process stand-in for the Telethon client.
+
+Every channel exists and holds FAKE_TELEGRAM_MESSAGES synthetic posts,
+generated deterministically from the channel name: the same channel always
+has the same posts, IDs and dates. Posts are built from a small set of
+topics so that retrieval has something meaningful to find. Messages and
+channels are real Telethon objects, so TelegramService runs unchanged.
+"""
+import os
+import random
+import zlib
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+from telethon.errors import FloodWaitError
+from telethon.tl.types import Message, Channel, PeerChannel, ChatPhotoEmpty
+from app.fakes.faults import FaultInjector, InjectedError
+
+MESSAGES_PER_CHANNEL = int(os.getenv("FAKE_TELEGRAM_MESSAGES", "200"))
+
+TOPICS = {
+    "markets": ["Bitcoin", "TON", "the dollar", "oil prices", "the stock market", "gold"],
+    "tech": ["the new iPhone", "AI assistants", "electric cars", "Telegram bots", "open source", "chip makers"],
+    "life": ["morning routines", "travel to Dubai", "reading habits", "remote work", "fitness", "coffee"]
+}
+TEMPLATES = [
+    "My take on {subject}: {opinion} Watch the next {days} days closely.",
+    "Quick update on {subject}. {opinion} Numbers: {number}% this week.",
+    "Many of you asked about {subject}. {opinion}",
+    "{subject} again in the news. {opinion} I expect {number}% by the end of the month."
+]
+OPINIONS = [
+    "I think it is overrated right now.",
+    "Long term this looks very promising.",
+    "The hype will fade, fundamentals will not.",
+    "Be careful, the risks are bigger than they look.",
+    "This is the most important trend of the year."
+]
+
+def _channel_id(name: str) -> int:
+    return zlib.crc32(name.encode("utf-8")) & 0x7FFFFFFF
+
+def _server_error() -> Exception:
+    return InjectedError("Injected Telegram failure", status_code=500)
+
+def _rate_limit_error(retry_after: float) -> Exception:
+    return FloodWaitError(request=None, capture=max(1, round(retry_after)))
+
+class FakeTelegramClient:
+    """Drop-in replacement for the TelegramClient calls TelegramService makes."""
+
+    parse_mode = None
+
+    def __init__(self, faults: Optional[FaultInjector] = None, messages_per_channel: int = MESSAGES_PER_CHANNEL):
+        self.faults = faults or FaultInjector("telegram", error=_server_error, rate_limit_error=_rate_limit_error)
+        self.messages_per_channel = messages_per_channel
+        self._connected = False
+        self._channels: Dict[int, List[Message]] = {}
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    async def connect(self) -> None:
+        await self.faults.acall()
+        self._connected = True
+
+    async def disconnect(self) -> None:
+        self._connected = False
+
+    async def is_user_authorized(self) -> bool:
+        return True
+
+    async def sign_in(self, phone: str, code: str) -> SimpleNamespace:
+        return SimpleNamespace(phone=phone)
+
+    async def get_entity(self, link: str) -> Channel:
+        await self.faults.acall()
+        username = link.lstrip("@").split("/")[-1]
+        return Channel(
+            id=_channel_id(username),
+            title=username.replace("_", " ").title(),
+            photo=ChatPhotoEmpty(),
+            date=datetime(2020, 1, 1, tzinfo=timezone.utc),
+            broadcast=True,
+            username=username
+        )
+
+    def _messages(self, channel: Channel) -> List[Message]:
+        """The channel's posts, newest first."""
+        if channel.id not in self._channels:
+            rng = random.Random(channel.id)
+            topic = rng.choice(sorted(TOPICS))
+            start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+            messages = []
+            for message_id in range(1, self.messages_per_channel + 1):
+                text = rng.choice(TEMPLATES).format(
+                    subject=rng.choice(TOPICS[topic]),
+                    opinion=rng.choice(OPINIONS),
+                    days=rng.randint(2, 30),
+                    number=rng.randint(1, 40)
+                )
+                message = Message(
+                    id=message_id,
+                    peer_id=PeerChannel(channel.id),
+                    date=start + timedelta(hours=6 * message_id),
+                    message=text,
+                    views=rng.randint(100, 50000),
+                    forwards=rng.randint(0, 500)
+                )
+                # Message.text formats through its client, like messages Telethon returns
+                message._client = self
+                messages.append(message)
+            self._channels[channel.id] = messages[::-1]
+        return self._channels[channel.id]
+
+    async def get_messages(
+        self,
+        entity: Channel,
+        limit: Optional[int] = None,
+        min_id: int = 0,
+        offset_date: Optional[datetime] = None,
+        reverse: bool = False,
+        **kwargs: Any
+    ) -> List[Message]:
+        await self.faults.acall()
+        messages = [
+            m for m in self._messages(entity)
+            if m.id > (min_id or 0) and (offset_date is None or m.date < offset_date)
+        ]
+        if reverse:
+            messages = messages[::-1]
+        return messages[:limit] if limit is not None else messages
+
+    async def __call__(self, request: Any) -> SimpleNamespace:
+        """Answers GetFullChannelRequest, the only raw request the app sends."""
+        await self.faults.acall()
+        return SimpleNamespace(full_chat=SimpleNamespace(
+            participants_count=1000 + _channel_id(request.channel.username or "") % 100000,
+            about=f"Synthetic channel {request.channel.title}"
+        ))
+
+    async def download_profile_photo(self, entity: Any, file: Any = None, **kwargs: Any) -> Optional[bytes]:
+        return None
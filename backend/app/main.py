@@ -7,15 +7,34 @@ from dotenv import load_dotenv
 # Load environment variables before importing services
 load_dotenv()
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from app.utils.logger import logger
-from app.services.openai_service import client as openai_client
-from app.services.pinecone_service import pc as pinecone_client
-from app.services.db_service import supabase
-from app.routes import agent, auth, telegram
+from app.utils.tracing import TracingMiddleware
+from app.utils.metrics import MetricsMiddleware
+from app.utils.deadline import DeadlineMiddleware
+from app.utils.rate_limit import RateLimitMiddleware
+from app.utils.idempotency import IdempotencyMiddleware
+from app.services.health_service import health_prober
+from app.routes import agent, auth, telegram, admin, metrics
 
-app = FastAPI(title="Agentique API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the background health prober for the lifetime of the worker."""
+    health_prober.start()
+    yield
+    await health_prober.stop()
+
+app = FastAPI(title="Agentique API", lifespan=lifespan)
+
+# Reject chats over the per-user and per-agent limits with 429. Added before
+# CORS so it runs inside it and the 429 responses carry CORS headers.
+app.add_middleware(RateLimitMiddleware)
+
+# Run each Idempotency-Key of chat and agent creation once and replay its
+# response to retries. Outside the rate limits, so replays cost no quota.
+app.add_middleware(IdempotencyMiddleware)
 
 # Configure CORS
 app.add_middleware(
@@ -26,61 +45,61 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Time each request's stages and report them in a Server-Timing header
+app.add_middleware(TracingMiddleware)
+
+# Give chats a deadline and cancel them when the client disconnects
+app.add_middleware(DeadlineMiddleware)
+
+# Count and time requests per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(agent.router, prefix="/agent", tags=["agent"])
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(telegram.router, prefix="/telegram", tags=["telegram"])
+app.include_router(admin.router, prefix="/admin")
+app.include_router(metrics.router)
 
 @app.get("/health")
-async def health_check():
+async def health_check(details: bool = False):
     """
-    Health check endpoint that verifies all external services are accessible.
-    
+    Health of all external services, as last probed in the background.
+
+    Answers from the health prober's cache, so polling it causes no external
+    calls. Services not probed yet are reported as "unknown".
+
+    Args:
+        details: Also return probe time, latency and error per service
+
     Returns:
         dict: Status of each service and overall health
-        
+
     Raises:
         HTTPException: If any critical service is unavailable
     """
-    status = {
-        "status": "healthy",
-        "services": {
-            "openai": "unknown",
-            "pinecone": "unknown",
-            "supabase": "unknown"
-        }
-    }
-    
-    try:
-        # Check OpenAI
-        await openai_client.models.list()
-        status["services"]["openai"] = "healthy"
-    except Exception as e:
-        logger.error("OpenAI health check failed: %s", str(e))
-        status["services"]["openai"] = "unhealthy"
-    
-    try:
-        # Check Pinecone
-        pinecone_client.list_indexes()
-        status["services"]["pinecone"] = "healthy"
-    except Exception as e:
-        logger.error("Pinecone health check failed: %s", str(e))
-        status["services"]["pinecone"] = "unhealthy"
-    
-    try:
-        # Check Supabase
-        supabase.table("users").select("*").limit(1).execute()
-        status["services"]["supabase"] = "healthy"
-    except Exception as e:
-        logger.error("Supabase health check failed: %s", str(e))
-        status["services"]["supabase"] = "unhealthy"
-    
-    # If any service is unhealthy, mark overall status as unhealthy
-    if any(s == "unhealthy" for s in status["services"].values()):
-        status["status"] = "unhealthy"
-        raise HTTPException(
-            status_code=503,
-            detail=status
-        )
-    
-    return status 
\ No newline at end of file
+    status = health_prober.report(details=details)
+    if status["status"] == "unhealthy":
+        raise HTTPException(status_code=503, detail=status)
+    return status
+
+@app.get("/health/live")
+async def liveness_check():
+    """Liveness: the process is up and serving requests."""
+    return {"status": "alive"}
+
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness: every enabled service passed its latest probe.
+
+    Fails until the first probe round completes, so new workers only get
+    traffic once their dependencies are reachable.
+
+    Raises:
+        HTTPException: If any service is unhealthy, stale or not probed yet
+    """
+    status = health_prober.report()
+    if not health_prober.is_ready():
+        raise HTTPException(status_code=503, detail=status)
+    return status
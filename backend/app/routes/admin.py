@@ -2,19 +2,25 @@
 admin.py: Admin-only routes for managing the platform.
 """
 import os
+import hmac
 from typing import Dict, Any, Optional
 from fastapi import APIRouter, HTTPException, Header
 from app.services.payment_service import add_credits
+from app.utils.logger import logger, set_log_level, get_log_levels
 
 router = APIRouter(tags=["admin"])
 
-ADMIN_KEY = os.getenv("ADMIN_KEY", "test_admin_key")
+# No default: without ADMIN_KEY every admin request is refused
+ADMIN_KEY = os.getenv("ADMIN_KEY")
 
 async def verify_admin(admin_key: Optional[str] = None):
     """Verify admin access using admin key from headers."""
+    if not ADMIN_KEY:
+        logger.warning("Admin request refused: ADMIN_KEY is not configured")
+        raise HTTPException(status_code=403, detail="Admin access is not configured")
     if not admin_key:
         raise HTTPException(status_code=403, detail="Missing admin key")
-    if admin_key != ADMIN_KEY:
+    if not hmac.compare_digest(admin_key.encode(), ADMIN_KEY.encode()):
         raise HTTPException(status_code=403, detail="Invalid admin key")
 
 @router.post("/credits/topup/{user_id}")
@@ -45,4 +51,54 @@ async def admin_topup(
         raise HTTPException(status_code=400, detail="Missing amount field in request body")
     
     # Add credits to user's balance
-    return await add_credits(user_id, amount["amount"], reason="admin_topup") 
\ No newline at end of file
+    return await add_credits(user_id, amount["amount"], reason="admin_topup")
+
+
+@router.get("/log-levels")
+async def admin_get_log_levels(
+    admin_key: Optional[str] = Header(None, alias="X-Admin-Key")
+) -> Dict[str, str]:
+    """
+    List the explicitly set logger levels of this worker. Admin-only endpoint.
+
+    Args:
+        admin_key: Admin API key for authorization
+
+    Returns:
+        Dict of logger name to level name
+    """
+    await verify_admin(admin_key)
+    return get_log_levels()
+
+
+@router.put("/log-levels")
+async def admin_set_log_levels(
+    levels: Dict[str, str],
+    admin_key: Optional[str] = Header(None, alias="X-Admin-Key")
+) -> Dict[str, str]:
+    """
+    Change logger levels at runtime, e.g. {"agentique": "DEBUG"}. Admin-only endpoint.
+
+    Levels live in process memory, so the change applies only to the one
+    worker serving the request, not to the other gunicorn workers, and is
+    reset on restart. Use LOG_LEVELS for a change that applies to every
+    worker.
+
+    Args:
+        levels: Logger name ("root" for the root logger) to level name
+        admin_key: Admin API key for authorization
+
+    Returns:
+        The resulting levels
+
+    Raises:
+        HTTPException: If admin key is missing or invalid (403) or a level is unknown (400)
+    """
+    await verify_admin(admin_key)
+    try:
+        for name, level in levels.items():
+            set_log_level(name, level)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Log levels changed: %s", levels)
+    return get_log_levels()
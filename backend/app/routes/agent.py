@@ -1,16 +1,24 @@
 """
 Agent-related routes for managing AI agents and their content.
 """
-from fastapi import APIRouter, HTTPException, BackgroundTasks, Form, File, UploadFile
-from typing import Dict, Any, Optional
+import json
+import uuid
+import asyncio
+from fastapi import APIRouter, HTTPException, BackgroundTasks, Form, File, UploadFile, WebSocket, WebSocketDisconnect
+from typing import Dict, Any, Optional, Tuple
 from datetime import datetime
 from app.services.telegram_service import TelegramService
-from app.services.db_service import create_agent, get_agent_by_id, list_agents, delete_agent, save_chat_message, get_chat_history
-from app.services.openai_service import generate_embedding
-from app.services.pinecone_service import upsert_vectors
+from app.services.db_service import create_agent, get_agent_by_id, list_agents, update_agent_status, save_chat_message, get_chat_history, is_being_deleted
+from app.services.ingestion_service import ingest_messages
+from app.services.deletion_service import delete_agent_cascade
 from app.utils.logger import logger
-from uuid import uuid4
-from app.services.rag_service import rag_retrieve_and_summarize
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded, handle_service_error
+from app.services.rag_service import rag_retrieve_and_summarize, is_generated_answer
+from app.services.chat_session import ChatSession, CHAT_SESSION_MAX_PIPELINED
+from app.services.conversation_summary import load_conversation, schedule_summary_update
+from app.utils.rate_limit import get_rate_limiter, RATE_LIMIT_ENABLED
+from app.utils.deadline import deadline_scope, CHAT_REQUEST_TIMEOUT
+from app.utils.metrics import RATE_LIMITED, CHAT_SESSIONS, CHAT_SESSION_QUESTIONS
 
 router = APIRouter()
 
@@ -116,53 +124,13 @@ async def create_agent_from_channel(
                     "agent": agent  # Include full agent info in response
                 }
             
-            # Process messages in batches
-            batch_size = 100
-            total_vectors = 0
-            
-            for i in range(0, len(messages), batch_size):
-                batch = messages[i:i + batch_size]
-                
-                # Generate embeddings for batch
-                vectors = []
-                metadata = []
-                ids = []
-                
-                for msg in batch:
-                    # Skip empty messages
-                    if not msg["text"].strip():
-                        continue
-                    
-                    # Generate embedding
-                    embedding = await generate_embedding(msg["text"])
-                    if not embedding:
-                        continue
-                    
-                    vectors.append(embedding)
-                    metadata.append({
-                        "agent_id": agent_id,
-                        "source_link": msg["link"],
-                        "text": msg["text"],
-                        "date": msg["date"],
-                        "views": msg["views"],
-                        "forwards": msg["forwards"]
-                    })
-                    ids.append(str(uuid4()))
-                
-                if vectors:
-                    # Upsert vectors to Pinecone
-                    success = await upsert_vectors(vectors, metadata, ids)
-                    if success:
-                        total_vectors += len(vectors)
-                        logger.info(
-                            "Processed batch of %d messages for channel %s (total vectors: %d)",
-                            len(vectors), channel_link, total_vectors
-                        )
+            # Embed and upsert messages
+            stats = await ingest_messages(agent_id, messages, channel=channel_link)
             
             return {
                 "agent_id": agent_id,
                 "message_count": len(messages),
-                "vector_count": total_vectors,
+                "vector_count": stats.vector_count,
                 "status": "success",
                 "agent": agent  # Include full agent info in response
             }
@@ -171,18 +139,23 @@ async def create_agent_from_channel(
         logger.error("Failed to create agent from channel %s: %s", channel_link, str(e))
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.delete("/{agent_id}")
-async def delete_agent_route(agent_id: str) -> Dict[str, Any]:
+@router.delete("/{agent_id}", status_code=202)
+async def delete_agent_route(agent_id: str, background_tasks: BackgroundTasks) -> Dict[str, Any]:
     """
     Delete an agent by ID.
+
+    The agent is hidden immediately; its vectors, chat messages, photos and
+    row are removed by a background job.
     """
+    agent = await get_agent_by_id(agent_id)
+    if not agent:
+        raise HTTPException(status_code=404, detail="Agent not found")
     try:
-        success = await delete_agent(agent_id)
-        if not success:
-            raise HTTPException(status_code=404, detail="Agent not found")
+        await update_agent_status(agent_id, "deleting")
+        background_tasks.add_task(delete_agent_cascade, agent_id, agent)
         return {
-            "status": "success",
-            "message": f"Agent {agent_id} deleted successfully"
+            "status": "deleting",
+            "message": f"Agent {agent_id} is being deleted"
         }
     except Exception as e:
         logger.error("Failed to delete agent: %s", str(e))
@@ -207,14 +180,14 @@ async def chat_with_agent(
     """
     try:
         logger.info("Chat request - agent_id: %s, user_id: %s", agent_id, user_id)
-        logger.debug("Message content: %s", message)
+        logger.debug("Message length: %d chars", len(message))
         
-        # Get agent details
+        # Get agent details; an agent being deleted is already gone for chats
         agent = await get_agent_by_id(agent_id)
-        if not agent:
+        if not agent or is_being_deleted(agent):
             logger.error("Agent not found: %s", agent_id)
             raise HTTPException(status_code=404, detail="Agent not found")
-        logger.debug("Found agent: %s", agent)
+        logger.debug("Found agent: %s", agent.get("name", agent_id))
             
         try:
             # Save user message
@@ -225,7 +198,7 @@ async def chat_with_agent(
                 role="user",
                 content=message
             )
-            logger.debug("Saved user message: %s", user_message)
+            logger.debug("Saved user message: %s", user_message.get("id"))
         except Exception as e:
             logger.error("Failed to save user message: %s", str(e), exc_info=True)
             raise HTTPException(
@@ -239,9 +212,14 @@ async def chat_with_agent(
             response = await rag_retrieve_and_summarize(
                 query=message,
                 agent_id=agent_id,
-                mode="chat"
+                mode="chat",
+                conversation=await load_conversation(user_id, agent_id)
             )
-            logger.debug("Generated response: %s", response)
+            logger.debug("Generated response of %d chars", len(response))
+        except (ServiceUnavailableError, DeadlineExceeded) as e:
+            # A dependency is down or too slow: fail fast rather than answer as if nothing was found
+            logger.error("Failed to generate response: %s", e.message)
+            raise handle_service_error(e)
         except Exception as e:
             logger.error("Failed to generate response: %s", str(e), exc_info=True)
             raise HTTPException(
@@ -258,11 +236,15 @@ async def chat_with_agent(
                 role="agent",
                 content=response
             )
-            logger.debug("Saved agent message: %s", agent_message)
         except Exception as e:
             logger.error("Failed to save agent response: %s", str(e), exc_info=True)
             # Don't fail the request if saving the response fails
             # The user still gets their answer
+
+        # Fold this turn into the conversation summary once the answer is out;
+        # canned and references-only replies say nothing about the conversation
+        if is_generated_answer(response):
+            schedule_summary_update(user_id, agent_id, message, response)
             
         return {
             "response": response,
@@ -280,6 +262,146 @@ async def chat_with_agent(
             detail="An unexpected error occurred"
         )
 
+# WebSocket close code when the agent does not exist or is being deleted
+WS_AGENT_NOT_FOUND = 4404
+
+async def _send_error(websocket: WebSocket, question_id: Optional[str], status: int, detail: str,
+                      retry_after: Optional[float] = None) -> None:
+    frame: Dict[str, Any] = {"type": "error", "id": question_id, "status": status, "detail": detail}
+    if retry_after is not None:
+        frame["retry_after"] = round(retry_after, 3)
+    await websocket.send_json(frame)
+
+async def _answer_question(websocket: WebSocket, session: ChatSession, question_id: Optional[str], message: str) -> None:
+    """Answer one question of a session under the chat rate limits and deadline."""
+    limiter = get_rate_limiter() if RATE_LIMIT_ENABLED else None
+    lease = uuid.uuid4().hex
+    try:
+        rejection = (await asyncio.to_thread(limiter.admit, session.user_id, session.agent_id, lease)
+                     if limiter else None)
+    except Exception as e:
+        logger.warning("Rate limiter unavailable, admitting question: %s", str(e))
+        limiter = rejection = None
+    if rejection is not None:
+        RATE_LIMITED.labels(rejection.scope, rejection.reason).inc()
+        CHAT_SESSION_QUESTIONS.labels("rate_limited").inc()
+        await _send_error(websocket, question_id, 429, rejection.detail, rejection.retry_after)
+        return
+
+    try:
+        await websocket.send_json({"type": "start", "id": question_id})
+
+        async def send_piece(piece: str) -> None:
+            await websocket.send_json({"type": "token", "id": question_id, "content": piece})
+
+        with deadline_scope(CHAT_REQUEST_TIMEOUT):
+            result = await session.ask(message, send_piece)
+        CHAT_SESSION_QUESTIONS.labels("answered").inc()
+        await websocket.send_json({"type": "done", "id": question_id, "status": "success", **result})
+    except (ServiceUnavailableError, DeadlineExceeded) as e:
+        logger.error("Failed to generate response: %s", e.message)
+        CHAT_SESSION_QUESTIONS.labels("failed").inc()
+        await _send_error(websocket, question_id, e.status_code, e.message, e.details.get("retry_after"))
+    except WebSocketDisconnect:
+        raise
+    except Exception as e:
+        logger.error("Failed to answer chat session question: %s", str(e), exc_info=True)
+        CHAT_SESSION_QUESTIONS.labels("failed").inc()
+        await _send_error(websocket, question_id, 500, "Failed to generate response")
+    finally:
+        if limiter is not None:
+            try:
+                await asyncio.to_thread(limiter.release, session.user_id, session.agent_id, lease)
+            except Exception as e:
+                logger.warning("Failed to release chat slots: %s", str(e))
+
+async def _answer_questions(websocket: WebSocket, session: ChatSession, questions: asyncio.Queue) -> None:
+    while True:
+        question_id, message = await questions.get()
+        await _answer_question(websocket, session, question_id, message)
+
+def _parse_frame(text: str) -> Tuple[str, Optional[str], Optional[str]]:
+    """
+    Read a client frame: {"type": "message", "id": ..., "message": ...} or {"type": "history"}.
+
+    Returns:
+        The frame type, the client's ID for the question and the message
+
+    Raises:
+        ValueError: If the frame is malformed
+    """
+    frame = json.loads(text)
+    if not isinstance(frame, dict):
+        raise ValueError("Frame must be a JSON object")
+    frame_type = frame.get("type", "message")
+    question_id = frame.get("id")
+    question_id = str(question_id) if question_id is not None else None
+    if frame_type == "history":
+        return frame_type, question_id, None
+    if frame_type != "message":
+        raise ValueError(f"Unknown frame type: {frame_type}")
+    message = frame.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("message must be a non-empty string")
+    return frame_type, question_id, message
+
+@router.websocket("/{agent_id}/chat/ws")
+async def chat_session(websocket: WebSocket, agent_id: str, user_id: str) -> None:
+    """
+    Chat with an agent over a WebSocket, with answers streamed as they are generated.
+
+    The agent and the recent history are loaded once for the connection.
+    The client sends {"type": "message", "id": ..., "message": ...} frames
+    and may send several before the first is answered; they are answered in
+    order. Each answer is a "start" frame, "token" frames with the pieces
+    of the answer and a "done" frame with the full response and saved
+    messages, or an "error" frame with the HTTP status the POST route would
+    give. {"type": "history"} returns the messages kept in the session.
+
+    Args:
+        agent_id: The ID of the agent to chat with
+        user_id: The ID of the user chatting (query parameter)
+    """
+    await websocket.accept()
+    logger.info("Chat session opened - agent_id: %s, user_id: %s", agent_id, user_id)
+    session = await ChatSession.open(agent_id, user_id)
+    if session is None:
+        logger.error("Agent not found: %s", agent_id)
+        await _send_error(websocket, None, 404, "Agent not found")
+        await websocket.close(code=WS_AGENT_NOT_FOUND)
+        return
+
+    CHAT_SESSIONS.inc()
+    questions: asyncio.Queue = asyncio.Queue(maxsize=CHAT_SESSION_MAX_PIPELINED)
+    answerer = asyncio.create_task(_answer_questions(websocket, session, questions))
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                frame_type, question_id, message = _parse_frame(text)
+            except ValueError as e:
+                await _send_error(websocket, None, 400, str(e))
+                continue
+            if frame_type == "history":
+                await websocket.send_json({"type": "history", "id": question_id, "messages": session.history})
+            elif questions.full():
+                CHAT_SESSION_QUESTIONS.labels("rejected").inc()
+                await _send_error(websocket, question_id, 429,
+                                  f"At most {CHAT_SESSION_MAX_PIPELINED} questions may wait for an answer")
+            else:
+                questions.put_nowait((question_id, message))
+    except WebSocketDisconnect:
+        logger.info("Chat session closed - agent_id: %s, user_id: %s", agent_id, user_id)
+    finally:
+        # Questions of a client that is gone are not worth answering
+        answerer.cancel()
+        try:
+            await answerer
+        except (asyncio.CancelledError, Exception):
+            # Sends to a closed socket fail; nothing is left to tell the client
+            pass
+        CHAT_SESSIONS.dec()
+
 @router.get("/{agent_id}/chat_history")
 async def get_agent_chat_history(
     agent_id: str,
@@ -312,7 +434,7 @@ async def get_agent_chat_history(
         if not agent:
             logger.error("Agent not found: %s", agent_id)
             raise HTTPException(status_code=404, detail="Agent not found")
-        logger.debug("Found agent: %s", agent)
+        logger.debug("Found agent: %s", agent.get("name", agent_id))
             
         try:
             # Get chat history
@@ -0,0 +1,12 @@
+"""
+metrics.py: Prometheus scrape endpoint.
+"""
+from fastapi import APIRouter, Response
+from app.utils.metrics import render, CONTENT_TYPE_LATEST
+
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Expose application metrics, aggregated across workers, in the Prometheus text format."""
+    return Response(content=render(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,642 @@
+"""
+Persistent approximate nearest-neighbour (IVF) vector store.
+
+Each agent gets its own IVF index directory. Vectors, inverted-list
+assignments and tombstones are flat binary files opened with `np.memmap`, so
+several worker processes serving the same index share the page cache instead
+of each holding a private copy.
+
+Layout of an index directory:
+
+    current.json            manifest: live generation, row count, dimension
+    lock                    flock() target serializing writers across processes
+    gen-000001/
+        vectors.f32         (count, dimension) unit-normalized float32 rows
+        lists.i32           inverted list of each row (-1 until trained)
+        deleted.u8          tombstone flag per row
+        centroids.f32       (nlist, dimension) coarse quantizer, once trained
+        records.jsonl       one {"id", "metadata"} line per row
+
+Inserts append rows and bump the manifest count; deletes and overwrites set
+tombstones in place. Compaction rewrites live rows into a new generation,
+(re)training the centroids, and runs on a background thread once the index
+is large enough to train or too many rows are tombstoned.
+"""
+import os
+import json
+import math
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from app.services.vector_store import (
+    VectorStore,
+    PARTITION_FIELD,
+    matches_filter,
+    route_filter,
+    best_first,
+    safe_partition_name
+)
+from app.utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - Windows has no flock
+    fcntl = None
+
+# Number of inverted lists probed per query
+DEFAULT_NPROBE = int(os.getenv("ANN_NPROBE", "8"))
+
+# Live rows required before the coarse quantizer is trained
+TRAIN_THRESHOLD = int(os.getenv("ANN_TRAIN_THRESHOLD", "2048"))
+
+# Fraction of tombstoned rows that triggers compaction
+COMPACTION_DELETED_RATIO = 0.2
+
+# Retrain once the index has grown this much since the last training
+RETRAIN_GROWTH_FACTOR = 4
+
+# K-means settings for training the coarse quantizer
+KMEANS_ITERATIONS = 10
+KMEANS_MAX_SAMPLE = 50_000
+
+def choose_nlist(count: int) -> int:
+    """Number of inverted lists for an index of `count` vectors (~4 * sqrt(n))."""
+    return max(1, min(4096, int(4 * math.sqrt(count))))
+
+def train_centroids(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """
+    Train a spherical k-means coarse quantizer.
+
+    Args:
+        vectors: Unit-normalized training vectors
+        nlist: Number of centroids
+        seed: Random seed for sampling and initialization
+
+    Returns:
+        (nlist, dimension) unit-normalized float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_MAX_SAMPLE:
+        vectors = vectors[np.sort(rng.choice(len(vectors), KMEANS_MAX_SAMPLE, replace=False))]
+    sample = np.ascontiguousarray(vectors, dtype=np.float32)
+    nlist = min(nlist, len(sample))
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        norms = np.linalg.norm(sums, axis=1)
+        empty = norms == 0
+        # Re-seed empty clusters with random sample points
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+        centroids = sums / norms[:, None]
+    return centroids.astype(np.float32)
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    """Assign each vector to its nearest centroid, in chunks to bound memory."""
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_size):
+        block = np.asarray(vectors[start:start + chunk_size])
+        assignments[start:start + chunk_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+def _open_memmap(path: str, dtype: Any, shape: Tuple[int, ...]) -> np.ndarray:
+    """Map a flat binary file, tolerating empty files (np.memmap rejects them)."""
+    if not shape[0]:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+class IvfIndex:
+    """
+    IVF-flat index for a single agent, stored in memory-mapped files.
+
+    Safe to use from several threads and from several processes pointing at
+    the same directory: writers serialize on a file lock and readers pick up
+    appended rows, tombstones and new generations on their next query.
+    """
+
+    def __init__(self, path: str, dimension: int, nprobe: int = DEFAULT_NPROBE):
+        self.path = path
+        self.dimension = dimension
+        self.nprobe = nprobe
+        os.makedirs(path, exist_ok=True)
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._generation = None
+        # Random ID written on first insert; detects an index deleted and recreated elsewhere
+        self._uid = None
+        self._count = 0
+        self._refresh()
+
+    # ----- files -----
+
+    @property
+    def _manifest_path(self) -> str:
+        return os.path.join(self.path, "current.json")
+
+    def _gen_dir(self, generation: int) -> str:
+        return os.path.join(self.path, f"gen-{generation:06d}")
+
+    def _gen_file(self, name: str, generation: Optional[int] = None) -> str:
+        return os.path.join(self._gen_dir(self._generation if generation is None else generation), name)
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        try:
+            with open(self._manifest_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generation": 0, "count": 0, "dimension": self.dimension, "trained_count": 0}
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+
+    @contextmanager
+    def _file_lock(self, name: str = "lock", blocking: bool = True):
+        """Cross-process lock; yields False if non-blocking acquisition failed."""
+        if fcntl is None:
+            yield True
+            return
+        with open(os.path.join(self.path, name), "a") as handle:
+            flags = fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(handle, flags)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    # ----- in-memory view -----
+
+    def _refresh(self) -> None:
+        """Pick up changes made by this or other processes since the last call."""
+        for attempt in range(3):
+            manifest = self._read_manifest()
+            try:
+                if manifest["generation"] != self._generation or manifest.get("uid") != self._uid:
+                    self._open(manifest)
+                elif manifest["count"] > self._count:
+                    self._extend(manifest["count"])
+                return
+            except FileNotFoundError:
+                # A concurrent compaction removed the generation we were reading
+                self._generation = None
+                if attempt == 2:
+                    raise
+
+    def _open(self, manifest: Dict[str, Any]) -> None:
+        self._generation = manifest["generation"]
+        self._uid = manifest.get("uid")
+        self._trained_count = manifest.get("trained_count", 0)
+        if self._generation == 0:
+            os.makedirs(self._gen_dir(0), exist_ok=True)
+        centroids_path = self._gen_file("centroids.f32")
+        if os.path.exists(centroids_path):
+            self.centroids = np.fromfile(centroids_path, dtype=np.float32).reshape(-1, self.dimension)
+        else:
+            self.centroids = None
+        self._count = 0
+        self._records_offset = 0
+        self._ids: List[str] = []
+        self._metadata: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {}
+        self._lists: Dict[int, np.ndarray] = {}
+        self._map(0)
+        self._extend(manifest["count"])
+
+    def _map(self, count: int) -> None:
+        self.vectors = _open_memmap(self._gen_file("vectors.f32"), np.float32, (count, self.dimension))
+        self.assignments = _open_memmap(self._gen_file("lists.i32"), np.int32, (count,))
+        self.deleted = _open_memmap(self._gen_file("deleted.u8"), np.uint8, (count,))
+
+    def _extend(self, count: int) -> None:
+        """Map rows [self._count, count) appended since the last refresh."""
+        start = self._count
+        self._map(count)
+        if count == start:
+            return
+        with open(self._gen_file("records.jsonl"), "rb") as f:
+            f.seek(self._records_offset)
+            for _ in range(count - start):
+                line = f.readline()
+                record = json.loads(line)
+                self._rows[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._metadata.append(record["metadata"])
+            self._records_offset = f.tell()
+
+        new_assignments = np.asarray(self.assignments[start:count])
+        rows = np.arange(start, count)
+        for list_id in np.unique(new_assignments):
+            members = rows[new_assignments == list_id]
+            existing = self._lists.get(int(list_id))
+            self._lists[int(list_id)] = members if existing is None else np.concatenate([existing, members])
+        self._count = count
+
+    # ----- public API -----
+
+    @property
+    def count(self) -> int:
+        """Number of rows, including tombstoned ones."""
+        with self._lock:
+            self._refresh()
+            return self._count
+
+    @property
+    def live_count(self) -> int:
+        """Number of rows that are not tombstoned."""
+        with self._lock:
+            self._refresh()
+            return self._count - int(np.count_nonzero(self.deleted))
+
+    def upsert(self, ids: List[str], vectors: np.ndarray, metadata: List[Dict[str, Any]]) -> None:
+        """
+        Append rows, tombstoning any earlier rows with the same IDs.
+
+        Args:
+            ids: Record IDs
+            vectors: (n, dimension) unit-normalized float32 vectors
+            metadata: Metadata dictionaries
+        """
+        # Keep only the last occurrence of duplicate IDs within the batch
+        latest = {id_: i for i, id_ in enumerate(ids)}
+        keep = sorted(latest.values())
+        if not keep:
+            return
+        ids = [ids[i] for i in keep]
+        vectors = np.ascontiguousarray(vectors[keep], dtype=np.float32)
+        metadata = [metadata[i] for i in keep]
+
+        with self._lock, self._file_lock():
+            self._refresh()
+            for id_ in ids:
+                row = self._rows.get(id_)
+                if row is not None:
+                    self.deleted[row] = 1
+
+            if self.centroids is not None:
+                assignments = assign_lists(vectors, self.centroids)
+            else:
+                assignments = np.full(len(ids), -1, dtype=np.int32)
+
+            with open(self._gen_file("vectors.f32"), "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._gen_file("lists.i32"), "ab") as f:
+                f.write(assignments.astype(np.int32).tobytes())
+            with open(self._gen_file("deleted.u8"), "ab") as f:
+                f.write(np.zeros(len(ids), dtype=np.uint8).tobytes())
+            with open(self._gen_file("records.jsonl"), "a") as f:
+                for id_, meta in zip(ids, metadata):
+                    f.write(json.dumps({"id": id_, "metadata": meta}) + "\n")
+            self._flush()
+
+            if self._uid is None:
+                self._uid = uuid.uuid4().hex
+            manifest = self._read_manifest()
+            manifest.update(
+                generation=self._generation,
+                count=self._count + len(ids),
+                dimension=self.dimension,
+                uid=self._uid
+            )
+            self._write_manifest(manifest)
+            self._refresh()
+
+    def delete(self, ids: List[str]) -> int:
+        """
+        Tombstone rows by ID.
+
+        Returns:
+            Number of rows tombstoned
+        """
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = [self._rows[id_] for id_ in ids if id_ in self._rows]
+            return self._tombstone(rows)
+
+    def delete_by_filter(self, filter: Optional[Dict[str, Any]]) -> int:
+        """Tombstone every live row whose metadata matches the filter."""
+        with self._lock, self._file_lock():
+            self._refresh()
+            rows = [
+                row for row in range(self._count)
+                if not self.deleted[row] and matches_filter(self._metadata[row], filter)
+            ]
+            return self._tombstone(rows)
+
+    def _tombstone(self, rows: List[int]) -> int:
+        rows = [row for row in rows if not self.deleted[row]]
+        if rows:
+            # The tombstone file is a shared mapping, so other processes see this immediately
+            self.deleted[rows] = 1
+            self._flush()
+        return len(rows)
+
+    def _flush(self) -> None:
+        if isinstance(self.deleted, np.memmap):
+            self.deleted.flush()
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        nprobe: Optional[int] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Approximate top-k search over live rows.
+
+        Probes the `nprobe` closest inverted lists (plus any rows not yet
+        assigned to a list) and scores candidates exactly.
+        """
+        with self._lock:
+            self._refresh()
+            if not self._count or top_k <= 0:
+                return []
+
+            if self.centroids is None:
+                candidates = np.arange(self._count)
+            else:
+                probe = np.argsort(-(self.centroids @ query))[:nprobe or self.nprobe]
+                parts = [self._lists[int(p)] for p in probe if int(p) in self._lists]
+                if -1 in self._lists:
+                    parts.append(self._lists[-1])
+                candidates = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+
+            candidates = candidates[np.asarray(self.deleted[candidates]) == 0]
+            if not len(candidates):
+                return []
+            scores = np.asarray(self.vectors[candidates]) @ query
+            accept = None
+            if filter:
+                accept = lambda i: matches_filter(self._metadata[candidates[i]], filter)
+            results = []
+            for i in best_first(scores, top_k, accept):
+                result = {
+                    "id": self._ids[candidates[i]],
+                    "score": float(scores[i]),
+                    "metadata": self._metadata[candidates[i]]
+                }
+                if include_values:
+                    result["values"] = np.asarray(self.vectors[candidates[i]]).tolist()
+                results.append(result)
+            return results
+
+    def fetch(self, ids: List[str]) -> Dict[str, List[float]]:
+        """Stored (normalized) vectors of live rows by ID."""
+        with self._lock:
+            self._refresh()
+            found = {}
+            for id_ in ids:
+                row = self._rows.get(id_)
+                if row is not None and not self.deleted[row]:
+                    found[id_] = np.asarray(self.vectors[row]).tolist()
+            return found
+
+    def needs_compaction(self) -> bool:
+        """Whether training, retraining or tombstone cleanup is due."""
+        with self._lock:
+            self._refresh()
+            deleted = int(np.count_nonzero(self.deleted))
+            live = self._count - deleted
+            if deleted > COMPACTION_DELETED_RATIO * self._count and deleted >= 64:
+                return True
+            if self.centroids is None:
+                return live >= TRAIN_THRESHOLD
+            return live > RETRAIN_GROWTH_FACTOR * max(self._trained_count, 1)
+
+    def compact(self) -> bool:
+        """
+        Rewrite live rows into a new generation and retrain the quantizer.
+
+        Rows are copied without holding the writer lock; inserts and deletes
+        that happen meanwhile are replayed before the new generation is
+        published.
+
+        Returns:
+            True if a new generation was published
+        """
+        with self._file_lock("compact.lock", blocking=False) as acquired:
+            if not acquired:
+                return False
+
+            with self._lock, self._file_lock():
+                self._refresh()
+                generation = self._generation
+                snapshot = self._count
+                live_rows = np.flatnonzero(np.asarray(self.deleted[:snapshot]) == 0)
+                vectors = self.vectors
+                records = [(self._ids[row], self._metadata[row]) for row in live_rows]
+
+            new_generation = generation + 1
+            new_dir = self._gen_dir(new_generation)
+            shutil.rmtree(new_dir, ignore_errors=True)
+            os.makedirs(new_dir)
+
+            live_vectors = np.asarray(vectors[live_rows]) if len(live_rows) else np.zeros((0, self.dimension), np.float32)
+            centroids = None
+            if len(live_rows) >= TRAIN_THRESHOLD:
+                centroids = train_centroids(live_vectors, choose_nlist(len(live_rows)))
+                centroids.tofile(os.path.join(new_dir, "centroids.f32"))
+                assignments = assign_lists(live_vectors, centroids)
+            else:
+                assignments = np.full(len(live_rows), -1, dtype=np.int32)
+
+            live_vectors.tofile(os.path.join(new_dir, "vectors.f32"))
+            assignments.astype(np.int32).tofile(os.path.join(new_dir, "lists.i32"))
+            deleted = np.zeros(len(live_rows), dtype=np.uint8)
+            with open(os.path.join(new_dir, "records.jsonl"), "w") as f:
+                for id_, meta in records:
+                    f.write(json.dumps({"id": id_, "metadata": meta}) + "\n")
+
+            with self._lock, self._file_lock():
+                self._refresh()
+                if self._generation != generation:
+                    shutil.rmtree(new_dir, ignore_errors=True)
+                    return False
+
+                # Replay tombstones set on copied rows since the snapshot
+                deleted[np.asarray(self.deleted[live_rows]) == 1] = 1
+                deleted.tofile(os.path.join(new_dir, "deleted.u8"))
+
+                # Replay rows appended since the snapshot
+                tail = np.arange(snapshot, self._count)
+                tail = tail[np.asarray(self.deleted[tail]) == 0]
+                if len(tail):
+                    tail_vectors = np.asarray(self.vectors[tail])
+                    if centroids is not None:
+                        tail_assignments = assign_lists(tail_vectors, centroids)
+                    else:
+                        tail_assignments = np.full(len(tail), -1, dtype=np.int32)
+                    with open(os.path.join(new_dir, "vectors.f32"), "ab") as f:
+                        f.write(tail_vectors.tobytes())
+                    with open(os.path.join(new_dir, "lists.i32"), "ab") as f:
+                        f.write(tail_assignments.astype(np.int32).tobytes())
+                    with open(os.path.join(new_dir, "deleted.u8"), "ab") as f:
+                        f.write(np.zeros(len(tail), dtype=np.uint8).tobytes())
+                    with open(os.path.join(new_dir, "records.jsonl"), "a") as f:
+                        for row in tail:
+                            f.write(json.dumps({"id": self._ids[row], "metadata": self._metadata[row]}) + "\n")
+
+                self._write_manifest({
+                    "generation": new_generation,
+                    "count": len(live_rows) + len(tail),
+                    "dimension": self.dimension,
+                    "uid": self._uid,
+                    "trained_count": len(live_rows) if centroids is not None else 0
+                })
+                self._refresh()
+
+            # Other processes may still map the old files; unlinking is safe on POSIX
+            shutil.rmtree(self._gen_dir(generation), ignore_errors=True)
+            logger.info(
+                "Compacted ANN index %s: generation %d, %d rows, %s lists",
+                self.path, new_generation, self._count,
+                len(centroids) if centroids is not None else "no"
+            )
+            return True
+
+    def compact_in_background(self) -> None:
+        """Start compaction on a daemon thread unless one is already running."""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run() -> None:
+            try:
+                self.compact()
+            except Exception as e:
+                logger.error("ANN index compaction failed for %s: %s", self.path, str(e))
+            finally:
+                self._compacting = False
+
+        threading.Thread(target=run, name="ann-compaction", daemon=True).start()
+
+class AnnVectorStore(VectorStore):
+    """
+    VectorStore with one persistent IvfIndex per partition under `path`.
+
+    A partition is the namespace when one is given, otherwise the record's
+    agent_id. Namespace names should stick to letters, digits, "-" and "_"
+    since they become directory names. Compaction is scheduled on a
+    background thread after writes whenever an index reports it is due.
+    """
+
+    def __init__(self, dimension: int, path: str, nprobe: int = DEFAULT_NPROBE):
+        self.dimension = dimension
+        self.path = path
+        self.nprobe = nprobe
+        self._indexes: Dict[str, IvfIndex] = {}
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _index(self, name: str) -> IvfIndex:
+        """Index for a partition directory name (see safe_partition_name)."""
+        with self._lock:
+            if name not in self._indexes:
+                self._indexes[name] = IvfIndex(os.path.join(self.path, name), self.dimension, self.nprobe)
+            return self._indexes[name]
+
+    def _partition_names(self, keys: Optional[List[str]]) -> List[str]:
+        """Existing partition directories, optionally restricted to some keys."""
+        names = [safe_partition_name(k) for k in keys] if keys is not None else os.listdir(self.path)
+        return [name for name in names if os.path.isdir(os.path.join(self.path, name))]
+
+    def _select(
+        self,
+        filter: Optional[Dict[str, Any]],
+        namespace: Optional[str]
+    ) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        """Partition directories to visit and the filter left to evaluate per record."""
+        if namespace is not None:
+            return self._partition_names([namespace]), filter
+        keys, residual = route_filter(filter)
+        return self._partition_names(keys), residual
+
+    def _normalize(self, vectors: Any) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def _maybe_compact(self, index: IvfIndex) -> None:
+        if index.needs_compaction():
+            index.compact_in_background()
+
+    def upsert(self, records: List[Dict[str, Any]], namespace: Optional[str] = None) -> None:
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for record in records:
+            key = namespace if namespace is not None else str((record.get("metadata") or {}).get(PARTITION_FIELD, ""))
+            groups.setdefault(safe_partition_name(key), []).append(record)
+        for name, group in groups.items():
+            index = self._index(name)
+            index.upsert(
+                [r["id"] for r in group],
+                self._normalize([r["values"] for r in group]),
+                [dict(r.get("metadata") or {}) for r in group]
+            )
+            self._maybe_compact(index)
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        query = self._normalize(vector)[0]
+        names, residual = self._select(filter, namespace)
+        results = []
+        for name in names:
+            results.extend(self._index(name).search(query, top_k, residual, include_values=include_values))
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:top_k]
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for name in self._partition_names([namespace] if namespace is not None else None):
+            for id_, values in self._index(name).fetch([i for i in ids if i not in found]).items():
+                found[id_] = values
+        return found
+
+    def delete(self, ids: List[str], namespace: Optional[str] = None) -> None:
+        names = self._partition_names([namespace] if namespace is not None else None)
+        for name in names:
+            index = self._index(name)
+            if index.delete(ids):
+                self._maybe_compact(index)
+
+    def delete_by_filter(self, filter: Dict[str, Any], namespace: Optional[str] = None) -> None:
+        names, residual = self._select(filter, namespace)
+        for name in names:
+            index = self._index(name)
+            if index.delete_by_filter(residual):
+                self._maybe_compact(index)
+
+    def delete_namespace(self, namespace: str) -> None:
+        name = safe_partition_name(namespace)
+        with self._lock:
+            self._indexes.pop(name, None)
+        # Other processes notice the missing directory on their next query
+        shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+    def list_namespaces(self) -> List[str]:
+        return [
+            "" if name == "_default" else name
+            for name in self._partition_names(None)
+            if self._index(name).live_count
+        ]
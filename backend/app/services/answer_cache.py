@@ -0,0 +1,228 @@
+"""
+Semantic answer cache for RAG responses.
+
+Popular agents get the same question many times in slightly different
+words. Answers are cached per agent and mode together with the query
+embedding; a new query whose embedding is within ANSWER_CACHE_MAX_DISTANCE
+(cosine distance) of a cached query gets the cached answer without a vector
+query or completion.
+
+Entries expire after ANSWER_CACHE_TTL seconds and are evicted least recently
+used, per agent and across agents. An agent's entries are dropped as soon
+as its content version changes (see ContentVersions.bump_version), which
+happens on every re-sync or deletion, from any process on the host.
+
+The cache lives in process memory, so each worker has its own.
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import numpy as np
+from app.services.chunk_store import content_versions, ALL_AGENTS
+from app.utils.logger import logger
+from app.utils.metrics import ANSWER_CACHE_LOOKUPS, ANSWER_CACHE_HITS, ANSWER_CACHE_SAVED
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+
+# Maximum cosine distance (1 - similarity) between a query and a cached query.
+# ada-002 similarities bunch up between 0.7 and 1.0: the same question about
+# another year or entity is often within 0.03, so the bar is kept tight.
+MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.02"))
+
+TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+MAX_ENTRIES_PER_AGENT = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+MAX_AGENTS = 1024
+
+@dataclass
+class CacheStats:
+    """Counters describing cache effectiveness."""
+    lookups: int = 0
+    hits: int = 0
+    stores: int = 0
+    evictions: int = 0
+    invalidations: int = 0
+    saved_seconds: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache."""
+        return self.hits / self.lookups if self.lookups else 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize stats for logs and endpoints."""
+        return {
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hit_rate, 4),
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "saved_seconds": round(self.saved_seconds, 3)
+        }
+
+@dataclass
+class _Entry:
+    query: str
+    answer: str
+    vector: np.ndarray
+    created: float
+    latency: float
+
+@dataclass
+class _Scope:
+    """Cached entries of one agent and mode."""
+    version: int
+    entries: "OrderedDict[int, _Entry]" = field(default_factory=OrderedDict)
+    matrix: Optional[np.ndarray] = None
+    keys: List[int] = field(default_factory=list)
+
+class SemanticCache:
+    """Per-agent LRU cache of answers, looked up by embedding similarity."""
+
+    def __init__(
+        self,
+        max_distance: float = MAX_DISTANCE,
+        ttl_seconds: float = TTL_SECONDS,
+        max_entries: int = MAX_ENTRIES_PER_AGENT,
+        max_agents: int = MAX_AGENTS,
+        version_of: Callable[[str], int] = content_versions.content_version,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.max_distance = max_distance
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_agents = max_agents
+        self.version_of = version_of
+        self.clock = clock
+        self.stats = CacheStats()
+        self._scopes: "OrderedDict[Tuple[str, str], _Scope]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _scope(self, agent_id: Optional[str], mode: str, create: bool) -> Optional[_Scope]:
+        """The live scope of an agent, dropping it if the agent's content changed."""
+        key = (agent_id or ALL_AGENTS, mode)
+        version = self.version_of(key[0])
+        scope = self._scopes.get(key)
+        if scope is not None and scope.version != version:
+            del self._scopes[key]
+            self.stats.invalidations += 1
+            scope = None
+        if scope is None and create:
+            scope = self._scopes[key] = _Scope(version=version)
+            if len(self._scopes) > self.max_agents:
+                _, evicted = self._scopes.popitem(last=False)
+                self.stats.evictions += len(evicted.entries)
+        if scope is not None:
+            self._scopes.move_to_end(key)
+        return scope
+
+    def _expire(self, scope: _Scope) -> None:
+        cutoff = self.clock() - self.ttl_seconds
+        expired = [key for key, entry in scope.entries.items() if entry.created < cutoff]
+        for key in expired:
+            del scope.entries[key]
+        if expired:
+            scope.matrix = None
+
+    def lookup(self, agent_id: Optional[str], mode: str, vector: List[float]) -> Optional[str]:
+        """
+        Find a cached answer for a query embedding.
+
+        Args:
+            agent_id: The agent, or None for search across all agents
+            mode: RAG mode, cached separately
+            vector: The query embedding
+
+        Returns:
+            The cached answer, or None on a miss
+        """
+        started = self.clock()
+        ANSWER_CACHE_LOOKUPS.inc()
+        with self._lock:
+            self.stats.lookups += 1
+            scope = self._scope(agent_id, mode, create=False)
+            if scope is None:
+                return None
+            self._expire(scope)
+            if not scope.entries:
+                return None
+            if scope.matrix is None:
+                scope.keys = list(scope.entries)
+                scope.matrix = np.stack([scope.entries[k].vector for k in scope.keys])
+            similarities = scope.matrix @ self._normalize(vector)
+            best = int(np.argmax(similarities))
+            if 1.0 - float(similarities[best]) > self.max_distance:
+                return None
+
+            key = scope.keys[best]
+            entry = scope.entries[key]
+            scope.entries.move_to_end(key)
+            self.stats.hits += 1
+            saved = max(entry.latency - (self.clock() - started), 0.0)
+            self.stats.saved_seconds += saved
+        ANSWER_CACHE_HITS.inc()
+        ANSWER_CACHE_SAVED.inc(saved)
+        logger.info("Answer cache hit for agent %s (similarity %.3f, saved %.0f ms, hit rate %.2f)",
+                    agent_id or ALL_AGENTS, float(similarities[best]), saved * 1000, self.stats.hit_rate)
+        return entry.answer
+
+    def store(
+        self,
+        agent_id: Optional[str],
+        mode: str,
+        query: str,
+        vector: List[float],
+        answer: str,
+        latency: float
+    ) -> None:
+        """
+        Cache an answer.
+
+        Args:
+            agent_id: The agent, or None for search across all agents
+            mode: RAG mode
+            query: The query text, kept for debugging
+            vector: The query embedding
+            answer: The generated answer
+            latency: Seconds it took to produce the answer, counted as saved on hits
+        """
+        with self._lock:
+            scope = self._scope(agent_id, mode, create=True)
+            self._next_key += 1
+            scope.entries[self._next_key] = _Entry(
+                query=query,
+                answer=answer,
+                vector=self._normalize(vector),
+                created=self.clock(),
+                latency=latency
+            )
+            while len(scope.entries) > self.max_entries:
+                scope.entries.popitem(last=False)
+                self.stats.evictions += 1
+            scope.matrix = None
+            self.stats.stores += 1
+
+    def invalidate(self, agent_id: Optional[str] = None) -> None:
+        """Drop cached answers of one agent (all modes), or everything."""
+        with self._lock:
+            keys = [k for k in self._scopes if agent_id is None or k[0] in (agent_id, ALL_AGENTS)]
+            for key in keys:
+                del self._scopes[key]
+            self.stats.invalidations += len(keys)
+
+    def size(self) -> int:
+        """Number of cached answers."""
+        with self._lock:
+            return sum(len(scope.entries) for scope in self._scopes.values())
+
+answer_cache = SemanticCache()
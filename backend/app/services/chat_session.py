@@ -0,0 +1,111 @@
+"""
+chat_session.py: State of a WebSocket chat between a user and an agent.
+
+A form POST chat looks the agent up again for every message. A ChatSession
+resolves the agent once per connection and keeps the last
+CHAT_SESSION_HISTORY messages of the conversation in memory for the
+connection's lifetime, so follow-up questions skip those lookups and the
+history is served without a database round trip. Answers are streamed
+piece by piece as the completion is generated (see rag_stream).
+"""
+import os
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+from app.services.db_service import get_agent_by_id, get_chat_history, save_chat_message, is_being_deleted
+from app.services.rag_service import rag_stream, is_generated_answer
+from app.services.conversation_summary import load_conversation, schedule_summary_update
+from app.utils.logger import logger
+
+CHAT_SESSION_HISTORY = int(os.getenv("CHAT_SESSION_HISTORY", "20"))
+
+# Questions a client may send ahead of the answers; they are answered in order
+CHAT_SESSION_MAX_PIPELINED = int(os.getenv("CHAT_SESSION_MAX_PIPELINED", "8"))
+
+class ChatSession:
+    """A user's conversation with an agent over one connection."""
+
+    def __init__(self, agent: Dict[str, Any], user_id: str, history: List[Dict[str, Any]]):
+        self.agent = agent
+        self.user_id = user_id
+        self._history: Deque[Dict[str, Any]] = deque(history, maxlen=CHAT_SESSION_HISTORY)
+
+    @classmethod
+    async def open(cls, agent_id: str, user_id: str) -> Optional["ChatSession"]:
+        """
+        Resolve the agent and load the recent history of the conversation.
+
+        Args:
+            agent_id: The ID of the agent to chat with
+            user_id: The ID of the user chatting
+
+        Returns:
+            The session, or None if the agent does not exist or is being deleted
+        """
+        agent = await get_agent_by_id(agent_id)
+        if not agent or is_being_deleted(agent):
+            return None
+        try:
+            history = await get_chat_history(agent_id=agent_id, user_id=user_id, limit=CHAT_SESSION_HISTORY)
+        except Exception as e:
+            # The history is a convenience; the chat works without it
+            logger.warning("Failed to load chat history for session - agent_id: %s, user_id: %s: %s",
+                           agent_id, user_id, str(e))
+            history = []
+        return cls(agent, user_id, history)
+
+    @property
+    def agent_id(self) -> str:
+        return self.agent["id"]
+
+    @property
+    def history(self) -> List[Dict[str, Any]]:
+        """The most recent messages, oldest first."""
+        return list(self._history)
+
+    async def ask(self, message: str, on_piece: Callable[[str], Awaitable[None]]) -> Dict[str, Any]:
+        """
+        Answer a message, passing the answer to `on_piece` as it is generated.
+
+        Args:
+            message: The user's message
+            on_piece: Called with each piece of the answer, in order
+
+        Returns:
+            The full response with the saved user and agent messages
+
+        Raises:
+            ServiceUnavailableError: If a dependency of the answer is unavailable
+            DeadlineExceeded: If the request deadline passes before the answer is complete
+            Exception: If the user message cannot be saved
+        """
+        user_message = await save_chat_message(
+            agent_id=self.agent_id,
+            user_id=self.user_id,
+            role="user",
+            content=message
+        )
+        self._history.append(user_message)
+
+        pieces = []
+        conversation = await load_conversation(self.user_id, self.agent_id)
+        async for piece in rag_stream(message, self.agent_id, mode="chat", conversation=conversation):
+            pieces.append(piece)
+            await on_piece(piece)
+        response = "".join(pieces)
+
+        agent_message = None
+        try:
+            agent_message = await save_chat_message(
+                agent_id=self.agent_id,
+                user_id=self.user_id,
+                role="agent",
+                content=response
+            )
+        except Exception as e:
+            # The user already has the answer
+            logger.error("Failed to save agent response: %s", str(e), exc_info=True)
+        # Remembered even if unsaved: the user saw it
+        self._history.append(agent_message or {"role": "agent", "content": response})
+        if is_generated_answer(response):
+            schedule_summary_update(self.user_id, self.agent_id, message, response)
+        return {"response": response, "user_message": user_message, "agent_message": agent_message}
@@ -0,0 +1,263 @@
+"""
+Chunk store keeping message text and display metadata out of the vector index.
+
+Vector metadata only carries the fields queries filter on (see
+FILTERABLE_FIELDS). Everything else - the post text, source link and any
+future rich fields - is stored here as a document keyed by vector ID, and
+fetched in one batched lookup once the top-k matches are known.
+
+Documents must be readable by every worker on every host that queries the
+index, so they are kept in a database selected with CHUNK_STORE:
+    supabase (default) - the `chunks` table (see migrations)
+    sqlite             - a local SQLite file (CHUNK_STORE_PATH), for tests
+                         and single-host offline deployments
+
+Alongside, a small local database keeps a content version per agent,
+bumped whenever an agent's vectors change, so caches in any process on the
+host (see answer_cache) can tell when an agent was re-synced.
+"""
+import os
+import json
+import zlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Iterable, Iterator, Tuple
+from app.utils.logger import logger
+
+CHUNK_STORE_BACKEND = os.getenv("CHUNK_STORE", "supabase").lower()
+CHUNK_STORE_PATH = os.getenv("CHUNK_STORE_PATH", "data/chunks.db")
+CONTENT_VERSION_PATH = os.getenv("CONTENT_VERSION_PATH", "data/versions.db")
+
+# Metadata fields kept on the vector; everything else goes to the chunk store
+FILTERABLE_FIELDS = ("agent_id", "date", "views", "forwards")
+
+# SQLite limits the number of bound parameters per statement
+LOOKUP_BATCH_SIZE = 500
+
+# PostgREST takes IN lists in the URL, which proxies cap at a few KB
+SUPABASE_BATCH_SIZE = 100
+
+# Version key bumped on any agent's change, for caches spanning all agents
+ALL_AGENTS = "*"
+
+def split_metadata(metadata: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Split full chunk metadata into vector metadata and a stored document.
+
+    Args:
+        metadata: Metadata including text and display fields
+
+    Returns:
+        Tuple of (filterable vector metadata, document for the chunk store)
+    """
+    slim = {k: v for k, v in metadata.items() if k in FILTERABLE_FIELDS}
+    document = {k: v for k, v in metadata.items() if k not in FILTERABLE_FIELDS}
+    return slim, document
+
+class ChunkStore(ABC):
+    """Chunk documents keyed by vector ID. Calls block; run them off the event loop."""
+
+    @abstractmethod
+    def put(self, agent_id: str, documents: Dict[str, Dict[str, Any]]) -> None:
+        """Insert or replace the documents of one agent, keyed by vector ID."""
+
+    @abstractmethod
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """Fetch documents for the given vector IDs; missing IDs are omitted."""
+
+    @abstractmethod
+    def iter_agent(self, agent_id: str) -> Iterator[Dict[str, Dict[str, Any]]]:
+        """Yield all documents of an agent in batches, keyed by vector ID."""
+
+    @abstractmethod
+    def agent_ids_of(self, ids: List[str]) -> List[str]:
+        """Distinct agents owning the given vector IDs."""
+
+    @abstractmethod
+    def delete(self, ids: List[str]) -> None:
+        """Delete documents by vector ID."""
+
+    @abstractmethod
+    def delete_agent(self, agent_id: str) -> int:
+        """Delete every document of an agent, returning how many were removed."""
+
+class SqliteChunkStore(ChunkStore):
+    """SQLite table of compressed chunk documents, shared by the workers of one host."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY,"
+            " agent_id TEXT NOT NULL,"
+            " document BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chunks_agent_id ON chunks (agent_id)")
+
+    @staticmethod
+    def _encode(document: Dict[str, Any]) -> bytes:
+        return zlib.compress(json.dumps(document, ensure_ascii=False).encode("utf-8"))
+
+    @staticmethod
+    def _decode(blob: bytes) -> Dict[str, Any]:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def put(self, agent_id: str, documents: Dict[str, Dict[str, Any]]) -> None:
+        rows = [(id_, agent_id, self._encode(doc)) for id_, doc in documents.items()]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, agent_id, document) VALUES (?, ?, ?)", rows
+            )
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ids = list(dict.fromkeys(ids))
+        found: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                batch = ids[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                for id_, blob in self._conn.execute(
+                    f"SELECT id, document FROM chunks WHERE id IN ({placeholders})", batch
+                ):
+                    found[id_] = self._decode(blob)
+        return found
+
+    def iter_agent(self, agent_id: str, batch_size: int = LOOKUP_BATCH_SIZE) -> Iterator[Dict[str, Dict[str, Any]]]:
+        last_id = ""
+        while True:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT id, document FROM chunks WHERE agent_id = ? AND id > ? ORDER BY id LIMIT ?",
+                    (agent_id, last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            yield {id_: self._decode(blob) for id_, blob in rows}
+            last_id = rows[-1][0]
+
+    def agent_ids_of(self, ids: List[str]) -> List[str]:
+        agents = set()
+        with self._lock:
+            for i in range(0, len(ids), LOOKUP_BATCH_SIZE):
+                batch = ids[i:i + LOOKUP_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                agents.update(row[0] for row in self._conn.execute(
+                    f"SELECT DISTINCT agent_id FROM chunks WHERE id IN ({placeholders})", batch
+                ))
+        return sorted(agents)
+
+    def delete(self, ids: List[str]) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+
+    def delete_agent(self, agent_id: str) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM chunks WHERE agent_id = ?", (agent_id,)).rowcount
+
+    def count(self) -> int:
+        """Total number of stored documents."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+class SupabaseChunkStore(ChunkStore):
+    """The `chunks` table in Supabase, read by every worker on every host."""
+
+    TABLE = "chunks"
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def _table(self) -> Any:
+        return self.client.table(self.TABLE)
+
+    def put(self, agent_id: str, documents: Dict[str, Dict[str, Any]]) -> None:
+        rows = [{"id": id_, "agent_id": agent_id, "document": doc} for id_, doc in documents.items()]
+        for i in range(0, len(rows), SUPABASE_BATCH_SIZE):
+            self._table().upsert(rows[i:i + SUPABASE_BATCH_SIZE]).execute()
+
+    def get_many(self, ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        ids = list(dict.fromkeys(ids))
+        found: Dict[str, Dict[str, Any]] = {}
+        for i in range(0, len(ids), SUPABASE_BATCH_SIZE):
+            response = self._table().select("id, document").in_("id", ids[i:i + SUPABASE_BATCH_SIZE]).execute()
+            found.update((row["id"], row["document"]) for row in response.data)
+        return found
+
+    def iter_agent(self, agent_id: str, batch_size: int = LOOKUP_BATCH_SIZE) -> Iterator[Dict[str, Dict[str, Any]]]:
+        last_id = ""
+        while True:
+            rows = (self._table().select("id, document").eq("agent_id", agent_id).gt("id", last_id)
+                    .order("id").limit(batch_size).execute().data)
+            if not rows:
+                return
+            yield {row["id"]: row["document"] for row in rows}
+            last_id = rows[-1]["id"]
+
+    def agent_ids_of(self, ids: List[str]) -> List[str]:
+        agents = set()
+        for i in range(0, len(ids), SUPABASE_BATCH_SIZE):
+            response = self._table().select("agent_id").in_("id", ids[i:i + SUPABASE_BATCH_SIZE]).execute()
+            agents.update(row["agent_id"] for row in response.data)
+        return sorted(agents)
+
+    def delete(self, ids: List[str]) -> None:
+        for i in range(0, len(ids), SUPABASE_BATCH_SIZE):
+            self._table().delete().in_("id", ids[i:i + SUPABASE_BATCH_SIZE]).execute()
+
+    def delete_agent(self, agent_id: str) -> int:
+        return len(self._table().delete().eq("agent_id", agent_id).execute().data)
+
+class ContentVersions:
+    """Per-agent content versions in a SQLite file shared by the workers of one host."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS agent_versions ("
+            " agent_id TEXT PRIMARY KEY,"
+            " version INTEGER NOT NULL)"
+        )
+
+    def bump_version(self, agent_ids: Iterable[str]) -> None:
+        """Record that the content of these agents (and so of all agents) changed."""
+        keys = [(key,) for key in set(agent_ids) | {ALL_AGENTS}]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO agent_versions (agent_id, version) VALUES (?, 1) "
+                "ON CONFLICT (agent_id) DO UPDATE SET version = version + 1",
+                keys
+            )
+
+    def content_version(self, agent_id: str) -> int:
+        """Current content version of an agent, or of all agents for ALL_AGENTS."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version FROM agent_versions WHERE agent_id = ?", (agent_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+if CHUNK_STORE_BACKEND == "supabase":
+    from app.services.db_service import supabase
+    chunk_store: ChunkStore = SupabaseChunkStore(supabase)
+    logger.info("Chunk store in the Supabase %s table", SupabaseChunkStore.TABLE)
+elif CHUNK_STORE_BACKEND == "sqlite":
+    chunk_store = SqliteChunkStore(CHUNK_STORE_PATH)
+    logger.info("Chunk store at %s", CHUNK_STORE_PATH)
+else:
+    raise ValueError(f"Unknown CHUNK_STORE backend: {CHUNK_STORE_BACKEND}")
+
+content_versions = ContentVersions(CONTENT_VERSION_PATH)
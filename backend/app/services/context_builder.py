@@ -0,0 +1,84 @@
+"""
+Context assembly for RAG prompts.
+
+Chunks are added to the prompt context in priority order (the order the
+reranker selected them) until a token budget is filled, counting tokens
+with the local tokenizer (see app.utils.tokens). Long chunks are cut at a
+sentence boundary to MAX_CHUNK_TOKENS, and the last chunk that does not
+fit is shortened to the remaining budget rather than dropped.
+"""
+import os
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+from app.utils.tokens import count_tokens, truncate_to_tokens
+from app.utils.logger import logger
+
+# Token budget for the references in the prompt context
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RAG_CONTEXT_TOKENS", "3000"))
+
+# Longest text a single chunk may contribute
+MAX_CHUNK_TOKENS = int(os.getenv("RAG_MAX_CHUNK_TOKENS", "600"))
+
+# Truncated chunks shorter than this are not worth including
+MIN_CHUNK_TOKENS = 32
+
+@dataclass
+class Context:
+    """Assembled prompt context and what went into it."""
+    text: str = ""
+    tokens: int = 0
+    budget: int = 0
+    chunks: List[Dict[str, Any]] = field(default_factory=list)
+    truncated_count: int = 0
+    dropped_count: int = 0
+
+def chunk_text(chunk: Dict[str, Any]) -> str:
+    """Text of a chunk, also for chunks that only carry it in metadata."""
+    return chunk.get('text') or chunk.get('metadata', {}).get('text', '')
+
+def format_reference(chunk: Dict[str, Any], text: str) -> str:
+    """Format one chunk as a bullet with its source reference."""
+    source = chunk.get('metadata', {}).get('source_link', 'Unknown source')
+    score = chunk.get('score', 0.0)
+    return f"• {text} (source: {source}, relevance: {score:.3f})"
+
+def build_context(
+    chunks: List[Dict[str, Any]],
+    budget: Optional[int] = None,
+    max_chunk_tokens: int = MAX_CHUNK_TOKENS
+) -> Context:
+    """
+    Format chunks into a bullet list of references that fits a token budget.
+
+    Args:
+        chunks: Chunks in priority order, best first
+        budget: Maximum tokens of the assembled context; defaults to CONTEXT_TOKEN_BUDGET
+        max_chunk_tokens: Maximum tokens of text taken from a single chunk
+
+    Returns:
+        Context with the formatted text, its token count and the included chunks
+    """
+    budget = CONTEXT_TOKEN_BUDGET if budget is None else budget
+    context = Context(budget=budget)
+    lines = []
+
+    for chunk in chunks:
+        text = chunk_text(chunk)
+        # Tokens of the bullet, source and score around the text, plus the newline
+        overhead = count_tokens(format_reference(chunk, "")) + 1
+        available = min(max_chunk_tokens, budget - context.tokens - overhead)
+        if available <= 0 or (available < MIN_CHUNK_TOKENS and count_tokens(text) > available):
+            context.dropped_count += 1
+            continue
+
+        fitted = truncate_to_tokens(text, available)
+        if fitted != text:
+            context.truncated_count += 1
+        line = format_reference(chunk, fitted)
+        lines.append(line)
+        context.tokens += count_tokens(line) + 1
+        context.chunks.append(chunk)
+        logger.debug("Context chunk %s: %d tokens", chunk.get('id'), count_tokens(line))
+
+    context.text = "\n".join(lines)
+    return context
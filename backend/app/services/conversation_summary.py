@@ -0,0 +1,323 @@
+"""
+conversation_summary.py: Rolling summaries of user-agent conversations.
+
+Chat retrieval only sees the latest message, so a follow-up such as "what
+about last year?" has nothing to retrieve with, while sending the whole
+history with every question would multiply its token cost. Instead each
+conversation keeps a rolling summary of at most SUMMARY_MAX_TOKENS and a
+short topic line (the people, things and time frame being discussed):
+
+- after each turn answered by a completion, schedule_summary_update folds
+  the turn into the summary with one small completion. It runs in the
+  background, after the answer has been sent, and folds the turns of a
+  conversation in order. It takes a slot of the completion admission
+  controller only if one is free, so under load summaries are skipped
+  rather than competing with answers.
+- a question that looks like a follow-up (see is_follow_up) is retrieved
+  for together with the topic and answered with the summary in the prompt.
+  The summary's tokens come out of the context budget, so prompts do not
+  grow; other questions are answered exactly as before.
+
+Summaries live in a SQLite database (CONVERSATION_STORE_PATH) shared by the
+worker processes of a host, like the chunk store.
+"""
+import os
+import re
+import time
+import asyncio
+import sqlite3
+import threading
+import contextvars
+from dataclasses import dataclass
+from typing import Dict, Optional, Set, Tuple
+from app.services.openai_service import generate_completion, COMPLETION_ERROR_MESSAGE, llm_admission
+from app.utils.logger import logger
+from app.utils.tokens import count_tokens, truncate_to_tokens
+from app.utils.metrics import CONVERSATION_SUMMARY_UPDATES, LLM_IN_FLIGHT
+
+CONVERSATION_SUMMARY_ENABLED = os.getenv("CONVERSATION_SUMMARY_ENABLED", "true").lower() == "true"
+CONVERSATION_STORE_PATH = os.getenv("CONVERSATION_STORE_PATH", "data/conversations.db")
+
+# Size of the stored summary and topic, and of a turn as folded into the summary
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "200"))
+TOPIC_MAX_TOKENS = 32
+SUMMARY_TURN_TOKENS = int(os.getenv("SUMMARY_TURN_TOKENS", "400"))
+
+# Summary completions running at once, and updates waiting before new ones are dropped
+SUMMARY_MAX_CONCURRENCY = int(os.getenv("SUMMARY_MAX_CONCURRENCY", "4"))
+SUMMARY_MAX_PENDING = int(os.getenv("SUMMARY_MAX_PENDING", "256"))
+
+# A question this short made only of question and function words ("why?",
+# "how much?", "and in 2023?") has nothing to retrieve with on its own
+FOLLOW_UP_MAX_WORDS = int(os.getenv("FOLLOW_UP_MAX_WORDS", "4"))
+
+# Openers continuing the previous turn (English and Russian)
+_CONTINUING = re.compile(
+    r"^\W*(and|but|also|so|what about|how about|what else|"
+    r"а|и|но|тоже|а что|а как)\b",
+    re.IGNORECASE
+)
+
+# Explicit references to earlier turns: to what was said, to a person
+# mentioned before, or to a thing as the object closing the question
+# ("tell me more about that"). A pronoun alone is not enough: "is it worth
+# buying TON?" and "do they accept crypto?" stand on their own.
+_REFERRING = re.compile(
+    r"\b(you (just )?(said|mentioned|wrote)|earlier|previous|the same|that one|this one|"
+    r"he|him|his|she|hers|"
+    r"(about|of|on|with|for|from|to|by) (it|that|this|these|those|them|him|her)\W*$|"
+    r"вы (сказали|писали|упомянули)|ранее|выше|то же|"
+    r"он|она|его|её|ее|ему|ей|"
+    r"(об|о|про|на|с|у|от|к|в) (этом|том|нём|нем|ней|них|это|то|этого|того)\W*$)",
+    re.IGNORECASE
+)
+
+# Words carrying no subject of their own
+_FUNCTION_WORDS = {
+    "what", "why", "how", "when", "where", "who", "which", "much", "many", "long", "more",
+    "else", "so", "really", "and", "but", "or", "in", "on", "at", "of", "for", "the", "a",
+    "is", "was", "are", "were", "did", "does", "do", "it", "that", "this", "then", "than",
+    "а", "и", "что", "почему", "как", "когда", "где", "кто", "сколько", "в", "на", "это", "ли"
+}
+
+_WORD = re.compile(r"[^\W_]+", re.UNICODE)
+
+SUMMARY_PROMPT = """Update the running summary of a conversation between a user and an AI expert on a Telegram channel.
+
+Current summary:
+{summary}
+
+Latest exchange:
+User: {question}
+Expert: {answer}
+
+Rewrite the summary in at most {max_words} words. Keep the names, numbers, dates and claims the user may refer back to; drop pleasantries. Then name what the conversation is about now (people, things, time frame) in a few words.
+
+Answer in this format:
+Summary: <summary>
+Topic: <topic>"""
+
+_SUMMARY_LINE = re.compile(r"^\s*summary:\s*", re.IGNORECASE | re.MULTILINE)
+_TOPIC_LINE = re.compile(r"^\s*topic:\s*(.*)$", re.IGNORECASE | re.MULTILINE)
+
+@dataclass
+class ConversationSummary:
+    """What a user and an agent have talked about so far."""
+    summary: str
+    topic: str
+    turns: int
+
+class ConversationStore:
+    """SQLite table of conversation summaries keyed by user and agent."""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_summaries ("
+            " user_id TEXT NOT NULL,"
+            " agent_id TEXT NOT NULL,"
+            " summary TEXT NOT NULL,"
+            " topic TEXT NOT NULL,"
+            " turns INTEGER NOT NULL,"
+            " updated REAL NOT NULL,"
+            " PRIMARY KEY (user_id, agent_id))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversation_summaries_agent_id ON conversation_summaries (agent_id)"
+        )
+
+    def get(self, user_id: str, agent_id: str) -> Optional[ConversationSummary]:
+        """The summary of a conversation, or None before its first turn."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT summary, topic, turns FROM conversation_summaries WHERE user_id = ? AND agent_id = ?",
+                (user_id, agent_id)
+            ).fetchone()
+        return ConversationSummary(*row) if row else None
+
+    def put(self, user_id: str, agent_id: str, conversation: ConversationSummary) -> None:
+        """Store the summary of a conversation, replacing the previous one."""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO conversation_summaries"
+                " (user_id, agent_id, summary, topic, turns, updated) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, agent_id, conversation.summary, conversation.topic, conversation.turns, time.time())
+            )
+
+    def delete_agent(self, agent_id: str) -> int:
+        """Delete the summaries of an agent's conversations; returns how many were deleted."""
+        with self._lock:
+            cursor = self._conn.execute("DELETE FROM conversation_summaries WHERE agent_id = ?", (agent_id,))
+        logger.info("Deleted %d conversation summaries of agent %s", cursor.rowcount, agent_id)
+        return cursor.rowcount
+
+conversation_store = ConversationStore(CONVERSATION_STORE_PATH)
+
+def is_follow_up(query: str) -> bool:
+    """
+    Whether a question likely depends on earlier turns.
+
+    It does if it continues the previous turn ("and what about 2023?"),
+    refers back to something said before ("did he confirm it?", "tell me
+    more about that"), or is too short to have a subject of its own
+    ("why?"). Questions that merely are short ("What is Bitcoin?") or
+    contain a pronoun ("is it worth buying TON?") are standalone.
+    """
+    if _CONTINUING.search(query) or _REFERRING.search(query):
+        return True
+    words = [word.lower() for word in _WORD.findall(query)]
+    return 0 < len(words) <= FOLLOW_UP_MAX_WORDS and all(
+        word in _FUNCTION_WORDS or word.isdigit() for word in words
+    )
+
+def contextualize_query(query: str, conversation: Optional[ConversationSummary]) -> str:
+    """The query to retrieve with: a follow-up is completed with the conversation topic."""
+    if conversation is None or not conversation.topic:
+        return query
+    return f"{query}\n{conversation.topic}"
+
+def parse_summary(text: str) -> Tuple[str, str]:
+    """
+    Read the summary and topic from a summary completion.
+
+    Returns:
+        Tuple of (summary, topic); the topic is empty if the completion has none
+    """
+    topic_match = _TOPIC_LINE.search(text)
+    topic = topic_match.group(1).strip() if topic_match else ""
+    summary = text[:topic_match.start()] if topic_match else text
+    summary = _SUMMARY_LINE.sub("", summary, count=1).strip()
+    return (
+        truncate_to_tokens(summary, SUMMARY_MAX_TOKENS),
+        truncate_to_tokens(topic, TOPIC_MAX_TOKENS, ellipsis="")
+    )
+
+async def load_conversation(user_id: str, agent_id: str) -> Optional[ConversationSummary]:
+    """The summary of a conversation; None if there is none or it cannot be read."""
+    if not CONVERSATION_SUMMARY_ENABLED:
+        return None
+    try:
+        return await asyncio.to_thread(conversation_store.get, user_id, agent_id)
+    except Exception as e:
+        logger.warning("Failed to load conversation summary - agent_id: %s, user_id: %s: %s",
+                       agent_id, user_id, str(e))
+        return None
+
+async def update_summary(user_id: str, agent_id: str, question: str, answer: str) -> Optional[ConversationSummary]:
+    """
+    Fold a turn into the summary of its conversation.
+
+    Args:
+        user_id: The user of the conversation
+        agent_id: The agent of the conversation
+        question: The user's message
+        answer: The agent's answer
+
+    Returns:
+        The updated summary, or None if it could not be updated
+    """
+    try:
+        current = await asyncio.to_thread(conversation_store.get, user_id, agent_id)
+        # The answer gets what the question leaves of the turn's budget
+        question = truncate_to_tokens(question, SUMMARY_TURN_TOKENS // 2)
+        answer = truncate_to_tokens(answer, SUMMARY_TURN_TOKENS - count_tokens(question))
+        prompt = SUMMARY_PROMPT.format(
+            summary=current.summary if current else "(none yet)",
+            question=question,
+            answer=answer,
+            # About three words per four tokens
+            max_words=SUMMARY_MAX_TOKENS * 3 // 4
+        )
+        text = await generate_completion(prompt, max_tokens=SUMMARY_MAX_TOKENS + TOPIC_MAX_TOKENS + 16,
+                                         temperature=0.2)
+        if not text or text == COMPLETION_ERROR_MESSAGE:
+            raise ValueError("No summary generated")
+        summary, topic = parse_summary(text)
+        updated = ConversationSummary(
+            summary=summary,
+            topic=topic or (current.topic if current else ""),
+            turns=(current.turns if current else 0) + 1
+        )
+        await asyncio.to_thread(conversation_store.put, user_id, agent_id, updated)
+    except Exception as e:
+        # The conversation keeps its previous summary; the next turn tries again
+        CONVERSATION_SUMMARY_UPDATES.labels("failed").inc()
+        logger.warning("Failed to update conversation summary - agent_id: %s, user_id: %s: %s",
+                       agent_id, user_id, str(e))
+        return None
+    CONVERSATION_SUMMARY_UPDATES.labels("updated").inc()
+    logger.debug("Updated conversation summary - agent_id: %s, user_id: %s, turns: %d, %d tokens",
+                 agent_id, user_id, updated.turns, count_tokens(updated.summary))
+    return updated
+
+_update_slots: Optional[asyncio.Semaphore] = None
+# Latest update scheduled per conversation, and all updates not yet done
+_latest: Dict[Tuple[str, str], asyncio.Task] = {}
+_pending: Set[asyncio.Task] = set()
+
+async def _update_in_order(previous: Optional[asyncio.Task], user_id: str, agent_id: str,
+                           question: str, answer: str) -> None:
+    global _update_slots
+    if previous is not None:
+        # Fold turns in the order they happened; the previous update's outcome does not matter
+        await asyncio.wait([previous])
+    if _update_slots is None:
+        _update_slots = asyncio.Semaphore(SUMMARY_MAX_CONCURRENCY)
+    async with _update_slots:
+        # Summaries share the completion slots of answers but never queue
+        # for one: under load they are skipped, not answers
+        if not llm_admission.try_acquire():
+            CONVERSATION_SUMMARY_UPDATES.labels("shed").inc()
+            logger.warning("Skipped conversation summary update - agent_id: %s, user_id: %s: "
+                           "completions saturated", agent_id, user_id)
+            return
+        started = time.monotonic()
+        LLM_IN_FLIGHT.inc()
+        try:
+            await update_summary(user_id, agent_id, question, answer)
+        finally:
+            LLM_IN_FLIGHT.dec()
+            llm_admission.observe(time.monotonic() - started)
+            llm_admission.release()
+
+def schedule_summary_update(user_id: str, agent_id: str, question: str, answer: str) -> None:
+    """
+    Fold a turn into its conversation's summary in the background.
+
+    The update runs outside the request: it has no deadline and is not
+    cancelled with the request. Turns of a conversation are folded in the
+    order they were scheduled. Updates beyond SUMMARY_MAX_PENDING are
+    dropped, and an update finding every completion slot taken is skipped.
+    """
+    if not CONVERSATION_SUMMARY_ENABLED:
+        return
+    if len(_pending) >= SUMMARY_MAX_PENDING:
+        CONVERSATION_SUMMARY_UPDATES.labels("dropped").inc()
+        logger.warning("Dropped conversation summary update - agent_id: %s, user_id: %s: %d pending",
+                       agent_id, user_id, len(_pending))
+        return
+    key = (user_id, agent_id)
+    coro = _update_in_order(_latest.get(key), user_id, agent_id, question, answer)
+    # A fresh context leaves the request's deadline and trace behind
+    task = contextvars.Context().run(asyncio.ensure_future, coro)
+    _latest[key] = task
+    _pending.add(task)
+
+    def done(task: asyncio.Task) -> None:
+        _pending.discard(task)
+        if _latest.get(key) is task:
+            del _latest[key]
+
+    task.add_done_callback(done)
+
+async def wait_for_summary_updates() -> None:
+    """Wait until the scheduled summary updates are done."""
+    while _pending:
+        await asyncio.wait(list(_pending))
@@ -4,9 +4,11 @@ Handles all database operations and provides a clean interface for data access.
 """
 import os
 from typing import Optional, List, Dict, Any
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 from app.utils.logger import logger
+from app.utils.tracing import traced
+from app.fakes import fake_enabled
 from datetime import datetime
 
 # Load environment variables
@@ -15,16 +17,24 @@ load_dotenv()
 # Initialize Supabase client
 supabase_url = os.getenv("SUPABASE_URL")
 supabase_key = os.getenv("SUPABASE_KEY")
+# Seconds a Supabase query may take; the client default is two minutes
+supabase_timeout = float(os.getenv("SUPABASE_TIMEOUT", "10"))
 
-if not supabase_url or not supabase_key:
-    logger.error("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
-    raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+if fake_enabled("supabase"):
+    from app.fakes.supabase_fake import FakeSupabase
+    logger.info("Using fake in-memory Supabase client")
+    supabase: Client = FakeSupabase()
+else:
+    if not supabase_url or not supabase_key:
+        logger.error("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
+        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in environment variables")
 
-logger.info("Initializing Supabase client with URL: %s", supabase_url)
-supabase: Client = create_client(
-    supabase_url=supabase_url,
-    supabase_key=supabase_key
-)
+    logger.info("Initializing Supabase client with URL: %s", supabase_url)
+    supabase: Client = create_client(
+        supabase_url=supabase_url,
+        supabase_key=supabase_key,
+        options=ClientOptions(postgrest_client_timeout=supabase_timeout)
+    )
 
 async def get_user_by_telegram_id(telegram_id: str) -> Optional[Dict[str, Any]]:
     """
@@ -56,6 +66,7 @@ async def create_user(telegram_id: str, username: str) -> Dict[str, Any]:
         logger.error("Failed to create user with telegram_id: %s - %s", telegram_id, str(e))
         raise
 
+@traced("supabase.get_agent")
 async def get_agent_by_id(agent_id: str) -> Optional[Dict[str, Any]]:
     """
     Retrieve an agent by its ID.
@@ -141,6 +152,7 @@ async def create_agent(
         logger.error("Failed to create agent for owner_id: %s - %s", owner_id, str(e))
         raise
 
+@traced("supabase.save_message")
 async def save_chat_message(
     agent_id: str,
     user_id: str,
@@ -163,7 +175,7 @@ async def save_chat_message(
         Exception: If message creation fails
     """
     logger.info("Saving chat message - agent_id: %s, user_id: %s, role: %s", agent_id, user_id, role)
-    logger.debug("Message content: %s", content)
+    logger.debug("Message length: %d chars", len(content))
     
     message_data = {
         "agent_id": agent_id,
@@ -174,16 +186,15 @@ async def save_chat_message(
     }
     
     try:
-        logger.debug("Inserting message into database: %s", message_data)
         response = supabase.table("chat_messages").insert(message_data).execute()
         logger.info("Successfully saved chat message with id: %s", response.data[0]["id"])
-        logger.debug("Saved message data: %s", response.data[0])
         return response.data[0]
     except Exception as e:
         logger.error("Failed to save chat message - %s", str(e), exc_info=True)
         logger.error("Error type: %s", type(e).__name__)
         raise
 
+@traced("supabase.chat_history")
 async def get_chat_history(
     agent_id: str,
     user_id: str,
@@ -223,12 +234,10 @@ async def get_chat_history(
         
         logger.debug("Executing query...")
         response = query.execute()
-        logger.debug("Raw response data: %s", response.data)
         
         # Return messages in chronological order (oldest first)
         messages = sorted(response.data, key=lambda x: x["created_at"])
         logger.info("Successfully fetched %d messages", len(messages))
-        logger.debug("Returning messages: %s", messages)
         return messages
         
     except Exception as e:
@@ -267,9 +276,80 @@ async def list_agents() -> List[Dict[str, Any]]:
         logger.error("Failed to fetch agents - %s", str(e))
         raise
 
+async def update_agent_status(agent_id: str, status: str) -> bool:
+    """
+    Set an agent's status, e.g. "deleting" while a deletion job runs.
+
+    Only agents with status "active" are listed.
+
+    Returns:
+        bool: True if successful, False if agent not found
+    """
+    logger.debug("Setting status of agent %s to %s", agent_id, status)
+    try:
+        response = supabase.table("agents").update({"status": status}).eq("id", agent_id).execute()
+        return bool(response.data)
+    except Exception as e:
+        logger.error("Failed to update status of agent %s - %s", agent_id, str(e))
+        raise
+
+def is_being_deleted(agent: Dict[str, Any]) -> bool:
+    """
+    Whether a deletion job has started on an agent.
+
+    Such agents take no new chats: messages saved while the cascade runs
+    could outlive it.
+    """
+    return agent.get("status") in ("deleting", "delete_failed")
+
+async def delete_chat_messages(agent_id: str) -> int:
+    """
+    Delete all chat messages of an agent in one statement.
+
+    Returns:
+        Number of deleted messages
+    """
+    logger.debug("Deleting chat messages for agent: %s", agent_id)
+    try:
+        response = supabase.table("chat_messages").delete().eq("agent_id", agent_id).execute()
+        logger.info("Deleted %d chat messages for agent: %s", len(response.data), agent_id)
+        return len(response.data)
+    except Exception as e:
+        logger.error("Failed to delete chat messages for agent: %s - %s", agent_id, str(e))
+        raise
+
+def agent_photo_path(profile_photo_url: Optional[str]) -> Optional[str]:
+    """Object path inside the agent-photos bucket for a public photo URL."""
+    marker = "/agent-photos/"
+    if not profile_photo_url or marker not in profile_photo_url:
+        return None
+    return profile_photo_url.split(marker, 1)[1].split("?", 1)[0]
+
+async def delete_agent_photos(agent: Dict[str, Any]) -> int:
+    """
+    Remove an agent's uploaded profile photo from storage.
+
+    Returns:
+        Number of removed storage objects
+    """
+    path = agent_photo_path(agent.get("profile_photo_url"))
+    if not path:
+        return 0
+    logger.debug("Removing storage object agent-photos/%s", path)
+    try:
+        removed = supabase.storage.from_("agent-photos").remove([path])
+        logger.info("Removed %d photos of agent: %s", len(removed or []), agent["id"])
+        return len(removed or [])
+    except Exception as e:
+        logger.error("Failed to remove photos of agent: %s - %s", agent["id"], str(e))
+        raise
+
 async def delete_agent(agent_id: str) -> bool:
     """
-    Delete an agent by ID.
+    Delete an agent row by ID.
+
+    Related chat messages, vectors and photos are removed first by
+    app.services.deletion_service.delete_agent_cascade.
     
     Args:
         agent_id: The ID of the agent to delete
@@ -0,0 +1,102 @@
+"""
+Deletion service for removing agents together with everything they own.
+
+An agent's vectors, chunk documents, lexical index, chat messages,
+conversation summaries and profile photo are removed before the agent row itself. The agent is marked
+"deleting" first so it disappears from listings immediately; if a step fails
+it is marked "delete_failed" and keeps its row, so the deletion can simply be
+retried.
+"""
+import time
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional
+from app.services.db_service import (
+    get_agent_by_id, update_agent_status, delete_chat_messages, delete_agent_photos, delete_agent
+)
+from app.services.pinecone_service import delete_agent_vectors
+from app.services.lexical_index import delete_index
+from app.services.conversation_summary import conversation_store
+from app.utils.logger import logger
+
+# Agents deleted in parallel by delete_agents
+DELETION_CONCURRENCY = 4
+
+@dataclass
+class AgentDeletionResult:
+    """Outcome of deleting a single agent."""
+    agent_id: str
+    deleted: bool = False
+    chat_messages: int = 0
+    photos: int = 0
+    error: Optional[str] = None
+    elapsed_seconds: float = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize the result for logs and reports."""
+        return asdict(self)
+
+async def delete_agent_cascade(agent_id: str, agent: Optional[Dict[str, Any]] = None) -> AgentDeletionResult:
+    """
+    Delete an agent and all of its vectors, chat messages and stored photos.
+
+    Meant to run as a background job; errors are recorded on the result and
+    the agent's status rather than raised.
+
+    Args:
+        agent_id: The agent to delete
+        agent: The agent row, if already fetched
+
+    Returns:
+        AgentDeletionResult for this agent
+    """
+    result = AgentDeletionResult(agent_id=agent_id)
+    started = time.monotonic()
+    try:
+        agent = agent or await get_agent_by_id(agent_id)
+        if not agent:
+            result.error = "Agent not found"
+            return result
+
+        await update_agent_status(agent_id, "deleting")
+        if not await delete_agent_vectors(agent_id):
+            raise RuntimeError("failed to delete vectors")
+        await asyncio.to_thread(delete_index, agent_id)
+        await asyncio.to_thread(conversation_store.delete_agent, agent_id)
+        result.chat_messages = await delete_chat_messages(agent_id)
+        result.photos = await delete_agent_photos(agent)
+        result.deleted = await delete_agent(agent_id)
+        logger.info("Deleted agent %s with %d chat messages and %d photos",
+                    agent_id, result.chat_messages, result.photos)
+    except Exception as e:
+        result.error = str(e)
+        logger.error("Failed to delete agent %s: %s", agent_id, str(e))
+        try:
+            await update_agent_status(agent_id, "delete_failed")
+        except Exception:
+            pass
+    finally:
+        result.elapsed_seconds = time.monotonic() - started
+    return result
+
+async def delete_agents(
+    agent_ids: List[str],
+    concurrency: int = DELETION_CONCURRENCY
+) -> List[AgentDeletionResult]:
+    """
+    Delete many agents in parallel.
+
+    Args:
+        agent_ids: Agents to delete
+        concurrency: Maximum number of agents deleted at once
+
+    Returns:
+        One AgentDeletionResult per agent, in input order
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(agent_id: str) -> AgentDeletionResult:
+        async with semaphore:
+            return await delete_agent_cascade(agent_id)
+
+    return await asyncio.gather(*(run(agent_id) for agent_id in agent_ids))
@@ -0,0 +1,186 @@
+"""
+Background health probing of external services.
+
+Each worker probes OpenAI, Pinecone and Supabase every HEALTH_CHECK_INTERVAL
+seconds in a background task and keeps the latest result, so health
+endpoints answer from memory: load balancer polls cause no external traffic
+and never wait on a slow dependency. Blocking clients are probed in a
+thread, and every probe is bounded by HEALTH_CHECK_TIMEOUT.
+
+A result older than HEALTH_STALE_AFTER seconds (the prober is stuck or
+dead) counts as unhealthy.
+
+Reports also include this worker's circuit breaker states. An open circuit
+does not fail readiness: every worker trips on the same outage, and taking
+them all out of rotation would turn fast failures into no service at all.
+"""
+import os
+import time
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+from app.services import openai_service, pinecone_service, db_service
+from app.utils.logger import logger
+from app.utils.circuit_breaker import breakers
+
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", "5"))
+HEALTH_STALE_AFTER = float(os.getenv("HEALTH_STALE_AFTER", str(3 * HEALTH_CHECK_INTERVAL)))
+
+HEALTHY = "healthy"
+UNHEALTHY = "unhealthy"
+UNKNOWN = "unknown"
+DISABLED = "disabled"
+
+@dataclass
+class ServiceHealth:
+    """Latest probe result of one service."""
+    status: str = UNKNOWN
+    checked_at: Optional[float] = None
+    latency_ms: Optional[float] = None
+    error: Optional[str] = None
+
+async def _probe_openai() -> None:
+    await openai_service.client.models.list()
+
+async def _probe_pinecone() -> None:
+    await asyncio.to_thread(pinecone_service.pc.list_indexes)
+
+async def _probe_supabase() -> None:
+    await asyncio.to_thread(
+        lambda: db_service.supabase.table("users").select("*").limit(1).execute()
+    )
+
+def default_probes() -> Dict[str, Optional[Callable[[], Awaitable[Any]]]]:
+    """Probes of the configured services; None marks a disabled service."""
+    return {
+        "openai": _probe_openai,
+        # A local vector store is configured instead of Pinecone
+        "pinecone": _probe_pinecone if pinecone_service.pc is not None else None,
+        "supabase": _probe_supabase
+    }
+
+class HealthProber:
+    """Probes services periodically and serves the cached results."""
+
+    def __init__(
+        self,
+        probes: Optional[Dict[str, Optional[Callable[[], Awaitable[Any]]]]] = None,
+        interval: float = HEALTH_CHECK_INTERVAL,
+        timeout: float = HEALTH_CHECK_TIMEOUT,
+        stale_after: float = HEALTH_STALE_AFTER,
+        clock: Callable[[], float] = time.time
+    ):
+        self.probes = probes if probes is not None else default_probes()
+        self.interval = interval
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.clock = clock
+        self.services: Dict[str, ServiceHealth] = {
+            name: ServiceHealth(status=DISABLED if probe is None else UNKNOWN)
+            for name, probe in self.probes.items()
+        }
+        self._task: Optional[asyncio.Task] = None
+
+    async def _probe(self, name: str, probe: Callable[[], Awaitable[Any]]) -> None:
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(probe(), self.timeout)
+            status, error = HEALTHY, None
+        except asyncio.TimeoutError:
+            status, error = UNHEALTHY, f"timed out after {self.timeout:g}s"
+        except Exception as e:
+            status, error = UNHEALTHY, str(e)
+
+        previous = self.services[name].status
+        self.services[name] = ServiceHealth(
+            status=status,
+            checked_at=self.clock(),
+            latency_ms=round((time.perf_counter() - started) * 1000, 1),
+            error=error
+        )
+        if status == UNHEALTHY:
+            logger.error("%s health check failed: %s", name, error)
+        elif previous == UNHEALTHY:
+            logger.info("%s is healthy again", name)
+
+    async def probe_all(self) -> None:
+        """Probe every enabled service once, concurrently."""
+        await asyncio.gather(*(
+            self._probe(name, probe) for name, probe in self.probes.items() if probe is not None
+        ))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error("Health probing failed: %s", str(e))
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        """Start probing in the background; the first round starts immediately."""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info("Health prober started (every %.0fs)", self.interval)
+
+    async def stop(self) -> None:
+        """Stop the background probing."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def status_of(self, name: str) -> str:
+        """Cached status of a service, unhealthy if the result is stale."""
+        health = self.services[name]
+        if health.checked_at is not None and self.clock() - health.checked_at > self.stale_after:
+            return UNHEALTHY
+        return health.status
+
+    def is_ready(self) -> bool:
+        """Whether every enabled service passed its latest, fresh probe."""
+        return all(self.status_of(name) in (HEALTHY, DISABLED) for name in self.services)
+
+    def report(self, details: bool = False) -> Dict[str, Any]:
+        """
+        Cached health in the /health response format.
+
+        Args:
+            details: Also include probe time, latency and error per service,
+                and call counts per circuit
+
+        Returns:
+            Dict with the overall status, the status of each service and the
+            state of each circuit breaker
+        """
+        statuses = {name: self.status_of(name) for name in self.services}
+        if any(s == UNHEALTHY for s in statuses.values()):
+            overall = UNHEALTHY
+        elif any(s == UNKNOWN for s in statuses.values()):
+            overall = UNKNOWN
+        else:
+            overall = HEALTHY
+        report: Dict[str, Any] = {
+            "status": overall,
+            "services": statuses,
+            "circuits": {
+                name: breaker.snapshot() if details else breaker.state
+                for name, breaker in breakers.items()
+            }
+        }
+        if details:
+            report["checks"] = {
+                name: {
+                    "checked_at": health.checked_at,
+                    "latency_ms": health.latency_ms,
+                    "error": health.error
+                }
+                for name, health in self.services.items()
+            }
+        return report
+
+health_prober = HealthProber()
@@ -0,0 +1,162 @@
+"""
+Ingestion service for turning Telegram channel messages into searchable vectors.
+
+Shared by the agent creation route and the ingestion scripts so that every
+entry point embeds, tags and upserts messages the same way.
+"""
+import time
+import asyncio
+from dataclasses import dataclass, asdict
+from typing import List, Dict, Any, Optional, Callable
+from app.services.openai_service import generate_embeddings
+from app.services.pinecone_service import upsert_vectors, agent_namespace
+from app.services.lexical_index import index_chunks
+from app.utils.logger import logger
+from app.utils.tokens import truncate_to_tokens
+from app.utils.metrics import (
+    INGESTED_MESSAGES, INGESTED_VECTORS, INGESTION_FAILURES, INGESTION_BATCH_LATENCY
+)
+
+# Number of messages embedded and upserted per batch
+EMBEDDING_BATCH_SIZE = 100
+
+# Input limit of text-embedding-ada-002; one longer text fails its whole batch
+EMBEDDING_MAX_TOKENS = 8191
+
+@dataclass
+class IngestionStats:
+    """Counters describing a single ingestion run."""
+    agent_id: str
+    channel: str = ""
+    message_count: int = 0
+    vector_count: int = 0
+    token_count: int = 0
+    failed_count: int = 0
+    last_message_id: Optional[int] = None
+    elapsed_seconds: float = 0.0
+
+    @property
+    def messages_per_second(self) -> float:
+        """Throughput of processed messages."""
+        if not self.elapsed_seconds:
+            return 0.0
+        return self.message_count / self.elapsed_seconds
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serialize stats for reports and API responses."""
+        data = asdict(self)
+        data["messages_per_second"] = round(self.messages_per_second, 2)
+        return data
+
+def make_vector_id(agent_id: str, message_id: Any) -> str:
+    """
+    Build a deterministic vector ID for a channel message.
+
+    Using "<agent_id>#<message_id>" makes re-ingestion idempotent and lets all
+    vectors of an agent be addressed by ID prefix.
+    """
+    return f"{agent_id}#{message_id}"
+
+def build_metadata(agent_id: str, msg: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the full metadata for a message embedding.
+
+    upsert_vectors keeps the filterable fields on the vector and moves the
+    text and source link to the chunk store.
+
+    Args:
+        agent_id: The agent the message belongs to
+        msg: Message dictionary as returned by TelegramService
+
+    Returns:
+        Metadata dictionary
+    """
+    return {
+        "agent_id": agent_id,
+        "source_link": msg["link"],
+        "text": msg["text"],
+        "date": msg["date"],
+        "views": msg.get("views") or 0,
+        "forwards": msg.get("forwards") or 0
+    }
+
+async def ingest_messages(
+    agent_id: str,
+    messages: List[Dict[str, Any]],
+    channel: str = "",
+    batch_size: int = EMBEDDING_BATCH_SIZE,
+    on_batch: Optional[Callable[[IngestionStats], None]] = None
+) -> IngestionStats:
+    """
+    Embed channel messages and upsert them into the vector store.
+
+    Messages are processed in ascending ID order so that `last_message_id`
+    always marks a safe point to resume from: it stops advancing at the first
+    failed batch, so nothing at or below it is missing from the index.
+
+    Args:
+        agent_id: The agent the messages belong to
+        messages: Message dictionaries as returned by TelegramService
+        channel: Channel name, used for logging and stats only
+        batch_size: Number of messages embedded per OpenAI call
+        on_batch: Optional callback invoked with running stats after each batch
+
+    Returns:
+        IngestionStats for this run
+    """
+    stats = IngestionStats(agent_id=agent_id, channel=channel)
+    started = time.monotonic()
+    ordered = sorted(messages, key=lambda m: m["id"])
+    resumable = True
+
+    for i in range(0, len(ordered), batch_size):
+        chunk = ordered[i:i + batch_size]
+        batch = [msg for msg in chunk if msg["text"].strip()]
+        stats.message_count += len(chunk)
+        INGESTED_MESSAGES.inc(len(chunk))
+        batch_started = time.monotonic()
+        stored = True
+
+        if batch:
+            # Only the embedded input is cut; the stored and indexed text stays whole
+            texts = [truncate_to_tokens(msg["text"], EMBEDDING_MAX_TOKENS, ellipsis="") for msg in batch]
+            embeddings, tokens = await generate_embeddings(texts)
+            stats.token_count += tokens
+            stored = len(embeddings) == len(batch)
+
+            if stored:
+                ids = [make_vector_id(agent_id, msg["id"]) for msg in batch]
+                metadata = [build_metadata(agent_id, msg) for msg in batch]
+                stored = await upsert_vectors(embeddings, metadata, ids, namespace=agent_namespace(agent_id))
+
+            if stored:
+                try:
+                    texts = {id_: msg["text"] for id_, msg in zip(ids, batch)}
+                    await asyncio.to_thread(index_chunks, agent_id, texts)
+                except Exception as e:
+                    # Lexical search only supplements dense retrieval; keep ingesting
+                    logger.error("Failed to update lexical index for channel %s: %s",
+                                 channel or agent_id, str(e))
+                stats.vector_count += len(batch)
+                INGESTED_VECTORS.inc(len(batch))
+                logger.info(
+                    "Processed batch of %d messages for channel %s (total vectors: %d)",
+                    len(batch), channel or agent_id, stats.vector_count
+                )
+            else:
+                logger.error("Failed to ingest batch of %d messages for channel %s",
+                             len(batch), channel or agent_id)
+                stats.failed_count += len(batch)
+                INGESTION_FAILURES.inc(len(batch))
+                resumable = False
+            INGESTION_BATCH_LATENCY.observe(time.monotonic() - batch_started)
+
+        if resumable:
+            stats.last_message_id = chunk[-1]["id"]
+
+        stats.elapsed_seconds = time.monotonic() - started
+        if on_batch:
+            on_batch(stats)
+
+    stats.elapsed_seconds = time.monotonic() - started
+    return stats
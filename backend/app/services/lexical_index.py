@@ -0,0 +1,162 @@
+"""
+Per-agent BM25 lexical index for hybrid retrieval.
+
+Dense retrieval is weak on exact names, tickers, hashtags and numbers, so
+every ingested chunk is also added to a lexical index of its agent. Each
+agent has its own SQLite FTS5 database under LEXICAL_INDEX_PATH, which keeps
+BM25 statistics per agent, is compact (no term positions are stored) and
+can be dropped with the agent.
+
+Tokenization uses FTS5's unicode61 tokenizer: text is case- and
+diacritic-folded and split on punctuation and underscores, so "#TON",
+"$ton" and "TON" all match the same term, and "#crypto_news" matches
+"crypto" and "news".
+"""
+import os
+import re
+import sqlite3
+import threading
+import hashlib
+from typing import List, Dict, Tuple, Iterable, Optional
+from app.utils.logger import logger
+
+LEXICAL_INDEX_PATH = os.getenv("LEXICAL_INDEX_PATH", "data/lexical")
+
+# Query terms beyond this are ignored to keep MATCH expressions cheap
+MAX_QUERY_TERMS = 32
+
+# Letters and digits, split like unicode61 splits indexed text: underscores
+# separate terms too, so every query term is a single FTS5 token (a quoted
+# multi-token term would be a phrase query, which detail=none rejects)
+_TERM_PATTERN = re.compile(r"[^\W_]+", re.UNICODE)
+
+def query_terms(query: str) -> List[str]:
+    """Distinct lowercase terms of a query, in order of appearance."""
+    terms = dict.fromkeys(term.lower() for term in _TERM_PATTERN.findall(query))
+    return list(terms)[:MAX_QUERY_TERMS]
+
+class LexicalIndex:
+    """BM25 index over the chunks of one agent."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        # ids maps vector IDs to the integer rowids FTS5 is keyed by
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ids (rowid INTEGER PRIMARY KEY, id TEXT UNIQUE NOT NULL)")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5("
+            "body, tokenize='unicode61 remove_diacritics 2', detail=none)"
+        )
+
+    def add(self, documents: Dict[str, str]) -> None:
+        """Insert or replace chunk texts, keyed by vector ID."""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for id_, text in documents.items():
+                    self._conn.execute("INSERT OR IGNORE INTO ids (id) VALUES (?)", (id_,))
+                    rowid = self._conn.execute("SELECT rowid FROM ids WHERE id = ?", (id_,)).fetchone()[0]
+                    self._conn.execute("DELETE FROM docs WHERE rowid = ?", (rowid,))
+                    self._conn.execute("INSERT INTO docs (rowid, body) VALUES (?, ?)", (rowid, text))
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Remove chunks by vector ID."""
+        with self._lock:
+            for id_ in ids:
+                row = self._conn.execute("SELECT rowid FROM ids WHERE id = ?", (id_,)).fetchone()
+                if row:
+                    self._conn.execute("DELETE FROM docs WHERE rowid = ?", row)
+                    self._conn.execute("DELETE FROM ids WHERE rowid = ?", row)
+
+    def search(self, query: str, top_k: int) -> List[Tuple[str, float]]:
+        """
+        Rank chunks by BM25 against any of the query terms.
+
+        Returns:
+            List of (vector ID, BM25 score) pairs, best first
+        """
+        terms = query_terms(query)
+        if not terms or top_k <= 0:
+            return []
+        expression = " OR ".join(f'"{term}"' for term in terms)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT ids.id, bm25(docs) FROM docs JOIN ids ON ids.rowid = docs.rowid "
+                "WHERE docs MATCH ? ORDER BY bm25(docs) LIMIT ?",
+                (expression, top_k)
+            ).fetchall()
+        # FTS5 reports BM25 negated so that smaller sorts first
+        return [(id_, -score) for id_, score in rows]
+
+    def count(self) -> int:
+        """Number of indexed chunks."""
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+
+def _index_path(agent_id: str) -> str:
+    # Agent IDs are UUIDs, but hash anyway so any ID is a safe file name
+    digest = hashlib.sha1(agent_id.encode("utf-8")).hexdigest()[:16]
+    return os.path.join(LEXICAL_INDEX_PATH, f"{digest}.db")
+
+def get_index(agent_id: str, create: bool = True) -> Optional[LexicalIndex]:
+    """
+    The lexical index of an agent.
+
+    Args:
+        agent_id: The agent
+        create: Create the index if it does not exist yet
+
+    Returns:
+        The agent's LexicalIndex, or None if it does not exist and create is False
+    """
+    with _indexes_lock:
+        index = _indexes.get(agent_id)
+        if index is None:
+            path = _index_path(agent_id)
+            if not create and not os.path.exists(path):
+                return None
+            os.makedirs(LEXICAL_INDEX_PATH, exist_ok=True)
+            index = _indexes[agent_id] = LexicalIndex(path)
+        return index
+
+def index_chunks(agent_id: str, documents: Dict[str, str]) -> None:
+    """Add chunk texts of an agent to its lexical index."""
+    if documents:
+        get_index(agent_id).add(documents)
+
+def delete_chunks(agent_id: str, ids: Iterable[str]) -> None:
+    """Remove chunks from an agent's lexical index, if it has one."""
+    index = get_index(agent_id, create=False)
+    if index:
+        index.delete(ids)
+
+def search(agent_id: str, query: str, top_k: int) -> List[Tuple[str, float]]:
+    """BM25 search in an agent's lexical index; empty if the agent has none."""
+    index = get_index(agent_id, create=False)
+    return index.search(query, top_k) if index else []
+
+def delete_index(agent_id: str) -> None:
+    """Drop an agent's lexical index."""
+    with _indexes_lock:
+        index = _indexes.pop(agent_id, None)
+        if index:
+            index.close()
+        path = _index_path(agent_id)
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    logger.info("Deleted lexical index of agent %s", agent_id)
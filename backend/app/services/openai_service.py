@@ -2,15 +2,60 @@
 OpenAI service for generating embeddings and completions.
 """
 import os
-from typing import Optional, List, Dict, Any
-from openai import AsyncOpenAI, APIError, RateLimitError
+import time
+import asyncio
+from typing import Optional, List, Dict, Any, Tuple, AsyncIterator
+from openai import (
+    AsyncOpenAI, APIConnectionError, APIStatusError, InternalServerError, RateLimitError
+)
 from app.utils.logger import logger
-from app.utils.errors import ServiceUnavailableError
+from app.utils.tracing import traced
+from app.utils.metrics import OPENAI_TOKENS
+from app.utils.tokens import count_tokens
+from app.fakes import fake_enabled
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.deadline import call_with_timeout
+from app.utils.circuit_breaker import circuit_breaker
+from app.utils.admission import AdmissionController
 
 # Initialize OpenAI client
-logger.info("Initializing OpenAI client")
-client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+if fake_enabled("openai"):
+    from app.fakes.openai_fake import FakeAsyncOpenAI
+    logger.info("Using fake OpenAI client")
+    client = FakeAsyncOpenAI()
+else:
+    logger.info("Initializing OpenAI client")
+    client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
+# Longest a single call may take, also bounded by the request deadline (see deadline)
+EMBEDDING_TIMEOUT = float(os.getenv("OPENAI_EMBEDDING_TIMEOUT", "10"))
+COMPLETION_TIMEOUT = float(os.getenv("OPENAI_COMPLETION_TIMEOUT", "30"))
+
+# Fails calls fast while OpenAI is failing (see circuit_breaker)
+breaker = circuit_breaker("openai")
+
+# Failures of OpenAI itself: connection errors and timeouts, 429 and 5xx.
+# Rejected requests (400, 401, 404, ...) are bad input or configuration and
+# must not count against the breaker shared by all chats.
+SERVICE_ERRORS = (APIConnectionError, RateLimitError, InternalServerError)
+
+# Completions running at once per process, completions waiting, and how long they may wait
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "10"))
+
+# Shared by every caller of generate_completion: answers queue for it (see
+# rag_service), background summaries only take a slot that is free
+llm_admission = AdmissionController(LLM_MAX_CONCURRENCY, LLM_MAX_QUEUE, LLM_QUEUE_TIMEOUT)
+
+COMPLETION_MODEL = "gpt-3.5-turbo"
+SYSTEM_PROMPT = "You are a helpful AI assistant."
+
+# Returned by generate_completion when the completion fails for a non-API reason
+COMPLETION_ERROR_MESSAGE = "I encountered an error while generating a response. Please try again."
+
+@breaker.protect
+@traced("openai.embedding")
 async def generate_embedding(text: str) -> Optional[List[float]]:
     """
     Generate an embedding for the given text using OpenAI's API.
@@ -23,49 +68,159 @@ async def generate_embedding(text: str) -> Optional[List[float]]:
     """
     try:
         logger.debug("Generating embedding for text: %s...", text[:100])
-        response = await client.embeddings.create(
+        response = await call_with_timeout(client.embeddings.create(
             model="text-embedding-ada-002",
             input=text
-        )
+        ), EMBEDDING_TIMEOUT, "OpenAI")
+        if response.usage:
+            OPENAI_TOKENS.labels("embedding").inc(response.usage.total_tokens)
         logger.info("Successfully generated embedding")
         return response.data[0].embedding
-    except (APIError, RateLimitError) as e:
+    except SERVICE_ERRORS as e:
         logger.error("OpenAI service error: %s", str(e))
         raise ServiceUnavailableError("OpenAI", {"error": str(e)})
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error("Failed to generate embedding: %s", str(e))
         return None
 
-async def generate_completion(prompt: str) -> str:
+@breaker.protect
+@traced("openai.embeddings")
+async def generate_embeddings(texts: List[str]) -> Tuple[List[List[float]], int]:
+    """
+    Generate embeddings for a batch of texts with a single API call.
+
+    Args:
+        texts: The texts to generate embeddings for
+
+    Returns:
+        Tuple of (embeddings in the same order as texts, total tokens consumed).
+        Returns ([], 0) if the batch failed for a non-service reason.
+    """
+    if not texts:
+        return [], 0
+    try:
+        logger.debug("Generating embeddings for batch of %d texts", len(texts))
+        response = await call_with_timeout(client.embeddings.create(
+            model="text-embedding-ada-002",
+            input=texts
+        ), EMBEDDING_TIMEOUT, "OpenAI")
+        embeddings = [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
+        tokens = response.usage.total_tokens if response.usage else 0
+        OPENAI_TOKENS.labels("embedding").inc(tokens)
+        logger.info("Successfully generated %d embeddings (%d tokens)", len(embeddings), tokens)
+        return embeddings, tokens
+    except SERVICE_ERRORS as e:
+        logger.error("OpenAI service error: %s", str(e))
+        raise ServiceUnavailableError("OpenAI", {"error": str(e)})
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error("Failed to generate embeddings: %s", str(e))
+        return [], 0
+
+@breaker.protect
+@traced("openai.completion")
+async def generate_completion(prompt: str, max_tokens: int = 1000, temperature: float = 0.7) -> str:
     """
     Generate a completion for the given prompt using OpenAI's API.
     
     Args:
         prompt: The prompt to generate a completion for
+        max_tokens: Longest completion to generate
+        temperature: Sampling temperature
         
     Returns:
         The generated completion text
     """
     try:
         logger.debug("Generating completion with prompt: %s...", prompt[:100])
-        response = await client.chat.completions.create(
-            model="gpt-3.5-turbo",
+        response = await call_with_timeout(client.chat.completions.create(
+            model=COMPLETION_MODEL,
             messages=[
-                {"role": "system", "content": "You are a helpful AI assistant."},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": prompt}
             ],
-            temperature=0.7,
-            max_tokens=1000
-        )
+            temperature=temperature,
+            max_tokens=max_tokens
+        ), COMPLETION_TIMEOUT, "OpenAI")
+        if response.usage:
+            OPENAI_TOKENS.labels("prompt").inc(response.usage.prompt_tokens)
+            OPENAI_TOKENS.labels("completion").inc(response.usage.completion_tokens)
         logger.info("Successfully generated completion")
         return response.choices[0].message.content
-    except (APIError, RateLimitError) as e:
+    except SERVICE_ERRORS as e:
         logger.error("OpenAI service error: %s", str(e))
         raise ServiceUnavailableError("OpenAI", {"error": str(e)})
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error("Failed to generate completion: %s", str(e))
-        return "I encountered an error while generating a response. Please try again."
+        return COMPLETION_ERROR_MESSAGE
+
+async def generate_completion_stream(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream a completion for the given prompt as it is generated.
+
+    The whole stream is bounded by COMPLETION_TIMEOUT and the request
+    deadline, and counts as one call for the circuit breaker.
+
+    Args:
+        prompt: The prompt to generate a completion for
+
+    Yields:
+        Pieces of the completion text, in order
+
+    Raises:
+        ServiceUnavailableError: If OpenAI fails or is too slow
+        DeadlineExceeded: If the request deadline passes while streaming
+    """
+    breaker.before_call()
+    ends = time.monotonic() + COMPLETION_TIMEOUT
+    pieces: List[str] = []
+    try:
+        stream = await call_with_timeout(client.chat.completions.create(
+            model=COMPLETION_MODEL,
+            messages=[
+                {"role": "system", "content": SYSTEM_PROMPT},
+                {"role": "user", "content": prompt}
+            ],
+            temperature=0.7,
+            max_tokens=1000,
+            stream=True
+        ), COMPLETION_TIMEOUT, "OpenAI")
+        iterator = stream.__aiter__()
+        while True:
+            try:
+                chunk = await call_with_timeout(iterator.__anext__(), ends - time.monotonic(), "OpenAI")
+            except StopAsyncIteration:
+                break
+            piece = chunk.choices[0].delta.content if chunk.choices else None
+            if piece:
+                pieces.append(piece)
+                yield piece
+    except SERVICE_ERRORS as e:
+        logger.error("OpenAI service error: %s", str(e))
+        breaker.record_failure()
+        raise ServiceUnavailableError("OpenAI", {"error": str(e)})
+    except ServiceUnavailableError:
+        breaker.record_failure()
+        raise
+    except (DeadlineExceeded, GeneratorExit, asyncio.CancelledError):
+        # The caller gave up; says nothing about OpenAI
+        breaker.record_cancelled()
+        raise
+    except Exception:
+        breaker.record_success()
+        raise
+    breaker.record_success()
+    # Streamed responses carry no usage; count the tokens locally
+    OPENAI_TOKENS.labels("prompt").inc(count_tokens(SYSTEM_PROMPT) + count_tokens(prompt))
+    OPENAI_TOKENS.labels("completion").inc(count_tokens("".join(pieces)))
+    logger.info("Successfully streamed completion")
 
+@breaker.protect
 async def moderate_content(text: str) -> Dict[str, Any]:
     """
     Check if text content is appropriate using OpenAI's moderation endpoint.
@@ -78,10 +233,11 @@ async def moderate_content(text: str) -> Dict[str, Any]:
         
     Raises:
         ServiceUnavailableError: If OpenAI service is unavailable
+        APIStatusError: If OpenAI rejects the request
     """
     try:
         logger.debug("Moderating content: %s...", text[:100])
-        response = await client.moderations.create(input=text)
+        response = await call_with_timeout(client.moderations.create(input=text), EMBEDDING_TIMEOUT, "OpenAI")
         result = response.results[0]
         if result.flagged:
             logger.warning("Content was flagged by moderation: %s", result.categories)
@@ -92,9 +248,15 @@ async def moderate_content(text: str) -> Dict[str, Any]:
             "categories": result.categories,
             "category_scores": result.category_scores
         }
-    except (APIError, RateLimitError) as e:
+    except SERVICE_ERRORS as e:
         logger.error("OpenAI service error: %s", str(e))
         raise ServiceUnavailableError("OpenAI", {"error": str(e)})
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
+    except APIStatusError:
+        # Rejected request: the caller's problem, not an outage
+        logger.error("OpenAI rejected moderation request", exc_info=True)
+        raise
     except Exception as e:
         logger.error("Failed to moderate content: %s", str(e))
         raise ServiceUnavailableError("OpenAI", {"error": "Unknown error occurred"}) 
\ No newline at end of file
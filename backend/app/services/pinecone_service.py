@@ -1,135 +1,451 @@
 """
 Pinecone service for vector similarity search.
+
+Each agent's vectors are stored in their own namespace (see agent_namespace),
+so chat queries only search that agent's vectors and an agent can be removed
+by dropping its namespace. Search mode fans out across all namespaces.
+
+All reads and writes go through a `VectorStore` selected with the
+VECTOR_STORE environment variable:
+    pinecone (default) - the shared Pinecone index
+    memory             - in-process NumPy store (optionally persisted to
+                         VECTOR_STORE_PATH), for tests and offline deployments
+    ann                - persistent memory-mapped IVF index per agent under
+                         VECTOR_STORE_PATH, for self-hosted deployments
+
+Vectors only carry filterable metadata (see chunk_store); the text and
+display fields are kept in the chunk store and joined onto the top-k
+matches in one batched lookup.
 """
 import os
-from typing import List, Dict, Any
-from pinecone import Pinecone, PodSpec
+import time
+import asyncio
+from typing import List, Dict, Any, Optional
+from app.services.vector_store import VectorStore, PineconeVectorStore, NumpyVectorStore
+from app.services.chunk_store import chunk_store, content_versions, split_metadata
+from app.services import lexical_index
 from app.utils.logger import logger
+from app.utils.tracing import traced
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.deadline import call_with_timeout
+from app.utils.circuit_breaker import circuit_breaker
+from app.fakes import fake_enabled
 
-# Initialize Pinecone client
-pc = Pinecone(
-    api_key=os.getenv("PINECONE_API_KEY"),
-    environment=os.getenv("PINECONE_ENVIRONMENT", "us-east-1-aws")  # Use standardized environment
-)
-
-# Get or create index
 INDEX_NAME = "agentique"
 DIMENSION = 1536  # OpenAI ada-002 embedding dimension
 
-try:
-    # Get index if it exists
+VECTOR_STORE_BACKEND = os.getenv("VECTOR_STORE", "pinecone").lower()
+
+# Each agent's vectors live in their own namespace: "agent-<agent_id>"
+AGENT_NAMESPACE_PREFIX = "agent-"
+
+# Also look in the default namespace for agents not yet migrated
+# (see scripts/migrate_namespaces.py); disable once migration is done
+LEGACY_NAMESPACE_FALLBACK = os.getenv("PINECONE_LEGACY_FALLBACK", "true").lower() == "true"
+
+# Parallel namespace queries for search mode and how long the namespace list is cached
+FANOUT_CONCURRENCY = int(os.getenv("PINECONE_FANOUT_CONCURRENCY", "8"))
+NAMESPACE_CACHE_SECONDS = 60
+_namespace_cache: Dict[str, Any] = {"names": [], "expires": 0.0}
+
+# Longest a single vector store call may take, also bounded by the request deadline
+VECTOR_STORE_TIMEOUT = float(os.getenv("VECTOR_STORE_TIMEOUT", "5"))
+
+# Fails queries fast while the vector store is failing (see circuit_breaker)
+breaker = circuit_breaker("pinecone")
+
+# Pinecone client and index; None when a local backend is selected
+pc = None
+index = None
+
+if VECTOR_STORE_BACKEND == "pinecone" and fake_enabled("pinecone"):
+    from app.fakes.pinecone_fake import FakePinecone
+    pc = FakePinecone()
     index = pc.Index(INDEX_NAME)
-    logger.info("Connected to existing Pinecone index: %s", INDEX_NAME)
-except Exception as e:
-    # Create index if it doesn't exist
-    logger.info("Creating new Pinecone index with environment: %s", os.getenv("PINECONE_ENVIRONMENT"))
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=DIMENSION,
-        metric="cosine",
-        spec=PodSpec(environment=os.getenv("PINECONE_ENVIRONMENT", "us-east-1-aws"))
+    store: VectorStore = PineconeVectorStore(index, DIMENSION)
+    logger.info("Using fake in-process Pinecone index")
+elif VECTOR_STORE_BACKEND == "pinecone":
+    from pinecone import Pinecone, PodSpec
+
+    # Initialize Pinecone client
+    pc = Pinecone(
+        api_key=os.getenv("PINECONE_API_KEY"),
+        environment=os.getenv("PINECONE_ENVIRONMENT", "us-east-1-aws")  # Use standardized environment
     )
-    index = pc.Index(INDEX_NAME)
-    logger.info("Created new Pinecone index: %s", INDEX_NAME)
 
+    try:
+        # Get index if it exists
+        index = pc.Index(INDEX_NAME)
+        logger.info("Connected to existing Pinecone index: %s", INDEX_NAME)
+    except Exception as e:
+        # Create index if it doesn't exist
+        logger.info("Creating new Pinecone index with environment: %s", os.getenv("PINECONE_ENVIRONMENT"))
+        pc.create_index(
+            name=INDEX_NAME,
+            dimension=DIMENSION,
+            metric="cosine",
+            spec=PodSpec(environment=os.getenv("PINECONE_ENVIRONMENT", "us-east-1-aws"))
+        )
+        index = pc.Index(INDEX_NAME)
+        logger.info("Created new Pinecone index: %s", INDEX_NAME)
+
+    store: VectorStore = PineconeVectorStore(index, DIMENSION)
+elif VECTOR_STORE_BACKEND == "memory":
+    store = NumpyVectorStore(DIMENSION, path=os.getenv("VECTOR_STORE_PATH") or None)
+    logger.info("Using in-process NumPy vector store")
+elif VECTOR_STORE_BACKEND == "ann":
+    from app.services.ann_index import AnnVectorStore
+    store = AnnVectorStore(DIMENSION, path=os.getenv("VECTOR_STORE_PATH", "data/ann"))
+    logger.info("Using local ANN vector store at %s", store.path)
+else:
+    raise ValueError(f"Unknown VECTOR_STORE backend: {VECTOR_STORE_BACKEND}")
+
+def agent_namespace(agent_id: str) -> str:
+    """Namespace holding all vectors of an agent."""
+    return f"{AGENT_NAMESPACE_PREFIX}{agent_id}"
+
+def _query(
+    query_vector: List[float],
+    top_k: int,
+    filter_params: Optional[Dict[str, Any]],
+    namespace: Optional[str],
+    include_values: bool = False
+) -> List[Dict[str, Any]]:
+    """Query one namespace, falling back to legacy agent_id-filtered vectors."""
+    matches = store.query(
+        query_vector, top_k=top_k, filter=filter_params, namespace=namespace, include_values=include_values
+    )
+    if not matches and _is_legacy_candidate(namespace):
+        # Vectors written before per-agent namespaces live in the default namespace
+        legacy_filter = {**(filter_params or {}), "agent_id": namespace[len(AGENT_NAMESPACE_PREFIX):]}
+        matches = store.query(query_vector, top_k=top_k, filter=legacy_filter, include_values=include_values)
+    return matches
+
+def _is_legacy_candidate(namespace: Optional[str]) -> bool:
+    """Whether an agent namespace may still have vectors in the default namespace."""
+    return bool(LEGACY_NAMESPACE_FALLBACK and namespace and namespace.startswith(AGENT_NAMESPACE_PREFIX))
+
+async def _to_chunks(matches: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Convert store matches into the chunk dictionaries used by the RAG service.
+
+    Chunk documents are fetched for all matches in a single lookup and merged
+    into the metadata. Vectors written before the chunk store still carry
+    their text in metadata and are used as-is.
+    """
+    matches = [match for match in matches if match["metadata"]]
+    documents = await asyncio.to_thread(chunk_store.get_many, [match["id"] for match in matches])
+    chunks = []
+    for match in matches:
+        metadata = {**match["metadata"], **documents.get(match["id"], {})}
+        chunk = {
+            'id': match["id"],
+            'text': metadata.get('text', ''),
+            'metadata': metadata,
+            'score': match["score"]
+        }
+        if "values" in match:
+            chunk['values'] = match["values"]
+        chunks.append(chunk)
+    return chunks
+
+async def fetch_chunks(ids: List[str]) -> List[Dict[str, Any]]:
+    """
+    Build chunks for vector IDs straight from the chunk store.
+
+    Used for lexical hits that dense retrieval did not return; the chunks
+    have no similarity score or values (see fetch_vectors). IDs without a
+    stored document are skipped.
+    """
+    documents = await asyncio.to_thread(chunk_store.get_many, ids)
+    return [
+        {
+            'id': id_,
+            'text': documents[id_].get('text', ''),
+            'metadata': documents[id_],
+            'score': 0.0
+        }
+        for id_ in ids
+        if id_ in documents
+    ]
+
+@traced("vector.fetch")
+async def fetch_vectors(ids: List[str], namespace: Optional[str] = None) -> Dict[str, List[float]]:
+    """
+    Fetch stored vector values by ID.
+
+    Args:
+        ids: Vector IDs
+        namespace: Namespace holding the vectors; None for the default one
+
+    Returns:
+        Values by ID; IDs that are not found are omitted
+    """
+    try:
+        found = await call_with_timeout(
+            asyncio.to_thread(store.fetch, ids, namespace), VECTOR_STORE_TIMEOUT, "Pinecone"
+        )
+        missing = [id_ for id_ in ids if id_ not in found]
+        if missing and _is_legacy_candidate(namespace):
+            found.update(await call_with_timeout(
+                asyncio.to_thread(store.fetch, missing, ""), VECTOR_STORE_TIMEOUT, "Pinecone"
+            ))
+        return found
+    except Exception as e:
+        logger.error("Failed to fetch vectors: %s", str(e))
+        return {}
+
+@breaker.protect
+@traced("vector.query")
 async def query_similar(
     query_vector: List[float],
     top_k: int = 5,
-    filter_params: Dict[str, Any] = None
+    filter_params: Dict[str, Any] = None,
+    namespace: Optional[str] = None,
+    include_values: bool = False
 ) -> List[Dict[str, Any]]:
     """
-    Query Pinecone for similar vectors.
-    
+    Query the vector store for similar vectors.
+
     Args:
         query_vector: The query embedding
         top_k: Number of results to return
         filter_params: Optional filter parameters
-        
+        namespace: Namespace to search (see agent_namespace); None for the default one
+        include_values: Also return each chunk's embedding under "values"
+
     Returns:
         List of similar chunks with metadata
+
+    Raises:
+        ServiceUnavailableError: If the vector store fails, so that an outage
+            is not mistaken for an empty result
     """
     try:
-        # Query the index
-        results = index.query(
-            vector=query_vector,
-            top_k=top_k,
-            filter=filter_params,
-            include_metadata=True
+        matches = await call_with_timeout(
+            asyncio.to_thread(_query, query_vector, top_k, filter_params, namespace, include_values),
+            VECTOR_STORE_TIMEOUT, "Pinecone"
         )
-        
-        # Format results
-        chunks = []
-        for match in results.matches:
-            if match.metadata:
-                chunks.append({
-                    'text': match.metadata.get('text', ''),
-                    'metadata': match.metadata,
-                    'score': match.score
-                })
-        
-        return chunks
-        
+        return await _to_chunks(matches)
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error("Failed to query Pinecone: %s", str(e))
-        return []
+        raise ServiceUnavailableError("Pinecone", {"error": str(e)})
+
+async def _list_namespaces() -> List[str]:
+    """Namespaces to fan out over, cached for NAMESPACE_CACHE_SECONDS."""
+    now = time.monotonic()
+    if _namespace_cache["expires"] <= now:
+        _namespace_cache["names"] = await call_with_timeout(
+            asyncio.to_thread(store.list_namespaces), VECTOR_STORE_TIMEOUT, "Pinecone"
+        )
+        _namespace_cache["expires"] = now + NAMESPACE_CACHE_SECONDS
+    return _namespace_cache["names"]
+
+@breaker.protect
+@traced("vector.query_all")
+async def query_all_namespaces(
+    query_vector: List[float],
+    top_k: int = 5,
+    filter_params: Dict[str, Any] = None,
+    include_values: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Query every namespace concurrently and merge the results by score.
+
+    Used by search mode, which is not scoped to a single agent.
+
+    Args:
+        query_vector: The query embedding
+        top_k: Number of results to return overall
+        filter_params: Optional filter parameters applied in every namespace
+        include_values: Also return each chunk's embedding under "values"
+
+    Returns:
+        List of similar chunks with metadata, best first
+
+    Raises:
+        ServiceUnavailableError: If the vector store fails
+    """
+    try:
+        namespaces = await _list_namespaces()
+        semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+
+        async def query_namespace(namespace: str) -> List[Dict[str, Any]]:
+            async with semaphore:
+                return await call_with_timeout(asyncio.to_thread(
+                    store.query, query_vector, top_k, filter_params, namespace, include_values
+                ), VECTOR_STORE_TIMEOUT, "Pinecone")
+
+        results = await asyncio.gather(*(query_namespace(ns) for ns in namespaces))
+        matches = sorted(
+            (match for matches in results for match in matches),
+            key=lambda match: match["score"],
+            reverse=True
+        )
+        return await _to_chunks(matches[:top_k])
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
+    except Exception as e:
+        logger.error("Failed to query Pinecone namespaces: %s", str(e))
+        raise ServiceUnavailableError("Pinecone", {"error": str(e)})
 
 async def upsert_vectors(
     vectors: List[List[float]],
     metadata: List[Dict[str, Any]],
-    ids: List[str]
+    ids: List[str],
+    namespace: Optional[str] = None
 ) -> bool:
     """
-    Upsert vectors to Pinecone.
-    
+    Upsert vectors to the vector store.
+
+    Only filterable fields are stored on the vectors; text and other display
+    fields are written to the chunk store first, so a vector is never
+    queryable without its document.
+
     Args:
         vectors: List of vector embeddings
-        metadata: List of metadata dictionaries
+        metadata: List of full metadata dictionaries, including text
         ids: List of unique IDs
-        
+        namespace: Target namespace. If omitted, each vector goes to the
+            namespace of its metadata agent_id (or the default namespace).
+
     Returns:
         True if successful, False otherwise
     """
     try:
-        # Prepare records
-        records = [
-            {
+        # Prepare records grouped by target namespace, and documents by agent
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        documents: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for id_, vector, meta in zip(ids, vectors, metadata):
+            slim, document = split_metadata(meta)
+            documents.setdefault(meta.get("agent_id", ""), {})[id_] = document
+            target = namespace
+            if target is None:
+                target = agent_namespace(meta["agent_id"]) if meta.get("agent_id") else ""
+            groups.setdefault(target, []).append({
                 'id': id_,
                 'values': vector,
-                'metadata': meta
-            }
-            for id_, vector, meta in zip(ids, vectors, metadata)
-        ]
-        
-        # Upsert in batches of 100
-        batch_size = 100
-        for i in range(0, len(records), batch_size):
-            batch = records[i:i + batch_size]
-            index.upsert(vectors=batch)
-            
+                'metadata': slim
+            })
+
+        for agent_id, agent_documents in documents.items():
+            await asyncio.to_thread(chunk_store.put, agent_id, agent_documents)
+        for target, records in groups.items():
+            await asyncio.to_thread(store.upsert, records, target)
+        # Only now are the new vectors queryable; invalidates cached answers
+        await asyncio.to_thread(content_versions.bump_version, list(documents))
         return True
-        
+
     except Exception as e:
         logger.error("Failed to upsert vectors: %s", str(e))
         return False
 
-async def delete_vectors(ids: List[str]) -> bool:
+def _namespaces_of(ids: List[str]) -> Dict[str, List[str]]:
+    """
+    Group vector IDs by the namespaces that may hold them.
+
+    IDs of agent chunks are "<agent_id>#<message_id>" and live in the agent's
+    namespace, and possibly still in the default one (see
+    LEGACY_NAMESPACE_FALLBACK). Other IDs live in the default namespace.
     """
-    Delete vectors from Pinecone.
-    
+    groups: Dict[str, List[str]] = {}
+    for id_ in ids:
+        agent_id, separator, _ = id_.partition("#")
+        if separator and agent_id:
+            groups.setdefault(agent_namespace(agent_id), []).append(id_)
+            if not LEGACY_NAMESPACE_FALLBACK:
+                continue
+        groups.setdefault("", []).append(id_)
+    return groups
+
+async def _delete_lexical(agent_ids: List[str], ids: List[str]) -> None:
+    """Drop deleted chunks from their agents' lexical indexes, so BM25 stops returning them."""
+    owners = set(agent_ids) | {id_.partition("#")[0] for id_ in ids if "#" in id_}
+    for agent_id in owners:
+        try:
+            await asyncio.to_thread(lexical_index.delete_chunks, agent_id, ids)
+        except Exception as e:
+            # A stale lexical hit has no document and is skipped by fetch_chunks
+            logger.error("Failed to delete chunks from lexical index of agent %s: %s", agent_id, str(e))
+
+async def delete_vectors(ids: List[str], namespace: Optional[str] = None) -> bool:
+    """
+    Delete vectors from the vector store.
+
     Args:
         ids: List of vector IDs to delete
-    
+        namespace: Namespace holding the vectors. If omitted, each vector is
+            deleted from the namespace its ID belongs to (see _namespaces_of).
+
     Returns:
         bool: True if successful
-        
-    Raises:
-        ServiceUnavailableError: If Pinecone service is unavailable
     """
     try:
         logger.debug("Deleting %d vectors from Pinecone", len(ids))
-        index.delete(ids=ids)
+        groups = {namespace: ids} if namespace is not None else _namespaces_of(ids)
+        for target, target_ids in groups.items():
+            await asyncio.to_thread(store.delete, target_ids, target)
+        agent_ids = await asyncio.to_thread(chunk_store.agent_ids_of, ids)
+        await asyncio.to_thread(chunk_store.delete, ids)
+        await _delete_lexical(agent_ids, ids)
+        await asyncio.to_thread(content_versions.bump_version, agent_ids)
         logger.info("Successfully deleted %d vectors", len(ids))
         return True
     except Exception as e:
         logger.error("Error deleting vectors: %s", str(e))
-        return False 
\ No newline at end of file
+        return False
+
+async def delete_vectors_by_filter(filter_params: Dict[str, Any], namespace: Optional[str] = None) -> bool:
+    """
+    Delete every vector whose metadata matches a filter.
+
+    Args:
+        filter_params: Pinecone-style metadata filter, e.g. {"agent_id": agent_id}
+        namespace: Namespace to delete from; None for the default one
+
+    Returns:
+        bool: True if successful
+    """
+    try:
+        logger.debug("Deleting vectors matching filter: %s", filter_params)
+        store.delete_by_filter(filter_params, namespace=namespace)
+        if set(filter_params) == {"agent_id"} and isinstance(filter_params["agent_id"], str):
+            # Whole-agent deletes also drop the agent's documents; documents
+            # orphaned by narrower filters are never read and are harmless
+            await asyncio.to_thread(chunk_store.delete_agent, filter_params["agent_id"])
+            await asyncio.to_thread(content_versions.bump_version, [filter_params["agent_id"]])
+        logger.info("Successfully deleted vectors matching filter: %s", filter_params)
+        return True
+    except Exception as e:
+        logger.error("Error deleting vectors by filter: %s", str(e))
+        return False
+
+async def delete_agent_vectors(agent_id: str) -> bool:
+    """
+    Delete every vector and chunk document of an agent.
+
+    Drops the agent's namespace in one operation, then removes any vectors
+    the agent still has in the default namespace from before per-agent
+    namespaces (by metadata filter, or by ID prefix where filters are not
+    supported).
+
+    Args:
+        agent_id: The agent whose vectors to delete
+
+    Returns:
+        bool: True if successful
+    """
+    try:
+        await asyncio.to_thread(store.delete_namespace, agent_namespace(agent_id))
+        await asyncio.to_thread(store.delete_by_filter, {"agent_id": agent_id}, "")
+        removed = await asyncio.to_thread(chunk_store.delete_agent, agent_id)
+        await asyncio.to_thread(content_versions.bump_version, [agent_id])
+        # The deleted namespace must not be fanned out to any more
+        _namespace_cache["expires"] = 0.0
+        logger.info("Deleted vectors and %d chunk documents of agent %s", removed, agent_id)
+        return True
+    except Exception as e:
+        logger.error("Error deleting vectors of agent %s: %s", agent_id, str(e))
+        return False
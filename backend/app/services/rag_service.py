@@ -2,107 +2,500 @@
 RAG service for retrieving and generating responses using Pinecone and OpenAI.
 
 This module provides a unified approach to RAG (Retrieval Augmented Generation)
-for both chat and search functionalities. It uses the same core logic but
-allows filtering by agent_id for chat-specific queries.
+for both chat and search functionalities. It uses the same core logic; chat
+queries are routed to the agent's namespace while search fans out across all
+agent namespaces.
+
+Chat retrieval is hybrid: dense matches from the agent's namespace and BM25
+matches from the agent's lexical index are merged with reciprocal rank
+fusion, which catches exact names, tickers and numbers that embeddings miss.
+Candidates below the relevance bar are dropped and the rest diversified
+with MMR (see reranking), so the number of chunks adapts to the query and
+near-duplicate posts do not crowd the context. If no candidate is relevant
+the LLM is not called at all.
+
+Answers are cached per agent by query similarity (see answer_cache), so
+repeated questions skip retrieval and completion entirely. Identical
+questions arriving at the same time share one in-flight computation.
+
+Follow-up questions in a chat are answered with the rolling summary of the
+conversation (see conversation_summary): its topic completes the query for
+retrieval and the summary goes into the prompt within the same token budget.
+
+Completions are admission-controlled: at most LLM_MAX_CONCURRENCY run at
+once per process and LLM_MAX_QUEUE more wait for up to LLM_QUEUE_TIMEOUT
+seconds. Requests shed under load get the retrieved references without a
+generated answer instead of an error, as do requests whose completion fails
+once retrieval succeeded or the request deadline (see deadline) is near. If
+embedding or retrieval fails the dependency's ServiceUnavailableError
+propagates, so callers can fail fast (see circuit_breaker) instead of
+answering as if nothing was found; so does DeadlineExceeded.
 """
-from typing import Optional, List, Dict, Any
-from app.services.openai_service import generate_embedding, generate_completion
-from app.services.pinecone_service import query_similar
+import os
+import re
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Any, AsyncIterator, Union
+from app.services.openai_service import (
+    generate_embedding, generate_completion, generate_completion_stream, COMPLETION_ERROR_MESSAGE,
+    llm_admission
+)
+from app.services.pinecone_service import (
+    query_similar, query_all_namespaces, agent_namespace, fetch_chunks, fetch_vectors
+)
+from app.services import lexical_index
+from app.services.reranking import mmr_select, relevance_cutoff, hybrid_relevance_cutoff, cosine_similarity
+from app.services.context_builder import build_context, Context, CONTEXT_TOKEN_BUDGET
+from app.services.conversation_summary import ConversationSummary, is_follow_up, contextualize_query
+from app.services.answer_cache import answer_cache, ANSWER_CACHE_ENABLED
 from app.utils.logger import logger
+from app.utils.tokens import count_tokens
+from app.utils.singleflight import SingleFlight
+from app.utils.admission import Overloaded
+from app.utils.tracing import span
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.deadline import current_deadline
+from app.utils.metrics import (
+    RAG_CONTEXT_TOKENS, RAG_PROMPT_TOKENS, RAG_CONTEXT_CHUNKS, RAG_IN_FLIGHT, RAG_COALESCED,
+    LLM_IN_FLIGHT, LLM_QUEUED, LLM_QUEUE_WAIT, LLM_SHED, RAG_FOLLOW_UPS
+)
+
+# Maximum number of chunks sent to the LLM
+TOP_K = int(os.getenv("RAG_TOP_K", "6"))
+
+# Candidates taken from each retriever before fusion and diversification
+CANDIDATE_K = int(os.getenv("RAG_CANDIDATE_K", "20"))
+
+# Reciprocal rank fusion constant; 60 is the value from the original RRF paper
+RRF_K = 60
 
-# Number of chunks to retrieve from Pinecone
-TOP_K = 10
+# Coalesces concurrent identical requests (see rag_retrieve_and_summarize)
+_in_flight = SingleFlight()
 
-def format_references(chunks: List[Dict[str, Any]]) -> str:
+# Per-process completion admission, shared with conversation summaries
+_llm_admission = llm_admission
+
+OVERLOADED_MESSAGE = (
+    "I'm receiving a lot of questions right now, so instead of a written answer "
+    "here are the posts most relevant to your question:"
+)
+
+RAG_ERROR_MESSAGE = "I encountered an error while processing your request. Please try again."
+QUERY_ERROR_MESSAGE = "Failed to process your query. Please try again."
+NO_RELEVANT_MESSAGE = "I couldn't find any relevant information to answer your question."
+
+_WHITESPACE = re.compile(r"\s+")
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, for request coalescing."""
+    return _WHITESPACE.sub(" ", query).strip().casefold()
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> Dict[str, float]:
     """
-    Format retrieved chunks into a bullet-point list with source references.
-    
+    Fuse several rankings of IDs with reciprocal rank fusion.
+
+    Each ID scores sum(1 / (k + rank)) over the rankings it appears in, so
+    IDs ranked well by either retriever rise to the top without having to
+    calibrate cosine similarities against BM25 scores.
+
     Args:
-        chunks: List of chunks with text and metadata
-        
+        rankings: Lists of IDs, each ordered best first
+        k: Damping constant; larger values flatten the rank contribution
+
     Returns:
-        Formatted string with bullet points and source links
-    """
-    references = []
-    for chunk in chunks:
-        text = chunk['text']
-        source = chunk['metadata'].get('source_link', 'Unknown source')
-        score = chunk.get('score', 0.0)
-        references.append(f"• {text} (source: {source}, relevance: {score:.3f})")
-        # Log each chunk for debugging
-        logger.debug("Retrieved chunk: %s (score: %.3f)", text[:100] + "...", score)
-    return "\n".join(references)
+        Fused score per ID
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, id_ in enumerate(ranking, start=1):
+            scores[id_] = scores.get(id_, 0.0) + 1.0 / (k + rank)
+    return scores
 
-async def rag_retrieve_and_summarize(
+async def _lexical_search(agent_id: str, query: str, top_k: int) -> List[tuple]:
+    """BM25 matches for the agent; empty on failure so dense results still serve."""
+    try:
+        with span("lexical.search"):
+            return await asyncio.to_thread(lexical_index.search, agent_id, query, top_k)
+    except Exception as e:
+        logger.error("Lexical search failed for agent %s: %s", agent_id, str(e))
+        return []
+
+async def hybrid_retrieve(
     query: str,
-    agent_id: Optional[str] = None,
-    mode: str = "chat"
-) -> str:
+    query_embedding: List[float],
+    agent_id: str,
+    top_k: int = TOP_K
+) -> List[Dict[str, Any]]:
     """
-    Perform RAG: embed query, retrieve from Pinecone, generate completion.
-    
+    Retrieve an agent's chunks with dense and lexical search fused by RRF.
+
+    Args:
+        query: The user's query, for BM25
+        query_embedding: The query embedding, for dense search
+        agent_id: The agent whose chunks to search
+        top_k: Number of fused chunks to return
+
+    Returns:
+        Chunks ordered by fused score, with embeddings under "values". Each
+        carries its cosine `score` (computed from the fetched values for
+        lexical-only hits), `lexical_score` and `fusion_score`.
+    """
+    namespace = agent_namespace(agent_id)
+    dense, lexical = await asyncio.gather(
+        query_similar(query_embedding, top_k=CANDIDATE_K, namespace=namespace, include_values=True),
+        _lexical_search(agent_id, query, CANDIDATE_K)
+    )
+    fused = reciprocal_rank_fusion([[c["id"] for c in dense], [id_ for id_, _ in lexical]])
+    ranked = sorted(fused, key=fused.get, reverse=True)[:top_k]
+
+    chunks = {c["id"]: c for c in dense}
+    # Text and values of lexical-only hits are looked up once, for the selected IDs only
+    lexical_only = [id_ for id_ in ranked if id_ not in chunks]
+    if lexical_only:
+        values = await fetch_vectors(lexical_only, namespace)
+        for chunk in await fetch_chunks(lexical_only):
+            chunk["values"] = values.get(chunk["id"])
+            if chunk["values"] is not None:
+                chunk["score"] = cosine_similarity(query_embedding, chunk["values"])
+            chunks[chunk["id"]] = chunk
+    lexical_scores = dict(lexical)
+
+    results = []
+    for id_ in ranked:
+        if id_ in chunks:
+            chunk = dict(chunks[id_])
+            chunk["lexical_score"] = lexical_scores.get(id_, 0.0)
+            chunk["fusion_score"] = fused[id_]
+            results.append(chunk)
+    logger.debug("Hybrid retrieval: %d dense, %d lexical, %d fused", len(dense), len(lexical), len(results))
+    return results
+
+def build_prompt(query: str, context_text: str, mode: str = "chat", conversation: Optional[str] = None) -> str:
+    """
+    Build the completion prompt from the query and the assembled context.
+
     Args:
         query: The user's query
-        agent_id: Optional agent ID to filter results
-        mode: Either "chat" or "search"
-        
+        context_text: Formatted references (see build_context)
+        mode: "chat" answers as the channel expert, "search" summarizes
+        conversation: Summary of the conversation so far, for follow-up questions
+
     Returns:
-        Generated response with references
+        The prompt text
     """
-    try:
-        # Generate query embedding
-        query_embedding = await generate_embedding(query)
-        if not query_embedding:
-            logger.error("Failed to generate embedding for query: %s", query)
-            return "Failed to process your query. Please try again."
-            
-        # Query Pinecone
-        filter_params = {"agent_id": agent_id} if agent_id else {}
-        logger.debug("Querying Pinecone with filter: %s", filter_params)
-        chunks = await query_similar(
-            query_embedding,
-            top_k=TOP_K,
-            filter_params=filter_params
-        )
-        
-        if not chunks:
-            logger.warning("No chunks found for query '%s' with filter %s", query, filter_params)
-            return "I couldn't find any relevant information to answer your question."
-            
-        # Log number of chunks retrieved
-        logger.info("Retrieved %d chunks for query '%s'", len(chunks), query)
-        
-        # Format context
-        context = format_references(chunks)
-        
-        # Build prompt
-        if mode == "chat":
-            prompt = f"""You are an AI expert based on the content from a specific channel. 
+    history = f"Summary of the conversation so far:\n{conversation}\n\n" if conversation else ""
+    if mode == "chat":
+        return f"""You are an AI expert based on the content from a specific channel. 
 Answer the following question using ONLY the information provided in the context below.
 If you can't find a relevant answer in the context, say so.
 Always reference your sources.
 
-Context:
-{context}
+{history}Context:
+{context_text}
 
 Question: {query}
 
 Please provide a helpful response based on the context:"""
-        else:  # search mode
-            prompt = f"""You are a search assistant. Summarize the most relevant information from the context below
+    # search mode
+    return f"""You are a search assistant. Summarize the most relevant information from the context below
 to answer the user's query. Include all relevant source links.
 
-Context:
-{context}
+{history}Context:
+{context_text}
 
 Query: {query}
 
 Please provide a summary of the relevant information:"""
-            
-        # Generate completion
-        response = await generate_completion(prompt)
+
+def references_only_answer(context: Context) -> str:
+    """Answer with the retrieved references alone, for when no completion can be afforded."""
+    return f"{OVERLOADED_MESSAGE}\n\n{context.text}"
+
+def is_generated_answer(response: str) -> bool:
+    """Whether an answer was written by a completion, not a canned or references-only reply."""
+    if response in (RAG_ERROR_MESSAGE, QUERY_ERROR_MESSAGE, NO_RELEVANT_MESSAGE, COMPLETION_ERROR_MESSAGE):
+        return False
+    return not response.startswith(OVERLOADED_MESSAGE)
+
+@asynccontextmanager
+async def _llm_slot() -> AsyncIterator[bool]:
+    """
+    Hold a completion slot under admission control for the block.
+
+    Yields:
+        True once admitted, False if the request was shed
+    """
+    LLM_QUEUED.inc()
+    queued_at = time.monotonic()
+    try:
+        # Waiting past the request deadline would be for nothing
+        await _llm_admission.acquire(deadline=current_deadline())
+        admitted = True
+    except Overloaded as e:
+        LLM_SHED.labels(e.reason).inc()
+        logger.warning("Completion shed (%s): %d running, %d queued, expected wait %.1fs",
+                       e.reason, _llm_admission.active, _llm_admission.queued, e.retry_after)
+        admitted = False
+    finally:
+        LLM_QUEUED.dec()
+        LLM_QUEUE_WAIT.observe(time.monotonic() - queued_at)
+    if not admitted:
+        yield False
+        return
+
+    started = time.monotonic()
+    LLM_IN_FLIGHT.inc()
+    try:
+        yield True
+    finally:
+        LLM_IN_FLIGHT.dec()
+        _llm_admission.observe(time.monotonic() - started)
+        _llm_admission.release()
+
+async def _admitted_completion(prompt: str) -> Optional[str]:
+    """
+    Generate a completion under admission control.
+
+    Returns:
+        The completion, or None if the request was shed, OpenAI is
+        unavailable or the request deadline passed
+    """
+    async with _llm_slot() as admitted:
+        if not admitted:
+            return None
+        try:
+            return await generate_completion(prompt)
+        except (ServiceUnavailableError, DeadlineExceeded) as e:
+            logger.warning("Completion unavailable, answering with references: %s", e.message)
+            return None
+
+async def rag_retrieve_and_summarize(
+    query: str,
+    agent_id: Optional[str] = None,
+    mode: str = "chat",
+    conversation: Optional[ConversationSummary] = None
+) -> str:
+    """
+    Perform RAG: embed query, retrieve from Pinecone, generate completion.
+
+    Concurrent calls with the same agent, mode and normalized query share a
+    single computation and its result. A caller that disconnects stops
+    waiting without affecting the others.
+
+    Args:
+        query: The user's query
+        agent_id: Optional agent ID to filter results
+        mode: Either "chat" or "search"
+        conversation: Summary of the user's conversation with the agent;
+            used if the query is a follow-up (see conversation_summary)
+
+    Returns:
+        Generated response with references
+
+    Raises:
+        ServiceUnavailableError: If the query cannot be embedded or the
+            vector store cannot be queried
+        DeadlineExceeded: If the request deadline passed before retrieval finished
+    """
+    conversation = _follow_up_conversation(query, conversation)
+    # Follow-ups only share a computation within the same conversation
+    key = (agent_id, normalize_query(query), mode, conversation.summary if conversation else None)
+    if key in _in_flight:
+        RAG_COALESCED.inc()
+    with span("rag", mode=mode):
+        return await _in_flight.do(
+            key, lambda: _rag_retrieve_and_summarize(query, agent_id, mode, conversation)
+        )
+
+@dataclass
+class PreparedAnswer:
+    """A query retrieved for and ready for its completion."""
+    query_embedding: List[float]
+    context: Context
+    prompt: str
+    # Answers to follow-ups depend on the conversation and are not cached
+    cacheable: bool = True
+
+def _follow_up_conversation(
+    query: str,
+    conversation: Optional[ConversationSummary]
+) -> Optional[ConversationSummary]:
+    """The conversation to answer a query with: only follow-ups need it."""
+    if conversation is None or not is_follow_up(query):
+        return None
+    RAG_FOLLOW_UPS.inc()
+    return conversation
+
+async def _prepare_answer(
+    query: str,
+    agent_id: Optional[str],
+    mode: str,
+    conversation: Optional[ConversationSummary] = None
+) -> Union[str, PreparedAnswer]:
+    """
+    Embed the query, look up the answer cache, retrieve and build the prompt.
+
+    A follow-up's conversation completes the query for retrieval and its
+    summary goes into the prompt, taking its tokens from the context budget.
+
+    Returns:
+        The final answer if no completion is needed (cached, nothing
+        relevant), else the prepared completion
+    """
+    search_query = contextualize_query(query, conversation)
+    cacheable = ANSWER_CACHE_ENABLED and conversation is None
+
+    # Generate query embedding
+    query_embedding = await generate_embedding(search_query)
+    if not query_embedding:
+        logger.error("Failed to generate embedding for query: %s", query)
+        return QUERY_ERROR_MESSAGE
+
+    # A semantically equivalent question may already have been answered
+    if cacheable:
+        with span("answer_cache.lookup") as s:
+            cached = answer_cache.lookup(agent_id, mode, query_embedding)
+            s.set(hit=cached is not None)
+        if cached is not None:
+            return cached
+
+    # Query the agent's namespace, or fan out over all agents in search mode
+    if agent_id:
+        namespace = agent_namespace(agent_id)
+        logger.debug("Querying Pinecone namespace: %s", namespace)
+        with span("retrieve"):
+            candidates = await hybrid_retrieve(search_query, query_embedding, agent_id, top_k=CANDIDATE_K)
+    else:
+        namespace = "*"
+        logger.debug("Querying all Pinecone namespaces")
+        with span("retrieve"):
+            candidates = await query_all_namespaces(query_embedding, top_k=CANDIDATE_K, include_values=True)
+
+    with span("rerank", candidates=len(candidates)):
+        # Fused candidates keep their fused order and their strong BM25 matches
+        relevant = hybrid_relevance_cutoff(candidates) if agent_id else relevance_cutoff(candidates)
+        relevance = [c["fusion_score"] for c in relevant] if agent_id else None
+        chunks = mmr_select(query_embedding, relevant, TOP_K, relevance=relevance) if relevant else []
+
+    if not relevant:
+        # Nothing clears the bar: answer without spending an LLM call
+        logger.warning("No relevant chunks for query '%s' in namespace %s (%d candidates)",
+                       query, namespace, len(candidates))
+        return NO_RELEVANT_MESSAGE
+
+    logger.info("Selected %d of %d relevant chunks (%d candidates) for query '%s'",
+                len(chunks), len(relevant), len(candidates), query)
+    
+    # Assemble context within the token budget
+    summary = conversation.summary if conversation else None
+    with span("context") as s:
+        context = build_context(chunks, budget=CONTEXT_TOKEN_BUDGET - count_tokens(summary) if summary else None)
+        s.set(tokens=context.tokens, chunks=len(context.chunks))
+    logger.info("Context: %d/%d tokens from %d chunks (%d truncated, %d dropped)",
+                context.tokens, context.budget, len(context.chunks),
+                context.truncated_count, context.dropped_count)
+    RAG_CONTEXT_TOKENS.observe(context.tokens)
+    RAG_CONTEXT_CHUNKS.labels("included").inc(len(context.chunks) - context.truncated_count)
+    RAG_CONTEXT_CHUNKS.labels("truncated").inc(context.truncated_count)
+    RAG_CONTEXT_CHUNKS.labels("dropped").inc(context.dropped_count)
+    
+    prompt = build_prompt(query, context.text, mode, conversation=summary)
+    prompt_tokens = count_tokens(prompt)
+    RAG_PROMPT_TOKENS.observe(prompt_tokens)
+    logger.info("Prompt size: %d tokens", prompt_tokens)
+    return PreparedAnswer(query_embedding, context, prompt, cacheable)
+
+async def _rag_retrieve_and_summarize(
+    query: str,
+    agent_id: Optional[str],
+    mode: str,
+    conversation: Optional[ConversationSummary]
+) -> str:
+    """Uncoalesced RAG pipeline behind rag_retrieve_and_summarize."""
+    started = time.monotonic()
+    RAG_IN_FLIGHT.inc()
+    try:
+        prepared = await _prepare_answer(query, agent_id, mode, conversation)
+        if isinstance(prepared, str):
+            return prepared
+        response = await _admitted_completion(prepared.prompt)
+        if response is None:
+            return references_only_answer(prepared.context)
+        if prepared.cacheable and response != COMPLETION_ERROR_MESSAGE:
+            answer_cache.store(agent_id, mode, query, prepared.query_embedding, response,
+                               time.monotonic() - started)
         return response
-        
+
+    except (ServiceUnavailableError, DeadlineExceeded):
+        raise
     except Exception as e:
         logger.error("Error in RAG process: %s", str(e))
-        return "I encountered an error while processing your request. Please try again." 
\ No newline at end of file
+        return RAG_ERROR_MESSAGE
+    finally:
+        RAG_IN_FLIGHT.dec()
+
+async def rag_stream(
+    query: str,
+    agent_id: Optional[str] = None,
+    mode: str = "chat",
+    conversation: Optional[ConversationSummary] = None
+) -> AsyncIterator[str]:
+    """
+    Perform RAG like rag_retrieve_and_summarize, yielding the answer as it is generated.
+
+    Answers that need no completion (cached, nothing relevant, shed) come
+    in one piece. Streams are not coalesced with other requests.
+
+    Args:
+        query: The user's query
+        agent_id: Optional agent ID to filter results
+        mode: Either "chat" or "search"
+        conversation: Summary of the user's conversation with the agent;
+            used if the query is a follow-up
+
+    Yields:
+        Pieces of the answer, in order
+
+    Raises:
+        ServiceUnavailableError: If the query cannot be embedded, the vector
+            store cannot be queried, or the completion fails after part of
+            it was sent
+        DeadlineExceeded: If the request deadline passes before the answer is complete
+    """
+    conversation = _follow_up_conversation(query, conversation)
+    started = time.monotonic()
+    RAG_IN_FLIGHT.inc()
+    try:
+        try:
+            prepared = await _prepare_answer(query, agent_id, mode, conversation)
+        except (ServiceUnavailableError, DeadlineExceeded):
+            raise
+        except Exception as e:
+            logger.error("Error in RAG process: %s", str(e))
+            prepared = RAG_ERROR_MESSAGE
+        if isinstance(prepared, str):
+            yield prepared
+            return
+
+        pieces: List[str] = []
+        async with _llm_slot() as admitted:
+            if admitted:
+                try:
+                    async for piece in generate_completion_stream(prepared.prompt):
+                        pieces.append(piece)
+                        yield piece
+                except (ServiceUnavailableError, DeadlineExceeded) as e:
+                    if pieces:
+                        raise
+                    logger.warning("Completion unavailable, answering with references: %s", e.message)
+        if not pieces:
+            yield references_only_answer(prepared.context)
+            return
+        if prepared.cacheable:
+            answer_cache.store(agent_id, mode, query, prepared.query_embedding, "".join(pieces),
+                               time.monotonic() - started)
+    finally:
+        RAG_IN_FLIGHT.dec()
+ 
\ No newline at end of file
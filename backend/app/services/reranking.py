@@ -0,0 +1,174 @@
+"""
+Reranking of retrieved chunks before they are put into a prompt.
+
+Retrieval always returns candidates, relevant or not. relevance_cutoff
+drops candidates below a similarity threshold and past the largest drop in
+the score curve (the "elbow"), so the number of chunks adapts to the query;
+when nothing is left the LLM call can be skipped. For hybrid candidates,
+hybrid_relevance_cutoff also keeps strong BM25 matches whatever their
+cosine similarity, and keeps the fused order.
+
+Channels repost and paraphrase the same news, so the top matches for a query
+are often near-duplicates. Maximal marginal relevance (MMR) picks chunks
+that are relevant to the query but dissimilar to the chunks already picked,
+until the output size or the context token budget is reached.
+"""
+import os
+from typing import List, Dict, Any, Optional
+import numpy as np
+from app.utils.tokens import count_tokens
+from app.services.context_builder import CONTEXT_TOKEN_BUDGET, MAX_CHUNK_TOKENS, chunk_text
+
+# Minimum cosine similarity for a chunk to count as relevant. Unrelated texts
+# still score around 0.7 with ada-002 embeddings, so the bar sits above that.
+MIN_SCORE = float(os.getenv("RAG_MIN_SCORE", "0.75"))
+
+# A drop of at least this much between consecutive scores ends the result list
+SCORE_GAP = float(os.getenv("RAG_SCORE_GAP", "0.05"))
+
+# BM25 matches scoring at least this fraction of the best one are relevant
+# whatever their cosine similarity: exact names and tickers embed poorly
+LEXICAL_MIN_RATIO = float(os.getenv("RAG_LEXICAL_MIN_RATIO", "0.5"))
+
+# Trade-off between relevance (1.0) and diversity (0.0)
+MMR_LAMBDA = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+
+def _unit_rows(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    """Cosine similarity of two vectors; 0.0 if either is zero."""
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(a @ b / norm) if norm else 0.0
+
+def relevance_cutoff(
+    chunks: List[Dict[str, Any]],
+    min_score: float = MIN_SCORE,
+    min_gap: float = SCORE_GAP
+) -> List[Dict[str, Any]]:
+    """
+    Keep only the chunks that clear the relevance bar.
+
+    Chunks scoring below `min_score` are dropped. Among the rest, if the
+    largest drop between consecutive scores is at least `min_gap`, everything
+    after it is dropped too: a few clearly relevant chunks followed by a
+    long flat tail of weak matches is the common case.
+
+    Args:
+        chunks: Candidate chunks with a cosine "score"
+        min_score: Absolute similarity threshold
+        min_gap: Smallest score drop treated as an elbow; 0 disables it
+
+    Returns:
+        Relevant chunks, best first; empty if none clear the bar
+    """
+    kept = sorted(
+        (chunk for chunk in chunks if chunk.get("score", 0.0) >= min_score),
+        key=lambda chunk: chunk["score"],
+        reverse=True
+    )
+    if len(kept) > 1 and min_gap > 0:
+        scores = np.array([chunk["score"] for chunk in kept])
+        gaps = scores[:-1] - scores[1:]
+        elbow = int(np.argmax(gaps))
+        if gaps[elbow] >= min_gap:
+            kept = kept[:elbow + 1]
+    return kept
+
+def hybrid_relevance_cutoff(
+    chunks: List[Dict[str, Any]],
+    min_score: float = MIN_SCORE,
+    min_gap: float = SCORE_GAP,
+    lexical_ratio: float = LEXICAL_MIN_RATIO
+) -> List[Dict[str, Any]]:
+    """
+    Keep the fused candidates that clear the relevance bar, in their fused order.
+
+    A chunk is relevant if relevance_cutoff keeps it by cosine "score", or
+    if its "lexical_score" is at least `lexical_ratio` of the best one.
+    Lexical-only hits may have no cosine score at all, so the cosine bar
+    alone would drop exactly the matches BM25 was added for.
+
+    Args:
+        chunks: Candidates ordered by fused score, with "score" and "lexical_score"
+        min_score: Absolute cosine similarity threshold
+        min_gap: Smallest cosine score drop treated as an elbow; 0 disables it
+        lexical_ratio: Fraction of the best BM25 score a lexical match needs
+
+    Returns:
+        Relevant chunks in the order given; empty if none clear the bar
+    """
+    dense = {id(chunk) for chunk in relevance_cutoff(chunks, min_score, min_gap)}
+    best_lexical = max((chunk.get("lexical_score", 0.0) for chunk in chunks), default=0.0)
+    return [
+        chunk for chunk in chunks
+        if id(chunk) in dense
+        or (best_lexical > 0 and chunk.get("lexical_score", 0.0) >= lexical_ratio * best_lexical)
+    ]
+
+def mmr_select(
+    query_vector: List[float],
+    chunks: List[Dict[str, Any]],
+    max_items: int,
+    lambda_mult: float = MMR_LAMBDA,
+    token_budget: Optional[int] = CONTEXT_TOKEN_BUDGET,
+    relevance: Optional[List[float]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Select a relevant but diverse subset of chunks with MMR.
+
+    All similarities are computed up front as two matrix products; each
+    selection step is then a vectorized update over the candidates.
+    Chunks without "values" are never penalized as redundant.
+
+    Args:
+        query_vector: The query embedding
+        chunks: Candidate chunks, each with "values" (its embedding) if available
+        max_items: Maximum number of chunks to select
+        lambda_mult: Weight of relevance against redundancy, between 0 and 1
+        token_budget: Maximum total tokens of selected chunk text; None for no limit.
+            Chunks cost at most MAX_CHUNK_TOKENS since the context builder
+            truncates longer ones.
+        relevance: Optional relevance per chunk (e.g. fused retrieval scores);
+            defaults to cosine similarity with the query
+
+    Returns:
+        Selected chunks in selection order
+    """
+    if not chunks or max_items <= 0:
+        return []
+
+    dimension = len(query_vector)
+    vectors = np.zeros((len(chunks), dimension), dtype=np.float32)
+    for i, chunk in enumerate(chunks):
+        if chunk.get("values") is not None:
+            vectors[i] = chunk["values"]
+    vectors = _unit_rows(vectors)
+
+    if relevance is None:
+        query = _unit_rows(np.asarray([query_vector], dtype=np.float32))[0]
+        scores = vectors @ query
+    else:
+        scores = np.asarray(relevance, dtype=np.float32)
+        if scores.max() > 0:
+            scores = scores / scores.max()
+    similarity = vectors @ vectors.T
+
+    tokens = np.array([min(count_tokens(chunk_text(chunk)), MAX_CHUNK_TOKENS) for chunk in chunks])
+    remaining = token_budget if token_budget is not None else np.inf
+    available = tokens <= remaining
+    redundancy = np.zeros(len(chunks), dtype=np.float32)
+    selected: List[int] = []
+
+    while len(selected) < max_items and available.any():
+        mmr = lambda_mult * scores - (1 - lambda_mult) * redundancy
+        best = int(np.argmax(np.where(available, mmr, -np.inf)))
+        selected.append(best)
+        remaining -= tokens[best]
+        available[best] = False
+        available &= tokens <= remaining
+        redundancy = np.maximum(redundancy, similarity[best])
+
+    return [chunks[i] for i in selected]
@@ -13,6 +13,8 @@ from datetime import datetime, timedelta
 import asyncio
 from app.utils.logger import logger
 from app.utils.errors import TelegramError
+from app.utils.tracing import traced
+from app.fakes import fake_enabled
 
 # Device info to match MacBook Pro to avoid conflicts with personal sessions
 DEVICE_MODEL = "MacBook Pro"
@@ -27,6 +29,9 @@ DEFAULT_SESSION_NAME = "agentique_bot"
 # Default message limit to avoid overloading
 DEFAULT_MESSAGE_LIMIT = 50
 
+# Seconds to wait for each Telegram request before retrying it
+TELEGRAM_TIMEOUT = int(os.getenv("TELEGRAM_TIMEOUT", "10"))
+
 class TelegramService:
     def __init__(self, session: Optional[str] = None):
         """
@@ -38,6 +43,13 @@ class TelegramService:
         Raises:
             TelegramError: If required credentials are missing
         """
+        if fake_enabled("telegram"):
+            from app.fakes.telegram_fake import FakeTelegramClient
+            logger.info("Using fake Telegram client")
+            self.api_id, self.api_hash, self.phone = 0, "", "fake"
+            self.client = FakeTelegramClient()
+            return
+
         self.api_id = int(os.getenv("TELEGRAM_API_ID", "0"))
         self.api_hash = os.getenv("TELEGRAM_API_HASH", "")
         self.phone = os.getenv("TELEGRAM_PHONE", "")
@@ -59,7 +71,8 @@ class TelegramService:
                 system_version=SYSTEM_VERSION,
                 app_version=APP_VERSION,
                 lang_code=LANG_CODE,
-                system_lang_code=SYSTEM_LANG_CODE
+                system_lang_code=SYSTEM_LANG_CODE,
+                timeout=TELEGRAM_TIMEOUT
             )
         else:
             # Get the absolute path to the backend directory
@@ -87,9 +100,11 @@ class TelegramService:
                 system_version=SYSTEM_VERSION,
                 app_version=APP_VERSION,
                 lang_code=LANG_CODE,
-                system_lang_code=SYSTEM_LANG_CODE
+                system_lang_code=SYSTEM_LANG_CODE,
+                timeout=TELEGRAM_TIMEOUT
             )
 
+    @traced("telegram.connect")
     async def connect(self) -> None:
         """
         Connect to Telegram and ensure authorization.
@@ -134,12 +149,14 @@ class TelegramService:
             logger.error("Failed to verify code: %s", str(e))
             raise TelegramError("verification", {"error": str(e)})
 
+    @traced("telegram.get_messages")
     async def get_channel_messages(
         self,
         channel_link: str,
         limit: Optional[int] = None,
         min_id: Optional[int] = None,
-        offset_date: Optional[datetime] = None
+        offset_date: Optional[datetime] = None,
+        reverse: bool = False
     ) -> List[Dict[str, Any]]:
         """
         Retrieve messages from a Telegram channel with support for partial ingestion.
@@ -149,6 +166,8 @@ class TelegramService:
             limit: Maximum number of messages to retrieve (defaults to DEFAULT_MESSAGE_LIMIT)
             min_id: Minimum message ID to retrieve (for partial ingestion)
             offset_date: Only retrieve messages after this date
+            reverse: Oldest messages first; with min_id, the messages right
+                after it rather than the newest ones
             
         Returns:
             List of message dictionaries with text and metadata
@@ -195,7 +214,7 @@ class TelegramService:
             # Prepare parameters for message retrieval
             kwargs = {
                 "limit": min(limit if limit else DEFAULT_MESSAGE_LIMIT, DEFAULT_MESSAGE_LIMIT),  # Never exceed DEFAULT_MESSAGE_LIMIT
-                "reverse": False  # Get newest messages first
+                "reverse": reverse  # Newest messages first unless paging up from min_id
             }
             if min_id:
                 kwargs["min_id"] = min_id
@@ -265,6 +284,7 @@ class TelegramService:
         """Async context manager exit."""
         await self.disconnect()
 
+    @traced("telegram.get_channel_info")
     async def get_channel_info(self, channel_link: str) -> Dict[str, Any]:
         """
         Get channel information including profile photo.
@@ -0,0 +1,533 @@
+"""
+Vector store backends used by the Pinecone service.
+
+`VectorStore` is the small interface that `query_similar`, `upsert_vectors`
+and friends are written against. `PineconeVectorStore` wraps a Pinecone index;
+`NumpyVectorStore` keeps everything in process so small deployments and the
+test suite can run without any external service.
+"""
+import os
+import json
+import threading
+from abc import ABC, abstractmethod
+from typing import List, Dict, Any, Optional, Iterable, Iterator, Tuple, Callable
+import numpy as np
+from app.utils.logger import logger
+
+# Metadata field used to partition local stores
+PARTITION_FIELD = "agent_id"
+
+class VectorStore(ABC):
+    """
+    Minimal vector store interface.
+
+    Records are dictionaries with "id", "values" and "metadata" keys, the same
+    shape Pinecone accepts for upserts. Query results are dictionaries with
+    "id", "score" and "metadata" keys (plus "values" when requested), sorted
+    by descending score.
+
+    Every operation takes an optional namespace. Namespaces are isolated
+    partitions (one per agent); None means the default namespace.
+    """
+
+    @abstractmethod
+    def upsert(self, records: List[Dict[str, Any]], namespace: Optional[str] = None) -> None:
+        """Insert or overwrite records."""
+
+    @abstractmethod
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Return the top_k most similar records matching the metadata filter."""
+
+    @abstractmethod
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict[str, List[float]]:
+        """Stored vector values by ID. Unknown IDs are omitted."""
+
+    @abstractmethod
+    def delete(self, ids: List[str], namespace: Optional[str] = None) -> None:
+        """Delete records by ID. Unknown IDs are ignored."""
+
+    @abstractmethod
+    def delete_by_filter(self, filter: Dict[str, Any], namespace: Optional[str] = None) -> None:
+        """Delete every record whose metadata matches the filter."""
+
+    @abstractmethod
+    def delete_namespace(self, namespace: str) -> None:
+        """Drop a whole namespace in one operation."""
+
+    @abstractmethod
+    def list_namespaces(self) -> List[str]:
+        """Names of all non-empty namespaces."""
+
+class PineconeVectorStore(VectorStore):
+    """VectorStore backed by a Pinecone index."""
+
+    # Maximum records per Pinecone upsert request
+    UPSERT_BATCH_SIZE = 100
+
+    # Maximum IDs per Pinecone delete or fetch request
+    ID_BATCH_SIZE = 1000
+
+    # Most matches a Pinecone query returns, which bounds ID listing on pod indexes
+    QUERY_PAGE_SIZE = 10000
+
+    # Query-listed pages deleted before giving up on a pod index prefix delete
+    MAX_DELETE_ROUNDS = 100
+
+    def __init__(self, index: Any, dimension: int = 1536):
+        self.index = index
+        self.dimension = dimension
+
+    def upsert(self, records: List[Dict[str, Any]], namespace: Optional[str] = None) -> None:
+        for i in range(0, len(records), self.UPSERT_BATCH_SIZE):
+            self.index.upsert(vectors=records[i:i + self.UPSERT_BATCH_SIZE], namespace=namespace or "")
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        results = self.index.query(
+            vector=vector,
+            top_k=top_k,
+            filter=filter or None,
+            include_metadata=True,
+            include_values=include_values,
+            namespace=namespace or ""
+        )
+        matches = []
+        for match in results.matches:
+            result = {"id": match.id, "score": match.score, "metadata": match.metadata or {}}
+            if include_values:
+                result["values"] = list(match.values)
+            matches.append(result)
+        return matches
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict[str, List[float]]:
+        if not ids:
+            return {}
+        vectors = self.index.fetch(ids=ids, namespace=namespace or "").vectors
+        return {id_: list(vector.values) for id_, vector in vectors.items()}
+
+    def delete(self, ids: List[str], namespace: Optional[str] = None) -> None:
+        self.index.delete(ids=ids, namespace=namespace or "")
+
+    def delete_by_filter(self, filter: Dict[str, Any], namespace: Optional[str] = None) -> None:
+        try:
+            self.index.delete(filter=filter, namespace=namespace or "")
+        except Exception:
+            # Serverless indexes reject metadata-filter deletes. A whole-agent
+            # filter can still be served by ID prefix ("<agent_id>#<message_id>")
+            agent_id = filter.get(PARTITION_FIELD) if set(filter) == {PARTITION_FIELD} else None
+            if not isinstance(agent_id, str):
+                raise
+            self.delete_by_prefix(f"{agent_id}#", namespace=namespace)
+
+    def _query_ids(self, prefix: str, namespace: Optional[str]) -> List[str]:
+        """IDs starting with `prefix` among the QUERY_PAGE_SIZE vectors a probe query returns."""
+        # IDs are "<agent_id>#<message_id>" and vectors carry agent_id, so an
+        # agent prefix is also a metadata filter that pod indexes support
+        agent_id = prefix[:-1] if prefix.endswith("#") else None
+        results = self.index.query(
+            vector=[1.0] + [0.0] * (self.dimension - 1),
+            top_k=self.QUERY_PAGE_SIZE,
+            filter={PARTITION_FIELD: agent_id} if agent_id else None,
+            include_metadata=False,
+            include_values=False,
+            namespace=namespace or ""
+        )
+        return [match.id for match in results.matches if match.id.startswith(prefix)]
+
+    def list_ids(self, prefix: str = "", namespace: Optional[str] = None) -> Iterator[List[str]]:
+        """
+        Yield the IDs starting with `prefix` in pages.
+
+        Serverless indexes list IDs directly. Pod indexes do not support
+        listing; there the IDs come from one probe query, which finds at most
+        QUERY_PAGE_SIZE of them (a warning is logged when the page is full).
+        """
+        listed = False
+        try:
+            for ids in self.index.list(prefix=prefix, namespace=namespace or ""):
+                listed = True
+                yield list(ids)
+            return
+        except Exception as e:
+            if listed:
+                raise
+            logger.debug("Index cannot list IDs (%s), listing by query", str(e))
+        ids = self._query_ids(prefix, namespace)
+        if len(ids) >= self.QUERY_PAGE_SIZE:
+            logger.warning("Listed only the first %d IDs with prefix %r in namespace %r",
+                           len(ids), prefix, namespace or "")
+        for i in range(0, len(ids), self.ID_BATCH_SIZE):
+            yield ids[i:i + self.ID_BATCH_SIZE]
+
+    def delete_by_prefix(self, prefix: str, namespace: Optional[str] = None) -> None:
+        """Delete every vector whose ID starts with `prefix`, one listed page at a time."""
+        # A pod index lists one query page at a time: list again until a page is not full
+        for _ in range(self.MAX_DELETE_ROUNDS):
+            deleted = 0
+            for ids in self.list_ids(prefix, namespace):
+                for i in range(0, len(ids), self.ID_BATCH_SIZE):
+                    self.index.delete(ids=ids[i:i + self.ID_BATCH_SIZE], namespace=namespace or "")
+                deleted += len(ids)
+            if deleted < self.QUERY_PAGE_SIZE:
+                return
+        logger.warning("Vectors with prefix %r may remain in namespace %r", prefix, namespace or "")
+
+    def delete_namespace(self, namespace: str) -> None:
+        # Deleting a namespace that was never written to is an error in Pinecone
+        if namespace in self.list_namespaces():
+            self.index.delete(delete_all=True, namespace=namespace)
+
+    def list_namespaces(self) -> List[str]:
+        stats = self.index.describe_index_stats()
+        return list((stats.namespaces or {}).keys())
+
+def _compare(value: Any, operator: str, operand: Any) -> bool:
+    """Evaluate a single Pinecone-style filter operator."""
+    if operator == "$eq":
+        return value == operand
+    if operator == "$ne":
+        return value != operand
+    if operator == "$in":
+        return value in operand
+    if operator == "$nin":
+        return value not in operand
+    if operator == "$exists":
+        return (value is not None) == bool(operand)
+    if value is None:
+        return False
+    if operator == "$gt":
+        return value > operand
+    if operator == "$gte":
+        return value >= operand
+    if operator == "$lt":
+        return value < operand
+    if operator == "$lte":
+        return value <= operand
+    raise ValueError(f"Unsupported filter operator: {operator}")
+
+def matches_filter(metadata: Dict[str, Any], filter: Optional[Dict[str, Any]]) -> bool:
+    """
+    Check metadata against a Pinecone-style filter.
+
+    Supports field equality shorthand, $eq/$ne/$in/$nin/$gt/$gte/$lt/$lte/$exists
+    and the $and/$or combinators.
+    """
+    if not filter:
+        return True
+    for field, condition in filter.items():
+        if field == "$and":
+            if not all(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif field == "$or":
+            if not any(matches_filter(metadata, sub) for sub in condition):
+                return False
+        elif isinstance(condition, dict):
+            value = metadata.get(field)
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif metadata.get(field) != condition:
+            return False
+    return True
+
+def route_filter(filter: Optional[Dict[str, Any]]) -> Tuple[Optional[List[str]], Optional[Dict[str, Any]]]:
+    """
+    Split a filter into the partitions it is restricted to and the rest.
+
+    Returns:
+        Tuple of (partition keys or None if any partition can match,
+        residual filter to evaluate per record)
+    """
+    if not filter or PARTITION_FIELD not in filter:
+        return None, filter
+    condition = filter[PARTITION_FIELD]
+    if isinstance(condition, dict) and set(condition) == {"$eq"}:
+        keys = [condition["$eq"]]
+    elif isinstance(condition, dict) and set(condition) == {"$in"}:
+        keys = list(condition["$in"])
+    elif isinstance(condition, dict):
+        return None, filter
+    else:
+        keys = [condition]
+    residual = {k: v for k, v in filter.items() if k != PARTITION_FIELD}
+    return [str(k) for k in keys], residual or None
+
+def best_first(
+    scores: np.ndarray,
+    top_k: int,
+    accept: Optional[Callable[[int], bool]] = None
+) -> List[int]:
+    """
+    Select the positions of the top_k highest scores.
+
+    Without `accept` this is an O(n) argpartition. With it, positions are
+    walked best-first and only those accepted count towards top_k.
+
+    Args:
+        scores: Similarity scores
+        top_k: Number of positions to return
+        accept: Optional predicate over positions (e.g. a metadata filter)
+
+    Returns:
+        Positions ordered by descending score
+    """
+    if top_k <= 0 or not len(scores):
+        return []
+    if accept is None:
+        k = min(top_k, len(scores))
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        return candidates[np.argsort(-scores[candidates])].tolist()
+
+    selected = []
+    for position in np.argsort(-scores):
+        if accept(int(position)):
+            selected.append(int(position))
+            if len(selected) >= top_k:
+                break
+    return selected
+
+def safe_partition_name(key: str) -> str:
+    """Map a namespace/partition key to a safe file or directory name."""
+    if not key:
+        return "_default"
+    return "".join(c if c.isalnum() or c in "-_" else "_" for c in key)
+
+class _Partition:
+    """
+    Contiguous float32 matrix of unit-normalized vectors for one agent.
+
+    Rows [0, size) are live; deletes move the last row into the hole so the
+    matrix never has gaps and a query is a single matrix-vector product.
+    """
+
+    INITIAL_CAPACITY = 64
+
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((self.INITIAL_CAPACITY, dimension), dtype=np.float32)
+        self.size = 0
+        self.ids: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        self.positions: Dict[str, int] = {}
+
+    def add(self, id_: str, vector: np.ndarray, metadata: Dict[str, Any]) -> None:
+        position = self.positions.get(id_)
+        if position is None:
+            if self.size == len(self.vectors):
+                grown = np.zeros((len(self.vectors) * 2, self.vectors.shape[1]), dtype=np.float32)
+                grown[:self.size] = self.vectors[:self.size]
+                self.vectors = grown
+            position = self.size
+            self.size += 1
+            self.ids.append(id_)
+            self.metadata.append(metadata)
+            self.positions[id_] = position
+        else:
+            self.metadata[position] = metadata
+        self.vectors[position] = vector
+
+    def remove(self, id_: str) -> bool:
+        position = self.positions.pop(id_, None)
+        if position is None:
+            return False
+        last = self.size - 1
+        if position != last:
+            moved_id = self.ids[last]
+            self.vectors[position] = self.vectors[last]
+            self.ids[position] = moved_id
+            self.metadata[position] = self.metadata[last]
+            self.positions[moved_id] = position
+        self.ids.pop()
+        self.metadata.pop()
+        self.size -= 1
+        return True
+
+    def search(
+        self,
+        query: np.ndarray,
+        top_k: int,
+        filter: Optional[Dict[str, Any]],
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        if not self.size or top_k <= 0:
+            return []
+        scores = self.vectors[:self.size] @ query
+        accept = (lambda position: matches_filter(self.metadata[position], filter)) if filter else None
+        results = []
+        for position in best_first(scores, top_k, accept):
+            result = {"id": self.ids[position], "score": float(scores[position]), "metadata": self.metadata[position]}
+            if include_values:
+                result["values"] = self.vectors[position].tolist()
+            results.append(result)
+        return results
+
+class NumpyVectorStore(VectorStore):
+    """
+    In-process VectorStore with one contiguous float32 matrix per partition.
+
+    A partition is the namespace when one is given, otherwise the record's
+    agent_id, so queries for one agent only touch that agent's matrix.
+    Cosine similarity is computed as a single dot product against
+    unit-normalized rows. If `path` is given, partitions are loaded from and
+    saved to one .npz file each so small deployments survive restarts.
+    """
+
+    def __init__(self, dimension: int, path: Optional[str] = None):
+        self.dimension = dimension
+        self.path = path
+        self._partitions: Dict[str, _Partition] = {}
+        self._lock = threading.RLock()
+        if path:
+            os.makedirs(path, exist_ok=True)
+            self._load()
+
+    def _normalize(self, values: Iterable[float]) -> np.ndarray:
+        vector = np.asarray(values, dtype=np.float32)
+        if vector.shape != (self.dimension,):
+            raise ValueError(f"Expected vector of dimension {self.dimension}, got {vector.shape}")
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _select(
+        self,
+        filter: Optional[Dict[str, Any]],
+        namespace: Optional[str]
+    ) -> Tuple[List[str], Optional[Dict[str, Any]]]:
+        """Partition keys to visit and the filter left to evaluate per record."""
+        if namespace is not None:
+            keys, residual = [namespace], filter
+        else:
+            keys, residual = route_filter(filter)
+            if keys is None:
+                keys = list(self._partitions)
+        return [k for k in keys if k in self._partitions], residual
+
+    def upsert(self, records: List[Dict[str, Any]], namespace: Optional[str] = None) -> None:
+        with self._lock:
+            touched = set()
+            for record in records:
+                metadata = dict(record.get("metadata") or {})
+                key = namespace if namespace is not None else str(metadata.get(PARTITION_FIELD, ""))
+                # Without a namespace an ID lives in exactly one agent partition;
+                # with namespaces, IDs are only unique within a namespace
+                if namespace is None:
+                    for other_key, partition in self._partitions.items():
+                        if other_key != key and partition.remove(record["id"]):
+                            touched.add(other_key)
+                partition = self._partitions.setdefault(key, _Partition(self.dimension))
+                partition.add(record["id"], self._normalize(record["values"]), metadata)
+                touched.add(key)
+            self._save(touched)
+
+    def query(
+        self,
+        vector: List[float],
+        top_k: int,
+        filter: Optional[Dict[str, Any]] = None,
+        namespace: Optional[str] = None,
+        include_values: bool = False
+    ) -> List[Dict[str, Any]]:
+        query = self._normalize(vector)
+        with self._lock:
+            keys, residual = self._select(filter, namespace)
+            results = []
+            for key in keys:
+                results.extend(self._partitions[key].search(query, top_k, residual, include_values))
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return results[:top_k]
+
+    def fetch(self, ids: List[str], namespace: Optional[str] = None) -> Dict[str, List[float]]:
+        with self._lock:
+            keys = [namespace] if namespace is not None else list(self._partitions)
+            found = {}
+            for key in keys:
+                partition = self._partitions.get(key)
+                if partition is None:
+                    continue
+                for id_ in ids:
+                    position = partition.positions.get(id_)
+                    if position is not None and id_ not in found:
+                        found[id_] = partition.vectors[position].tolist()
+            return found
+
+    def delete(self, ids: List[str], namespace: Optional[str] = None) -> None:
+        with self._lock:
+            keys = [namespace] if namespace is not None else list(self._partitions)
+            touched = set()
+            for id_ in ids:
+                for key in keys:
+                    partition = self._partitions.get(key)
+                    if partition and partition.remove(id_):
+                        touched.add(key)
+                        break
+            self._save(touched)
+
+    def delete_by_filter(self, filter: Dict[str, Any], namespace: Optional[str] = None) -> None:
+        with self._lock:
+            keys, residual = self._select(filter, namespace)
+            touched = set()
+            for key in keys:
+                partition = self._partitions[key]
+                doomed = [
+                    id_ for id_, metadata in zip(partition.ids, partition.metadata)
+                    if matches_filter(metadata, residual)
+                ]
+                for id_ in doomed:
+                    partition.remove(id_)
+                if doomed:
+                    touched.add(key)
+            self._save(touched)
+
+    def delete_namespace(self, namespace: str) -> None:
+        with self._lock:
+            if self._partitions.pop(namespace, None) is not None and self.path:
+                os.remove(self._file_for(namespace))
+
+    def list_namespaces(self) -> List[str]:
+        with self._lock:
+            return [key for key, partition in self._partitions.items() if partition.size]
+
+    def count(self) -> int:
+        """Total number of stored vectors."""
+        with self._lock:
+            return sum(p.size for p in self._partitions.values())
+
+    def _file_for(self, key: str) -> str:
+        return os.path.join(self.path, f"{safe_partition_name(key)}.npz")
+
+    def _save(self, keys: Iterable[str]) -> None:
+        if not self.path:
+            return
+        for key in keys:
+            partition = self._partitions[key]
+            tmp_path = self._file_for(key) + ".tmp.npz"
+            np.savez(
+                tmp_path,
+                key=np.array(key),
+                vectors=partition.vectors[:partition.size],
+                ids=np.array(partition.ids, dtype=str),
+                metadata=np.array(json.dumps(partition.metadata))
+            )
+            os.replace(tmp_path, self._file_for(key))
+
+    def _load(self) -> None:
+        for filename in os.listdir(self.path):
+            if not filename.endswith(".npz") or filename.endswith(".tmp.npz"):
+                continue
+            data = np.load(os.path.join(self.path, filename))
+            partition = _Partition(self.dimension)
+            for id_, vector, metadata in zip(data["ids"], data["vectors"], json.loads(str(data["metadata"]))):
+                partition.add(str(id_), vector, metadata)
+            self._partitions[str(data["key"])] = partition
+        logger.info("Loaded %d vectors from %s", self.count(), self.path)
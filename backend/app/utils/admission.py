@@ -0,0 +1,131 @@
+"""
+admission.py: Bounded concurrency with a bounded, deadline-aware queue.
+
+AdmissionController lets at most `limit` callers use a resource at once and
+queues up to `max_queue` more, served in arrival order. Instead of waiting
+indefinitely, a caller is shed - refused with Overloaded - when:
+
+- the queue is full
+- the expected wait, estimated from the queue length and recent service
+  times, would not end before its deadline
+- its deadline passes while it waits
+
+Every caller's deadline is at most `max_wait` seconds away. Shedding early
+keeps latency bounded under spikes, and leaves callers enough time to fall
+back to a cheaper answer.
+"""
+import time
+import asyncio
+from collections import deque
+from typing import Callable, Deque, Optional
+
+# Weight of the latest call in the service time estimate
+SERVICE_TIME_ALPHA = 0.2
+
+class Overloaded(Exception):
+    """Raised when a caller is shed instead of admitted."""
+
+    def __init__(self, reason: str, retry_after: float):
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"Overloaded ({reason}), retry after {retry_after:.1f}s")
+
+class AdmissionController:
+    """Admit at most `limit` concurrent callers; queue or shed the rest."""
+
+    def __init__(
+        self,
+        limit: int,
+        max_queue: int,
+        max_wait: float,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.clock = clock
+        self.active = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._service_time: Optional[float] = None
+
+    @property
+    def queued(self) -> int:
+        """Number of callers waiting for a slot."""
+        return sum(1 for w in self._waiters if not w.done())
+
+    def expected_wait(self) -> float:
+        """Estimated seconds a caller arriving now would wait for a slot."""
+        if self.active < self.limit and not self.queued:
+            return 0.0
+        # Slots free up at about limit / service_time per second
+        return (self.queued + 1) * (self._service_time or 0.0) / self.limit
+
+    def try_acquire(self) -> bool:
+        """
+        Take a slot only if one is free and nobody is waiting, without
+        queueing; release() must follow a successful call, as after acquire().
+
+        Returns:
+            True if the slot was taken
+        """
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return True
+        return False
+
+    async def acquire(self, deadline: Optional[float] = None) -> None:
+        """
+        Wait for a slot; release() must follow, after observe() with the
+        time the slot was held.
+
+        Args:
+            deadline: Time on the controller's clock by which the caller
+                needs its slot; capped at max_wait from now
+
+        Raises:
+            Overloaded: If the caller is shed
+        """
+        if self.active < self.limit and not self.queued:
+            self.active += 1
+            return
+
+        now = self.clock()
+        deadline = min(deadline, now + self.max_wait) if deadline is not None else now + self.max_wait
+        expected = self.expected_wait()
+        if self.queued >= self.max_queue:
+            raise Overloaded("queue_full", expected)
+        if expected > deadline - now:
+            raise Overloaded("deadline", expected)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, max(0.0, deadline - now))
+        except asyncio.TimeoutError:
+            raise Overloaded("timeout", self.expected_wait())
+        except asyncio.CancelledError:
+            # The slot may have been handed over just before the cancellation
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        """Free a slot, handing it to the longest waiting caller if any."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # The slot passes on directly; `active` stays the same
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def observe(self, seconds: float) -> None:
+        """Record how long a caller held its slot, for expected_wait()."""
+        if self._service_time is None:
+            self._service_time = seconds
+        else:
+            self._service_time += SERVICE_TIME_ALPHA * (seconds - self._service_time)
+
@@ -0,0 +1,37 @@
+"""
+asgi.py: Request body helpers shared by the pure ASGI middlewares.
+
+A middleware that looks at the body (the rate limiter's user_id, the
+idempotency fingerprint) consumes it from `receive`, so it reads the body
+once and hands the app a receive callable that replays it.
+"""
+from typing import Any, Callable, Dict
+
+async def read_body(receive: Callable) -> bytes:
+    """Read the whole request body from `receive`."""
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] != "http.request":
+            break
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+def replay_body(body: bytes, receive: Callable) -> Callable:
+    """A receive callable returning `body` as the request, then deferring to `receive`."""
+    replayed = False
+
+    async def replay():
+        nonlocal replayed
+        if not replayed:
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+
+    return replay
+
+async def disconnected() -> Dict[str, Any]:
+    """A receive callable for parsing a buffered body: the client is gone."""
+    return {"type": "http.disconnect"}
@@ -0,0 +1,203 @@
+"""
+circuit_breaker.py: Circuit breakers for external services.
+
+A breaker watches the outcome of calls to one dependency over a sliding
+window of CIRCUIT_WINDOW seconds:
+
+- closed: calls go through. Once the window holds at least
+  CIRCUIT_MIN_CALLS calls and CIRCUIT_FAILURE_RATE of them failed, the
+  breaker opens.
+- open: calls fail at once with CircuitOpenError (a ServiceUnavailableError)
+  instead of waiting for a dependency that is down. After
+  CIRCUIT_OPEN_SECONDS the breaker turns half-open.
+- half-open: up to CIRCUIT_HALF_OPEN_CALLS probe calls go through. If they
+  all succeed the breaker closes; any failure opens it again.
+
+Only ServiceUnavailableError counts as a failure: the services raise it for
+errors of the dependency itself, not for bad input. Breakers are per worker
+process; their state is reported by /health and the circuit_breaker_state
+metric.
+"""
+import os
+import time
+import asyncio
+import functools
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, TypeVar
+from app.utils.logger import logger
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.metrics import CIRCUIT_STATE, CIRCUIT_TRANSITIONS, CIRCUIT_REJECTED
+
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MIN_CALLS = int(os.getenv("CIRCUIT_MIN_CALLS", "10"))
+CIRCUIT_WINDOW = float(os.getenv("CIRCUIT_WINDOW", "30"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "15"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "2"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Values of the circuit_breaker_state gauge
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+F = TypeVar("F", bound=Callable[..., Awaitable[Any]])
+
+class CircuitOpenError(ServiceUnavailableError):
+    """Raised instead of calling a service whose circuit is open."""
+
+    def __init__(self, service_name: str, retry_after: float):
+        self.retry_after = retry_after
+        super().__init__(service_name, {"circuit": OPEN, "retry_after": round(retry_after, 1)})
+
+class CircuitBreaker:
+    """Failure-rate circuit breaker for one dependency."""
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float = CIRCUIT_FAILURE_RATE,
+        min_calls: int = CIRCUIT_MIN_CALLS,
+        window: float = CIRCUIT_WINDOW,
+        open_seconds: float = CIRCUIT_OPEN_SECONDS,
+        half_open_calls: int = CIRCUIT_HALF_OPEN_CALLS,
+        clock: Callable[[], float] = time.monotonic
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.window = window
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self._state = CLOSED
+        self._opened_at = 0.0
+        # Outcomes per second: [second, calls, failures]
+        self._buckets: Deque[List[float]] = deque()
+        self._probes = 0
+        self._probe_successes = 0
+        CIRCUIT_STATE.labels(name).set(STATE_VALUES[CLOSED])
+
+    @property
+    def state(self) -> str:
+        """Current state; an open circuit turns half-open once its time is up."""
+        if self._state == OPEN and self.clock() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        return self._state
+
+    def _transition(self, state: str) -> None:
+        previous, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = self.clock()
+        if state in (HALF_OPEN, CLOSED):
+            self._probes = self._probe_successes = 0
+        if state == CLOSED:
+            self._buckets.clear()
+        CIRCUIT_STATE.labels(self.name).set(STATE_VALUES[state])
+        CIRCUIT_TRANSITIONS.labels(self.name, state).inc()
+        log = logger.warning if state == OPEN else logger.info
+        log("Circuit %s: %s -> %s", self.name, previous, state)
+
+    def _window_counts(self) -> tuple:
+        now = self.clock()
+        while self._buckets and self._buckets[0][0] <= now - self.window:
+            self._buckets.popleft()
+        calls = sum(b[1] for b in self._buckets)
+        failures = sum(b[2] for b in self._buckets)
+        return calls, failures
+
+    def _record(self, failed: bool) -> None:
+        second = int(self.clock())
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append([second, 0, 0])
+        self._buckets[-1][1] += 1
+        self._buckets[-1][2] += failed
+
+    def retry_after(self) -> float:
+        """Seconds until an open circuit lets probes through."""
+        if self._state != OPEN:
+            return 0.0
+        return max(0.0, self.open_seconds - (self.clock() - self._opened_at))
+
+    def before_call(self) -> None:
+        """
+        Admit a call, counting it as a probe when half-open.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with all probes in flight
+        """
+        state = self.state
+        if state == CLOSED:
+            return
+        if state == HALF_OPEN and self._probes < self.half_open_calls:
+            self._probes += 1
+            return
+        CIRCUIT_REJECTED.labels(self.name).inc()
+        # Half-open with every probe taken: retry shortly, when the probes are done
+        raise CircuitOpenError(self.name, self.retry_after() or 1.0)
+
+    def record_success(self) -> None:
+        state = self.state
+        if state == HALF_OPEN:
+            self._probe_successes += 1
+            if self._probe_successes >= self.half_open_calls:
+                self._transition(CLOSED)
+        elif state == CLOSED:
+            self._record(False)
+
+    def record_failure(self) -> None:
+        state = self.state
+        if state == HALF_OPEN:
+            self._transition(OPEN)
+        elif state == CLOSED:
+            self._record(True)
+            calls, failures = self._window_counts()
+            if calls >= self.min_calls and failures / calls >= self.failure_rate:
+                self._transition(OPEN)
+
+    def record_cancelled(self) -> None:
+        """A call ended without an outcome; a probe frees its place for another."""
+        if self._state == HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        """State and window counts, for /health."""
+        calls, failures = self._window_counts()
+        snapshot: Dict[str, Any] = {"state": self.state, "calls": calls, "failures": failures}
+        if self._state == OPEN:
+            snapshot["retry_after"] = round(self.retry_after(), 1)
+        return snapshot
+
+    def protect(self, fn: F) -> F:
+        """
+        Decorate an async service function with this breaker.
+
+        The function must raise ServiceUnavailableError when the dependency
+        fails; other exceptions and return values count as successes.
+        """
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            self.before_call()
+            try:
+                result = await fn(*args, **kwargs)
+            except ServiceUnavailableError:
+                self.record_failure()
+                raise
+            except (asyncio.CancelledError, DeadlineExceeded):
+                # The caller gave up; says nothing about the dependency
+                self.record_cancelled()
+                raise
+            except Exception:
+                self.record_success()
+                raise
+            self.record_success()
+            return result
+        return wrapper  # type: ignore[return-value]
+
+breakers: Dict[str, CircuitBreaker] = {}
+
+def circuit_breaker(name: str) -> CircuitBreaker:
+    """The breaker of a dependency, created with the CIRCUIT_* settings on first use."""
+    if name not in breakers:
+        breakers[name] = CircuitBreaker(name)
+    return breakers[name]
@@ -0,0 +1,180 @@
+"""
+deadline.py: Request deadlines and cancellation on client disconnect.
+
+DeadlineMiddleware gives each request to the routes in DEADLINE_ROUTES
+(chat) a deadline: CHAT_REQUEST_TIMEOUT seconds after it arrives, or sooner
+if the client asks for less with an X-Request-Timeout header. The deadline
+is kept in a context variable, so it follows the request into every
+coroutine and task it starts without being passed around. External calls
+go through call_with_timeout, which bounds each call by its own timeout
+and by the time the request has left.
+
+The middleware also watches the connection of those requests and cancels
+the handler when the client disconnects. The embedding, vector query and
+completion of an abandoned chat stop instead of running to completion and
+being saved for nobody.
+"""
+import os
+import re
+import time
+import asyncio
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+from starlette.datastructures import Headers
+from app.utils.logger import logger
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.metrics import REQUESTS_CANCELLED
+
+CHAT_REQUEST_TIMEOUT = float(os.getenv("CHAT_REQUEST_TIMEOUT", "60"))
+
+# Routes with a deadline and cancellation on disconnect: method, path pattern, timeout
+DEADLINE_ROUTES: List[Tuple[str, "re.Pattern[str]", float]] = [
+    ("POST", re.compile(r"^/agent/[^/]+/chat/?$"), CHAT_REQUEST_TIMEOUT)
+]
+
+# Status recorded for requests abandoned by the client (nginx convention)
+CLIENT_CLOSED_REQUEST = 499
+
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+def current_deadline() -> Optional[float]:
+    """The deadline of the current request on the time.monotonic() clock, if any."""
+    return _deadline.get()
+
+def remaining() -> Optional[float]:
+    """Seconds left until the current deadline; None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[Optional[float]]:
+    """
+    Run a block under a deadline `seconds` from now.
+
+    An enclosing deadline that is sooner stays in force; None keeps the
+    enclosing deadline as it is.
+
+    Yields:
+        The deadline in force within the block
+    """
+    deadline = _deadline.get()
+    if seconds is not None:
+        own = time.monotonic() + seconds
+        deadline = own if deadline is None else min(deadline, own)
+    token = _deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _deadline.reset(token)
+
+@contextmanager
+def no_deadline() -> Iterator[None]:
+    """Run a block without a request deadline, e.g. to start work shared by several requests."""
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+async def call_with_timeout(call: Awaitable[Any], timeout: float, service: str) -> Any:
+    """
+    Await an external call for at most `timeout` seconds and no later than the request deadline.
+
+    Args:
+        call: The awaitable making the call
+        timeout: Longest the service may take for this call
+        service: Service name for errors, e.g. "OpenAI"
+
+    Returns:
+        The call's result
+
+    Raises:
+        DeadlineExceeded: If the request deadline passed before or during the call
+        ServiceUnavailableError: If the service took longer than `timeout`
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        if asyncio.iscoroutine(call):
+            call.close()
+        raise DeadlineExceeded(service)
+    limit = timeout if left is None else min(timeout, left)
+    try:
+        return await asyncio.wait_for(call, limit)
+    except asyncio.TimeoutError:
+        if left is not None and left <= timeout:
+            raise DeadlineExceeded(service)
+        raise ServiceUnavailableError(service, {"error": f"Timed out after {timeout:g}s"})
+
+def _route_timeout(scope: Dict[str, Any]) -> Optional[float]:
+    """Timeout of a request to one of the DEADLINE_ROUTES, shortened by X-Request-Timeout."""
+    for method, pattern, timeout in DEADLINE_ROUTES:
+        if scope["method"] == method and pattern.match(scope["path"]):
+            requested = Headers(scope=scope).get("x-request-timeout")
+            try:
+                return min(timeout, float(requested)) if requested else timeout
+            except ValueError:
+                return timeout
+    return None
+
+class DeadlineMiddleware:
+    """ASGI middleware setting request deadlines and cancelling requests on disconnect."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        timeout = _route_timeout(scope) if scope["type"] == "http" else None
+        if timeout is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Read the body first; afterwards the only message left is the disconnect
+        messages = []
+        while True:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request" or not message.get("more_body", False):
+                break
+        disconnected = asyncio.Event()
+        if messages[-1]["type"] == "http.disconnect":
+            disconnected.set()
+
+        async def app_receive():
+            if messages:
+                return messages.pop(0)
+            await disconnected.wait()
+            return {"type": "http.disconnect"}
+
+        async def watch_disconnect():
+            while not disconnected.is_set():
+                if (await receive())["type"] == "http.disconnect":
+                    disconnected.set()
+
+        with deadline_scope(timeout):
+            handler = asyncio.create_task(self.app(scope, app_receive, send))
+        watcher = asyncio.create_task(watch_disconnect())
+        try:
+            await asyncio.wait({handler, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            handler.cancel()
+            watcher.cancel()
+            raise
+        watcher.cancel()
+        if handler.done() or not disconnected.is_set():
+            await handler
+            return
+
+        handler.cancel()
+        try:
+            await handler
+        except asyncio.CancelledError:
+            pass
+        REQUESTS_CANCELLED.inc()
+        logger.info("Client disconnected, cancelled %s %s", scope["method"], scope["path"])
+        try:
+            # Servers drop sends after a disconnect; this only labels the request in metrics
+            await send({"type": "http.response.start", "status": CLIENT_CLOSED_REQUEST, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+        except Exception:
+            pass
@@ -4,6 +4,7 @@ errors.py: Centralized error handling for the application.
 This module defines custom exceptions and error handlers for various
 service-level errors that can occur in the application.
 """
+import math
 from fastapi import HTTPException
 from typing import Optional, Dict, Any
 
@@ -24,6 +25,15 @@ class ServiceUnavailableError(ServiceError):
             details=details
         )
 
+class DeadlineExceeded(ServiceError):
+    """Raised when a request runs out of time while waiting for a service."""
+    def __init__(self, service_name: str):
+        super().__init__(
+            message=f"Request deadline exceeded waiting for {service_name}",
+            status_code=504,
+            details={"service": service_name}
+        )
+
 class InsufficientCreditsError(ServiceError):
     """Raised when a user doesn't have enough credits."""
     def __init__(self, current_balance: int, required_amount: int):
@@ -46,11 +56,13 @@ class TelegramError(ServiceError):
         )
 
 def handle_service_error(error: ServiceError) -> HTTPException:
-    """Convert a ServiceError to an HTTPException."""
+    """Convert a ServiceError to an HTTPException, with Retry-After if the error has one."""
+    retry_after = error.details.get("retry_after")
     return HTTPException(
         status_code=error.status_code,
         detail={
             "message": error.message,
             "details": error.details
-        }
+        },
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))} if retry_after is not None else None
     ) 
\ No newline at end of file
@@ -0,0 +1,404 @@
+"""
+idempotency.py: Idempotency keys for chat and agent creation.
+
+Clients on flaky networks retry requests whose response they never got. A
+chat retried this way runs another RAG generation, and a retried
+/agent/create ingests the channel again into a second agent. With an
+Idempotency-Key header, IdempotencyMiddleware runs a request once per key:
+
+- the first request with a key claims it and runs; its response is stored
+  for IDEMPOTENCY_TTL seconds
+- a repeat of a finished request gets the stored response, marked with an
+  Idempotent-Replayed: true header
+- a repeat of a request still running waits for its response, for up to
+  IDEMPOTENCY_WAIT_TIMEOUT seconds, then gets 409 with Retry-After
+- a key reused for a different request (other route or form) gets 422
+
+Server errors (5xx) and 429 are not stored: the key is freed and the next
+retry runs the request again. A claim expires after IDEMPOTENCY_LOCK_TTL
+seconds, so a worker that died mid-request cannot block its key.
+
+Responses live in a store chosen by IDEMPOTENCY_BACKEND: "memory" (per
+process) or "sqlite" (IDEMPOTENCY_DB_PATH, shared by the workers of a host,
+like the rate limiter's). With several workers only "sqlite" catches a
+retry that lands on another worker; Procfile.concurrency selects it. Store
+calls block, so they run off the event loop. If the store fails, requests
+run as if they had no key.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from starlette.datastructures import UploadFile
+from starlette.requests import Request
+from app.utils.asgi import read_body, replay_body, disconnected
+from app.utils.logger import logger
+from app.utils.metrics import IDEMPOTENT_REQUESTS
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory")
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "data/idempotency.db")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_LOCK_TTL = float(os.getenv("IDEMPOTENCY_LOCK_TTL", "600"))
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT", "120"))
+
+# How often a repeat polls for the response of a request running in another worker
+POLL_INTERVAL = 0.25
+
+# Retry-After of a repeat that gave up waiting for the first request
+CONFLICT_RETRY_AFTER = 1
+
+# Longest key accepted and largest response stored
+MAX_KEY_LENGTH = 255
+MAX_RESPONSE_BYTES = 1024 * 1024
+
+# Routes honouring Idempotency-Key: method and path pattern
+IDEMPOTENT_ROUTES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("POST", re.compile(r"^/agent/create/?$")),
+    ("POST", re.compile(r"^/agent/[^/]+/chat/?$"))
+]
+
+# Responses that say nothing final about the request; the key is freed instead
+UNSTORED_STATUSES = {429}
+
+# Expired entries are dropped once memory holds this many keys, or every
+# PRUNE_EVERY claims in SQLite
+MAX_MEMORY_KEYS = 10000
+PRUNE_EVERY = 1000
+
+@dataclass
+class StoredResponse:
+    """A response recorded for replay."""
+    status: int
+    headers: List[Tuple[bytes, bytes]]
+    body: bytes
+
+@dataclass
+class Entry:
+    """What the store holds for a key: the request's fingerprint and, once finished, its response."""
+    fingerprint: str
+    response: Optional[StoredResponse]
+
+def _encode_headers(headers: List[Tuple[bytes, bytes]]) -> str:
+    return json.dumps([[k.decode("latin-1"), v.decode("latin-1")] for k, v in headers])
+
+def _decode_headers(data: str) -> List[Tuple[bytes, bytes]]:
+    return [(k.encode("latin-1"), v.encode("latin-1")) for k, v in json.loads(data)]
+
+class IdempotencyStore(ABC):
+    """Storage of claimed keys and their responses."""
+
+    @abstractmethod
+    def claim(self, key: str, fingerprint: str, lease: str, now: float) -> Optional[Entry]:
+        """
+        Claim a key for a request that is about to run.
+
+        Returns:
+            None if the key was free and is now held under `lease`, else
+            the entry of the request holding it
+        """
+
+    @abstractmethod
+    def complete(self, key: str, lease: str, response: StoredResponse, expires: float) -> None:
+        """Store the response of the request holding `key` under `lease`."""
+
+    @abstractmethod
+    def abandon(self, key: str, lease: str) -> None:
+        """Free a key held under `lease` without storing a response."""
+
+class MemoryStore(IdempotencyStore):
+    """Keys and responses of this process."""
+
+    def __init__(self, lock_ttl: float = IDEMPOTENCY_LOCK_TTL):
+        self.lock_ttl = lock_ttl
+        self._lock = threading.Lock()
+        # key -> (fingerprint, lease, expires, response)
+        self._entries: Dict[str, Tuple[str, str, float, Optional[StoredResponse]]] = {}
+
+    def claim(self, key: str, fingerprint: str, lease: str, now: float) -> Optional[Entry]:
+        with self._lock:
+            if len(self._entries) > MAX_MEMORY_KEYS:
+                self._entries = {k: v for k, v in self._entries.items() if v[2] > now}
+            current = self._entries.get(key)
+            if current is not None and current[2] > now:
+                return Entry(current[0], current[3])
+            self._entries[key] = (fingerprint, lease, now + self.lock_ttl, None)
+        return None
+
+    def complete(self, key: str, lease: str, response: StoredResponse, expires: float) -> None:
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[1] == lease:
+                self._entries[key] = (current[0], lease, expires, response)
+
+    def abandon(self, key: str, lease: str) -> None:
+        with self._lock:
+            current = self._entries.get(key)
+            if current is not None and current[1] == lease and current[3] is None:
+                del self._entries[key]
+
+class SqliteStore(IdempotencyStore):
+    """Keys and responses in a SQLite database shared by the workers of a host."""
+
+    def __init__(self, path: str = IDEMPOTENCY_DB_PATH, lock_ttl: float = IDEMPOTENCY_LOCK_TTL):
+        self.path = path
+        self.lock_ttl = lock_ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Fail fast under contention; a failing store runs the request without a key
+        self._conn.execute("PRAGMA busy_timeout=1000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            " key TEXT PRIMARY KEY,"
+            " fingerprint TEXT NOT NULL,"
+            " lease TEXT NOT NULL,"
+            " expires REAL NOT NULL,"
+            " status INTEGER,"
+            " headers TEXT,"
+            " body BLOB)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idempotency_keys_expires ON idempotency_keys (expires)"
+        )
+        self._claims = 0
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Serialize read-modify-write across threads and processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def claim(self, key: str, fingerprint: str, lease: str, now: float) -> Optional[Entry]:
+        with self._transaction() as conn:
+            self._claims += 1
+            if self._claims % PRUNE_EVERY == 0:
+                conn.execute("DELETE FROM idempotency_keys WHERE expires <= ?", (now,))
+            row = conn.execute(
+                "SELECT fingerprint, expires, status, headers, body FROM idempotency_keys WHERE key = ?",
+                (key,)
+            ).fetchone()
+            if row is not None and row[1] > now:
+                response = None
+                if row[2] is not None:
+                    response = StoredResponse(row[2], _decode_headers(row[3]), bytes(row[4]))
+                return Entry(row[0], response)
+            conn.execute(
+                "INSERT OR REPLACE INTO idempotency_keys (key, fingerprint, lease, expires) VALUES (?, ?, ?, ?)",
+                (key, fingerprint, lease, now + self.lock_ttl)
+            )
+        return None
+
+    def complete(self, key: str, lease: str, response: StoredResponse, expires: float) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "UPDATE idempotency_keys SET expires = ?, status = ?, headers = ?, body = ?"
+                " WHERE key = ? AND lease = ?",
+                (expires, response.status, _encode_headers(response.headers), response.body, key, lease)
+            )
+
+    def abandon(self, key: str, lease: str) -> None:
+        with self._transaction() as conn:
+            conn.execute(
+                "DELETE FROM idempotency_keys WHERE key = ? AND lease = ? AND status IS NULL", (key, lease)
+            )
+
+def create_store(name: str = IDEMPOTENCY_BACKEND) -> IdempotencyStore:
+    """
+    Create the store selected by IDEMPOTENCY_BACKEND.
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    if name == "memory":
+        return MemoryStore()
+    if name == "sqlite":
+        return SqliteStore()
+    raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {name}")
+
+_store: Optional[IdempotencyStore] = None
+
+def get_idempotency_store() -> IdempotencyStore:
+    """The process-wide store, created on first use."""
+    global _store
+    if _store is None:
+        _store = create_store()
+    return _store
+
+def set_idempotency_store(store: Optional[IdempotencyStore]) -> None:
+    """Replace the process-wide store; None recreates it from the environment."""
+    global _store
+    _store = store
+
+def _is_idempotent_route(scope: Dict[str, Any]) -> bool:
+    return any(scope["method"] == method and pattern.match(scope["path"]) for method, pattern in IDEMPOTENT_ROUTES)
+
+async def fingerprint(scope: Dict[str, Any], body: bytes) -> str:
+    """
+    Identify a request by its route and content.
+
+    Forms are compared by their fields, not their bytes: a retried multipart
+    request usually has a new boundary.
+    """
+    digest = hashlib.sha256(f"{scope['method']} {scope['path']}\n".encode("utf-8"))
+    content_type = Request(scope).headers.get("content-type", "")
+    if content_type.startswith(("application/x-www-form-urlencoded", "multipart/form-data")):
+        try:
+            form = await Request(scope, replay_body(body, disconnected)).form()
+            fields = []
+            for name, value in form.multi_items():
+                if isinstance(value, UploadFile):
+                    value = hashlib.sha256(await value.read()).hexdigest()
+                fields.append([name, value])
+            await form.close()
+            digest.update(json.dumps(sorted(fields)).encode("utf-8"))
+            return digest.hexdigest()
+        except Exception as e:
+            logger.debug("Could not parse form for idempotency fingerprint: %s", str(e))
+    digest.update(body)
+    return digest.hexdigest()
+
+async def _send_json(send: Callable, status: int, content: Dict[str, Any], headers: List[Tuple[bytes, bytes]]) -> None:
+    body = json.dumps(content).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1"))
+        ] + headers
+    })
+    await send({"type": "http.response.body", "body": body})
+
+async def _send_stored(send: Callable, response: StoredResponse) -> None:
+    await send({
+        "type": "http.response.start",
+        "status": response.status,
+        "headers": response.headers + [(b"idempotent-replayed", b"true")]
+    })
+    await send({"type": "http.response.body", "body": response.body})
+
+class IdempotencyMiddleware:
+    """ASGI middleware running each Idempotency-Key of the idempotent routes once."""
+
+    def __init__(self, app, clock: Callable[[], float] = time.time):
+        self.app = app
+        self.clock = clock
+        # Keys being run by this process; repeats wait on the event
+        self._running: Dict[str, asyncio.Event] = {}
+
+    async def __call__(self, scope, receive, send):
+        key = None
+        if scope["type"] == "http" and IDEMPOTENCY_ENABLED and _is_idempotent_route(scope):
+            key = Request(scope).headers.get("idempotency-key")
+        if not key:
+            await self.app(scope, receive, send)
+            return
+        if len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": f"Idempotency-Key longer than {MAX_KEY_LENGTH} characters"}, [])
+            return
+
+        body = await read_body(receive)
+        receive = replay_body(body, receive)
+        request_fingerprint = await fingerprint(scope, body)
+        store_key = hashlib.sha256(f"{scope['path']}\n{key}".encode("utf-8")).hexdigest()
+        lease = uuid.uuid4().hex
+        waited_until = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+
+        while True:
+            try:
+                entry = await asyncio.to_thread(
+                    get_idempotency_store().claim, store_key, request_fingerprint, lease, self.clock()
+                )
+            except Exception as e:
+                logger.warning("Idempotency store unavailable, running request without key: %s", str(e))
+                await self.app(scope, receive, send)
+                return
+
+            if entry is None:
+                IDEMPOTENT_REQUESTS.labels("new").inc()
+                await self._run(scope, receive, send, store_key, lease)
+                return
+            if entry.fingerprint != request_fingerprint:
+                IDEMPOTENT_REQUESTS.labels("mismatch").inc()
+                await _send_json(send, 422, {"detail": "Idempotency-Key was used for a different request"}, [])
+                return
+            if entry.response is not None:
+                IDEMPOTENT_REQUESTS.labels("replayed").inc()
+                logger.info("Replaying stored response for %s %s", scope["method"], scope["path"])
+                await _send_stored(send, entry.response)
+                return
+
+            # The first request is still running, here or in another worker
+            left = waited_until - time.monotonic()
+            if left <= 0:
+                IDEMPOTENT_REQUESTS.labels("conflict").inc()
+                await _send_json(
+                    send, 409, {"detail": "A request with this Idempotency-Key is still in progress"},
+                    [(b"retry-after", str(CONFLICT_RETRY_AFTER).encode("latin-1"))]
+                )
+                return
+            event = self._running.get(store_key)
+            try:
+                if event is not None:
+                    await asyncio.wait_for(event.wait(), left)
+                else:
+                    await asyncio.sleep(min(POLL_INTERVAL, left))
+            except asyncio.TimeoutError:
+                pass
+
+    async def _run(self, scope, receive, send, store_key: str, lease: str) -> None:
+        """Run the request holding the key, then store its response or free the key."""
+        event = self._running[store_key] = asyncio.Event()
+        start: Dict[str, Any] = {}
+        chunks: List[bytes] = []
+        size = 0
+
+        async def capture(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if size <= MAX_RESPONSE_BYTES:
+                    chunks.append(message.get("body", b""))
+            await send(message)
+
+        response = None
+        try:
+            await self.app(scope, receive, capture)
+            status = start.get("status", 500)
+            if status < 500 and status not in UNSTORED_STATUSES and size <= MAX_RESPONSE_BYTES:
+                response = StoredResponse(status, list(start.get("headers", [])), b"".join(chunks))
+        finally:
+            try:
+                store = get_idempotency_store()
+                if response is not None:
+                    expires = self.clock() + IDEMPOTENCY_TTL
+                    await asyncio.to_thread(store.complete, store_key, lease, response, expires)
+                else:
+                    await asyncio.to_thread(store.abandon, store_key, lease)
+            except Exception as e:
+                logger.warning("Failed to record idempotent response (key expires in %.0fs): %s",
+                               IDEMPOTENCY_LOCK_TTL, str(e))
+            if self._running.get(store_key) is event:
+                del self._running[store_key]
+            event.set()
@@ -1,24 +1,144 @@
 """
 logger.py: Comprehensive logging setup capturing both application and server logs.
+
+Logging never does I/O on the calling thread: every logger hands its records
+to a bounded in-memory queue, and a background listener thread formats them
+and writes them to the console and the rotating log file. When the queue is
+full (the disk or terminal cannot keep up), records are dropped and counted
+instead of blocking the event loop.
+
+Configuration (environment):
+
+- LOG_LEVEL: level of the application and root loggers (default INFO)
+- LOG_LEVELS: per-logger overrides, e.g. "openai=WARNING,agentique.db=DEBUG"
+- LOG_FORMAT: "text" or "json" (one JSON object per line) for both outputs
+- LOG_DEBUG_MAX_PER_SECOND: DEBUG records allowed per second per call site;
+  hot paths that debug-log on every request are thinned to this rate
+- LOG_DEBUG_SAMPLE_RATE: fraction of DEBUG records kept before rate limiting
+
+Levels can be changed at runtime with set_log_level (see the admin routes);
+the change applies to the worker process that receives it.
 """
 
-import logging
 import os
-from logging.handlers import RotatingFileHandler
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+from datetime import datetime, timezone
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from typing import Dict, Optional, Tuple
 
 # Create logs directory if it doesn't exist
 logs_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(__file__))), "logs")
 os.makedirs(logs_dir, exist_ok=True)
 
-# Configure logging
-logger = logging.getLogger("agentique")
-logger.setLevel(logging.DEBUG)
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_LEVELS = os.getenv("LOG_LEVELS", "")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+DEBUG_MAX_PER_SECOND = float(os.getenv("LOG_DEBUG_MAX_PER_SECOND", "10"))
+DEBUG_SAMPLE_RATE = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "1.0"))
+
+# Attributes every LogRecord has; anything else was passed via `extra`
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DebugRateLimitFilter(logging.Filter):
+    """
+    Sample DEBUG records and cap them per call site.
+
+    Each call site (logger, file and line) gets a token bucket refilled at
+    max_per_second. Records above the rate are dropped; the next record let
+    through from that call site carries the number dropped as `suppressed`.
+    Records at INFO and above always pass.
+    """
+
+    def __init__(self, max_per_second: float = DEBUG_MAX_PER_SECOND, sample_rate: float = DEBUG_SAMPLE_RATE):
+        super().__init__()
+        self.max_per_second = max_per_second
+        self.sample_rate = sample_rate
+        self._buckets: Dict[Tuple[str, str, int], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+            return False
+        if self.max_per_second <= 0:
+            return True
+
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            # [tokens, last refill, suppressed since last pass]
+            bucket = self._buckets.setdefault(key, [self.max_per_second, now, 0])
+            bucket[0] = min(self.max_per_second, bucket[0] + (now - bucket[1]) * self.max_per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            if bucket[2]:
+                record.suppressed = bucket[2]
+                bucket[2] = 0
+        return True
+
+class TraceContextFilter(logging.Filter):
+    """Tags records with the trace of the request that logged them."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # Looked up lazily: tracing itself logs through this module
+        tracing = sys.modules.get("app.utils.tracing")
+        trace = tracing.current_trace() if tracing else None
+        if trace is not None:
+            record.trace_id = trace.trace_id
+        return True
+
+class NonBlockingQueueHandler(QueueHandler):
+    """Queue handler that drops records instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _formatter() -> logging.Formatter:
+    if LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
 
 # Console handler
 console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.INFO)
-console_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
-console_handler.setFormatter(console_formatter)
+console_handler.setFormatter(_formatter())
 
 # File handler
 file_handler = RotatingFileHandler(
@@ -26,32 +146,65 @@ file_handler = RotatingFileHandler(
     maxBytes=10*1024*1024,  # 10MB
     backupCount=5
 )
-file_handler.setLevel(logging.DEBUG)
-file_formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
-file_handler.setFormatter(file_formatter)
+file_handler.setFormatter(_formatter())
 
-# Add handlers
-logger.addHandler(console_handler)
-logger.addHandler(file_handler)
+# Records are queued by the logging threads and written by the listener thread
+log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(log_queue)
+queue_handler.addFilter(DebugRateLimitFilter())
+queue_handler.addFilter(TraceContextFilter())
+listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+listener.start()
+# Flush queued records on interpreter exit
+atexit.register(listener.stop)
+
+# Configure logging
+logger = logging.getLogger("agentique")
+logger.setLevel(LOG_LEVEL)
+logger.propagate = False
+logger.addHandler(queue_handler)
 
 # Configure root logger to capture all logs
 root_logger = logging.getLogger()
-root_logger.setLevel(logging.DEBUG)
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
-
-# Configure Uvicorn logger
-uvicorn_logger = logging.getLogger("uvicorn")
-uvicorn_logger.handlers = []  # Remove default handlers
-uvicorn_logger.addHandler(file_handler)
-uvicorn_logger.addHandler(console_handler)
-
-# Also capture other important loggers
-for logger_name in ["uvicorn.error", "fastapi", "telethon", "pinecone", "openai"]:
+root_logger.setLevel(LOG_LEVEL)
+root_logger.addHandler(queue_handler)
+
+# Configure Uvicorn logger and other important loggers through the root logger
+for logger_name in ["uvicorn", "uvicorn.error", "fastapi", "telethon", "pinecone", "openai"]:
     module_logger = logging.getLogger(logger_name)
-    module_logger.handlers = []  # Remove any existing handlers
-    module_logger.addHandler(file_handler)
-    module_logger.addHandler(console_handler)
+    module_logger.handlers = []  # Remove default handlers
+    module_logger.propagate = True
+
+def set_log_level(name: Optional[str], level: str) -> None:
+    """
+    Change the level of a logger at runtime.
+
+    Args:
+        name: Logger name, e.g. "agentique" or "openai"; None or "root" for the root logger
+        level: Level name, e.g. "DEBUG"
+
+    Raises:
+        ValueError: If the level is not a known level name
+    """
+    level = level.upper()
+    if not isinstance(logging.getLevelName(level), int):
+        raise ValueError(f"Unknown log level: {level}")
+    logging.getLogger(None if name in (None, "", "root") else name).setLevel(level)
+
+def get_log_levels() -> Dict[str, str]:
+    """Explicitly set levels of the root logger and all named loggers."""
+    levels = {"root": logging.getLevelName(root_logger.level)}
+    for name, existing in sorted(logging.root.manager.loggerDict.items()):
+        if isinstance(existing, logging.Logger) and existing.level != logging.NOTSET:
+            levels[name] = logging.getLevelName(existing.level)
+    return levels
+
+for override in filter(None, (part.strip() for part in LOG_LEVELS.split(","))):
+    name, _, level = override.partition("=")
+    try:
+        set_log_level(name.strip(), level.strip())
+    except ValueError as e:
+        logger.warning("Ignoring LOG_LEVELS entry %s: %s", override, str(e))
 
 # Export the logger object
-__all__ = ['logger'] 
\ No newline at end of file
+__all__ = ['logger', 'set_log_level', 'get_log_levels']
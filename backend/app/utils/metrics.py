@@ -0,0 +1,205 @@
+"""
+metrics.py: Prometheus metrics for the API, external services and RAG.
+
+Metrics are prometheus_client collectors shared by the whole app:
+
+- HTTP request rate, latency and in-progress requests per route
+  (MetricsMiddleware), labelled with the route template, not the raw path
+- latency and errors of external calls, taken from the tracing spans named
+  "<service>.<operation>" for the services in EXTERNAL_SERVICES
+- OpenAI tokens consumed, RAG context and prompt sizes
+- LLM completions running and queued under admission control, queue wait
+  and requests shed to references-only answers
+- answer cache lookups and hits (hit ratio = hits / lookups), coalesced
+  requests, RAG work in flight
+- ingested messages, vectors and batches
+- circuit breaker state per service, transitions and fast-failed calls
+- requests rejected by rate limits and concurrency quotas, requests
+  cancelled because the client disconnected, and requests with an
+  Idempotency-Key by outcome (run, replayed, conflicting)
+- open WebSocket chat sessions and the questions asked over them by outcome
+- conversation summary updates by outcome, and follow-up questions answered
+  with a conversation summary
+
+With gunicorn (Procfile.concurrency) every worker is a separate process, so
+counters are kept in prometheus_client's multiprocess mode: when
+PROMETHEUS_MULTIPROC_DIR is set (gunicorn.conf.py sets it), each worker
+writes its values to memory-mapped files in that directory and /metrics
+aggregates the files of all workers, whichever worker serves the scrape.
+"""
+import os
+import time
+from typing import Dict
+from prometheus_client import (
+    CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+)
+from prometheus_client import multiprocess
+from app.utils.tracing import Span, add_span_listener
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Span name prefixes of external calls, mapped to the "service" label
+EXTERNAL_SERVICES: Dict[str, str] = {
+    "openai": "openai",
+    "vector": "pinecone",
+    "supabase": "supabase",
+    "telegram": "telegram"
+}
+
+# Buckets in seconds, from cache hits to slow completions
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TOKEN_BUCKETS = (64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests handled", ["method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency", ["method", "route"],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being handled", ["method"],
+    multiprocess_mode="livesum"
+)
+
+EXTERNAL_LATENCY = Histogram(
+    "external_call_duration_seconds", "Latency of calls to external services",
+    ["service", "operation"], buckets=LATENCY_BUCKETS
+)
+EXTERNAL_ERRORS = Counter(
+    "external_call_errors_total", "Failed calls to external services", ["service", "operation"]
+)
+
+OPENAI_TOKENS = Counter(
+    "openai_tokens_total", "Tokens consumed by OpenAI calls", ["kind"]
+)
+RAG_CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens", "Tokens of assembled RAG context", buckets=TOKEN_BUCKETS
+)
+RAG_PROMPT_TOKENS = Histogram(
+    "rag_prompt_tokens", "Tokens of RAG prompts sent for completion", buckets=TOKEN_BUCKETS
+)
+RAG_CONTEXT_CHUNKS = Counter(
+    "rag_context_chunks_total", "Chunks considered for RAG context", ["outcome"]
+)
+RAG_IN_FLIGHT = Gauge(
+    "rag_in_flight", "Distinct RAG computations in flight", multiprocess_mode="livesum"
+)
+RAG_COALESCED = Counter(
+    "rag_coalesced_requests_total", "RAG requests that joined an identical in-flight computation"
+)
+
+LLM_IN_FLIGHT = Gauge(
+    "llm_completions_in_flight", "Completions holding an admission slot", multiprocess_mode="livesum"
+)
+LLM_QUEUED = Gauge(
+    "llm_completions_queued", "Completions waiting for an admission slot", multiprocess_mode="livesum"
+)
+LLM_QUEUE_WAIT = Histogram(
+    "llm_admission_wait_seconds", "Time completions waited for an admission slot",
+    buckets=LATENCY_BUCKETS
+)
+LLM_SHED = Counter(
+    "llm_shed_total", "Completions shed by admission control", ["reason"]
+)
+
+ANSWER_CACHE_LOOKUPS = Counter("answer_cache_lookups_total", "Answer cache lookups")
+ANSWER_CACHE_HITS = Counter("answer_cache_hits_total", "Answer cache hits")
+ANSWER_CACHE_SAVED = Counter(
+    "answer_cache_saved_seconds_total", "Latency saved by answer cache hits"
+)
+
+INGESTED_MESSAGES = Counter("ingestion_messages_total", "Channel messages processed by ingestion")
+INGESTED_VECTORS = Counter("ingestion_vectors_total", "Vectors stored by ingestion")
+INGESTION_FAILURES = Counter("ingestion_failed_messages_total", "Messages that failed to ingest")
+INGESTION_BATCH_LATENCY = Histogram(
+    "ingestion_batch_duration_seconds", "Time to embed and store one ingestion batch",
+    buckets=LATENCY_BUCKETS
+)
+
+CIRCUIT_STATE = Gauge(
+    "circuit_breaker_state", "Circuit breaker state (0 closed, 1 half-open, 2 open)", ["service"],
+    multiprocess_mode="max"
+)
+CIRCUIT_TRANSITIONS = Counter(
+    "circuit_breaker_transitions_total", "Circuit breaker state changes", ["service", "state"]
+)
+CIRCUIT_REJECTED = Counter(
+    "circuit_breaker_rejected_total", "Calls failed fast by an open circuit", ["service"]
+)
+
+RATE_LIMITED = Counter(
+    "rate_limited_requests_total", "Requests rejected by rate limits", ["scope", "reason"]
+)
+
+REQUESTS_CANCELLED = Counter(
+    "http_requests_cancelled_total", "Requests cancelled because the client disconnected"
+)
+
+IDEMPOTENT_REQUESTS = Counter(
+    "idempotent_requests_total", "Requests with an Idempotency-Key by outcome", ["outcome"]
+)
+
+CHAT_SESSIONS = Gauge(
+    "chat_sessions_open", "WebSocket chat sessions open", multiprocess_mode="livesum"
+)
+CHAT_SESSION_QUESTIONS = Counter(
+    "chat_session_questions_total", "Questions asked over WebSocket chat sessions by outcome", ["outcome"]
+)
+
+CONVERSATION_SUMMARY_UPDATES = Counter(
+    "conversation_summary_updates_total", "Conversation summary updates by outcome", ["outcome"]
+)
+RAG_FOLLOW_UPS = Counter(
+    "rag_follow_up_questions_total", "Questions answered as follow-ups with the conversation summary"
+)
+
+def observe_span(s: Span) -> None:
+    """Record an external call span as latency and error metrics."""
+    service, _, operation = s.name.partition(".")
+    label = EXTERNAL_SERVICES.get(service)
+    if label is None or not operation:
+        return
+    EXTERNAL_LATENCY.labels(label, operation).observe(s.duration_ms / 1000)
+    if s.error:
+        EXTERNAL_ERRORS.labels(label, operation).inc()
+
+add_span_listener(observe_span)
+
+def render() -> bytes:
+    """The current metrics in the Prometheus text format, across all workers."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests and timing them per route template."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = {"code": 500}
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_PROGRESS.labels(method).inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_IN_PROGRESS.labels(method).dec()
+            # Unmatched paths share one label so scanners cannot explode cardinality
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUESTS.labels(method, route, str(status["code"])).inc()
+            HTTP_LATENCY.labels(method, route).observe(time.perf_counter() - started)
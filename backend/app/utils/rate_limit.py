@@ -0,0 +1,458 @@
+"""
+rate_limit.py: Per-user and per-agent rate limits and concurrency quotas.
+
+Every chat costs OpenAI tokens, so RateLimitMiddleware guards the chat
+routes. The user and the agent of a request each get:
+
+- a token bucket: *_CHAT_RATE_PER_MINUTE chats per minute on average, with
+  bursts of up to *_CHAT_BURST
+- a quota of concurrent chats (*_MAX_CONCURRENT_CHATS), held until the
+  response has been sent
+
+A request over any limit is rejected at once with 429 and a Retry-After
+header rather than queued behind the others. A limit of 0 disables it.
+
+Limiter state lives in a backend chosen by RATE_LIMIT_BACKEND:
+
+- memory: per process, so with N gunicorn workers each worker enforces
+  the limits on its own share of the traffic and a user gets up to N times
+  the configured limits
+- sqlite: a SQLite database (RATE_LIMIT_DB_PATH) shared by all worker
+  processes on a host; Procfile.concurrency selects it. Concurrency slots
+  are leases expiring after RATE_LIMIT_SLOT_TTL seconds, so a crashed worker
+  cannot leak them
+
+Backend calls block (SQLite waits up to a second for a contended lock), so
+callers run admit() and release() off the event loop.
+
+If the backend fails, requests are let through: the limiter protects
+capacity and must not take chat down with it.
+"""
+import os
+import re
+import json
+import math
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from starlette.requests import Request
+from app.utils.asgi import read_body, replay_body, disconnected
+from app.utils.logger import logger
+from app.utils.metrics import RATE_LIMITED
+
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_DB_PATH = os.getenv("RATE_LIMIT_DB_PATH", "data/rate_limits.db")
+
+USER_CHAT_RATE_PER_MINUTE = float(os.getenv("USER_CHAT_RATE_PER_MINUTE", "20"))
+USER_CHAT_BURST = float(os.getenv("USER_CHAT_BURST", "5"))
+USER_MAX_CONCURRENT_CHATS = int(os.getenv("USER_MAX_CONCURRENT_CHATS", "2"))
+AGENT_CHAT_RATE_PER_MINUTE = float(os.getenv("AGENT_CHAT_RATE_PER_MINUTE", "300"))
+AGENT_CHAT_BURST = float(os.getenv("AGENT_CHAT_BURST", "30"))
+AGENT_MAX_CONCURRENT_CHATS = int(os.getenv("AGENT_MAX_CONCURRENT_CHATS", "20"))
+
+SLOT_TTL = float(os.getenv("RATE_LIMIT_SLOT_TTL", "300"))
+
+# Suggested wait when a concurrency quota is full; slots free up as chats finish
+CONCURRENCY_RETRY_AFTER = float(os.getenv("RATE_LIMIT_CONCURRENCY_RETRY_AFTER", "1"))
+
+# Rate-limited routes: method and a path pattern capturing the agent ID
+CHAT_ROUTES: List[Tuple[str, "re.Pattern[str]"]] = [
+    ("POST", re.compile(r"^/agent/(?P<agent_id>[^/]+)/chat/?$"))
+]
+
+# Full buckets are forgotten once memory tracks this many keys, or every
+# PRUNE_EVERY takes in SQLite
+MAX_MEMORY_KEYS = 10000
+PRUNE_EVERY = 1000
+
+@dataclass(frozen=True)
+class Bucket:
+    """Token bucket: `rate` tokens per second, holding at most `burst`."""
+    scope: str
+    key: str
+    rate: float
+    burst: float
+
+@dataclass(frozen=True)
+class Quota:
+    """At most `limit` concurrent holders of a key."""
+    scope: str
+    key: str
+    limit: int
+
+@dataclass
+class Rejection:
+    """Why a request was refused and when to retry."""
+    scope: str
+    reason: str
+    retry_after: float
+
+    @property
+    def detail(self) -> str:
+        if self.reason == "concurrency":
+            return f"Too many concurrent chats for this {self.scope}"
+        return f"Chat rate limit exceeded for this {self.scope}"
+
+def _refill(tokens: float, updated: float, bucket: Bucket, now: float) -> float:
+    """Tokens in a bucket at `now`, given its level at `updated`."""
+    return min(bucket.burst, tokens + max(0.0, now - updated) * bucket.rate)
+
+def _wait(tokens: float, bucket: Bucket) -> float:
+    """Seconds until a bucket holding `tokens` has a whole token."""
+    return (1 - tokens) / bucket.rate
+
+class RateLimitBackend(ABC):
+    """Storage of token buckets and concurrency slots."""
+
+    @abstractmethod
+    def take(self, buckets: List[Bucket], now: float) -> Optional[Tuple[Bucket, float]]:
+        """
+        Take one token from every bucket, or from none.
+
+        Returns:
+            None if the tokens were taken, else the first empty bucket and
+            the seconds until it has a token
+        """
+
+    @abstractmethod
+    def acquire(self, quotas: List[Quota], lease: str, now: float) -> Optional[Quota]:
+        """
+        Hold a slot of every quota under `lease`, or of none.
+
+        Returns:
+            None if the slots were acquired, else the first full quota
+        """
+
+    @abstractmethod
+    def release(self, quotas: List[Quota], lease: str) -> None:
+        """Free the slots held under `lease`."""
+
+class MemoryBackend(RateLimitBackend):
+    """Limiter state of this process."""
+
+    def __init__(self, slot_ttl: float = SLOT_TTL):
+        self.slot_ttl = slot_ttl
+        self._lock = threading.Lock()
+        # key -> (tokens, updated, time the bucket is full again)
+        self._buckets: Dict[str, Tuple[float, float, float]] = {}
+        self._slots: Dict[str, Dict[str, float]] = {}
+
+    def take(self, buckets: List[Bucket], now: float) -> Optional[Tuple[Bucket, float]]:
+        with self._lock:
+            if len(self._buckets) > MAX_MEMORY_KEYS:
+                # A bucket that has refilled completely is the same as a new one
+                self._buckets = {k: v for k, v in self._buckets.items() if v[2] > now}
+            levels = []
+            for bucket in buckets:
+                tokens, updated, _ = self._buckets.get(bucket.key, (bucket.burst, now, now))
+                tokens = _refill(tokens, updated, bucket, now)
+                if tokens < 1:
+                    return bucket, _wait(tokens, bucket)
+                levels.append(tokens)
+            for bucket, tokens in zip(buckets, levels):
+                full_at = now + (bucket.burst - tokens + 1) / bucket.rate
+                self._buckets[bucket.key] = (tokens - 1, now, full_at)
+        return None
+
+    def acquire(self, quotas: List[Quota], lease: str, now: float) -> Optional[Quota]:
+        with self._lock:
+            for quota in quotas:
+                holders = self._slots.get(quota.key, {})
+                for holder, expires in list(holders.items()):
+                    if expires <= now:
+                        del holders[holder]
+                if len(holders) >= quota.limit:
+                    return quota
+            for quota in quotas:
+                self._slots.setdefault(quota.key, {})[lease] = now + self.slot_ttl
+        return None
+
+    def release(self, quotas: List[Quota], lease: str) -> None:
+        with self._lock:
+            for quota in quotas:
+                holders = self._slots.get(quota.key)
+                if holders is not None:
+                    holders.pop(lease, None)
+                    if not holders:
+                        del self._slots[quota.key]
+
+class SqliteBackend(RateLimitBackend):
+    """Limiter state in a SQLite database shared by the workers of a host."""
+
+    def __init__(self, path: str = RATE_LIMIT_DB_PATH, slot_ttl: float = SLOT_TTL):
+        self.path = path
+        self.slot_ttl = slot_ttl
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # Fail fast under contention; a failing backend admits the request
+        self._conn.execute("PRAGMA busy_timeout=1000")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets ("
+            " key TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated REAL NOT NULL,"
+            " full_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS buckets_full_at ON buckets (full_at)")
+        self._takes = 0
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS slots ("
+            " key TEXT NOT NULL,"
+            " lease TEXT NOT NULL,"
+            " expires REAL NOT NULL,"
+            " PRIMARY KEY (key, lease))"
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        """Serialize read-modify-write across threads and processes."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def take(self, buckets: List[Bucket], now: float) -> Optional[Tuple[Bucket, float]]:
+        with self._transaction() as conn:
+            self._takes += 1
+            if self._takes % PRUNE_EVERY == 0:
+                # A bucket that has refilled completely is the same as a new one
+                conn.execute("DELETE FROM buckets WHERE full_at <= ?", (now,))
+            levels = []
+            for bucket in buckets:
+                row = conn.execute(
+                    "SELECT tokens, updated FROM buckets WHERE key = ?", (bucket.key,)
+                ).fetchone()
+                tokens = _refill(row[0], row[1], bucket, now) if row else bucket.burst
+                if tokens < 1:
+                    return bucket, _wait(tokens, bucket)
+                levels.append(tokens)
+            conn.executemany(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated, full_at) VALUES (?, ?, ?, ?)",
+                [
+                    (bucket.key, tokens - 1, now, now + (bucket.burst - tokens + 1) / bucket.rate)
+                    for bucket, tokens in zip(buckets, levels)
+                ]
+            )
+        return None
+
+    def acquire(self, quotas: List[Quota], lease: str, now: float) -> Optional[Quota]:
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM slots WHERE expires <= ?", (now,))
+            for quota in quotas:
+                held = conn.execute("SELECT COUNT(*) FROM slots WHERE key = ?", (quota.key,)).fetchone()[0]
+                if held >= quota.limit:
+                    return quota
+            conn.executemany(
+                "INSERT OR REPLACE INTO slots (key, lease, expires) VALUES (?, ?, ?)",
+                [(quota.key, lease, now + self.slot_ttl) for quota in quotas]
+            )
+        return None
+
+    def release(self, quotas: List[Quota], lease: str) -> None:
+        with self._transaction() as conn:
+            conn.executemany(
+                "DELETE FROM slots WHERE key = ? AND lease = ?",
+                [(quota.key, lease) for quota in quotas]
+            )
+
+def create_backend(name: str = RATE_LIMIT_BACKEND) -> RateLimitBackend:
+    """
+    Create the limiter backend selected by RATE_LIMIT_BACKEND.
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    if name == "memory":
+        return MemoryBackend()
+    if name == "sqlite":
+        return SqliteBackend()
+    raise ValueError(f"Unknown RATE_LIMIT_BACKEND: {name}")
+
+class RateLimiter:
+    """Chat rate limits and concurrency quotas per user and per agent."""
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        user_rate_per_minute: float = USER_CHAT_RATE_PER_MINUTE,
+        user_burst: float = USER_CHAT_BURST,
+        user_max_concurrent: int = USER_MAX_CONCURRENT_CHATS,
+        agent_rate_per_minute: float = AGENT_CHAT_RATE_PER_MINUTE,
+        agent_burst: float = AGENT_CHAT_BURST,
+        agent_max_concurrent: int = AGENT_MAX_CONCURRENT_CHATS,
+        clock: Callable[[], float] = time.time
+    ):
+        self.backend = backend
+        self.limits = {
+            "user": (user_rate_per_minute, user_burst, user_max_concurrent),
+            "agent": (agent_rate_per_minute, agent_burst, agent_max_concurrent)
+        }
+        self.clock = clock
+
+    def _limits(self, user_id: Optional[str], agent_id: Optional[str]) -> Tuple[List[Bucket], List[Quota]]:
+        buckets, quotas = [], []
+        for scope, id_ in (("user", user_id), ("agent", agent_id)):
+            if not id_:
+                continue
+            rate, burst, max_concurrent = self.limits[scope]
+            if rate > 0:
+                buckets.append(Bucket(scope, f"chat:{scope}:{id_}", rate / 60, max(1.0, burst)))
+            if max_concurrent > 0:
+                quotas.append(Quota(scope, f"chat:{scope}:{id_}", max_concurrent))
+        return buckets, quotas
+
+    def admit(self, user_id: Optional[str], agent_id: Optional[str], lease: str) -> Optional[Rejection]:
+        """
+        Admit a chat: take a concurrency slot and a rate token for its user and agent.
+
+        An admitted chat holds its slots until release() with the same lease.
+
+        Args:
+            user_id: The user sending the chat, if known
+            agent_id: The agent being chatted with, if known
+            lease: Unique ID of this chat, identifying its slots
+
+        Returns:
+            None if admitted, else the Rejection
+        """
+        buckets, quotas = self._limits(user_id, agent_id)
+        now = self.clock()
+        full = self.backend.acquire(quotas, lease, now) if quotas else None
+        if full is not None:
+            return Rejection(full.scope, "concurrency", CONCURRENCY_RETRY_AFTER)
+        empty = self.backend.take(buckets, now) if buckets else None
+        if empty is not None:
+            if quotas:
+                self.backend.release(quotas, lease)
+            bucket, wait = empty
+            return Rejection(bucket.scope, "rate", wait)
+        return None
+
+    def release(self, user_id: Optional[str], agent_id: Optional[str], lease: str) -> None:
+        """Free the concurrency slots of an admitted chat."""
+        _, quotas = self._limits(user_id, agent_id)
+        if quotas:
+            self.backend.release(quotas, lease)
+
+_rate_limiter: Optional[RateLimiter] = None
+
+def get_rate_limiter() -> RateLimiter:
+    """The process-wide limiter, created on first use."""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = RateLimiter(create_backend())
+    return _rate_limiter
+
+def set_rate_limiter(limiter: Optional[RateLimiter]) -> None:
+    """Replace the process-wide limiter; None recreates it from the environment."""
+    global _rate_limiter
+    _rate_limiter = limiter
+
+def _chat_agent_id(scope: Dict[str, Any]) -> Optional[str]:
+    """The agent ID if the request is for a rate-limited route."""
+    for method, pattern in CHAT_ROUTES:
+        if scope["method"] == method:
+            match = pattern.match(scope["path"])
+            if match:
+                return match.group("agent_id")
+    return None
+
+async def _user_id(scope: Dict[str, Any], receive: Callable) -> Tuple[Optional[str], Callable]:
+    """
+    The user sending a chat, from the user_id form field the route reads.
+
+    Headers and query parameters are ignored: the route answers as the
+    form's user, and keying on another value would let a client vary it per
+    request and never hit its own limits. Reading the form consumes the
+    request body, so it is buffered and replayed to the app.
+
+    Returns:
+        The user ID (None if absent) and the receive callable the app must use
+    """
+    content_type = Request(scope).headers.get("content-type", "")
+    if not content_type.startswith(("application/x-www-form-urlencoded", "multipart/form-data")):
+        return None, receive
+
+    body = await read_body(receive)
+    user_id = None
+    try:
+        form = await Request(scope, replay_body(body, disconnected)).form()
+        value = form.get("user_id")
+        await form.close()
+        user_id = value if isinstance(value, str) else None
+    except Exception as e:
+        logger.debug("Could not read user_id from form: %s", str(e))
+    return user_id, replay_body(body, receive)
+
+async def _reject(send: Callable, rejection: Rejection) -> None:
+    retry_after = max(1, math.ceil(rejection.retry_after))
+    body = json.dumps({
+        "detail": rejection.detail,
+        "scope": rejection.scope,
+        "reason": rejection.reason,
+        "retry_after": round(rejection.retry_after, 3)
+    }).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": 429,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("latin-1")),
+            (b"retry-after", str(retry_after).encode("latin-1"))
+        ]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+class RateLimitMiddleware:
+    """ASGI middleware applying the chat rate limits and concurrency quotas."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        agent_id = _chat_agent_id(scope) if scope["type"] == "http" and RATE_LIMIT_ENABLED else None
+        if agent_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        user_id, receive = await _user_id(scope, receive)
+        limiter = get_rate_limiter()
+        lease = uuid.uuid4().hex
+        try:
+            rejection = await asyncio.to_thread(limiter.admit, user_id, agent_id, lease)
+        except Exception as e:
+            logger.warning("Rate limiter unavailable, admitting request: %s", str(e))
+            await self.app(scope, receive, send)
+            return
+
+        if rejection is not None:
+            RATE_LIMITED.labels(rejection.scope, rejection.reason).inc()
+            logger.info(
+                "Rejected chat (%s %s limit) - agent_id: %s, user_id: %s, retry after %.1fs",
+                rejection.scope, rejection.reason, agent_id, user_id, rejection.retry_after
+            )
+            await _reject(send, rejection)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            try:
+                await asyncio.to_thread(limiter.release, user_id, agent_id, lease)
+            except Exception as e:
+                logger.warning("Failed to release chat slots (expire in %.0fs): %s", SLOT_TTL, str(e))
@@ -0,0 +1,85 @@
+"""
+singleflight.py: Coalescing of identical concurrent async calls.
+
+While a call for a key is in flight, further calls with the same key wait
+for it and share its result (or exception) instead of starting their own.
+The shared work runs in its own task: a caller that is cancelled stops
+waiting without cancelling the work for the others, and the work is only
+cancelled once every caller waiting for it has gone.
+
+Callers may have different request deadlines (see deadline), so the work
+runs without one, bounded by the timeouts of its own calls. Each caller
+waits no longer than its own deadline and then gives up with
+DeadlineExceeded, like a cancelled caller.
+"""
+import time
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+from app.utils.deadline import current_deadline, no_deadline
+from app.utils.errors import DeadlineExceeded
+
+class SingleFlight:
+    """Run at most one in-flight call per key."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._waiters: Dict[Hashable, int] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._calls
+
+    def in_flight(self) -> int:
+        """Number of keys with a call in flight."""
+        return len(self._calls)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn(), or the call already in flight for the same key.
+
+        Args:
+            key: Identity of the call; equal keys share one execution
+            fn: Zero-argument coroutine function doing the work
+
+        Returns:
+            The result of the shared call
+
+        Raises:
+            DeadlineExceeded: If the caller's request deadline passes first
+            Whatever the shared call raised, in every waiting caller
+        """
+        task = self._calls.get(key)
+        if task is None:
+            # The first caller's deadline must not cut the call short for the others
+            with no_deadline():
+                task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda _: self._forget(key, task))
+
+        self._waiters[key] += 1
+        try:
+            deadline = current_deadline()
+            if deadline is None:
+                return await asyncio.shield(task)
+            # Unlike wait_for, wait leaves the shared task running on timeout
+            await asyncio.wait([task], timeout=max(0.0, deadline - time.monotonic()))
+            if not task.done():
+                raise DeadlineExceeded("shared call")
+            return task.result()
+        except (asyncio.CancelledError, DeadlineExceeded):
+            if task.cancelled() or self._waiters.get(key) != 1 or self._calls.get(key) is not task:
+                raise
+            # The last caller gave up: nobody needs the result anymore
+            task.cancel()
+            raise
+        finally:
+            if self._calls.get(key) is task:
+                self._waiters[key] -= 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+            del self._waiters[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every waiter was cancelled
+            task.exception()
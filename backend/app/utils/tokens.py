@@ -0,0 +1,89 @@
+"""
+tokens.py: Local token counting for prompt budgeting.
+
+Counts use the tokenizer of the completion model via tiktoken. tiktoken
+downloads its BPE tables on first use (cached in TIKTOKEN_CACHE_DIR), so if
+it is not installed or the tables cannot be loaded, counts fall back to an
+estimate from UTF-8 length: about four bytes per token holds for English
+and slightly overestimates Cyrillic text, which errs on the side of shorter
+prompts.
+"""
+import os
+import re
+import math
+from functools import lru_cache
+from typing import Any, Optional
+from app.utils.logger import logger
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover - optional dependency
+    tiktoken = None
+
+TOKENIZER_MODEL = os.getenv("TOKENIZER_MODEL", "gpt-3.5-turbo")
+BYTES_PER_TOKEN = 4
+
+# Sentence ends: terminal punctuation followed by whitespace, or line breaks
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+|\n+")
+
+@lru_cache(maxsize=1)
+def _encoding() -> Optional[Any]:
+    """The tiktoken encoding of TOKENIZER_MODEL, or None if unavailable."""
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed; estimating token counts")
+        return None
+    try:
+        return tiktoken.encoding_for_model(TOKENIZER_MODEL)
+    except Exception as e:
+        logger.warning("Could not load tokenizer for %s, estimating token counts: %s", TOKENIZER_MODEL, str(e))
+        return None
+
+def count_tokens(text: str) -> int:
+    """Number of tokens in a text."""
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return math.ceil(len(text.encode("utf-8")) / BYTES_PER_TOKEN)
+
+def _hard_truncate(text: str, max_tokens: int) -> str:
+    """Cut a text to at most max_tokens tokens, ignoring sentence boundaries."""
+    encoding = _encoding()
+    if encoding is not None:
+        return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    data = text.encode("utf-8")[:max_tokens * BYTES_PER_TOKEN]
+    return data.decode("utf-8", errors="ignore")
+
+def truncate_to_tokens(text: str, max_tokens: int, ellipsis: str = "…") -> str:
+    """
+    Shorten a text to fit max_tokens, cutting at a sentence boundary.
+
+    Whole sentences are kept while they fit. If not even the first sentence
+    fits, it is cut mid-sentence. An ellipsis marks any truncation.
+
+    Args:
+        text: The text to shorten
+        max_tokens: Token limit, including the ellipsis
+        ellipsis: Marker appended to truncated text
+
+    Returns:
+        The text itself if it fits, otherwise a truncated version
+    """
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    limit = max_tokens - count_tokens(ellipsis)
+    if limit <= 0:
+        return ""
+    kept = ""
+    for match in _SENTENCE_END.finditer(text):
+        candidate = text[:match.start()]
+        if count_tokens(candidate) > limit:
+            break
+        kept = candidate
+    if not kept:
+        kept = _hard_truncate(text, limit).rstrip()
+    return kept + ellipsis
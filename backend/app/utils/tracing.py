@@ -0,0 +1,313 @@
+"""
+tracing.py: Per-stage latency spans for requests.
+
+A trace collects the spans recorded while one request is handled; the
+current trace and span are kept in context variables, so spans nest across
+awaits and tasks without being passed around. Stages are timed with
+
+    with span("rerank", chunks=len(chunks)):
+        ...
+
+or by decorating a coroutine function with @traced("openai.embedding").
+
+TracingMiddleware opens a trace per HTTP request, summarizes it in a
+Server-Timing response header (durations summed per span name) and hands
+the finished spans to the configured exporter (TRACE_EXPORTER):
+
+- "log": one summary line per trace in the application log (default)
+- "jsonl": one JSON object per span in TRACE_FILE, using OpenTelemetry
+  field names (traceId, spanId, parentSpanId, start/endTimeUnixNano)
+- "otel": re-emitted through the OpenTelemetry API, for whatever SDK and
+  exporter the deployment configures
+- "none": spans only feed the Server-Timing header
+
+Spans recorded outside a request (ingestion, scripts) form their own trace,
+exported when the outermost span ends.
+"""
+import os
+import json
+import time
+import secrets
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+from app.utils.logger import logger
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - optional dependency
+    otel_trace = None
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "log").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("logs", "traces.jsonl"))
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING", "true").lower() == "true"
+
+@dataclass
+class Span:
+    """One timed stage of a trace."""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str] = None
+    start_ns: int = 0
+    duration_ms: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        """Attach attributes, e.g. result sizes known only at the end."""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """The span in OpenTelemetry's JSON field naming."""
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.start_ns + int(self.duration_ms * 1_000_000),
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"}
+        }
+
+@dataclass
+class Trace:
+    """Spans recorded for one request or one top-level operation."""
+    name: str
+    trace_id: str = field(default_factory=lambda: secrets.token_hex(16))
+    spans: List[Span] = field(default_factory=list)
+
+    def durations(self) -> Dict[str, float]:
+        """Total milliseconds per span name, in order of first completion."""
+        totals: Dict[str, float] = {}
+        for s in self.spans:
+            totals[s.name] = totals.get(s.name, 0.0) + s.duration_ms
+        return totals
+
+class SpanExporter:
+    """Receives the spans of every finished trace."""
+
+    def export(self, trace: Trace) -> None:
+        raise NotImplementedError
+
+class LogExporter(SpanExporter):
+    """Logs one line per trace with the time spent in each stage."""
+
+    def export(self, trace: Trace) -> None:
+        stages = ", ".join(f"{name}={ms:.1f}ms" for name, ms in trace.durations().items())
+        logger.info("Trace %s %s: %s", trace.trace_id[:8], trace.name, stages)
+
+class JsonlExporter(SpanExporter):
+    """Appends spans as JSON lines to a file."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, trace: Trace) -> None:
+        lines = "".join(json.dumps(s.to_dict(), default=str) + "\n" for s in trace.spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+class OpenTelemetryExporter(SpanExporter):
+    """Re-emits spans through the OpenTelemetry API with their original timing."""
+
+    def __init__(self):
+        if otel_trace is None:
+            raise RuntimeError("opentelemetry-api is not installed")
+        self.tracer = otel_trace.get_tracer("agentique")
+
+    def export(self, trace: Trace) -> None:
+        emitted = {}
+        # Parents start before their children, so they are emitted first
+        for s in sorted(trace.spans, key=lambda s: s.start_ns):
+            parent = emitted.get(s.parent_id)
+            context = otel_trace.set_span_in_context(parent) if parent is not None else None
+            otel_span = self.tracer.start_span(s.name, context=context, start_time=s.start_ns,
+                                               attributes={k: str(v) for k, v in s.attributes.items()})
+            if s.error:
+                otel_span.set_status(otel_trace.Status(otel_trace.StatusCode.ERROR, s.error))
+            otel_span.end(end_time=s.start_ns + int(s.duration_ms * 1_000_000))
+            emitted[s.span_id] = otel_span
+
+class NullExporter(SpanExporter):
+    """Discards spans."""
+
+    def export(self, trace: Trace) -> None:
+        pass
+
+_EXPORTERS: Dict[str, Callable[[], SpanExporter]] = {
+    "log": LogExporter,
+    "jsonl": JsonlExporter,
+    "otel": OpenTelemetryExporter,
+    "none": NullExporter
+}
+
+def _create_exporter(name: str) -> SpanExporter:
+    try:
+        return _EXPORTERS[name]()
+    except KeyError:
+        logger.warning("Unknown TRACE_EXPORTER %s, logging traces instead", name)
+    except Exception as e:
+        logger.warning("Could not create %s trace exporter, logging traces instead: %s", name, str(e))
+    return LogExporter()
+
+_exporter: SpanExporter = _create_exporter(TRACE_EXPORTER)
+
+def set_exporter(exporter: SpanExporter) -> None:
+    """Replace the exporter finished traces are sent to."""
+    global _exporter
+    _exporter = exporter
+
+def export(trace: Trace) -> None:
+    """Send a finished trace to the exporter; exporter failures are only logged."""
+    if not trace.spans:
+        return
+    try:
+        _exporter.export(trace)
+    except Exception as e:
+        logger.error("Failed to export trace %s: %s", trace.trace_id, str(e))
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+def current_trace() -> Optional[Trace]:
+    """The trace of the running request, if any."""
+    return _current_trace.get()
+
+@contextmanager
+def start_trace(name: str) -> Iterator[Trace]:
+    """
+    Collect the spans recorded inside the block into a new trace.
+
+    The trace is not exported automatically; the caller decides when it is
+    finished (TracingMiddleware exports it after the response is sent).
+
+    Args:
+        name: Name of the traced operation, e.g. "POST /agent/{agent_id}/chat"
+
+    Yields:
+        The trace
+    """
+    trace = Trace(name=name)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(None)
+    try:
+        yield trace
+    finally:
+        _current_span.reset(span_token)
+        _current_trace.reset(trace_token)
+
+_span_listeners: List[Callable[[Span], None]] = []
+
+def add_span_listener(listener: Callable[[Span], None]) -> None:
+    """
+    Call a function with every finished span, e.g. to feed metrics.
+
+    Listeners also see spans when TRACING_ENABLED is off; they must be cheap
+    and must not raise.
+    """
+    _span_listeners.append(listener)
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Time a stage as a span of the current trace.
+
+    With TRACING_ENABLED off the stage is still timed for span listeners,
+    but not recorded in a trace or exported.
+
+    Args:
+        name: Stage name; spans with the same name are summed in Server-Timing
+        **attributes: Extra attributes recorded with the span
+
+    Yields:
+        The span, to attach attributes to
+    """
+    trace = _current_trace.get()
+    owns_trace = trace is None and TRACING_ENABLED
+    if owns_trace:
+        trace = Trace(name=name)
+    parent = _current_span.get()
+    s = Span(
+        name=name,
+        trace_id=trace.trace_id if trace else "",
+        span_id=secrets.token_hex(8),
+        parent_id=parent.span_id if parent else None,
+        start_ns=time.time_ns(),
+        attributes=attributes
+    )
+    span_token = _current_span.set(s)
+    trace_token = _current_trace.set(trace) if owns_trace else None
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        s.duration_ms = (time.perf_counter() - started) * 1000
+        if trace_token is not None:
+            _current_trace.reset(trace_token)
+        _current_span.reset(span_token)
+        for listener in _span_listeners:
+            listener(s)
+        if trace is not None and TRACING_ENABLED:
+            trace.spans.append(s)
+            if owns_trace:
+                export(trace)
+
+def traced(name: str) -> Callable:
+    """Decorator recording each call of a coroutine function as a span."""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def server_timing(trace: Trace) -> str:
+    """Format a trace's per-stage durations as a Server-Timing header value."""
+    return ", ".join(f"{name};dur={ms:.1f}" for name, ms in trace.durations().items())
+
+class TracingMiddleware:
+    """ASGI middleware tracing each HTTP request and adding a Server-Timing header."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        with start_trace(f"{scope['method']} {scope['path']}") as trace:
+            started = time.perf_counter()
+
+            async def send_with_timing(message):
+                if message["type"] == "http.response.start" and SERVER_TIMING_ENABLED:
+                    total = (time.perf_counter() - started) * 1000
+                    value = server_timing(trace)
+                    value = f"{value}, total;dur={total:.1f}" if value else f"total;dur={total:.1f}"
+                    message["headers"] = list(message.get("headers", [])) + [
+                        (b"server-timing", value.encode("latin-1"))
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_timing)
+            finally:
+                # Route template rather than raw path, so traces of one endpoint group together
+                route = scope.get("route")
+                if route is not None and getattr(route, "path", None):
+                    trace.name = f"{scope['method']} {route.path}"
+                export(trace)
@@ -0,0 +1,22 @@
+"""
+Gunicorn configuration, loaded automatically from the working directory.
+
+Prepares prometheus_client multiprocess mode so that /metrics aggregates
+the metrics of every worker (see app.utils.metrics).
+"""
+import os
+import shutil
+
+# Workers inherit the environment of the master, which imports this file first
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/agentique-metrics")
+
+def on_starting(server):
+    """Start from an empty metrics directory; files of a previous run would be counted."""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+def child_exit(server, worker):
+    """Drop the live gauges of a worker that exited."""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
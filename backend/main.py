@@ -3,7 +3,12 @@ Main FastAPI application file for the Agentique backend.
 """
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.routes import agent, auth, chat, search, admin, credits
+from app.routes import agent, auth, chat, search, admin, credits, metrics
+from app.utils.tracing import TracingMiddleware
+from app.utils.metrics import MetricsMiddleware
+from app.utils.deadline import DeadlineMiddleware
+from app.utils.rate_limit import RateLimitMiddleware
+from app.utils.idempotency import IdempotencyMiddleware
 
 app = FastAPI(
     title="Agentique API",
@@ -11,6 +16,14 @@ app = FastAPI(
     version="1.0.0"
 )
 
+# Reject chats over the per-user and per-agent limits with 429. Added before
+# CORS so it runs inside it and the 429 responses carry CORS headers.
+app.add_middleware(RateLimitMiddleware)
+
+# Run each Idempotency-Key of chat and agent creation once and replay its
+# response to retries. Outside the rate limits, so replays cost no quota.
+app.add_middleware(IdempotencyMiddleware)
+
 # Define allowed origins
 origins = [
     "http://localhost:3000",  # Frontend in development
@@ -26,6 +39,15 @@ app.add_middleware(
     allow_headers=["*"],  # Allow all headers
 )
 
+# Time each request's stages and report them in a Server-Timing header
+app.add_middleware(TracingMiddleware)
+
+# Give chats a deadline and cancel them when the client disconnects
+app.add_middleware(DeadlineMiddleware)
+
+# Count and time requests per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
 # Include routers
 app.include_router(agent.router, prefix="/agent", tags=["Agents"])
 app.include_router(auth.router, prefix="/auth", tags=["Authentication"])
@@ -33,6 +55,7 @@ app.include_router(chat.router, prefix="/chat", tags=["Chat"])
 app.include_router(search.router, prefix="/search", tags=["Search"])
 app.include_router(admin.router, prefix="/admin", tags=["Admin"])
 app.include_router(credits.router)
+app.include_router(metrics.router)
 
 @app.get("/")
 async def root():
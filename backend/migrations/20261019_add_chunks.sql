@@ -0,0 +1,10 @@
+-- Chunk documents: text and display fields of each vector, keyed by vector ID
+-- (see app/services/chunk_store.py). Vectors only carry filterable metadata.
+CREATE TABLE IF NOT EXISTS chunks (
+    id TEXT PRIMARY KEY,
+    agent_id TEXT NOT NULL,
+    document JSONB NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_chunks_agent_id ON chunks(agent_id, id);
@@ -0,0 +1,118 @@
+"""
+Benchmark the local ANN (IVF) vector store against exact brute-force search.
+
+Generates clustered synthetic embeddings, loads them into both the
+memory-mapped AnnVectorStore and the exact NumpyVectorStore, and reports
+recall@k and p50/p99 query latency for several nprobe values.
+
+Usage:
+    python scripts/benchmark_ann.py --vectors 50000 --dimension 1536 --queries 200
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+
+# Add backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.ann_index import AnnVectorStore
+from app.services.vector_store import NumpyVectorStore
+
+AGENT_ID = "benchmark"
+
+def make_dataset(count: int, dimension: int, clusters: int, seed: int) -> np.ndarray:
+    """Clustered Gaussian data, closer to real embeddings than uniform noise."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dimension)).astype(np.float32)
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.5 * rng.normal(size=(count, dimension)).astype(np.float32)
+
+def percentile_ms(samples: list, q: float) -> float:
+    return round(float(np.percentile(samples, q)) * 1000, 3)
+
+def timed_queries(store, queries: np.ndarray, k: int) -> tuple:
+    """Run all queries, returning (result ID lists, per-query latencies)."""
+    results, latencies = [], []
+    for query in queries:
+        started = time.perf_counter()
+        matches = store.query(query.tolist(), top_k=k, filter={"agent_id": AGENT_ID})
+        latencies.append(time.perf_counter() - started)
+        results.append([m["id"] for m in matches])
+    return results, latencies
+
+def main(args: argparse.Namespace) -> None:
+    data = make_dataset(args.vectors, args.dimension, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    queries = data[rng.choice(len(data), args.queries, replace=False)]
+    queries = queries + 0.1 * rng.normal(size=queries.shape).astype(np.float32)
+
+    records = [
+        {"id": f"{AGENT_ID}#{i}", "values": vector, "metadata": {"agent_id": AGENT_ID}}
+        for i, vector in enumerate(data)
+    ]
+
+    exact = NumpyVectorStore(args.dimension)
+    exact.upsert(records)
+
+    path = args.path or tempfile.mkdtemp(prefix="ann-benchmark-")
+    ann = AnnVectorStore(args.dimension, path)
+    started = time.perf_counter()
+    for i in range(0, len(records), 1000):
+        ann.upsert(records[i:i + 1000])
+    index = ann._index(AGENT_ID)
+    # Let any background compaction finish, then train on the full dataset
+    while index._compacting:
+        time.sleep(0.1)
+    index.compact()
+    build_seconds = time.perf_counter() - started
+
+    truth, exact_latencies = timed_queries(exact, queries, args.k)
+    report = {
+        "vectors": args.vectors,
+        "dimension": args.dimension,
+        "queries": args.queries,
+        "k": args.k,
+        "nlist": int(len(index.centroids)) if index.centroids is not None else 0,
+        "build_seconds": round(build_seconds, 2),
+        "exact": {
+            "p50_ms": percentile_ms(exact_latencies, 50),
+            "p99_ms": percentile_ms(exact_latencies, 99)
+        },
+        "ann": []
+    }
+
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        found, latencies = timed_queries(ann, queries, args.k)
+        recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth) if t])
+        report["ann"].append({
+            "nprobe": nprobe,
+            f"recall@{args.k}": round(float(recall), 4),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99)
+        })
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if not args.path:
+        shutil.rmtree(path, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ANN recall and latency against exact search")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dimension", type=int, default=1536)
+    parser.add_argument("--clusters", type=int, default=100)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", help="Keep the index in this directory instead of a temp dir")
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    main(parser.parse_args())
@@ -0,0 +1,326 @@
+"""
+Benchmark chat, agent listing and ingestion against the offline fakes.
+
+Runs the FastAPI app in-process with every external service replaced by
+the fakes in app/fakes (with the latencies given below), so results are
+reproducible and need no network. Reports:
+
+- for POST /agent/{id}/chat and GET /agent/list: throughput and p50/p95/p99
+  latency at each concurrency level of the sweep
+- ingestion throughput (messages embedded, stored and indexed per second)
+- microbenchmarks of hot functions: context assembly, prompt building,
+  relevance cutoff + MMR, rank fusion and token counting
+
+Requests go through httpx's ASGI transport, so latencies include routing,
+middleware and serialization but not sockets. The JSON report records the
+git commit; compare two reports with --compare to spot regressions.
+
+Usage:
+    python scripts/benchmark_api.py --output results.json
+    python scripts/benchmark_api.py --concurrency 1 8 32 --requests 300 --openai-latency-ms 400
+    python scripts/benchmark_api.py --compare baseline.json results.json --threshold 0.1
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Add backend directory to Python path
+sys.path.append(BACKEND_DIR)
+
+CHANNEL = "https://t.me/benchmark_channel"
+
+QUESTIONS = [
+    "What do you think about Bitcoin?",
+    "Is TON a good investment?",
+    "Any news on AI assistants?",
+    "What is your opinion on electric cars?",
+    "How do you plan your morning routines?",
+    "Should I worry about oil prices?",
+    "What happened with the stock market this week?",
+    "Tips for remote work?"
+]
+
+def percentile_ms(samples: List[float], q: float) -> float:
+    import numpy as np
+    return round(float(np.percentile(samples, q)) * 1000, 2) if samples else 0.0
+
+def configure_environment(args: argparse.Namespace, data_dir: str) -> None:
+    """Select the fakes and isolate local state; must run before importing the app."""
+    os.environ.update({
+        "FAKE_SERVICES": "all",
+        "VECTOR_STORE": "pinecone",
+        "FAKE_SEED": str(args.seed),
+        "FAKE_OPENAI_LATENCY_MS": str(args.openai_latency_ms),
+        "FAKE_PINECONE_LATENCY_MS": str(args.pinecone_latency_ms),
+        "FAKE_SUPABASE_LATENCY_MS": str(args.supabase_latency_ms),
+        "FAKE_TELEGRAM_LATENCY_MS": str(args.telegram_latency_ms),
+        "FAKE_TELEGRAM_MESSAGES": str(args.messages),
+        "CONTENT_VERSION_PATH": os.path.join(data_dir, "versions.db"),
+        "LEXICAL_INDEX_PATH": os.path.join(data_dir, "lexical"),
+        "ANSWER_CACHE": "true" if args.answer_cache else "false",
+        "TRACE_EXPORTER": "none",
+        "LOG_LEVEL": "WARNING",
+        # Every chat comes from one benchmark user; per-user limits would turn the run into 429s
+        "RATE_LIMIT_ENABLED": "false"
+    })
+
+async def run_load(
+    request: Callable[[int], Awaitable[Any]],
+    concurrency: int,
+    total: int
+) -> Dict[str, Any]:
+    """
+    Issue `total` requests with at most `concurrency` in flight.
+
+    Args:
+        request: Coroutine function sending request number i, returning the response
+        concurrency: Number of concurrent workers
+        total: Number of requests
+
+    Returns:
+        Throughput, latency percentiles and error count
+    """
+    latencies: List[float] = []
+    errors = 0
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            started = time.perf_counter()
+            try:
+                response = await request(i)
+                if response.status_code >= 400:
+                    errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "throughput_rps": round(total / elapsed, 2),
+        "p50_ms": percentile_ms(latencies, 50),
+        "p95_ms": percentile_ms(latencies, 95),
+        "p99_ms": percentile_ms(latencies, 99)
+    }
+
+def microbenchmark(fn: Callable[[], Any], iterations: int) -> Dict[str, float]:
+    """Time repeated calls of a function, in microseconds."""
+    timings = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    timings.sort()
+    return {
+        "calls": iterations,
+        "mean_us": round(sum(timings) / len(timings) * 1e6, 2),
+        "p50_us": round(timings[len(timings) // 2] * 1e6, 2),
+        "p99_us": round(timings[min(len(timings) - 1, int(len(timings) * 0.99))] * 1e6, 2)
+    }
+
+def run_microbenchmarks(iterations: int, seed: int) -> Dict[str, Dict[str, float]]:
+    """Benchmark the pure functions on the chat hot path with synthetic chunks."""
+    from app.fakes.openai_fake import fake_embedding
+    from app.fakes.telegram_fake import TEMPLATES, OPINIONS, TOPICS
+    from app.services.context_builder import build_context
+    from app.services.rag_service import build_prompt, reciprocal_rank_fusion
+    from app.services.reranking import relevance_cutoff, mmr_select
+    from app.utils.tokens import count_tokens
+
+    rng = random.Random(seed)
+    subjects = [s for topic in TOPICS.values() for s in topic]
+    query = QUESTIONS[0]
+    query_vector = fake_embedding(query)
+    chunks = []
+    for i in range(20):
+        text = " ".join(rng.choice(TEMPLATES).format(
+            subject=rng.choice(subjects), opinion=rng.choice(OPINIONS),
+            days=rng.randint(2, 30), number=rng.randint(1, 40)
+        ) for _ in range(rng.randint(1, 6)))
+        values = fake_embedding(text)
+        chunks.append({
+            "id": f"bench#{i}",
+            "score": 0.95 - i * 0.005,
+            "text": text,
+            "values": values,
+            "metadata": {"source_link": f"t.me/bench/{i}"}
+        })
+    context = build_context(chunks)
+    rankings = [[c["id"] for c in chunks], [c["id"] for c in reversed(chunks)]]
+
+    return {
+        "build_context": microbenchmark(lambda: build_context(chunks), iterations),
+        "build_prompt": microbenchmark(lambda: build_prompt(query, context.text), iterations),
+        "rerank": microbenchmark(
+            lambda: mmr_select(query_vector, relevance_cutoff(chunks), 6), iterations
+        ),
+        "reciprocal_rank_fusion": microbenchmark(lambda: reciprocal_rank_fusion(rankings), iterations),
+        "count_tokens_prompt": microbenchmark(
+            lambda: count_tokens(build_prompt(query, context.text)), iterations
+        )
+    }
+
+async def run_benchmarks(args: argparse.Namespace) -> Dict[str, Any]:
+    import httpx
+    from app.main import app
+    from app.fakes.telegram_fake import FakeTelegramClient
+    from app.services.ingestion_service import ingest_messages
+
+    transport = httpx.ASGITransport(app=app)
+    report: Dict[str, Any] = {"endpoints": {}}
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+        response = await client.post("/agent/create", data={
+            "channel_link": CHANNEL,
+            "prompt_template": "benchmark",
+            "owner_id": "benchmark-user",
+            "channel_title": "Benchmark",
+            "limit": "20"
+        })
+        response.raise_for_status()
+        agent_id = response.json()["agent_id"]
+
+        # Ingestion of the channel history, timed apart from the request path.
+        # TelegramService caps a fetch at DEFAULT_MESSAGE_LIMIT, so read the fake directly.
+        telegram = FakeTelegramClient(messages_per_channel=args.messages)
+        channel = await telegram.get_entity(CHANNEL)
+        messages = [
+            {
+                "id": m.id, "text": m.text, "date": m.date.isoformat(), "link": f"{CHANNEL}/{m.id}",
+                "views": m.views, "forwards": m.forwards
+            }
+            for m in await telegram.get_messages(channel)
+        ]
+        started = time.perf_counter()
+        stats = await ingest_messages(agent_id, messages, channel=CHANNEL)
+        elapsed = time.perf_counter() - started
+        report["ingestion"] = {
+            "messages": stats.message_count,
+            "vectors": stats.vector_count,
+            "seconds": round(elapsed, 3),
+            "messages_per_second": round(stats.message_count / elapsed, 2)
+        }
+
+        async def chat(i: int):
+            question = f"{QUESTIONS[i % len(QUESTIONS)]} ({i})"
+            return await client.post(f"/agent/{agent_id}/chat",
+                                     data={"message": question, "user_id": "benchmark-user"})
+
+        async def list_agents(i: int):
+            return await client.get("/agent/list")
+
+        for name, request in (("POST /agent/{agent_id}/chat", chat), ("GET /agent/list", list_agents)):
+            results = []
+            for concurrency in args.concurrency:
+                # Warm up connections and caches outside the measurement
+                await run_load(request, concurrency, concurrency)
+                results.append(await run_load(request, concurrency, args.requests))
+            report["endpoints"][name] = results
+    return report
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def flatten(report: Dict[str, Any]) -> Dict[str, float]:
+    """Comparable metrics of a report, keyed by a readable path."""
+    metrics = {}
+    for endpoint, results in report.get("endpoints", {}).items():
+        for result in results:
+            prefix = f"{endpoint} c={result['concurrency']}"
+            metrics[f"{prefix} throughput_rps"] = result["throughput_rps"]
+            metrics[f"{prefix} p95_ms"] = result["p95_ms"]
+            metrics[f"{prefix} p99_ms"] = result["p99_ms"]
+    if "ingestion" in report:
+        metrics["ingestion messages_per_second"] = report["ingestion"]["messages_per_second"]
+    for name, result in report.get("micro", {}).items():
+        metrics[f"micro {name} mean_us"] = result["mean_us"]
+    return metrics
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """
+    Print metric changes between two reports.
+
+    Throughput regresses when it drops, latencies when they rise, by more
+    than `threshold` (a fraction).
+
+    Returns:
+        Number of regressions
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(current_path) as f:
+        current = json.load(f)
+    print(f"Baseline {baseline['meta']['commit']} -> current {current['meta']['commit']}")
+    old, new = flatten(baseline), flatten(current)
+    regressions = 0
+    for key in sorted(old.keys() & new.keys()):
+        before, after = old[key], new[key]
+        change = (after - before) / before if before else 0.0
+        higher_is_better = key.endswith("_rps") or key.endswith("per_second")
+        regressed = (-change if higher_is_better else change) > threshold
+        regressions += regressed
+        print(f"{'REGRESSION ' if regressed else '           '}{key}: {before} -> {after} ({change:+.1%})")
+    return regressions
+
+def main(args: argparse.Namespace) -> None:
+    if args.compare:
+        regressions = compare(args.compare[0], args.compare[1], args.threshold)
+        sys.exit(1 if regressions and args.fail_on_regression else 0)
+
+    data_dir = tempfile.mkdtemp(prefix="api-benchmark-")
+    configure_environment(args, data_dir)
+    random.seed(args.seed)
+
+    report = asyncio.run(run_benchmarks(args))
+    report["micro"] = run_microbenchmarks(args.micro_iterations, args.seed)
+    report["meta"] = {
+        "commit": git_commit(),
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")}
+    }
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark chat, listing and ingestion against offline fakes")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and concurrency level")
+    parser.add_argument("--messages", type=int, default=1000, help="Channel messages to ingest")
+    parser.add_argument("--openai-latency-ms", type=float, default=100)
+    parser.add_argument("--pinecone-latency-ms", type=float, default=20)
+    parser.add_argument("--supabase-latency-ms", type=float, default=15)
+    parser.add_argument("--telegram-latency-ms", type=float, default=50)
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache on")
+    parser.add_argument("--micro-iterations", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Also write the JSON report to this file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two reports instead of running the benchmark")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change that counts as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 on regressions")
+    main(parser.parse_args())
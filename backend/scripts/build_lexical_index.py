@@ -0,0 +1,52 @@
+"""
+Script to (re)build the BM25 lexical index of agents from the chunk store.
+
+New ingestion keeps lexical indexes up to date; this backfills agents
+ingested before hybrid retrieval, or rebuilds an index from scratch.
+
+Usage:
+    python scripts/build_lexical_index.py                  # all agents in Supabase
+    python scripts/build_lexical_index.py --agent-id <id>  # specific agents
+"""
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.chunk_store import chunk_store
+from app.services.lexical_index import delete_index, index_chunks
+
+def build(agent_id: str) -> int:
+    """Rebuild one agent's index, returning the number of indexed chunks."""
+    delete_index(agent_id)
+    count = 0
+    for documents in chunk_store.iter_agent(agent_id):
+        index_chunks(agent_id, {id_: doc.get("text", "") for id_, doc in documents.items() if doc.get("text")})
+        count += len(documents)
+    return count
+
+def main(args: argparse.Namespace) -> None:
+    if args.agent_id:
+        agent_ids = args.agent_id
+    else:
+        from app.services.db_service import supabase
+        agent_ids = [row["id"] for row in supabase.table("agents").select("id").execute().data]
+
+    for agent_id in agent_ids:
+        logger.info("[%s] indexed %d chunks", agent_id, build(agent_id))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild per-agent BM25 indexes from the chunk store")
+    parser.add_argument("--agent-id", action="append", help="Agent to index (repeatable); default: all")
+    main(parser.parse_args())
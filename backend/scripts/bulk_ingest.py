@@ -0,0 +1,214 @@
+"""
+Script to ingest many agents/channels in one run.
+
+Reads a JSON manifest, ingests channels concurrently (bounded by --concurrency),
+logs per-channel progress and throughput, checkpoints progress after every
+batch so an interrupted run can be resumed, and writes a summary report.
+
+Manifest format (a list of entries; "channel" or "channels" is accepted):
+
+    [
+        {"agent_id": "518e61b9-...", "channel": "@durov", "limit": 50},
+        {"agent_id": "7c1d...", "channels": ["@channel_a", "@channel_b"]}
+    ]
+
+Usage:
+    python scripts/bulk_ingest.py manifest.json --concurrency 4
+    python scripts/bulk_ingest.py manifest.json --refresh   # re-sync completed channels
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+from datetime import datetime, timezone
+from typing import List, Dict, Any
+from dotenv import load_dotenv
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.telegram_service import TelegramService
+from app.services.ingestion_service import ingest_messages, IngestionStats
+
+DEFAULT_CHECKPOINT = "bulk_ingest_checkpoint.json"
+DEFAULT_REPORT = "bulk_ingest_report.json"
+
+def load_manifest(path: str) -> List[Dict[str, Any]]:
+    """
+    Load the manifest and flatten it into one job per (agent, channel).
+
+    Args:
+        path: Path to the JSON manifest
+
+    Returns:
+        List of job dictionaries with agent_id, channel and optional limit
+    """
+    with open(path) as f:
+        entries = json.load(f)
+
+    jobs = []
+    for entry in entries:
+        channels = entry.get("channels") or [entry["channel"]]
+        for channel in channels:
+            jobs.append({
+                "agent_id": entry["agent_id"],
+                "channel": channel,
+                "limit": entry.get("limit"),
+                "min_id": entry.get("min_id")
+            })
+    return jobs
+
+def job_key(job: Dict[str, Any]) -> str:
+    """Checkpoint key for a job."""
+    return f"{job['agent_id']}|{job['channel']}"
+
+class Checkpoint:
+    """JSON checkpoint file, rewritten atomically after every update."""
+
+    def __init__(self, path: str, fresh: bool = False):
+        self.path = path
+        self.state: Dict[str, Dict[str, Any]] = {}
+        if not fresh and os.path.exists(path):
+            with open(path) as f:
+                self.state = json.load(f)
+            logger.info("Loaded checkpoint with %d entries from %s", len(self.state), path)
+
+    def get(self, key: str) -> Dict[str, Any]:
+        return self.state.get(key, {})
+
+    def update(self, key: str, **values: Any) -> None:
+        self.state.setdefault(key, {}).update(values)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+async def run_job(
+    job: Dict[str, Any],
+    telegram: TelegramService,
+    checkpoint: Checkpoint,
+    semaphore: asyncio.Semaphore,
+    refresh: bool
+) -> Dict[str, Any]:
+    """
+    Ingest a single channel for an agent, resuming from its checkpoint.
+
+    Returns:
+        Report entry for this job
+    """
+    key = job_key(job)
+    saved = checkpoint.get(key)
+    if saved.get("status") == "done" and not refresh:
+        logger.info("[%s] already completed, skipping (use --refresh to re-sync)", job["channel"])
+        return {**saved, "agent_id": job["agent_id"], "channel": job["channel"], "skipped": True}
+
+    async with semaphore:
+        started = time.monotonic()
+        min_id = saved.get("last_message_id") or job.get("min_id")
+        if min_id:
+            logger.info("[%s] resuming after message %s", job["channel"], min_id)
+
+        try:
+            # Page up from the checkpoint: the newest `limit` messages above
+            # min_id would skip everything between the checkpoint and them
+            messages = await telegram.get_channel_messages(
+                channel_link=job["channel"],
+                limit=job.get("limit"),
+                min_id=min_id,
+                reverse=bool(min_id)
+            )
+        except Exception as e:
+            logger.error("[%s] failed to fetch messages: %s", job["channel"], str(e))
+            checkpoint.update(key, status="failed", error=str(e))
+            return {"agent_id": job["agent_id"], "channel": job["channel"], "status": "failed", "error": str(e)}
+
+        total = len(messages)
+        logger.info("[%s] fetched %d messages", job["channel"], total)
+
+        def report_progress(stats: IngestionStats) -> None:
+            logger.info(
+                "[%s] %d/%d messages, %d vectors, %d tokens, %.1f msg/s",
+                job["channel"], stats.message_count, total, stats.vector_count,
+                stats.token_count, stats.messages_per_second
+            )
+            if stats.last_message_id is not None:
+                checkpoint.update(key, status="in_progress", last_message_id=stats.last_message_id)
+
+        stats = await ingest_messages(
+            job["agent_id"], messages, channel=job["channel"], on_batch=report_progress
+        )
+
+        status = "done" if not stats.failed_count else "partial"
+        last_message_id = stats.last_message_id or saved.get("last_message_id")
+        checkpoint.update(key, status=status, last_message_id=last_message_id)
+
+        entry = stats.to_dict()
+        entry["elapsed_seconds"] = round(time.monotonic() - started, 2)
+        entry["status"] = status
+        logger.info(
+            "[%s] %s: %d messages, %d vectors, %d tokens in %.1fs",
+            job["channel"], status, stats.message_count, stats.vector_count,
+            stats.token_count, entry["elapsed_seconds"]
+        )
+        return entry
+
+async def main(args: argparse.Namespace) -> int:
+    jobs = load_manifest(args.manifest)
+    logger.info("Loaded %d jobs from %s (concurrency: %d)", len(jobs), args.manifest, args.concurrency)
+
+    checkpoint = Checkpoint(args.checkpoint, fresh=args.fresh)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    started = time.monotonic()
+
+    # A single Telegram client is shared; Telethon multiplexes concurrent requests
+    async with TelegramService() as telegram:
+        results = await asyncio.gather(
+            *(run_job(job, telegram, checkpoint, semaphore, args.refresh) for job in jobs)
+        )
+
+    elapsed = time.monotonic() - started
+    processed = [r for r in results if not r.get("skipped")]
+    totals = {
+        key: sum(r.get(key, 0) for r in processed)
+        for key in ("message_count", "vector_count", "token_count", "failed_count")
+    }
+    report = {
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "elapsed_seconds": round(elapsed, 2),
+        "jobs": len(jobs),
+        "skipped": len(results) - len(processed),
+        "failed": sum(1 for r in processed if r.get("status") != "done"),
+        "totals": {
+            **totals,
+            "messages_per_second": round(totals["message_count"] / elapsed, 2) if elapsed else 0.0
+        },
+        "channels": results
+    }
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+
+    logger.info(
+        "Ingested %d messages into %d vectors (%d tokens) in %.1fs; report written to %s",
+        totals["message_count"], totals["vector_count"], totals["token_count"], elapsed, args.report
+    )
+    return 1 if report["failed"] else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk ingest Telegram channels for agents")
+    parser.add_argument("manifest", help="Path to the JSON manifest of agents/channels")
+    parser.add_argument("--concurrency", type=int, default=4, help="Channels ingested in parallel")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="Checkpoint file path")
+    parser.add_argument("--report", default=DEFAULT_REPORT, help="Summary report path")
+    parser.add_argument("--fresh", action="store_true", help="Ignore any existing checkpoint")
+    parser.add_argument("--refresh", action="store_true", help="Re-sync channels already completed")
+    sys.exit(asyncio.run(main(parser.parse_args())))
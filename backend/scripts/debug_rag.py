@@ -20,7 +20,7 @@ if not openai_key:
 os.environ["OPENAI_API_KEY"] = openai_key
 
 from app.services.openai_service import generate_embedding
-from app.services.pinecone_service import query_similar
+from app.services.pinecone_service import query_similar, query_all_namespaces, agent_namespace
 from app.utils.logger import logger
 
 async def debug_rag_retrieval(query: str, agent_id: str = None):
@@ -37,12 +37,14 @@ async def debug_rag_retrieval(query: str, agent_id: str = None):
     
     # Query Pinecone
     print("\nQuerying Pinecone...")
-    filter_params = {"agent_id": agent_id} if agent_id else {}
-    chunks = await query_similar(
-        query_embedding,
-        top_k=10,  # Increased from 5
-        filter_params=filter_params
-    )
+    if agent_id:
+        chunks = await query_similar(
+            query_embedding,
+            top_k=10,  # Increased from 5
+            namespace=agent_namespace(agent_id)
+        )
+    else:
+        chunks = await query_all_namespaces(query_embedding, top_k=10)
     
     if not chunks:
         print("No chunks found!")
@@ -1,11 +1,21 @@
 """
-Script to delete all agents except TateB.
+Script to delete agents together with their vectors, chat messages and photos.
+
+By default deletes all agents except TateB.
+
+Usage:
+    python scripts/delete_agents.py                      # all agents except TateB
+    python scripts/delete_agents.py --agent-id <id> ...  # specific agents
+    python scripts/delete_agents.py --keep TateB --keep Durov --concurrency 8
+    python scripts/delete_agents.py --dry-run
 """
 import os
 import sys
+import json
+import asyncio
 import logging
+import argparse
 from dotenv import load_dotenv
-from supabase import create_client, Client
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -14,47 +24,49 @@ logger = logging.getLogger("agentique")
 # Load environment variables
 load_dotenv()
 
-# Initialize Supabase client
-url: str = os.environ.get("SUPABASE_URL", "")
-key: str = os.environ.get("SUPABASE_KEY", "")
-supabase: Client = create_client(url, key)
-
-logger.info("Initializing Supabase client with URL: %s", url[:30])
-
-try:
-    # Get all agents
-    response = supabase.table("agents").select("*").execute()
-    agents = response.data
-
-    for agent in agents:
-        agent_id = agent["id"]
-        expert_name = agent["expert_name"]
-        
-        # Skip TateB agent
-        if expert_name == "TateB":
-            logger.info(f"Skipping agent {agent_id} (TateB)")
-            continue
-            
-        logger.info(f"Deleting agent {agent_id} ({expert_name})")
-        
-        try:
-            # First delete associated chat messages
-            logger.debug(f"Deleting chat messages for agent: {agent_id}")
-            supabase.table("chat_messages").delete().eq("agent_id", agent_id).execute()
-            
-            # Then delete the agent
-            logger.debug(f"Deleting agent with id: {agent_id}")
-            response = supabase.table("agents").delete().eq("id", agent_id).execute()
-            logger.info(f"Successfully deleted agent with id: {agent_id}")
-            
-        except Exception as e:
-            logger.error(f"Failed to delete agent with id: {agent_id} - {e.args[0]}")
-            continue
-
-except Exception as e:
-    logger.error(f"Error deleting agents: {e.args[0]}")
-    sys.exit(1)
+# Add backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.db_service import supabase
+from app.services.deletion_service import delete_agents
+
+async def main(args: argparse.Namespace) -> None:
+    if args.agent_id:
+        agent_ids = args.agent_id
+    else:
+        # All agents regardless of status, so earlier failed deletions are retried
+        response = supabase.table("agents").select("id, expert_name").execute()
+        keep = set(args.keep or ["TateB"])
+        agent_ids = []
+        for agent in response.data:
+            if agent["expert_name"] in keep:
+                logger.info("Skipping agent %s (%s)", agent["id"], agent["expert_name"])
+            else:
+                agent_ids.append(agent["id"])
+
+    logger.info("Deleting %d agents with concurrency %d", len(agent_ids), args.concurrency)
+    if args.dry_run:
+        for agent_id in agent_ids:
+            logger.info("Would delete agent %s", agent_id)
+        return
+
+    results = await delete_agents(agent_ids, concurrency=args.concurrency)
+    failed = [r for r in results if not r.deleted]
+    for result in failed:
+        logger.error("Failed to delete agent %s: %s", result.agent_id, result.error)
+    logger.info("Deleted %d of %d agents", len(results) - len(failed), len(results))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump([r.to_dict() for r in results], f, indent=2)
+    if failed:
+        sys.exit(1)
 
 if __name__ == "__main__":
-    load_dotenv()
-    asyncio.run(delete_agents()) 
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Delete agents and everything they own")
+    parser.add_argument("--agent-id", action="append", help="Agent to delete (repeatable); default: all but --keep")
+    parser.add_argument("--keep", action="append", help="Expert name to keep (repeatable); default: TateB")
+    parser.add_argument("--concurrency", type=int, default=4, help="Agents deleted in parallel")
+    parser.add_argument("--report", help="Write per-agent results as JSON to this file")
+    parser.add_argument("--dry-run", action="store_true", help="Only list the agents that would be deleted")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,170 @@
+"""
+Script to move existing vectors into per-agent Pinecone namespaces.
+
+Vectors ingested before per-agent namespaces live in the default namespace
+and are told apart by their `agent_id` metadata. For each agent this script
+pages through those vectors (with values), upserts them into
+"agent-<agent_id>" and deletes them from the default namespace.
+
+Vectors are also slimmed on the way: text and display fields move to the
+chunk store and only filterable metadata stays on the vector. Vectors that
+are already in the agent's namespace but still carry text or display fields
+are slimmed in place.
+
+Usage:
+    python scripts/migrate_namespaces.py                  # all agents in Supabase
+    python scripts/migrate_namespaces.py --agent-id <id>  # specific agents
+    python scripts/migrate_namespaces.py --dry-run        # only count vectors
+
+Once every agent is migrated, set PINECONE_LEGACY_FALLBACK=false so chat
+queries stop checking the default namespace.
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+from typing import List
+import numpy as np
+from dotenv import load_dotenv
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Add backend directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.services.pinecone_service import index, store, agent_namespace, DIMENSION
+from app.services.chunk_store import chunk_store, split_metadata
+
+# Pinecone returns at most 1000 matches per query when values are included
+PAGE_SIZE = 1000
+UPSERT_BATCH_SIZE = 100
+
+# Deletes are eventually consistent; retry a page of already-moved IDs this often
+MAX_STALE_PAGES = 5
+
+def load_agent_ids() -> List[str]:
+    """All agent IDs from Supabase, including inactive agents."""
+    from app.services.db_service import supabase
+    response = supabase.table("agents").select("id").execute()
+    return [row["id"] for row in response.data]
+
+def slim_records(agent_id: str, records: List[dict]) -> List[dict]:
+    """Move documents of full-metadata records to the chunk store and strip them."""
+    documents = {}
+    slimmed = []
+    for record in records:
+        slim, document = split_metadata(record["metadata"] or {})
+        if document:
+            documents[record["id"]] = document
+        slimmed.append({**record, "metadata": slim})
+    if documents:
+        chunk_store.put(agent_id, documents)
+    return slimmed
+
+def needs_slimming(metadata: dict) -> bool:
+    """Whether vector metadata carries more than split_metadata keeps on the vector."""
+    return bool(metadata) and split_metadata(metadata)[0] != metadata
+
+def slim_namespace(agent_id: str, dry_run: bool) -> int:
+    """
+    Slim vectors already in the agent's namespace that still carry display fields.
+
+    Returns:
+        Number of vectors slimmed (or found, for a dry run)
+    """
+    namespace = agent_namespace(agent_id)
+    slimmed = 0
+    # Pod indexes cannot list IDs; list_ids falls back to a probe query
+    for ids in store.list_ids(f"{agent_id}#", namespace=namespace):
+        fetched = index.fetch(ids=ids, namespace=namespace).vectors
+        records = [
+            {"id": id_, "values": vector.values, "metadata": vector.metadata}
+            for id_, vector in fetched.items()
+            if needs_slimming(vector.metadata)
+        ]
+        if records and not dry_run:
+            index.upsert(vectors=slim_records(agent_id, records), namespace=namespace)
+        slimmed += len(records)
+    return slimmed
+
+def migrate_agent(agent_id: str, dry_run: bool) -> int:
+    """
+    Move one agent's vectors from the default namespace into its own.
+
+    Returns:
+        Number of vectors moved (or found, for a dry run)
+    """
+    namespace = agent_namespace(agent_id)
+    # Any non-zero vector works as a probe; the filter does the selection
+    probe = np.random.default_rng(0).normal(size=DIMENSION).tolist()
+    moved = set()
+    stale_pages = 0
+
+    while True:
+        results = index.query(
+            vector=probe,
+            top_k=PAGE_SIZE,
+            filter={"agent_id": agent_id},
+            include_values=True,
+            include_metadata=True,
+            namespace=""
+        )
+        matches = [m for m in results.matches if m.id not in moved]
+        if dry_run:
+            return len(results.matches)
+        if not matches:
+            if not results.matches or stale_pages >= MAX_STALE_PAGES:
+                break
+            # Only already-moved vectors came back: wait for deletes to propagate
+            stale_pages += 1
+            time.sleep(1)
+            continue
+
+        records = [{"id": m.id, "values": m.values, "metadata": m.metadata} for m in matches]
+        records = slim_records(agent_id, records)
+        for i in range(0, len(records), UPSERT_BATCH_SIZE):
+            index.upsert(vectors=records[i:i + UPSERT_BATCH_SIZE], namespace=namespace)
+        index.delete(ids=[r["id"] for r in records], namespace="")
+        moved.update(r["id"] for r in records)
+        logger.info("[%s] moved %d vectors to %s", agent_id, len(moved), namespace)
+
+    return len(moved)
+
+async def main(args: argparse.Namespace) -> None:
+    if index is None:
+        logger.error("Namespace migration only applies to the Pinecone backend (VECTOR_STORE=pinecone)")
+        sys.exit(1)
+
+    agent_ids = args.agent_id or load_agent_ids()
+    logger.info("Migrating %d agents (dry run: %s)", len(agent_ids), args.dry_run)
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def run(agent_id: str) -> int:
+        async with semaphore:
+            try:
+                moved = await asyncio.to_thread(migrate_agent, agent_id, args.dry_run)
+                slimmed = await asyncio.to_thread(slim_namespace, agent_id, args.dry_run)
+                logger.info("[%s] %d namespaced vectors still carried display fields", agent_id, slimmed)
+                return moved
+            except Exception as e:
+                logger.error("[%s] migration failed: %s", agent_id, str(e))
+                return 0
+
+    counts = await asyncio.gather(*(run(agent_id) for agent_id in agent_ids))
+    for agent_id, count in zip(agent_ids, counts):
+        logger.info("[%s] %s %d vectors", agent_id, "found" if args.dry_run else "moved", count)
+    logger.info("Total: %d vectors", sum(counts))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move vectors into per-agent Pinecone namespaces")
+    parser.add_argument("--agent-id", action="append", help="Agent to migrate (repeatable); default: all")
+    parser.add_argument("--concurrency", type=int, default=4, help="Agents migrated in parallel")
+    parser.add_argument("--dry-run", action="store_true", help="Only report how many vectors would move")
+    asyncio.run(main(parser.parse_args()))
@@ -25,11 +25,9 @@ logger.info("TELEGRAM_API_ID: %s", os.getenv("TELEGRAM_API_ID"))
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.services.telegram_service import TelegramService
-from app.services.openai_service import generate_embedding
-from app.services.pinecone_service import upsert_vectors
-from uuid import uuid4
+from app.services.ingestion_service import ingest_messages
 
-# Constants
+# Constants (use scripts/bulk_ingest.py for several agents/channels at once)
 AGENT_ID = "518e61b9-b660-4994-8c5b-02b4bf65bdc7"  # Durov's agent ID
 CHANNEL_LINK = "@durov"  # Durov's channel
 
@@ -46,50 +44,9 @@ async def main():
                 logger.warning("No messages found in channel")
                 return
             
-            # Process messages in batches
-            batch_size = 100
-            total_vectors = 0
-            
-            for i in range(0, len(messages), batch_size):
-                batch = messages[i:i + batch_size]
-                
-                # Generate embeddings for batch
-                vectors = []
-                metadata = []
-                ids = []
-                
-                for msg in batch:
-                    # Skip empty messages
-                    if not msg["text"].strip():
-                        continue
-                    
-                    # Generate embedding
-                    embedding = await generate_embedding(msg["text"])
-                    if not embedding:
-                        continue
-                    
-                    vectors.append(embedding)
-                    metadata.append({
-                        "agent_id": AGENT_ID,
-                        "source_link": msg["link"],
-                        "text": msg["text"],  # Include the text for better context
-                        "date": msg["date"],
-                        "views": msg["views"],
-                        "forwards": msg["forwards"]
-                    })
-                    ids.append(str(uuid4()))
-                
-                if vectors:
-                    # Upsert vectors to Pinecone
-                    success = await upsert_vectors(vectors, metadata, ids)
-                    if success:
-                        total_vectors += len(vectors)
-                        logger.info(
-                            "Processed batch of %d messages (total vectors: %d)",
-                            len(vectors), total_vectors
-                        )
-            
-            logger.info("Successfully re-ingested %d vectors", total_vectors)
+            # Embed and upsert messages
+            stats = await ingest_messages(AGENT_ID, messages, channel=CHANNEL_LINK)
+            logger.info("Successfully re-ingested %d vectors", stats.vector_count)
             
     except Exception as e:
         logger.error("Failed to re-ingest content: %s", str(e))
@@ -0,0 +1,96 @@
+"""
+Test bounded LLM concurrency and load shedding.
+"""
+import asyncio
+import pytest
+from app.utils.admission import AdmissionController, Overloaded
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.mark.asyncio
+async def test_admits_up_to_limit_then_queues_in_order():
+    """Callers beyond the limit wait and get slots in arrival order."""
+    controller = AdmissionController(limit=2, max_queue=5, max_wait=5)
+    await controller.acquire()
+    await controller.acquire()
+    admitted = []
+
+    async def waiter(name):
+        await controller.acquire()
+        admitted.append(name)
+
+    tasks = [asyncio.create_task(waiter(n)) for n in ("a", "b")]
+    await asyncio.sleep(0)
+    assert (controller.active, controller.queued) == (2, 2)
+
+    controller.release()
+    await asyncio.sleep(0.01)
+    assert admitted == ["a"]
+    controller.release()
+    await asyncio.gather(*tasks)
+    assert admitted == ["a", "b"]
+    assert (controller.active, controller.queued) == (2, 0)
+
+@pytest.mark.asyncio
+async def test_sheds_when_queue_is_full():
+    """A full queue refuses new callers at once."""
+    controller = AdmissionController(limit=1, max_queue=1, max_wait=5)
+    await controller.acquire()
+    queued = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(Overloaded) as shed:
+        await controller.acquire()
+    assert shed.value.reason == "queue_full"
+
+    controller.release()
+    await queued
+    assert controller.active == 1
+
+@pytest.mark.asyncio
+async def test_sheds_when_wait_exceeds_deadline():
+    """Callers that cannot be served before their deadline are shed without waiting."""
+    clock = Clock()
+    controller = AdmissionController(limit=1, max_queue=10, max_wait=30, clock=clock)
+    controller.observe(2.0)
+    await controller.acquire()
+
+    with pytest.raises(Overloaded) as shed:
+        await controller.acquire(deadline=clock.now + 1.0)
+    assert shed.value.reason == "deadline"
+    assert shed.value.retry_after == pytest.approx(2.0)
+    assert controller.queued == 0
+
+@pytest.mark.asyncio
+async def test_times_out_waiting_and_keeps_slots_consistent():
+    """A caller whose wait runs out is shed, and its place in the queue is dropped."""
+    controller = AdmissionController(limit=1, max_queue=5, max_wait=0.02)
+    await controller.acquire()
+
+    with pytest.raises(Overloaded) as shed:
+        await controller.acquire()
+    assert shed.value.reason == "timeout"
+    assert controller.queued == 0
+
+    controller.release()
+    assert controller.active == 0
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_gives_up_its_place():
+    """A waiter cancelled (e.g. client gone) does not swallow the next free slot."""
+    controller = AdmissionController(limit=1, max_queue=5, max_wait=5)
+    await controller.acquire()
+    cancelled = asyncio.create_task(controller.acquire())
+    second = asyncio.create_task(controller.acquire())
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    controller.release()
+    await second
+    assert (controller.active, controller.queued) == (1, 0)
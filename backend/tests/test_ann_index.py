@@ -0,0 +1,80 @@
+"""
+Test the persistent memory-mapped IVF vector store.
+"""
+import numpy as np
+import pytest
+from app.services.ann_index import AnnVectorStore, IvfIndex, TRAIN_THRESHOLD
+from app.services.vector_store import NumpyVectorStore
+
+DIMENSION = 16
+
+def make_records(count: int, agent_id: str = "a", seed: int = 0) -> list:
+    """Clustered records so the IVF quantizer has structure to learn."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(8, DIMENSION))
+    vectors = centers[rng.integers(0, 8, count)] + 0.2 * rng.normal(size=(count, DIMENSION))
+    return [
+        {"id": f"{agent_id}#{i}", "values": vectors[i].tolist(), "metadata": {"agent_id": agent_id, "n": i}}
+        for i in range(count)
+    ]
+
+def test_untrained_index_is_exact(tmp_path):
+    """Below the training threshold the index falls back to exact search."""
+    records = make_records(50)
+    ann, exact = AnnVectorStore(DIMENSION, str(tmp_path)), NumpyVectorStore(DIMENSION)
+    ann.upsert(records)
+    exact.upsert(records)
+
+    query = records[7]["values"]
+    assert [r["id"] for r in ann.query(query, 5)] == [r["id"] for r in exact.query(query, 5)]
+
+def test_compaction_trains_and_keeps_recall(tmp_path):
+    """After compaction the IVF search still finds the true neighbours."""
+    records = make_records(TRAIN_THRESHOLD + 100)
+    index = IvfIndex(str(tmp_path / "a"), DIMENSION, nprobe=16)
+    vectors = np.asarray([r["values"] for r in records], dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    index.upsert([r["id"] for r in records], vectors, [r["metadata"] for r in records])
+
+    assert index.compact()
+    assert index.centroids is not None
+
+    exact = NumpyVectorStore(DIMENSION)
+    exact.upsert(records)
+    hits = 0
+    for i in range(0, 200, 10):
+        truth = {r["id"] for r in exact.query(records[i]["values"], 10)}
+        found = {r["id"] for r in index.search(vectors[i], 10)}
+        hits += len(truth & found)
+    assert hits / 200 >= 0.9
+
+def test_tombstones_and_overwrites(tmp_path):
+    """Deleted and overwritten rows never show up in results."""
+    store = AnnVectorStore(DIMENSION, str(tmp_path))
+    records = make_records(20)
+    store.upsert(records)
+
+    store.delete(["a#3"])
+    assert "a#3" not in [r["id"] for r in store.query(records[3]["values"], 20)]
+
+    store.upsert([{**records[5], "metadata": {"agent_id": "a", "n": -1}}])
+    results = store.query(records[5]["values"], 20)
+    assert [r["metadata"]["n"] for r in results if r["id"] == "a#5"] == [-1]
+    assert len(results) == 19
+
+    store.delete_by_filter({"agent_id": "a", "n": {"$lt": 10}})
+    assert all(r["metadata"]["n"] >= 10 for r in store.query(records[0]["values"], 20))
+
+def test_second_instance_sees_writes(tmp_path):
+    """Another process (simulated by a second store) picks up appends and deletes."""
+    writer = AnnVectorStore(DIMENSION, str(tmp_path))
+    reader = AnnVectorStore(DIMENSION, str(tmp_path))
+    records = make_records(10)
+
+    writer.upsert(records[:5])
+    assert len(reader.query(records[0]["values"], 10, filter={"agent_id": "a"})) == 5
+
+    writer.upsert(records[5:])
+    writer.delete(["a#0"])
+    ids = [r["id"] for r in reader.query(records[0]["values"], 10, filter={"agent_id": "a"})]
+    assert len(ids) == 9 and "a#0" not in ids
@@ -0,0 +1,73 @@
+"""
+Test the semantic answer cache.
+"""
+import pytest
+from app.services.answer_cache import SemanticCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+@pytest.fixture
+def versions():
+    return {}
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def cache(versions, clock):
+    return SemanticCache(
+        max_distance=0.05, ttl_seconds=60, max_entries=2,
+        version_of=lambda agent_id: versions.get(agent_id, 0), clock=clock
+    )
+
+def test_similar_query_hits_and_distant_query_misses(cache):
+    """Queries within the distance threshold share an answer, per agent."""
+    cache.store("a", "chat", "what is new?", [1.0, 0.0], "answer", latency=2.0)
+    assert cache.lookup("a", "chat", [0.99, 0.05]) == "answer"
+    assert cache.lookup("a", "chat", [0.5, 0.5]) is None
+    assert cache.lookup("b", "chat", [1.0, 0.0]) is None
+    assert cache.lookup("a", "search", [1.0, 0.0]) is None
+    assert cache.stats.hits == 1
+    assert cache.stats.hit_rate == pytest.approx(0.25)
+    assert cache.stats.saved_seconds == pytest.approx(2.0)
+
+def with_similarity(similarity: float) -> list:
+    """A unit vector at the given cosine similarity to [1, 0]."""
+    return [similarity, (1 - similarity ** 2) ** 0.5]
+
+def test_default_distance_tells_apart_near_identical_questions(versions, clock):
+    """A paraphrase is answered from the cache; the same question about another year is not."""
+    cache = SemanticCache(version_of=lambda agent_id: versions.get(agent_id, 0), clock=clock)
+    cache.store("a", "chat", "What did Durov say about TON in 2023?", [1.0, 0.0], "2023 answer", latency=2.0)
+    # Typical ada-002 similarities: a rewording ~0.99, the 2024 question ~0.97
+    assert cache.lookup("a", "chat", with_similarity(0.99)) == "2023 answer"
+    assert cache.lookup("a", "chat", with_similarity(0.97)) is None
+
+def test_ttl_expiry(cache, clock):
+    """Entries older than the TTL are not served."""
+    cache.store("a", "chat", "q", [1.0, 0.0], "answer", latency=1.0)
+    clock.now += 61
+    assert cache.lookup("a", "chat", [1.0, 0.0]) is None
+    assert cache.size() == 0
+
+def test_lru_eviction(cache):
+    """The least recently used entry is evicted first."""
+    cache.store("a", "chat", "q1", [1.0, 0.0], "one", latency=1.0)
+    cache.store("a", "chat", "q2", [0.0, 1.0], "two", latency=1.0)
+    assert cache.lookup("a", "chat", [1.0, 0.0]) == "one"
+    cache.store("a", "chat", "q3", [-1.0, 0.0], "three", latency=1.0)
+    assert cache.lookup("a", "chat", [0.0, 1.0]) is None
+    assert cache.lookup("a", "chat", [1.0, 0.0]) == "one"
+
+def test_content_version_change_invalidates(cache, versions):
+    """Re-syncing an agent (a new content version) drops its cached answers."""
+    cache.store("a", "chat", "q", [1.0, 0.0], "stale", latency=1.0)
+    versions["a"] = 1
+    assert cache.lookup("a", "chat", [1.0, 0.0]) is None
+    assert cache.stats.invalidations == 1
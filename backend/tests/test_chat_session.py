@@ -0,0 +1,144 @@
+"""
+Test WebSocket chat sessions.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+from app.routes import agent
+from app.utils.circuit_breaker import CircuitOpenError
+from app.utils.rate_limit import RateLimiter, MemoryBackend, set_rate_limiter
+
+AGENT = {"id": "a1", "name": "Durov"}
+HISTORY = [{"id": "m0", "role": "user", "content": "Earlier question"}]
+
+async def answer(query, agent_id=None, mode="chat", conversation=None):
+    for piece in ("About ", "TON: ", query):
+        yield piece
+
+def saved(agent_id, user_id, role, content):
+    return {"id": f"{role}-{content[:12]}", "agent_id": agent_id, "user_id": user_id, "role": role, "content": content}
+
+@pytest.fixture
+def client():
+    app = FastAPI()
+    app.include_router(agent.router, prefix="/agent")
+    set_rate_limiter(RateLimiter(MemoryBackend(), user_rate_per_minute=0, user_max_concurrent=1,
+                                 agent_rate_per_minute=0, agent_max_concurrent=0))
+    with patch('app.services.chat_session.get_agent_by_id', AsyncMock(return_value=AGENT)) as get_agent, \
+         patch('app.services.chat_session.get_chat_history', AsyncMock(return_value=list(HISTORY))), \
+         patch('app.services.chat_session.save_chat_message', AsyncMock(side_effect=saved)), \
+         patch('app.services.chat_session.rag_stream', answer), \
+         patch('app.services.chat_session.load_conversation', AsyncMock(return_value=None)), \
+         patch('app.services.chat_session.schedule_summary_update') as summarize:
+        test_client = TestClient(app)
+        test_client.get_agent = get_agent
+        test_client.summarize = summarize
+        yield test_client
+    set_rate_limiter(None)
+
+def receive_answer(ws):
+    """Frames of one answer, up to its done or error frame."""
+    frames = []
+    while True:
+        frames.append(ws.receive_json())
+        if frames[-1]["type"] in ("done", "error"):
+            return frames
+
+def test_answers_are_streamed(client):
+    """An answer comes as start, token pieces and done with the saved messages."""
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        ws.send_json({"type": "message", "id": "q1", "message": "news?"})
+        frames = receive_answer(ws)
+
+    assert [f["type"] for f in frames] == ["start", "token", "token", "token", "done"]
+    assert "".join(f["content"] for f in frames if f["type"] == "token") == "About TON: news?"
+    done = frames[-1]
+    assert (done["id"], done["response"], done["status"]) == ("q1", "About TON: news?", "success")
+    assert done["user_message"]["role"] == "user"
+    assert done["agent_message"]["content"] == "About TON: news?"
+
+def test_session_keeps_agent_and_history(client):
+    """The agent is resolved once per connection and the history kept in memory."""
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        for i in range(2):
+            ws.send_json({"id": f"q{i}", "message": f"question {i}"})
+            assert receive_answer(ws)[-1]["type"] == "done"
+        ws.send_json({"type": "history"})
+        history = ws.receive_json()
+
+    assert client.get_agent.await_count == 1
+    client.summarize.assert_called_with("u1", "a1", "question 1", "About TON: question 1")
+    assert [m["content"] for m in history["messages"]] == [
+        "Earlier question", "question 0", "About TON: question 0", "question 1", "About TON: question 1"
+    ]
+
+def test_pipelined_questions_are_answered_in_order(client):
+    """Questions sent before the first answer are answered one after another."""
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        for i in range(3):
+            ws.send_json({"id": f"q{i}", "message": f"question {i}"})
+        answers = [receive_answer(ws) for _ in range(3)]
+
+    for i, frames in enumerate(answers):
+        assert {f["id"] for f in frames} == {f"q{i}"}
+        assert frames[-1]["type"] == "done"
+
+def test_unknown_agent_closes_session(client):
+    """A session for a missing agent is closed with 4404 after a 404 error frame."""
+    client.get_agent.return_value = None
+    with client.websocket_connect("/agent/missing/chat/ws?user_id=u1") as ws:
+        assert ws.receive_json()["status"] == 404
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            ws.receive_json()
+    assert exc_info.value.code == agent.WS_AGENT_NOT_FOUND
+
+def test_agent_being_deleted_takes_no_chats(client):
+    """Chats with an agent whose deletion has started are refused before anything is saved."""
+    deleting = dict(AGENT, status="deleting")
+    client.get_agent.return_value = deleting
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        assert ws.receive_json()["status"] == 404
+        with pytest.raises(WebSocketDisconnect) as exc_info:
+            ws.receive_json()
+    assert exc_info.value.code == agent.WS_AGENT_NOT_FOUND
+
+    save = AsyncMock(side_effect=saved)
+    with patch('app.routes.agent.get_agent_by_id', AsyncMock(return_value=deleting)), \
+         patch('app.routes.agent.save_chat_message', save):
+        response = client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+    assert response.status_code == 404
+    save.assert_not_called()
+
+def test_errors_are_reported_per_question(client):
+    """Malformed frames and unavailable services get error frames; the session stays open."""
+    async def unavailable(query, agent_id=None, mode="chat", conversation=None):
+        raise CircuitOpenError("openai", 3)
+        yield  # pragma: no cover
+
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        ws.send_text("not json")
+        assert ws.receive_json()["status"] == 400
+        ws.send_json({"id": "q1", "message": "   "})
+        assert ws.receive_json()["status"] == 400
+
+        with patch('app.services.chat_session.rag_stream', unavailable):
+            ws.send_json({"id": "q2", "message": "news?"})
+            error = receive_answer(ws)[-1]
+        assert (error["id"], error["status"], error["retry_after"]) == ("q2", 503, 3)
+
+        ws.send_json({"id": "q3", "message": "news?"})
+        assert receive_answer(ws)[-1]["type"] == "done"
+
+def test_questions_are_rate_limited(client):
+    """Each question takes a token of the user's chat rate limit."""
+    set_rate_limiter(RateLimiter(MemoryBackend(), user_rate_per_minute=60, user_burst=1,
+                                 agent_rate_per_minute=0, agent_max_concurrent=0))
+    with client.websocket_connect("/agent/a1/chat/ws?user_id=u1") as ws:
+        ws.send_json({"id": "q1", "message": "news?"})
+        assert receive_answer(ws)[-1]["type"] == "done"
+        ws.send_json({"id": "q2", "message": "more?"})
+        error = receive_answer(ws)[-1]
+    assert (error["id"], error["status"]) == ("q2", 429)
+    assert error["retry_after"] > 0
@@ -0,0 +1,57 @@
+"""
+Test the compressed chunk document store.
+"""
+import pytest
+from app.fakes.supabase_fake import FakeSupabase
+from app.services.chunk_store import SqliteChunkStore, SupabaseChunkStore, ContentVersions, split_metadata, ALL_AGENTS
+
+def test_split_metadata_keeps_only_filterable_fields():
+    """Text and display fields move to the document."""
+    metadata = {
+        "agent_id": "a",
+        "date": "2024-01-01T00:00:00",
+        "views": 10,
+        "forwards": 1,
+        "text": "hello",
+        "source_link": "https://t.me/test/1"
+    }
+    slim, document = split_metadata(metadata)
+    assert slim == {"agent_id": "a", "date": "2024-01-01T00:00:00", "views": 10, "forwards": 1}
+    assert document == {"text": "hello", "source_link": "https://t.me/test/1"}
+
+@pytest.fixture(params=["sqlite", "supabase"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SqliteChunkStore(str(tmp_path / "chunks.db"))
+    return SupabaseChunkStore(FakeSupabase())
+
+def test_batched_lookup_and_deletes(store):
+    """Documents round-trip, missing IDs are skipped and agent deletes cascade."""
+    store.put("a", {f"a#{i}": {"text": f"пост {i}" * 100} for i in range(3)})
+    store.put("b", {"b#1": {"text": "other"}})
+
+    found = store.get_many(["a#2", "missing", "a#0"])
+    assert set(found) == {"a#0", "a#2"}
+    assert found["a#2"]["text"] == "пост 2" * 100
+
+    store.delete(["a#0"])
+    assert store.delete_agent("a") == 2
+    assert store.get_many(["a#1", "b#1"]) == {"b#1": {"text": "other"}}
+
+def test_content_versions(tmp_path):
+    """Bumping an agent's version also bumps the all-agents version."""
+    versions = ContentVersions(str(tmp_path / "versions.db"))
+    assert versions.content_version("a") == 0
+    versions.bump_version(["a"])
+    versions.bump_version(["a", "b"])
+    assert (versions.content_version("a"), versions.content_version("b")) == (2, 1)
+    assert versions.content_version(ALL_AGENTS) == 2
+
+def test_documents_are_replaced_and_paged_by_agent(store):
+    """A re-synced chunk replaces its document; an agent's documents come in ID order pages."""
+    store.put("a", {f"a#{i}": {"text": f"old {i}"} for i in range(5)})
+    store.put("a", {"a#3": {"text": "new 3"}})
+    pages = list(store.iter_agent("a", batch_size=2))
+    assert [sorted(page) for page in pages] == [["a#0", "a#1"], ["a#2", "a#3"], ["a#4"]]
+    assert pages[1]["a#3"] == {"text": "new 3"}
+    assert store.agent_ids_of(["a#1", "x#1"]) == ["a"]
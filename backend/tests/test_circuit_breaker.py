@@ -0,0 +1,191 @@
+"""
+Test circuit breakers for external services.
+"""
+import asyncio
+import httpx
+import pytest
+from openai import BadRequestError, InternalServerError
+from unittest.mock import patch
+from app.utils.circuit_breaker import CircuitBreaker, CircuitOpenError, breakers, CLOSED, OPEN, HALF_OPEN
+from app.utils.errors import ServiceUnavailableError, handle_service_error
+from app.services.pinecone_service import query_similar
+from app.services import openai_service
+from app.services.rag_service import rag_retrieve_and_summarize
+from app.services.health_service import HealthProber
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_breaker(clock, **kwargs):
+    settings = dict(failure_rate=0.5, min_calls=4, window=10, open_seconds=5, half_open_calls=2)
+    settings.update(kwargs)
+    return CircuitBreaker("test", clock=clock, **settings)
+
+def unavailable():
+    return ServiceUnavailableError("Test")
+
+def test_opens_on_failure_rate_within_window():
+    """The circuit opens once enough calls in the window failed, not on the first failure."""
+    clock = Clock()
+    breaker = make_breaker(clock)
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == CLOSED  # only 3 calls so far
+
+    breaker.record_failure()
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as exc_info:
+        breaker.before_call()
+    assert exc_info.value.status_code == 503
+    assert exc_info.value.retry_after == pytest.approx(5)
+
+def test_old_failures_leave_the_window():
+    """Failures older than the window no longer count."""
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 11
+    breaker.record_failure()
+    assert breaker.state == CLOSED
+
+def test_half_open_probes_close_or_reopen():
+    """After the open period probes go through; successes close, a failure reopens."""
+    clock = Clock()
+    breaker = make_breaker(clock)
+    for _ in range(4):
+        breaker.record_failure()
+
+    clock.now += 5
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # both probe slots taken
+    breaker.record_failure()
+    assert breaker.state == OPEN
+
+    clock.now += 5
+    breaker.before_call()
+    breaker.record_success()
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot() == {"state": CLOSED, "calls": 0, "failures": 0}
+
+@pytest.mark.asyncio
+async def test_protect_fails_fast_while_open():
+    """A protected function is not called while the circuit is open."""
+    clock = Clock()
+    breaker = make_breaker(clock, min_calls=2)
+    calls = []
+
+    @breaker.protect
+    async def call_service(fail):
+        calls.append(fail)
+        if fail:
+            raise unavailable()
+        return "ok"
+
+    for _ in range(2):
+        with pytest.raises(ServiceUnavailableError):
+            await call_service(True)
+    with pytest.raises(CircuitOpenError):
+        await call_service(False)
+    assert len(calls) == 2
+
+    # Errors that are not the dependency's fault do not count as failures
+    clock.now += 5
+
+    @breaker.protect
+    async def bad_input():
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        await bad_input()
+    assert await call_service(False) == "ok"
+    assert breaker.state == CLOSED
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_frees_its_slot():
+    """A probe cancelled mid-call does not hold the half-open circuit forever."""
+    clock = Clock()
+    breaker = make_breaker(clock, min_calls=1, half_open_calls=1)
+    breaker.record_failure()
+    clock.now += 5
+
+    @breaker.protect
+    async def hang():
+        await asyncio.sleep(10)
+
+    task = asyncio.create_task(hang())
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    breaker.before_call()  # the slot is free again
+
+def test_open_circuit_maps_to_503_with_retry_after():
+    """Routes turn an open circuit into 503 with Retry-After."""
+    exc = handle_service_error(CircuitOpenError("pinecone", 4.2))
+    assert exc.status_code == 503
+    assert exc.headers == {"Retry-After": "5"}
+    assert handle_service_error(unavailable()).headers is None
+
+@pytest.mark.asyncio
+async def test_query_failure_is_not_an_empty_result():
+    """A failing vector store raises instead of returning no matches."""
+    with patch('app.services.pinecone_service.store.query', side_effect=ConnectionError("timeout")):
+        with pytest.raises(ServiceUnavailableError, match="Pinecone service is currently unavailable"):
+            await query_similar([0.1] * 1536, namespace="agent-x")
+
+def openai_error(cls, status):
+    response = httpx.Response(status, request=httpx.Request("POST", "https://api.openai.com/v1/embeddings"))
+    return cls(f"HTTP {status}", response=response, body=None)
+
+@pytest.mark.asyncio
+async def test_rejected_openai_request_is_not_an_outage():
+    """A 400 for bad input fails the call without counting against the breaker; a 500 counts."""
+    failures = openai_service.breaker.snapshot()["failures"]
+    with patch.object(openai_service.client.embeddings, "create",
+                      side_effect=openai_error(BadRequestError, 400)):
+        assert await openai_service.generate_embeddings(["too long " * 10000]) == ([], 0)
+    assert openai_service.breaker.snapshot()["failures"] == failures
+
+    with patch.object(openai_service.client.embeddings, "create",
+                      side_effect=openai_error(InternalServerError, 500)):
+        with pytest.raises(ServiceUnavailableError):
+            await openai_service.generate_embeddings(["text"])
+    assert openai_service.breaker.snapshot()["failures"] == failures + 1
+
+@pytest.mark.asyncio
+async def test_rag_propagates_retrieval_outage():
+    """RAG surfaces a vector store outage instead of answering 'nothing found'."""
+    with patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536), \
+         patch('app.services.rag_service.query_all_namespaces', side_effect=CircuitOpenError("pinecone", 3)):
+        with pytest.raises(CircuitOpenError):
+            await rag_retrieve_and_summarize("What about TON?", mode="search")
+
+@pytest.mark.asyncio
+async def test_rag_answers_with_references_when_completion_unavailable():
+    """Once retrieval succeeded, an OpenAI outage degrades to the references."""
+    chunks = [{"id": "1", "text": "Durov posted about TON", "metadata": {"source_link": "t.me/d/1"}, "score": 0.9}]
+    with patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536), \
+         patch('app.services.rag_service.query_all_namespaces', return_value=chunks), \
+         patch('app.services.rag_service.generate_completion', side_effect=CircuitOpenError("openai", 3)):
+        result = await rag_retrieve_and_summarize("Durov and TON, any news?", mode="search")
+    assert "Durov posted about TON" in result
+
+@pytest.mark.asyncio
+async def test_health_reports_circuit_states():
+    """Circuit states of the worker appear in the health report."""
+    prober = HealthProber(probes={"openai": None})
+    report = prober.report()
+    assert report["circuits"]["openai"] in (CLOSED, OPEN, HALF_OPEN)
+    assert set(breakers) >= {"openai", "pinecone"}
+    assert "calls" in prober.report(details=True)["circuits"]["pinecone"]
@@ -0,0 +1,37 @@
+"""
+Test token counting and budgeted context assembly.
+"""
+from app.utils.tokens import count_tokens, truncate_to_tokens
+from app.services.context_builder import build_context
+
+def make_chunk(id_: str, text: str) -> dict:
+    return {"id": id_, "text": text, "metadata": {"source_link": f"https://t.me/test/{id_}"}, "score": 0.8}
+
+def test_truncate_cuts_at_sentence_boundary():
+    """Whole sentences are kept and the cut is marked with an ellipsis."""
+    text = "First sentence here. Second sentence is a bit longer. Third one."
+    limit = count_tokens("First sentence here. Second sentence is a bit longer.") + count_tokens("…")
+    assert truncate_to_tokens(text, limit) == "First sentence here. Second sentence is a bit longer.…"
+    assert truncate_to_tokens(text, 1000) == text
+
+def test_truncate_hard_cuts_a_single_long_sentence():
+    """Without a sentence boundary in reach the text is cut mid-sentence."""
+    truncated = truncate_to_tokens("word " * 200, 10)
+    assert truncated.endswith("…")
+    assert count_tokens(truncated) <= 10
+
+def test_context_fills_budget_in_priority_order():
+    """Chunks are added best first, and the context never exceeds the budget."""
+    chunks = [make_chunk(str(i), f"Post number {i}. " * 30) for i in range(10)]
+    context = build_context(chunks, budget=400, max_chunk_tokens=150)
+
+    assert 0 < context.tokens <= 400
+    assert context.chunks == chunks[:len(context.chunks)]
+    assert context.dropped_count == 10 - len(context.chunks)
+    assert context.text.startswith("• Post number 0.")
+    assert count_tokens(context.text) <= context.tokens
+
+def test_context_reads_text_from_metadata():
+    """Chunks carrying their text only in metadata are still included."""
+    chunk = {"id": "1", "metadata": {"text": "Legacy text", "source_link": "s"}, "score": 0.9}
+    assert "Legacy text (source: s, relevance: 0.900)" in build_context([chunk]).text
@@ -0,0 +1,171 @@
+"""
+Test rolling conversation summaries and follow-up retrieval.
+"""
+import asyncio
+import pytest
+from unittest.mock import patch
+from app.services import conversation_summary
+from app.services.conversation_summary import (
+    ConversationStore, ConversationSummary, is_follow_up, contextualize_query, parse_summary,
+    update_summary, schedule_summary_update, wait_for_summary_updates
+)
+from app.services.rag_service import (
+    rag_retrieve_and_summarize, is_generated_answer, references_only_answer,
+    NO_RELEVANT_MESSAGE, RAG_ERROR_MESSAGE
+)
+from app.utils.admission import AdmissionController
+from app.services.context_builder import build_context, CONTEXT_TOKEN_BUDGET
+from app.utils.tokens import count_tokens
+from app.services.answer_cache import answer_cache
+from app.utils.deadline import deadline_scope, current_deadline
+
+CONVERSATION = ConversationSummary(
+    summary="The user asked about TON; Durov said TON doubled its users in 2024.",
+    topic="TON user growth, 2024",
+    turns=2
+)
+
+@pytest.fixture
+def store(tmp_path):
+    store = ConversationStore(str(tmp_path / "conversations.db"))
+    with patch('app.services.conversation_summary.conversation_store', store):
+        yield store
+
+def test_store_round_trip_and_agent_deletion(store):
+    """Summaries are kept per user and agent and go away with the agent."""
+    assert store.get("u1", "a1") is None
+    store.put("u1", "a1", CONVERSATION)
+    store.put("u2", "a1", CONVERSATION)
+    store.put("u1", "a2", CONVERSATION)
+    assert store.get("u1", "a1") == CONVERSATION
+
+    assert store.delete_agent("a1") == 2
+    assert store.get("u1", "a1") is None
+    assert store.get("u1", "a2") == CONVERSATION
+
+def test_follow_ups_are_recognized():
+    """Questions continuing or referring back to earlier turns count as follow-ups."""
+    assert is_follow_up("what about last year?")
+    assert is_follow_up("And did he confirm it?")
+    assert is_follow_up("А что было в 2023?")
+    assert is_follow_up("Tell me more about that")
+    assert is_follow_up("Why?")
+    assert not is_follow_up("What did Durov write about the TON blockchain roadmap?")
+
+def test_standalone_questions_are_not_follow_ups():
+    """Being short or containing a pronoun does not make a question a follow-up."""
+    assert not is_follow_up("What is Bitcoin?")
+    assert not is_follow_up("Tips for remote work?")
+    assert not is_follow_up("Is it worth buying TON?")
+    assert not is_follow_up("Do they accept crypto in Dubai?")
+    assert not is_follow_up("Is this a good time to buy gold?")
+    assert contextualize_query("what about last year?", CONVERSATION) == "what about last year?\nTON user growth, 2024"
+    assert contextualize_query("what about last year?", None) == "what about last year?"
+
+def test_parse_summary():
+    """Summary and topic are read from the completion; a missing topic is empty."""
+    assert parse_summary("Summary: Durov on TON.\nTopic: TON, 2024") == ("Durov on TON.", "TON, 2024")
+    assert parse_summary("Durov on TON.") == ("Durov on TON.", "")
+
+@pytest.mark.asyncio
+async def test_update_folds_turns_into_summary(store):
+    """Each turn is folded into the previous summary, which stays within its token budget."""
+    prompts = []
+
+    async def summarize(prompt, max_tokens, temperature):
+        prompts.append(prompt)
+        return f"Summary: summary {len(prompts)}\nTopic: topic {len(prompts)}"
+
+    with patch('app.services.conversation_summary.generate_completion', side_effect=summarize):
+        first = await update_summary("u1", "a1", "How is TON doing?", "TON doubled its users. " * 200)
+        second = await update_summary("u1", "a1", "what about last year?", "Growth was slower in 2023.")
+
+    assert (first.summary, first.topic, first.turns) == ("summary 1", "topic 1", 1)
+    assert store.get("u1", "a1") == second == ConversationSummary("summary 2", "topic 2", 2)
+    assert "summary 1" in prompts[1]
+    # The long answer was cut to the turn budget
+    assert len(prompts[0]) < len("TON doubled its users. " * 200)
+
+@pytest.mark.asyncio
+async def test_failed_update_keeps_previous_summary(store):
+    """A failing completion leaves the stored summary as it was."""
+    store.put("u1", "a1", CONVERSATION)
+    with patch('app.services.conversation_summary.generate_completion', side_effect=RuntimeError("down")):
+        assert await update_summary("u1", "a1", "more?", "More TON news.") is None
+    assert store.get("u1", "a1") == CONVERSATION
+
+@pytest.mark.asyncio
+async def test_scheduled_updates_run_in_order_outside_the_request(store):
+    """Background updates fold turns in order, without the request's deadline."""
+    seen = []
+
+    async def summarize(prompt, max_tokens, temperature):
+        seen.append((prompt.split("User: ")[1].split("\n")[0], current_deadline()))
+        await asyncio.sleep(0.01)
+        return f"Summary: after {len(seen)} turns\nTopic: TON"
+
+    with patch('app.services.conversation_summary.generate_completion', side_effect=summarize):
+        with deadline_scope(0.001):
+            schedule_summary_update("u1", "a1", "first", "answer 1")
+            schedule_summary_update("u1", "a1", "second", "answer 2")
+        await wait_for_summary_updates()
+
+    assert seen == [("first", None), ("second", None)]
+    assert store.get("u1", "a1") == ConversationSummary("after 2 turns", "TON", 2)
+    assert not conversation_summary._latest
+
+@pytest.mark.asyncio
+async def test_updates_are_skipped_when_completions_are_saturated(store):
+    """A summary never queues for a completion slot that an answer needs."""
+    llm = AdmissionController(1, 4, 5)
+    await llm.acquire()
+    with patch('app.services.conversation_summary.llm_admission', llm), \
+         patch('app.services.conversation_summary.generate_completion',
+               return_value="Summary: s\nTopic: t") as summarize:
+        schedule_summary_update("u1", "a1", "first", "answer 1")
+        await wait_for_summary_updates()
+        assert not summarize.called
+        assert store.get("u1", "a1") is None
+
+        llm.release()
+        schedule_summary_update("u1", "a1", "second", "answer 2")
+        await wait_for_summary_updates()
+    assert store.get("u1", "a1").turns == 1
+    assert llm.active == 0
+
+def test_only_generated_answers_are_summarized():
+    """Canned and references-only replies are not turns of the conversation."""
+    context = build_context([{"id": "1", "text": "TON news", "metadata": {"source_link": "t.me/d/1"}}])
+    assert is_generated_answer("TON doubled its users in 2024.")
+    assert not is_generated_answer(NO_RELEVANT_MESSAGE)
+    assert not is_generated_answer(RAG_ERROR_MESSAGE)
+    assert not is_generated_answer(references_only_answer(context))
+
+@pytest.mark.asyncio
+async def test_follow_up_is_retrieved_with_topic_and_answered_with_summary():
+    """A follow-up embeds with the topic and carries the summary within the context budget."""
+    chunks = [{"id": "1", "text": "In 2023 TON grew 40%", "metadata": {"source_link": "t.me/d/1"}, "score": 0.9}]
+    answer_cache.invalidate()
+    with patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536) as embed, \
+         patch('app.services.rag_service.query_all_namespaces', return_value=chunks), \
+         patch('app.services.rag_service.build_context', wraps=build_context) as context, \
+         patch('app.services.rag_service.generate_completion', return_value="It grew 40%") as completion:
+        assert await rag_retrieve_and_summarize("what about last year?", mode="search",
+                                                conversation=CONVERSATION) == "It grew 40%"
+        embed.assert_called_with("what about last year?\nTON user growth, 2024")
+        assert CONVERSATION.summary in completion.call_args[0][0]
+        assert context.call_args[1]["budget"] == CONTEXT_TOKEN_BUDGET - count_tokens(CONVERSATION.summary)
+
+        # A standalone question is answered as before, without the conversation
+        await rag_retrieve_and_summarize("What did Durov write about the TON blockchain roadmap?",
+                                         mode="search", conversation=CONVERSATION)
+        embed.assert_called_with("What did Durov write about the TON blockchain roadmap?")
+        assert CONVERSATION.summary not in completion.call_args[0][0]
+
+        # So is a short one, and its answer is cached as usual
+        answer_cache.invalidate()
+        completion.reset_mock()
+        await rag_retrieve_and_summarize("What is Bitcoin?", mode="search", conversation=CONVERSATION)
+        embed.assert_called_with("What is Bitcoin?")
+        assert CONVERSATION.summary not in completion.call_args[0][0]
+        assert answer_cache.lookup(None, "search", [0.1] * 1536) == "It grew 40%"
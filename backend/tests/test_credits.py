@@ -5,6 +5,7 @@ import os
 import pytest
 from httpx import AsyncClient
 from fastapi import HTTPException
+from app.routes import admin
 
 @pytest.mark.asyncio
 async def test_credit_operations(client: AsyncClient, test_user: str):
@@ -26,8 +27,23 @@ async def test_credit_operations(client: AsyncClient, test_user: str):
             assert response.status_code == 400
 
 @pytest.mark.asyncio
-async def test_admin_topup(client: AsyncClient, test_user: str):
+async def test_admin_access_fails_closed_without_admin_key(monkeypatch):
+    """Without ADMIN_KEY configured no key is accepted."""
+    monkeypatch.setattr(admin, "ADMIN_KEY", None)
+    for key in (None, "", "test_admin_key"):
+        with pytest.raises(HTTPException) as exc_info:
+            await admin.verify_admin(key)
+        assert exc_info.value.status_code == 403
+
+    monkeypatch.setattr(admin, "ADMIN_KEY", "secret")
+    await admin.verify_admin("secret")
+    with pytest.raises(HTTPException):
+        await admin.verify_admin("secret2")
+
+@pytest.mark.asyncio
+async def test_admin_topup(client: AsyncClient, test_user: str, monkeypatch):
     """Test admin top-up endpoint."""
+    monkeypatch.setattr(admin, "ADMIN_KEY", os.getenv("ADMIN_KEY", "test_admin_key"))
     async for http_client in client:
         async for user_id in test_user:
             # Test admin top-up without admin key
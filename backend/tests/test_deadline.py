@@ -0,0 +1,148 @@
+"""
+Test request deadlines and cancellation of chats on client disconnect.
+"""
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI, Form, Request
+from fastapi.responses import JSONResponse
+from app.utils import deadline
+from app.utils.deadline import DeadlineMiddleware, deadline_scope, call_with_timeout, current_deadline, remaining
+from app.utils.circuit_breaker import CircuitBreaker, CLOSED
+from app.utils.errors import ServiceUnavailableError, DeadlineExceeded
+from app.utils.metrics import REQUESTS_CANCELLED
+
+def test_nested_scope_keeps_the_sooner_deadline():
+    """An inner scope can shorten the deadline but never extend it."""
+    assert current_deadline() is None
+    with deadline_scope(5) as outer:
+        with deadline_scope(60) as inner:
+            assert inner == outer
+        with deadline_scope(1) as inner:
+            assert inner < outer
+        with deadline_scope(None) as inner:
+            assert inner == outer
+        assert 4 < remaining() <= 5
+    assert current_deadline() is None
+
+@pytest.mark.asyncio
+async def test_call_with_timeout_tells_deadline_from_slow_service():
+    """A call cut short by the request deadline raises DeadlineExceeded, otherwise 503."""
+    with pytest.raises(ServiceUnavailableError, match="OpenAI"):
+        await call_with_timeout(asyncio.sleep(1), 0.01, "OpenAI")
+
+    with deadline_scope(0.01):
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            await call_with_timeout(asyncio.sleep(1), 5, "Pinecone")
+    assert exc_info.value.status_code == 504
+
+    # Out of time already: the call is not even started
+    with deadline_scope(-1):
+        with pytest.raises(DeadlineExceeded):
+            await call_with_timeout(asyncio.sleep(1), 5, "Pinecone")
+    assert await call_with_timeout(asyncio.sleep(0, "ok"), 5, "Pinecone") == "ok"
+
+@pytest.mark.asyncio
+async def test_deadline_does_not_trip_circuit_breaker():
+    """Running out of request time says nothing about the dependency's health."""
+    breaker = CircuitBreaker("test", min_calls=1)
+
+    @breaker.protect
+    async def call_service():
+        return await call_with_timeout(asyncio.sleep(1), 5, "Test")
+
+    with deadline_scope(0.01):
+        with pytest.raises(DeadlineExceeded):
+            await call_service()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["calls"] == 0
+
+@pytest.fixture
+def chat_app():
+    app = FastAPI()
+    app.add_middleware(DeadlineMiddleware)
+    app.state.events = []
+
+    @app.post("/agent/{agent_id}/chat")
+    async def chat(agent_id: str, request: Request, message: str = Form(...)):
+        app.state.events.append(("deadline", remaining()))
+        if message == "slow":
+            try:
+                await call_with_timeout(asyncio.sleep(10), 30, "OpenAI")
+            except asyncio.CancelledError:
+                app.state.events.append(("cancelled", None))
+                raise
+        return {"message": message}
+
+    @app.get("/agent/list")
+    async def list_agents():
+        return {"deadline": current_deadline()}
+
+    return app
+
+@pytest.mark.asyncio
+async def test_middleware_sets_deadline_on_chat_only(chat_app):
+    """Chats get CHAT_REQUEST_TIMEOUT, shortened by X-Request-Timeout; other routes none."""
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/agent/a1/chat", data={"message": "hi"})
+        assert response.json() == {"message": "hi"}
+        response = await client.post("/agent/a1/chat", data={"message": "hi"},
+                                     headers={"X-Request-Timeout": "2"})
+        assert response.status_code == 200
+        assert (await client.get("/agent/list")).json() == {"deadline": None}
+
+    first, second = [left for _, left in chat_app.state.events]
+    assert deadline.CHAT_REQUEST_TIMEOUT - 1 < first <= deadline.CHAT_REQUEST_TIMEOUT
+    assert 1 < second <= 2
+
+@pytest.mark.asyncio
+async def test_middleware_returns_504_past_deadline(chat_app):
+    """A chat that runs out of time fails with the route's error, not a hang."""
+    @chat_app.exception_handler(DeadlineExceeded)
+    async def deadline_exceeded(request, exc):
+        return JSONResponse({"detail": exc.message}, status_code=exc.status_code)
+
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/agent/a1/chat", data={"message": "slow"},
+                                     headers={"X-Request-Timeout": "0.05"})
+    assert response.status_code == 504
+    assert "OpenAI" in response.json()["detail"]
+
+@pytest.mark.asyncio
+async def test_disconnect_cancels_the_handler(chat_app):
+    """When the client goes away the chat stops instead of running to completion."""
+    body = b"message=slow"
+    client_gone = asyncio.Event()
+    received = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {"type": "http.request", "body": body, "more_body": False}
+        await client_gone.wait()
+        return {"type": "http.disconnect"}
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": "/agent/a1/chat", "raw_path": b"/agent/a1/chat", "root_path": "",
+        "query_string": b"", "server": ("test", 80), "client": ("127.0.0.1", 1234),
+        "headers": [(b"content-type", b"application/x-www-form-urlencoded"),
+                    (b"content-length", str(len(body)).encode())],
+    }
+    cancelled_before = REQUESTS_CANCELLED._value.get()
+    request = asyncio.create_task(chat_app(scope, receive, send))
+    await asyncio.sleep(0.05)
+    assert not request.done()
+
+    client_gone.set()
+    await asyncio.wait_for(request, 1)
+    assert ("cancelled", None) in chat_app.state.events
+    assert REQUESTS_CANCELLED._value.get() == cancelled_before + 1
+    assert sent[0]["status"] == deadline.CLIENT_CLOSED_REQUEST
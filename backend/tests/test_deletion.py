@@ -0,0 +1,50 @@
+"""
+Test cascading agent deletion.
+"""
+import pytest
+from unittest.mock import patch, AsyncMock
+from app.services.db_service import agent_photo_path
+from app.services.deletion_service import delete_agent_cascade
+
+AGENT = {
+    "id": "agent-1",
+    "profile_photo_url": "https://x.supabase.co/storage/v1/object/public/agent-photos/agent_photos/u_1.jpg?"
+}
+
+def test_agent_photo_path():
+    """Public photo URLs map back to their object path in the bucket."""
+    assert agent_photo_path(AGENT["profile_photo_url"]) == "agent_photos/u_1.jpg"
+    assert agent_photo_path(None) is None
+
+@pytest.mark.asyncio
+async def test_cascade_removes_everything_before_the_row():
+    """Vectors, messages and photos are removed, then the agent row."""
+    calls = []
+    def track(name, value):
+        return AsyncMock(side_effect=lambda *args: calls.append(name) or value)
+
+    with patch("app.services.deletion_service.update_agent_status", track("status", True)), \
+         patch("app.services.deletion_service.delete_agent_vectors", track("vectors", True)), \
+         patch("app.services.deletion_service.delete_chat_messages", track("messages", 3)), \
+         patch("app.services.deletion_service.delete_agent_photos", track("photos", 1)), \
+         patch("app.services.deletion_service.delete_agent", track("row", True)):
+        result = await delete_agent_cascade("agent-1", AGENT)
+
+    assert result.deleted
+    assert (result.chat_messages, result.photos) == (3, 1)
+    assert calls == ["status", "vectors", "messages", "photos", "row"]
+
+@pytest.mark.asyncio
+async def test_cascade_keeps_row_when_vector_delete_fails():
+    """A failed step marks the agent delete_failed so it can be retried."""
+    status = AsyncMock(return_value=True)
+    delete_row = AsyncMock(return_value=True)
+    with patch("app.services.deletion_service.update_agent_status", status), \
+         patch("app.services.deletion_service.delete_agent_vectors", AsyncMock(return_value=False)), \
+         patch("app.services.deletion_service.delete_agent", delete_row):
+        result = await delete_agent_cascade("agent-1", AGENT)
+
+    assert not result.deleted
+    assert result.error
+    delete_row.assert_not_called()
+    status.assert_called_with("agent-1", "delete_failed")
@@ -0,0 +1,141 @@
+"""
+Test the offline service fakes and their fault injection.
+"""
+import pytest
+from openai import RateLimitError, InternalServerError
+from postgrest.exceptions import APIError
+from app.fakes import FaultConfig, FaultInjector, InjectedError
+from app.fakes.openai_fake import FakeAsyncOpenAI, fake_embedding
+from app.fakes.pinecone_fake import FakePinecone
+from app.fakes.supabase_fake import FakeSupabase
+from app.fakes.telegram_fake import FakeTelegramClient
+from app.services.reranking import cosine_similarity
+from app.services.vector_store import PineconeVectorStore
+
+def test_fault_injection_is_reproducible():
+    """A seeded injector fails the same calls every run, at about the configured rate."""
+    def failures(seed):
+        injector = FaultInjector("x", FaultConfig(error_rate=0.3), seed=seed)
+        outcome = []
+        for _ in range(200):
+            try:
+                injector.call()
+                outcome.append(False)
+            except InjectedError:
+                outcome.append(True)
+        return outcome
+
+    assert failures(7) == failures(7)
+    assert 40 <= sum(failures(7)) <= 80
+
+def test_rate_limit_injection():
+    """Calls beyond the rate fail with a retry hint until tokens refill."""
+    now = [0.0]
+    injector = FaultInjector("x", FaultConfig(rate_limit=2), clock=lambda: now[0])
+    injector.call()
+    injector.call()
+    with pytest.raises(InjectedError) as exc_info:
+        injector.call()
+    assert exc_info.value.status_code == 429
+    assert exc_info.value.retry_after == pytest.approx(0.5)
+    now[0] += 0.5
+    injector.call()
+
+@pytest.mark.asyncio
+async def test_openai_fake_embeddings_and_errors():
+    """Embeddings are deterministic and word overlap raises similarity; errors are OpenAI's own."""
+    client = FakeAsyncOpenAI()
+    response = await client.embeddings.create(model="m", input=["Bitcoin is up", "Bitcoin is up"])
+    assert response.data[0].embedding == response.data[1].embedding
+    assert response.usage.total_tokens > 0
+
+    related = cosine_similarity(fake_embedding("bitcoin price today"), fake_embedding("the bitcoin price"))
+    unrelated = cosine_similarity(fake_embedding("bitcoin price today"), fake_embedding("morning coffee"))
+    assert related > 0.8 > unrelated > 0.6
+
+    client.faults.config = FaultConfig(error_rate=1.0)
+    with pytest.raises(InternalServerError):
+        await client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+    client.faults.config = FaultConfig(rate_limit=0.001)
+    client.faults._tokens = 0
+    with pytest.raises(RateLimitError):
+        await client.embeddings.create(model="m", input="hi")
+
+@pytest.mark.asyncio
+async def test_openai_fake_streams_completion():
+    """Streaming completions yield the answer in pieces."""
+    client = FakeAsyncOpenAI()
+    prompt = "Context:\n• TON is rising (source: t.me/x/1, relevance: 0.9)\n\nQuestion: TON?"
+    stream = await client.chat.completions.create(model="m", messages=[{"role": "user", "content": prompt}],
+                                                  stream=True)
+    pieces = [chunk.choices[0].delta.content async for chunk in stream]
+    assert len(pieces) > 1
+    assert "TON is rising" in "".join(pieces)
+
+def test_pinecone_fake_behind_vector_store():
+    """The Pinecone code path works against the fake index, namespaces included."""
+    store = PineconeVectorStore(FakePinecone().Index("test"))
+    store.upsert([
+        {"id": "a#1", "values": fake_embedding("ton news"), "metadata": {"agent_id": "a"}},
+        {"id": "a#2", "values": fake_embedding("coffee"), "metadata": {"agent_id": "a"}}
+    ], namespace="agent-a")
+    store.upsert([{"id": "b#1", "values": fake_embedding("ton news"), "metadata": {"agent_id": "b"}}],
+                 namespace="agent-b")
+
+    matches = store.query(fake_embedding("ton"), top_k=2, namespace="agent-a", include_values=True)
+    assert [m["id"] for m in matches] == ["a#1", "a#2"]
+    assert len(matches[0]["values"]) == 1536
+    assert sorted(store.list_namespaces()) == ["agent-a", "agent-b"]
+
+    store.delete_by_prefix("a#", namespace="agent-a")
+    store.delete_namespace("agent-b")
+    assert store.list_namespaces() == []
+
+def test_pinecone_store_lists_ids_by_query_on_pod_indexes():
+    """Pod indexes cannot list IDs; prefix deletes fall back to a filtered probe query."""
+    index = FakePinecone().Index("agentique")
+
+    def list_unsupported(prefix="", namespace=""):
+        raise NotImplementedError("list is only supported on serverless indexes")
+
+    index.list = list_unsupported
+    store = PineconeVectorStore(index)
+    store.upsert([
+        {"id": f"{agent}#{i}", "values": fake_embedding(f"post {i}"), "metadata": {"agent_id": agent}}
+        for agent in ("a", "b") for i in range(3)
+    ])
+    assert sorted(id_ for ids in store.list_ids("a#") for id_ in ids) == ["a#0", "a#1", "a#2"]
+    store.delete_by_prefix("a#")
+    assert sorted(index.fetch(ids=["a#0", "b#0"]).vectors) == ["b#0"]
+
+def test_supabase_fake_query_builder():
+    """Inserts get defaults and queries filter, order, limit and select columns."""
+    db = FakeSupabase()
+    user = db.table("users").insert({"telegram_id": "1"}).execute().data[0]
+    assert user["credits_balance"] == 0
+    for i in range(3):
+        db.table("chat_messages").insert({"user_id": user["id"], "content": f"m{i}",
+                                          "created_at": f"2024-01-0{i + 1}T00:00:00"}).execute()
+
+    rows = db.table("chat_messages").select("content").eq("user_id", user["id"])\
+        .order("created_at", desc=True).limit(2).execute().data
+    assert rows == [{"content": "m2"}, {"content": "m1"}]
+
+    db.table("users").update({"credits_balance": 5}).eq("id", user["id"]).execute()
+    assert db.table("users").select("credits_balance").eq("id", user["id"]).single().execute().data == {"credits_balance": 5}
+    with pytest.raises(APIError):
+        db.table("users").select("*").eq("id", "missing").single().execute()
+    assert len(db.table("chat_messages").delete().eq("user_id", user["id"]).execute().data) == 3
+
+@pytest.mark.asyncio
+async def test_telegram_fake_is_deterministic():
+    """A channel always has the same posts, newest first, honoring min_id and limit."""
+    client = FakeTelegramClient(messages_per_channel=20)
+    channel = await client.get_entity("@some_channel")
+    messages = await client.get_messages(channel, limit=5, min_id=10)
+    assert [m.id for m in messages] == [20, 19, 18, 17, 16]
+    assert messages[0].text
+
+    other = FakeTelegramClient(messages_per_channel=20)
+    again = await other.get_messages(await other.get_entity("some_channel"), limit=5, min_id=10)
+    assert [m.text for m in again] == [m.text for m in messages]
@@ -1,10 +1,12 @@
 """
 Test the health check endpoint functionality.
 """
+import asyncio
 import pytest
 from unittest.mock import patch, MagicMock, AsyncMock
 from fastapi import HTTPException
-from app.main import health_check
+from app.main import health_check, liveness_check, readiness_check
+from app.services.health_service import HealthProber, health_prober
 
 @pytest.mark.asyncio
 async def test_health_check_all_healthy():
@@ -18,7 +20,8 @@ async def test_health_check_all_healthy():
         mock_pinecone.return_value = ["index1", "index2"]
         mock_supabase.return_value.select.return_value.limit.return_value.execute.return_value = {"data": []}
         
-        # Call health check
+        # Probe, then read the cached result
+        await health_prober.probe_all()
         response = await health_check()
         
         # Verify response
@@ -26,6 +29,7 @@ async def test_health_check_all_healthy():
         assert response["services"]["openai"] == "healthy"
         assert response["services"]["pinecone"] == "healthy"
         assert response["services"]["supabase"] == "healthy"
+        assert (await readiness_check())["status"] == "healthy"
 
 @pytest.mark.asyncio
 async def test_health_check_openai_unhealthy():
@@ -39,7 +43,8 @@ async def test_health_check_openai_unhealthy():
         mock_pinecone.return_value = ["index1", "index2"]
         mock_supabase.return_value.select.return_value.limit.return_value.execute.return_value = {"data": []}
         
-        # Call health check and expect exception
+        # Probe, then expect the cached result to fail the check
+        await health_prober.probe_all()
         with pytest.raises(HTTPException) as exc_info:
             await health_check()
         
@@ -62,7 +67,8 @@ async def test_health_check_all_unhealthy():
         mock_pinecone.side_effect = Exception("Connection error")
         mock_supabase.side_effect = Exception("DB error")
         
-        # Call health check and expect exception
+        # Probe, then expect the cached result to fail the check
+        await health_prober.probe_all()
         with pytest.raises(HTTPException) as exc_info:
             await health_check()
         
@@ -71,4 +77,59 @@ async def test_health_check_all_unhealthy():
         assert exc_info.value.detail["status"] == "unhealthy"
         assert exc_info.value.detail["services"]["openai"] == "unhealthy"
         assert exc_info.value.detail["services"]["pinecone"] == "unhealthy"
-        assert exc_info.value.detail["services"]["supabase"] == "unhealthy" 
\ No newline at end of file
+        assert exc_info.value.detail["services"]["supabase"] == "unhealthy"
+
+@pytest.mark.asyncio
+async def test_health_check_answers_from_cache():
+    """Health endpoints do not call external services themselves."""
+    with patch('app.services.openai_service.client.models.list', new_callable=AsyncMock) as mock_openai, \
+         patch('app.services.db_service.supabase.table') as mock_supabase:
+        await health_prober.probe_all()
+        calls = mock_openai.call_count
+        for _ in range(3):
+            await health_check()
+        assert mock_openai.call_count == calls
+        assert (await liveness_check()) == {"status": "alive"}
+
+@pytest.mark.asyncio
+async def test_readiness_waits_for_fresh_probes():
+    """Not ready before the first probe, ready after it, unhealthy once stale."""
+    now = [1000.0]
+    prober = HealthProber(
+        probes={"openai": AsyncMock(), "pinecone": None},
+        stale_after=90,
+        clock=lambda: now[0]
+    )
+    assert not prober.is_ready()
+    assert prober.report()["status"] == "unknown"
+
+    await prober.probe_all()
+    assert prober.is_ready()
+    assert prober.report()["services"] == {"openai": "healthy", "pinecone": "disabled"}
+
+    now[0] += 91
+    assert not prober.is_ready()
+    assert prober.report()["status"] == "unhealthy"
+
+@pytest.mark.asyncio
+async def test_slow_probe_times_out():
+    """A hanging dependency is reported unhealthy after the probe timeout."""
+    async def hang():
+        await asyncio.sleep(10)
+
+    prober = HealthProber(probes={"supabase": hang}, timeout=0.01)
+    await prober.probe_all()
+    report = prober.report(details=True)
+    assert report["services"]["supabase"] == "unhealthy"
+    assert "timed out" in report["checks"]["supabase"]["error"]
+
+@pytest.mark.asyncio
+async def test_background_prober_start_stop():
+    """The background task probes immediately and stops cleanly."""
+    probe = AsyncMock()
+    prober = HealthProber(probes={"openai": probe}, interval=60)
+    prober.start()
+    await asyncio.sleep(0.01)
+    await prober.stop()
+    assert probe.call_count == 1
+    assert prober.is_ready()
@@ -0,0 +1,181 @@
+"""
+Test idempotency keys for chat and agent creation.
+"""
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI, Form, HTTPException
+from app.utils import idempotency
+from app.utils.idempotency import (
+    IdempotencyMiddleware, MemoryStore, SqliteStore, StoredResponse, set_idempotency_store
+)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        return MemoryStore(lock_ttl=60)
+    return SqliteStore(str(tmp_path / "idempotency.db"), lock_ttl=60)
+
+def test_claim_complete_and_expire(store):
+    """A key is held while running, then holds the response until it expires."""
+    assert store.claim("k1", "f1", "lease1", 1000) is None
+    entry = store.claim("k1", "f1", "lease2", 1001)
+    assert (entry.fingerprint, entry.response) == ("f1", None)
+
+    response = StoredResponse(200, [(b"content-type", b"application/json")], b'{"ok": true}')
+    store.complete("k1", "lease2", response, 2000)  # not the holder
+    assert store.claim("k1", "f1", "lease2", 1002).response is None
+    store.complete("k1", "lease1", response, 2000)
+    assert store.claim("k1", "f1", "lease2", 1999).response == response
+    assert store.claim("k1", "f1", "lease2", 2000) is None
+
+def test_abandoned_and_stale_claims_free_the_key(store):
+    """A failed request frees its key; a claim of a dead worker expires."""
+    assert store.claim("k1", "f1", "lease1", 1000) is None
+    store.abandon("k1", "lease1")
+    assert store.claim("k1", "f1", "lease2", 1000) is None
+    assert store.claim("k1", "f1", "lease3", 1059) is not None
+    assert store.claim("k1", "f1", "lease3", 1060) is None
+
+def test_sqlite_keys_are_shared_between_workers(tmp_path):
+    """A key claimed by one worker is seen by another, like two gunicorn workers."""
+    path = str(tmp_path / "idempotency.db")
+    first, second = SqliteStore(path), SqliteStore(path)
+    assert first.claim("k1", "f1", "lease1", 1000) is None
+    first.complete("k1", "lease1", StoredResponse(201, [], b"created"), 2000)
+    assert second.claim("k1", "f1", "lease2", 1000).response.body == b"created"
+
+@pytest.fixture
+def app():
+    app = FastAPI()
+    app.add_middleware(IdempotencyMiddleware)
+    app.state.runs = []
+    app.state.release = asyncio.Event()
+    app.state.release.set()
+
+    @app.post("/agent/{agent_id}/chat")
+    async def chat(agent_id: str, message: str = Form(...), user_id: str = Form(...)):
+        app.state.runs.append(message)
+        await app.state.release.wait()
+        if message == "fail":
+            raise HTTPException(status_code=500, detail="Failed to generate response")
+        return {"response": f"answer {len(app.state.runs)}"}
+
+    set_idempotency_store(MemoryStore())
+    yield app
+    set_idempotency_store(None)
+
+def client_for(app):
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+
+@pytest.mark.asyncio
+async def test_retry_replays_the_stored_response(app):
+    """A retried chat is answered from the store instead of generating again."""
+    async with client_for(app) as client:
+        headers = {"Idempotency-Key": "retry-1"}
+        first = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"}, headers=headers)
+        # Same form fields in a multipart body with a new boundary
+        second = await client.post("/agent/a1/chat", files={"message": (None, "hi"), "user_id": (None, "u1")},
+                                   headers=headers)
+        third = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+
+    assert first.json() == second.json() == {"response": "answer 1"}
+    assert second.headers["idempotent-replayed"] == "true"
+    assert "idempotent-replayed" not in first.headers
+    assert third.json() == {"response": "answer 2"}  # no key, no replay
+    assert app.state.runs == ["hi", "hi"]
+
+@pytest.mark.asyncio
+async def test_retry_on_another_worker_replays(app, tmp_path):
+    """With the SQLite store a retry handled by a second worker gets the first worker's response."""
+    set_idempotency_store(SqliteStore(str(tmp_path / "idempotency.db")))
+    second_worker = FastAPI()
+    second_worker.add_middleware(IdempotencyMiddleware)
+
+    @second_worker.post("/agent/{agent_id}/chat")
+    async def chat(agent_id: str, message: str = Form(...), user_id: str = Form(...)):
+        raise AssertionError("the retry must not run again")
+
+    headers = {"Idempotency-Key": "worker-1"}
+    data = {"message": "hi", "user_id": "u1"}
+    async with client_for(app) as first, client_for(second_worker) as second:
+        original = await first.post("/agent/a1/chat", data=data, headers=headers)
+        retry = await second.post("/agent/a1/chat", data=data, headers=headers)
+    assert retry.json() == original.json() == {"response": "answer 1"}
+    assert retry.headers["idempotent-replayed"] == "true"
+
+@pytest.mark.asyncio
+async def test_concurrent_retry_waits_for_the_first(app):
+    """A retry sent while the first request runs gets its response without running again."""
+    app.state.release.clear()
+    async with client_for(app) as client:
+        headers = {"Idempotency-Key": "slow-1"}
+        data = {"message": "hi", "user_id": "u1"}
+        first = asyncio.create_task(client.post("/agent/a1/chat", data=data, headers=headers))
+        await asyncio.sleep(0.05)
+        second = asyncio.create_task(client.post("/agent/a1/chat", data=data, headers=headers))
+        await asyncio.sleep(0.05)
+        assert not second.done()
+
+        app.state.release.set()
+        first, second = await first, await second
+    assert first.json() == second.json() == {"response": "answer 1"}
+    assert app.state.runs == ["hi"]
+
+@pytest.mark.asyncio
+async def test_wait_gives_up_with_409(app, monkeypatch):
+    """A retry does not wait forever for a request that is stuck."""
+    monkeypatch.setattr(idempotency, "IDEMPOTENCY_WAIT_TIMEOUT", 0.05)
+    app.state.release.clear()
+    async with client_for(app) as client:
+        headers = {"Idempotency-Key": "stuck-1"}
+        data = {"message": "hi", "user_id": "u1"}
+        first = asyncio.create_task(client.post("/agent/a1/chat", data=data, headers=headers))
+        await asyncio.sleep(0.05)
+        second = await client.post("/agent/a1/chat", data=data, headers=headers)
+        app.state.release.set()
+        await first
+    assert second.status_code == 409
+    assert second.headers["retry-after"] == "1"
+
+@pytest.mark.asyncio
+async def test_key_reused_for_other_request_is_rejected(app):
+    """The same key with a different message is a client bug, not a retry."""
+    async with client_for(app) as client:
+        headers = {"Idempotency-Key": "reused-1"}
+        await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"}, headers=headers)
+        response = await client.post("/agent/a1/chat", data={"message": "bye", "user_id": "u1"}, headers=headers)
+    assert response.status_code == 422
+    assert app.state.runs == ["hi"]
+
+@pytest.mark.asyncio
+async def test_server_errors_are_not_stored(app):
+    """After a 5xx the retry runs the request again."""
+    async with client_for(app) as client:
+        headers = {"Idempotency-Key": "fail-1"}
+        data = {"message": "fail", "user_id": "u1"}
+        assert (await client.post("/agent/a1/chat", data=data, headers=headers)).status_code == 500
+        response = await client.post("/agent/a1/chat", data=data, headers=headers)
+    assert response.status_code == 500
+    assert "idempotent-replayed" not in response.headers
+    assert app.state.runs == ["fail", "fail"]
+
+@pytest.mark.asyncio
+async def test_broken_store_runs_request(app):
+    """A failing store must not take chat down."""
+    class BrokenStore(MemoryStore):
+        def claim(self, key, fingerprint, lease, now):
+            raise RuntimeError("database is locked")
+
+    set_idempotency_store(BrokenStore())
+    async with client_for(app) as client:
+        response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"},
+                                     headers={"Idempotency-Key": "k"})
+    assert response.status_code == 200
@@ -0,0 +1,38 @@
+"""
+Test embedding and upserting of channel messages.
+"""
+import pytest
+from app.services import ingestion_service
+from app.services.ingestion_service import ingest_messages
+from app.services.telegram_service import TelegramService
+
+@pytest.mark.asyncio
+async def test_long_message_is_truncated_instead_of_failing_its_batch(monkeypatch):
+    """A message over the embedding token limit is cut to fit, not dropped with its batch."""
+    embedded = []
+
+    async def generate_embeddings(texts):
+        embedded.extend(texts)
+        if any(len(text) > 200 for text in texts):
+            return [], 0  # the API rejects the whole batch
+        return [[0.1] * 1536 for _ in texts], len(texts)
+
+    monkeypatch.setattr(ingestion_service, "generate_embeddings", generate_embeddings)
+    monkeypatch.setattr(ingestion_service, "EMBEDDING_MAX_TOKENS", 50)
+    long_text = "Bitcoin is a decentralized currency. " * 100
+    messages = [{"id": i, "text": text, "link": f"https://t.me/channel/{i}", "date": "2024-01-01T00:00:00"}
+                for i, text in [(1, "Short message"), (2, long_text)]]
+
+    stats = await ingest_messages("agent-long", messages)
+    assert (stats.vector_count, stats.failed_count, stats.last_message_id) == (2, 0, 2)
+    assert embedded[0] == "Short message"
+    assert long_text.startswith(embedded[1]) and len(embedded[1]) <= 200
+
+@pytest.mark.asyncio
+async def test_resumed_fetch_continues_right_after_the_checkpoint():
+    """Paging up from min_id leaves no gap between the checkpoint and the fetched messages."""
+    telegram = TelegramService()
+    newest = await telegram.get_channel_messages("@resume_channel", limit=5, min_id=10)
+    resumed = await telegram.get_channel_messages("@resume_channel", limit=5, min_id=10, reverse=True)
+    assert [m["id"] for m in resumed] == [11, 12, 13, 14, 15]
+    assert min(m["id"] for m in newest) > 15
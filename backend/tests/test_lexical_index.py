@@ -0,0 +1,76 @@
+"""
+Test the BM25 lexical index and hybrid rank fusion.
+"""
+import pytest
+from unittest.mock import patch
+from app.services import lexical_index
+from app.services.lexical_index import LexicalIndex, query_terms
+from app.services.pinecone_service import delete_vectors
+from app.services.rag_service import reciprocal_rank_fusion, hybrid_retrieve
+
+@pytest.fixture
+def index(tmp_path):
+    index = LexicalIndex(str(tmp_path / "agent.db"))
+    index.add({
+        "a#1": "Цена $TON выросла на 15% за неделю",
+        "a#2": "Обсуждаем новости рынка и #crypto",
+        "a#3": "Durov announced a new Telegram feature",
+    })
+    return index
+
+def test_query_terms_fold_case_and_punctuation():
+    """Hashtags, tickers and casing reduce to the same terms as indexed text."""
+    assert query_terms("What about #TON and $ton, Durov?") == ["what", "about", "ton", "and", "durov"]
+
+def test_search_matches_exact_tokens(index):
+    """Names, tickers and numbers are found by exact term."""
+    assert index.search("$TON", top_k=5)[0][0] == "a#1"
+    assert index.search("15", top_k=5)[0][0] == "a#1"
+    assert [id_ for id_, _ in index.search("durov", top_k=5)] == ["a#3"]
+    assert index.search("???", top_k=5) == []
+
+def test_underscore_terms_match_their_parts(index):
+    """A handle or hashtag with underscores is searched by its parts, not rejected."""
+    assert query_terms("#crypto_news @durov_channel") == ["crypto", "news", "durov", "channel"]
+    assert index.search("#crypto_news", top_k=5)[0][0] == "a#2"
+    assert index.search("durov_announced", top_k=5)[0][0] == "a#3"
+
+def test_add_replaces_and_delete_removes(index):
+    """Re-adding an ID replaces its text; deleted IDs stop matching."""
+    index.add({"a#3": "nothing to see"})
+    assert index.search("durov", top_k=5) == []
+    index.delete(["a#1"])
+    assert index.search("ton", top_k=5) == []
+    assert index.count() == 2
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    """An ID ranked by both retrievers beats IDs ranked by only one."""
+    scores = reciprocal_rank_fusion([["x", "y"], ["y", "z"]])
+    assert max(scores, key=scores.get) == "y"
+    assert scores["x"] > scores["z"]
+
+@pytest.mark.asyncio
+async def test_hybrid_retrieve_adds_lexical_only_hits():
+    """Lexical-only hits are fetched from the chunk store and fused in."""
+    dense = [{"id": "a#1", "text": "dense", "metadata": {}, "score": 0.8}]
+    lexical_only = [{"id": "a#2", "text": "lexical", "metadata": {}, "score": 0.0}]
+    with patch("app.services.rag_service.query_similar", return_value=dense), \
+         patch("app.services.rag_service.lexical_index.search", return_value=[("a#2", 7.5), ("a#1", 2.0)]), \
+         patch("app.services.rag_service.fetch_chunks", return_value=lexical_only) as fetch, \
+         patch("app.services.rag_service.fetch_vectors", return_value={"a#2": [0.2]}):
+        chunks = await hybrid_retrieve("query", [0.1], "a", top_k=5)
+
+    assert [c["id"] for c in chunks] == ["a#1", "a#2"]
+    assert chunks[1]["lexical_score"] == 7.5
+    assert chunks[1]["values"] == [0.2]
+    fetch.assert_called_once_with(["a#2"])
+
+@pytest.mark.asyncio
+async def test_deleted_vectors_leave_the_lexical_index(tmp_path, monkeypatch):
+    """Vectors deleted by ID no longer come back as BM25 hits."""
+    monkeypatch.setattr(lexical_index, "LEXICAL_INDEX_PATH", str(tmp_path))
+    monkeypatch.setattr(lexical_index, "_indexes", {})
+    lexical_index.index_chunks("agent-del", {"agent-del#1": "TON news", "agent-del#2": "TON price"})
+
+    assert await delete_vectors(["agent-del#1"])
+    assert [id_ for id_, _ in lexical_index.search("agent-del", "ton", top_k=5)] == ["agent-del#2"]
@@ -0,0 +1,57 @@
+"""
+Test the queue-based logging pipeline.
+"""
+import json
+import queue
+import logging
+import pytest
+from app.utils.logger import (
+    JsonFormatter, DebugRateLimitFilter, NonBlockingQueueHandler, set_log_level, get_log_levels
+)
+
+def make_record(level=logging.DEBUG, lineno=10, msg="hot path %s", args=("x",)):
+    return logging.LogRecord("agentique.test", level, "/app/hot.py", lineno, msg, args, None)
+
+def test_debug_rate_limited_per_call_site():
+    """Debug records above the rate are dropped and counted on the next one let through."""
+    log_filter = DebugRateLimitFilter(max_per_second=2)
+    passed = [log_filter.filter(make_record()) for _ in range(5)]
+    assert passed == [True, True, False, False, False]
+    # Another call site and higher levels are unaffected
+    assert log_filter.filter(make_record(lineno=11))
+    assert all(log_filter.filter(make_record(level=logging.INFO)) for _ in range(5))
+
+    bucket = log_filter._buckets[("agentique.test", "/app/hot.py", 10)]
+    bucket[1] -= 1  # a second later
+    record = make_record()
+    assert log_filter.filter(record)
+    assert record.suppressed == 3
+
+def test_debug_sampling():
+    """A zero sample rate drops all debug records but keeps warnings."""
+    log_filter = DebugRateLimitFilter(max_per_second=0, sample_rate=0.0)
+    assert not log_filter.filter(make_record())
+    assert log_filter.filter(make_record(level=logging.WARNING))
+
+def test_json_formatter_includes_extra_fields():
+    """Records become one JSON line with standard and extra fields."""
+    record = make_record(level=logging.INFO)
+    record.trace_id = "abc"
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["message"] == "hot path x"
+    assert entry["level"] == "INFO"
+    assert entry["trace_id"] == "abc"
+
+def test_full_queue_drops_instead_of_blocking():
+    """A full queue costs a dropped record, never a blocked caller."""
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=1))
+    handler.handle(make_record(level=logging.INFO))
+    handler.handle(make_record(level=logging.INFO))
+    assert handler.dropped == 1
+
+def test_runtime_log_levels():
+    """Levels change at runtime and unknown levels are rejected."""
+    set_log_level("agentique.test_runtime", "warning")
+    assert get_log_levels()["agentique.test_runtime"] == "WARNING"
+    with pytest.raises(ValueError):
+        set_log_level("agentique.test_runtime", "LOUD")
@@ -0,0 +1,78 @@
+"""
+Test the Prometheus metrics endpoint and instrumentation.
+"""
+import os
+import sys
+import subprocess
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from app.routes import metrics
+from app.utils.metrics import MetricsMiddleware
+from app.utils.tracing import span
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+def make_app():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics.router)
+
+    @app.get("/agent/{agent_id}")
+    async def get_agent(agent_id: str):
+        if agent_id == "missing":
+            raise HTTPException(status_code=404)
+        return {"id": agent_id}
+
+    return app
+
+def test_requests_counted_per_route_template():
+    """Requests are labelled by route template and status, unknown paths share a label."""
+    client = TestClient(make_app())
+    before = sample("http_requests_total", method="GET", route="/agent/{agent_id}", status="200")
+    client.get("/agent/1")
+    client.get("/agent/2")
+    client.get("/agent/missing")
+    client.get("/wp-login.php")
+
+    assert sample("http_requests_total", method="GET", route="/agent/{agent_id}", status="200") == before + 2
+    assert sample("http_requests_total", method="GET", route="/agent/{agent_id}", status="404") >= 1
+    assert sample("http_requests_total", method="GET", route="unmatched", status="404") >= 1
+    assert sample("http_request_duration_seconds_count", method="GET", route="/agent/{agent_id}") >= 3
+
+def test_external_call_spans_become_metrics():
+    """Spans of external services feed latency and error metrics."""
+    labels = {"service": "pinecone", "operation": "query"}
+    before = sample("external_call_duration_seconds_count", **labels)
+    errors = sample("external_call_errors_total", **labels)
+    with span("vector.query"):
+        pass
+    try:
+        with span("vector.query"):
+            raise ConnectionError("down")
+    except ConnectionError:
+        pass
+    with span("rerank"):
+        pass
+
+    assert sample("external_call_duration_seconds_count", **labels) == before + 2
+    assert sample("external_call_errors_total", **labels) == errors + 1
+
+def test_metrics_endpoint_serves_text_format():
+    """The scrape endpoint returns the Prometheus exposition format."""
+    response = TestClient(make_app()).get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert "http_requests_total" in response.text
+
+def test_multiprocess_aggregation(tmp_path):
+    """Counters incremented in separate worker processes are summed in one scrape."""
+    env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=str(tmp_path))
+    worker = "from app.utils.metrics import INGESTED_MESSAGES; INGESTED_MESSAGES.inc(5)"
+    for _ in range(2):
+        subprocess.run([sys.executable, "-c", worker], env=env, check=True)
+    scrape = "from app.utils.metrics import render; print(render().decode())"
+    output = subprocess.run([sys.executable, "-c", scrape], env=env, check=True,
+                            capture_output=True, text=True).stdout
+    assert "ingestion_messages_total 10.0" in output
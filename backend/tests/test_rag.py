@@ -4,6 +4,12 @@ Test the unified RAG service functionality.
 import pytest
 from unittest.mock import patch
 from app.services.rag_service import rag_retrieve_and_summarize
+from app.services.answer_cache import answer_cache
+
+@pytest.fixture(autouse=True)
+def empty_answer_cache():
+    """Tests reuse the same embeddings, so start each with an empty cache."""
+    answer_cache.invalidate()
 
 @pytest.mark.asyncio
 async def test_rag_chat_mode():
@@ -67,7 +73,7 @@ async def test_rag_search_mode():
     
     # Set up mocks
     with patch('app.services.rag_service.generate_embedding', return_value=mock_embedding), \
-         patch('app.services.rag_service.query_similar', return_value=mock_chunks), \
+         patch('app.services.rag_service.query_all_namespaces', return_value=mock_chunks), \
          patch('app.services.rag_service.generate_completion', return_value=mock_completion):
         
         # Call function
@@ -80,4 +86,89 @@ async def test_rag_search_mode():
 async def test_rag_invalid_mode():
     """Test RAG with invalid mode raises ValueError."""
     with pytest.raises(ValueError, match="Invalid mode. Must be 'chat' or 'search'"):
-        await rag_retrieve_and_summarize("test query", mode="invalid") 
\ No newline at end of file
+        await rag_retrieve_and_summarize("test query", mode="invalid") 
+@pytest.mark.asyncio
+async def test_rag_skips_llm_without_relevant_chunks():
+    """When no chunk clears the relevance bar the LLM is not called."""
+    weak_chunks = [{"id": "1", "text": "Unrelated", "metadata": {}, "score": 0.5}]
+    with patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536), \
+         patch('app.services.rag_service.query_all_namespaces', return_value=weak_chunks), \
+         patch('app.services.rag_service.generate_completion') as completion:
+        result = await rag_retrieve_and_summarize("Anything about cats?", mode="search")
+
+    assert "couldn't find any relevant information" in result
+    completion.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_rag_coalesces_identical_concurrent_queries():
+    """Identical questions asked at the same time run the pipeline once."""
+    import asyncio
+    chunks = [{"id": "1", "text": "Durov posted about TON", "metadata": {}, "score": 0.9}]
+
+    async def slow_embedding(text):
+        await asyncio.sleep(0.01)
+        return [0.1] * 1536
+
+    with patch('app.services.rag_service.generate_embedding', side_effect=slow_embedding) as embed, \
+         patch('app.services.rag_service.query_all_namespaces', return_value=chunks), \
+         patch('app.services.rag_service.generate_completion', return_value="TON news"):
+        results = await asyncio.gather(
+            rag_retrieve_and_summarize("What about TON?", mode="search"),
+            rag_retrieve_and_summarize("  what about   ton?", mode="search")
+        )
+
+    assert results == ["TON news", "TON news"]
+    assert embed.call_count == 1
+
+@pytest.mark.asyncio
+async def test_rag_sheds_to_references_when_llm_is_saturated():
+    """Questions beyond the completion queue get the references instead of waiting."""
+    import asyncio
+    from app.utils.admission import AdmissionController
+    chunks = [{"id": "1", "text": "Durov posted about TON", "metadata": {"source_link": "t.me/d/1"}, "score": 0.9}]
+    release = asyncio.Event()
+
+    async def slow_completion(prompt):
+        await release.wait()
+        return "TON news"
+
+    with patch('app.services.rag_service._llm_admission', AdmissionController(1, 0, 5)), \
+         patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536), \
+         patch('app.services.rag_service.query_all_namespaces', return_value=chunks), \
+         patch('app.services.rag_service.generate_completion', side_effect=slow_completion) as completion:
+        first = asyncio.create_task(rag_retrieve_and_summarize("What about TON?", mode="search"))
+        await asyncio.sleep(0.01)
+        shed = await rag_retrieve_and_summarize("Anything on Durov and TON?", mode="search")
+        release.set()
+
+        assert await first == "TON news"
+    assert shed.startswith("I'm receiving a lot of questions")
+    assert "Durov posted about TON (source: t.me/d/1" in shed
+    assert completion.call_count == 1
+
+@pytest.mark.asyncio
+async def test_rag_stream_yields_pieces_and_falls_back_to_references():
+    """Streamed answers arrive in pieces; a completion failing before its first piece degrades to references."""
+    from app.services.rag_service import rag_stream
+    from app.utils.errors import ServiceUnavailableError
+    chunks = [{"id": "1", "text": "Durov posted about TON", "metadata": {"source_link": "t.me/d/1"}, "score": 0.9}]
+
+    async def streamed(prompt):
+        for piece in ("TON ", "is ", "up"):
+            yield piece
+
+    async def failing(prompt):
+        raise ServiceUnavailableError("OpenAI")
+        yield  # pragma: no cover
+
+    with patch('app.services.rag_service.generate_embedding', return_value=[0.1] * 1536), \
+         patch('app.services.rag_service.query_all_namespaces', return_value=chunks):
+        with patch('app.services.rag_service.generate_completion_stream', streamed):
+            pieces = [piece async for piece in rag_stream("What about TON?", mode="search")]
+        assert pieces == ["TON ", "is ", "up"]
+
+        answer_cache.invalidate()
+        with patch('app.services.rag_service.generate_completion_stream', failing):
+            pieces = [piece async for piece in rag_stream("Durov and TON?", mode="search")]
+    assert len(pieces) == 1
+    assert "Durov posted about TON" in pieces[0]
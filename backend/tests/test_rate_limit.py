@@ -0,0 +1,191 @@
+"""
+Test per-user and per-agent chat rate limits and concurrency quotas.
+"""
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI, Form
+from app.utils import rate_limit
+from app.utils.rate_limit import (
+    RateLimiter, MemoryBackend, SqliteBackend, RateLimitMiddleware, set_rate_limiter
+)
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture(params=["memory", "sqlite"])
+def backend(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBackend()
+    return SqliteBackend(str(tmp_path / "limits.db"))
+
+def test_token_bucket_allows_burst_then_refills(backend):
+    """A user gets BURST chats at once, then one per 60/RATE seconds."""
+    clock = Clock()
+    limiter = RateLimiter(backend, user_rate_per_minute=6, user_burst=2, user_max_concurrent=0,
+                          agent_rate_per_minute=0, agent_max_concurrent=0, clock=clock)
+
+    assert limiter.admit("u1", "a1", "l1") is None
+    assert limiter.admit("u1", "a1", "l2") is None
+    rejection = limiter.admit("u1", "a1", "l3")
+    assert (rejection.scope, rejection.reason) == ("user", "rate")
+    assert rejection.retry_after == pytest.approx(10)
+    # Other users have their own bucket
+    assert limiter.admit("u2", "a1", "l4") is None
+
+    clock.now += 10
+    assert limiter.admit("u1", "a1", "l5") is None
+    assert limiter.admit("u1", "a1", "l6") is not None
+
+def test_concurrency_quota_is_held_until_release(backend):
+    """Concurrent chats beyond the quota are refused until one finishes."""
+    limiter = RateLimiter(backend, user_rate_per_minute=0, user_max_concurrent=1,
+                          agent_rate_per_minute=0, agent_max_concurrent=2, clock=Clock())
+
+    assert limiter.admit("u1", "a1", "l1") is None
+    rejection = limiter.admit("u1", "a1", "l2")
+    assert (rejection.scope, rejection.reason) == ("user", "concurrency")
+    assert limiter.admit("u2", "a1", "l3") is None
+    assert limiter.admit("u3", "a1", "l4").scope == "agent"
+
+    limiter.release("u1", "a1", "l1")
+    assert limiter.admit("u1", "a1", "l5") is None
+
+def test_rejection_takes_nothing(backend):
+    """A request refused by one limit consumes neither tokens nor slots of the others."""
+    clock = Clock()
+    limiter = RateLimiter(backend, user_rate_per_minute=60, user_burst=1, user_max_concurrent=5,
+                          agent_rate_per_minute=60, agent_burst=5, agent_max_concurrent=5, clock=clock)
+
+    assert limiter.admit("u1", "a1", "l1") is None
+    limiter.release("u1", "a1", "l1")
+    assert limiter.admit("u1", "a1", "l2").scope == "user"
+    # The refused request released its slots and left the agent bucket alone
+    for i in range(4):
+        assert limiter.admit(f"other{i}", "a1", f"m{i}") is None
+    assert limiter.admit("other9", "a1", "m9").scope == "agent"
+
+def test_sqlite_state_is_shared_between_workers(tmp_path):
+    """Two backends on the same database see each other's slots, like two gunicorn workers."""
+    path = str(tmp_path / "limits.db")
+    first = RateLimiter(SqliteBackend(path), user_rate_per_minute=0, user_max_concurrent=1,
+                        agent_max_concurrent=0, clock=Clock())
+    second = RateLimiter(SqliteBackend(path), user_rate_per_minute=0, user_max_concurrent=1,
+                         agent_max_concurrent=0, clock=Clock())
+
+    assert first.admit("u1", "a1", "l1") is None
+    assert second.admit("u1", "a1", "l2").reason == "concurrency"
+    first.release("u1", "a1", "l1")
+    assert second.admit("u1", "a1", "l2") is None
+
+def test_expired_slots_are_reclaimed(backend):
+    """Slots of a worker that died without releasing expire after the TTL."""
+    clock = Clock()
+    backend.slot_ttl = 30
+    limiter = RateLimiter(backend, user_rate_per_minute=0, user_max_concurrent=1,
+                          agent_max_concurrent=0, clock=clock)
+
+    assert limiter.admit("u1", "a1", "l1") is None
+    assert limiter.admit("u1", "a1", "l2") is not None
+    clock.now += 31
+    assert limiter.admit("u1", "a1", "l2") is None
+
+@pytest.fixture
+def chat_app():
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware)
+    release = asyncio.Event()
+
+    @app.post("/agent/{agent_id}/chat")
+    async def chat(agent_id: str, message: str = Form(...), user_id: str = Form(...)):
+        if message == "slow":
+            await release.wait()
+        return {"agent_id": agent_id, "user_id": user_id, "message": message}
+
+    @app.get("/agent/list")
+    async def list_agents():
+        return []
+
+    app.state.release = release
+    yield app
+    set_rate_limiter(None)
+
+@pytest.mark.asyncio
+async def test_middleware_rejects_with_retry_after(chat_app):
+    """Over-limit chats get 429 with Retry-After; the form still reaches the route."""
+    set_rate_limiter(RateLimiter(MemoryBackend(), user_rate_per_minute=60, user_burst=2,
+                                 agent_rate_per_minute=0, agent_max_concurrent=0))
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for _ in range(2):
+            response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+            assert response.status_code == 200
+            assert response.json() == {"agent_id": "a1", "user_id": "u1", "message": "hi"}
+
+        response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+        assert response.status_code == 429
+        assert response.headers["retry-after"] == "1"
+        assert response.json()["scope"] == "user"
+
+        # Multipart forms identify the user too; other routes are not limited
+        response = await client.post("/agent/a1/chat", files={"message": (None, "hi"), "user_id": (None, "u2")})
+        assert response.status_code == 200
+        for _ in range(5):
+            assert (await client.get("/agent/list")).status_code == 200
+
+@pytest.mark.asyncio
+async def test_middleware_limits_concurrent_chats(chat_app):
+    """A user's second concurrent chat is refused at once, not queued."""
+    set_rate_limiter(RateLimiter(MemoryBackend(), user_rate_per_minute=0, user_max_concurrent=1,
+                                 agent_rate_per_minute=0, agent_max_concurrent=0))
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        slow = asyncio.create_task(client.post("/agent/a1/chat", data={"message": "slow", "user_id": "u1"}))
+        await asyncio.sleep(0.05)
+
+        response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+        assert response.status_code == 429
+        assert response.json()["reason"] == "concurrency"
+
+        chat_app.state.release.set()
+        assert (await slow).status_code == 200
+        response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+        assert response.status_code == 200
+
+@pytest.mark.asyncio
+async def test_middleware_limits_the_user_the_route_answers(chat_app):
+    """A different X-User-Id or user_id query parameter per request does not escape the form user's limit."""
+    set_rate_limiter(RateLimiter(MemoryBackend(), user_rate_per_minute=60, user_burst=2,
+                                 agent_rate_per_minute=0, agent_max_concurrent=0))
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        statuses = [
+            (await client.post(f"/agent/a1/chat?user_id=q{i}", headers={"X-User-Id": f"h{i}"},
+                               data={"message": "hi", "user_id": "u1"})).status_code
+            for i in range(3)
+        ]
+    assert statuses == [200, 200, 429]
+
+@pytest.mark.asyncio
+async def test_middleware_admits_when_backend_fails(chat_app):
+    """A broken backend must not take chat down."""
+    class BrokenBackend(MemoryBackend):
+        def acquire(self, quotas, lease, now):
+            raise RuntimeError("database is locked")
+
+    set_rate_limiter(RateLimiter(BrokenBackend()))
+    transport = httpx.ASGITransport(app=chat_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        response = await client.post("/agent/a1/chat", data={"message": "hi", "user_id": "u1"})
+        assert response.status_code == 200
+
+def test_disabled_limits_are_skipped():
+    """Limits set to 0 are not enforced."""
+    limiter = RateLimiter(MemoryBackend(), user_rate_per_minute=0, user_max_concurrent=0,
+                          agent_rate_per_minute=0, agent_max_concurrent=0)
+    assert all(limiter.admit("u1", "a1", f"l{i}") is None for i in range(100))
+    assert rate_limit.create_backend("memory").__class__ is MemoryBackend
@@ -0,0 +1,59 @@
+"""
+Test MMR diversification of retrieved chunks.
+"""
+import numpy as np
+from app.services.reranking import mmr_select, relevance_cutoff, hybrid_relevance_cutoff
+
+def chunk(id_: str, values: list, text: str = "short text") -> dict:
+    return {"id": id_, "text": text, "values": values}
+
+QUERY = [1.0, 0.0, 0.0]
+
+def test_near_duplicates_are_skipped():
+    """A near-copy of the best chunk loses to a less similar but distinct one."""
+    chunks = [
+        chunk("best", [0.95, 0.31, 0.0]),
+        chunk("copy", [0.94, 0.34, 0.0]),
+        chunk("other", [0.8, 0.0, 0.6]),
+    ]
+    selected = mmr_select(QUERY, chunks, max_items=2, lambda_mult=0.5, token_budget=None)
+    assert [c["id"] for c in selected] == ["best", "other"]
+
+def test_lambda_one_is_plain_relevance_order():
+    """Without the diversity term MMR keeps relevance order."""
+    chunks = [chunk("b", [0.8, 0.6, 0.0]), chunk("a", [1.0, 0.0, 0.0]), chunk("c", [0.0, 1.0, 0.0])]
+    selected = mmr_select(QUERY, chunks, max_items=3, lambda_mult=1.0, token_budget=None)
+    assert [c["id"] for c in selected] == ["a", "b", "c"]
+
+def test_token_budget_skips_chunks_that_do_not_fit():
+    """A chunk over the remaining budget is skipped for smaller ones."""
+    chunks = [
+        chunk("long", [1.0, 0.0, 0.0], text="x" * 400),
+        chunk("small", [0.0, 1.0, 0.0], text="x" * 40),
+    ]
+    selected = mmr_select(QUERY, chunks, max_items=2, token_budget=50)
+    assert [c["id"] for c in selected] == ["small"]
+
+def test_explicit_relevance_and_missing_values():
+    """Given relevance scores override cosine; chunks without values still rank."""
+    chunks = [chunk("dense", [1.0, 0.0, 0.0]), {"id": "lexical", "text": "t", "values": None}]
+    selected = mmr_select(QUERY, chunks, max_items=2, relevance=[0.01, 0.03], token_budget=None)
+    assert [c["id"] for c in selected] == ["lexical", "dense"]
+
+def test_relevance_cutoff_threshold_and_elbow():
+    """Weak chunks are dropped and the tail after a clear score drop is cut."""
+    scored = lambda *scores: [{"id": str(i), "score": s} for i, s in enumerate(scores)]
+    assert [c["id"] for c in relevance_cutoff(scored(0.80, 0.91, 0.70), min_gap=0)] == ["1", "0"]
+    assert [c["id"] for c in relevance_cutoff(scored(0.92, 0.90, 0.81, 0.80), min_score=0.75, min_gap=0.05)] == ["0", "1"]
+    assert relevance_cutoff(scored(0.70, 0.60), min_score=0.75) == []
+
+def test_hybrid_cutoff_keeps_strong_lexical_hits_in_fused_order():
+    """A BM25-only hit with no cosine score survives; fused order is not re-sorted by cosine."""
+    fused = [
+        {"id": "lexical", "score": 0.0, "lexical_score": 9.0},
+        {"id": "both", "score": 0.80, "lexical_score": 6.0},
+        {"id": "dense", "score": 0.90, "lexical_score": 0.0},
+        {"id": "weak", "score": 0.70, "lexical_score": 1.0},
+    ]
+    assert [c["id"] for c in hybrid_relevance_cutoff(fused, min_gap=0)] == ["lexical", "both", "dense"]
+    assert hybrid_relevance_cutoff([{"id": "x", "score": 0.6, "lexical_score": 0.0}]) == []
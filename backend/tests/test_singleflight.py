@@ -0,0 +1,110 @@
+"""
+Test coalescing of identical concurrent calls.
+"""
+import asyncio
+import pytest
+from app.utils.singleflight import SingleFlight
+from app.utils.deadline import deadline_scope, current_deadline
+from app.utils.errors import DeadlineExceeded
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_share_one_execution():
+    """Callers with the same key get the result of a single call."""
+    flight = SingleFlight()
+    calls = 0
+
+    async def work():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    results = await asyncio.gather(*(flight.do("k", work) for _ in range(5)), flight.do("other", work))
+    assert results == ["answer"] * 6
+    assert calls == 2
+    assert flight.in_flight() == 0
+
+    # Once finished, the next call runs again
+    await flight.do("k", work)
+    assert calls == 3
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_caller():
+    """An exception from the shared call is raised in all waiting callers."""
+    flight = SingleFlight()
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+    assert all(isinstance(r, ValueError) for r in results)
+
+@pytest.mark.asyncio
+async def test_cancelling_one_caller_keeps_work_for_others():
+    """Only when the last caller is cancelled is the shared work cancelled."""
+    flight = SingleFlight()
+    started, cancelled = asyncio.Event(), asyncio.Event()
+
+    async def work():
+        started.set()
+        try:
+            await asyncio.sleep(0.05)
+            return "done"
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    first = asyncio.create_task(flight.do("k", work))
+    second = asyncio.create_task(flight.do("k", work))
+    await started.wait()
+    first.cancel()
+    assert await second == "done"
+    assert first.cancelled()
+
+    lonely = asyncio.create_task(flight.do("k", work))
+    await asyncio.sleep(0.01)
+    lonely.cancel()
+    await asyncio.sleep(0.01)
+    assert cancelled.is_set()
+    assert flight.in_flight() == 0
+
+@pytest.mark.asyncio
+async def test_each_caller_keeps_its_own_deadline():
+    """A caller with a short deadline gives up alone; the shared call runs without it."""
+    flight = SingleFlight()
+    seen = []
+
+    async def work():
+        seen.append(current_deadline())
+        await asyncio.sleep(0.1)
+        return "answer"
+
+    async def call(timeout):
+        with deadline_scope(timeout):
+            return await flight.do("k", work)
+
+    results = await asyncio.gather(call(0.02), call(5), call(None), return_exceptions=True)
+    assert isinstance(results[0], DeadlineExceeded)
+    assert results[1:] == ["answer", "answer"]
+    assert seen == [None]
+    assert flight.in_flight() == 0
+
+@pytest.mark.asyncio
+async def test_last_caller_past_deadline_cancels_the_call():
+    """When every caller has run out of time, nobody is left to wait for the work."""
+    flight = SingleFlight()
+    cancelled = asyncio.Event()
+
+    async def work():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.set()
+            raise
+
+    with deadline_scope(0.02):
+        with pytest.raises(DeadlineExceeded):
+            await flight.do("k", work)
+    await asyncio.wait_for(cancelled.wait(), 1)
+    assert flight.in_flight() == 0
@@ -0,0 +1,94 @@
+"""
+Test per-stage tracing and the Server-Timing header.
+"""
+import json
+import asyncio
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.utils import tracing
+from app.utils.tracing import (
+    span, traced, start_trace, server_timing, JsonlExporter, SpanExporter, TracingMiddleware
+)
+
+class RecordingExporter(SpanExporter):
+    def __init__(self):
+        self.traces = []
+
+    def export(self, trace):
+        self.traces.append(trace)
+
+@pytest.fixture
+def exporter():
+    recorder = RecordingExporter()
+    previous = tracing._exporter
+    tracing.set_exporter(recorder)
+    yield recorder
+    tracing.set_exporter(previous)
+
+@pytest.mark.asyncio
+async def test_spans_nest_across_tasks(exporter):
+    """Spans in concurrent tasks share the trace and point at their parent."""
+    @traced("child")
+    async def child():
+        await asyncio.sleep(0.01)
+
+    with start_trace("request") as trace:
+        with span("parent", agent="a") as parent:
+            await asyncio.gather(child(), child())
+
+    assert [s.name for s in trace.spans] == ["child", "child", "parent"]
+    assert all(s.parent_id == parent.span_id for s in trace.spans[:2])
+    assert parent.attributes == {"agent": "a"}
+    assert trace.durations()["child"] >= 20
+    # Traces opened with start_trace are exported by their owner
+    assert exporter.traces == []
+
+def test_root_span_exports_its_own_trace(exporter):
+    """A span outside any trace is exported when it ends, with errors recorded."""
+    with pytest.raises(ValueError):
+        with span("ingest"):
+            raise ValueError("boom")
+    [trace] = exporter.traces
+    assert trace.spans[0].error == "ValueError: boom"
+    assert trace.spans[0].to_dict()["status"]["code"] == "ERROR"
+
+def test_server_timing_sums_spans_by_name():
+    """Repeated stages are summed into one Server-Timing metric."""
+    with start_trace("request") as trace:
+        for _ in range(2):
+            with span("supabase.save_message"):
+                pass
+    trace.spans[0].duration_ms = 1.25
+    trace.spans[1].duration_ms = 2.0
+    assert server_timing(trace) == "supabase.save_message;dur=3.2"
+
+def test_jsonl_exporter_writes_otel_fields(tmp_path):
+    """Each span becomes one JSON line with OpenTelemetry field names."""
+    path = tmp_path / "traces.jsonl"
+    with start_trace("request") as trace:
+        with span("embed"):
+            pass
+    JsonlExporter(str(path)).export(trace)
+    record = json.loads(path.read_text().strip())
+    assert record["name"] == "embed"
+    assert record["traceId"] == trace.trace_id
+    assert record["endTimeUnixNano"] >= record["startTimeUnixNano"]
+
+def test_middleware_adds_server_timing_header(exporter):
+    """Responses carry the request's stage timings and the trace is exported once."""
+    app = FastAPI()
+    app.add_middleware(TracingMiddleware)
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        with span("db"):
+            pass
+        return {"id": item_id}
+
+    response = TestClient(app).get("/items/1")
+    header = response.headers["server-timing"]
+    assert header.startswith("db;dur=")
+    assert "total;dur=" in header
+    [trace] = exporter.traces
+    assert trace.name == "GET /items/{item_id}"
@@ -0,0 +1,108 @@
+"""
+Test the in-process NumPy vector store.
+"""
+import numpy as np
+import pytest
+from unittest.mock import patch
+from app.services.vector_store import NumpyVectorStore, matches_filter
+from app.services.pinecone_service import delete_vectors
+
+DIMENSION = 8
+
+def make_vector(seed: int) -> list:
+    """Deterministic random vector for a seed."""
+    return np.random.default_rng(seed).normal(size=DIMENSION).tolist()
+
+@pytest.fixture
+def store():
+    """Store with two agents and a few records each."""
+    store = NumpyVectorStore(DIMENSION)
+    store.upsert([
+        {"id": f"a#{i}", "values": make_vector(i), "metadata": {"agent_id": "a", "views": i}}
+        for i in range(5)
+    ] + [
+        {"id": f"b#{i}", "values": make_vector(100 + i), "metadata": {"agent_id": "b", "views": i}}
+        for i in range(5)
+    ])
+    return store
+
+def test_query_returns_exact_match_first(store):
+    """The stored vector itself should be the best match with score ~1."""
+    results = store.query(make_vector(3), top_k=3)
+    assert results[0]["id"] == "a#3"
+    assert results[0]["score"] == pytest.approx(1.0, abs=1e-5)
+    assert len(results) == 3
+    assert [r["score"] for r in results] == sorted((r["score"] for r in results), reverse=True)
+
+def test_query_filters_by_agent(store):
+    """An agent_id filter should only return that agent's records."""
+    results = store.query(make_vector(3), top_k=10, filter={"agent_id": "b"})
+    assert len(results) == 5
+    assert all(r["metadata"]["agent_id"] == "b" for r in results)
+
+def test_query_with_metadata_operators(store):
+    """Range filters are applied on top of the agent partition."""
+    results = store.query(make_vector(0), top_k=10, filter={"agent_id": "a", "views": {"$gte": 3}})
+    assert sorted(r["id"] for r in results) == ["a#3", "a#4"]
+
+def test_upsert_overwrites_existing_id(store):
+    """Upserting an existing ID replaces its vector instead of duplicating it."""
+    store.upsert([{"id": "a#0", "values": make_vector(42), "metadata": {"agent_id": "a", "views": 0}}])
+    assert store.count() == 10
+    assert store.query(make_vector(42), top_k=1)[0]["id"] == "a#0"
+
+def test_include_values_and_fetch(store):
+    """Values come back unit-normalized from queries and fetches."""
+    result = store.query(make_vector(3), top_k=1, include_values=True)[0]
+    expected = np.asarray(make_vector(3)) / np.linalg.norm(make_vector(3))
+    assert np.allclose(result["values"], expected, atol=1e-6)
+    fetched = store.fetch(["a#3", "missing"])
+    assert list(fetched) == ["a#3"]
+    assert np.allclose(fetched["a#3"], expected, atol=1e-6)
+
+def test_delete_and_delete_by_filter(store):
+    """Deleted records disappear from results."""
+    store.delete(["a#3", "missing"])
+    assert "a#3" not in [r["id"] for r in store.query(make_vector(3), top_k=10)]
+
+    store.delete_by_filter({"agent_id": "b"})
+    assert store.query(make_vector(100), top_k=10, filter={"agent_id": "b"}) == []
+    assert store.count() == 4
+
+def test_persistence_round_trip(tmp_path):
+    """A store with a path reloads its vectors on startup."""
+    store = NumpyVectorStore(DIMENSION, path=str(tmp_path))
+    store.upsert([{"id": "a#1", "values": make_vector(1), "metadata": {"agent_id": "a", "text": "hi"}}])
+
+    reloaded = NumpyVectorStore(DIMENSION, path=str(tmp_path))
+    results = reloaded.query(make_vector(1), top_k=1)
+    assert results[0]["id"] == "a#1"
+    assert results[0]["metadata"]["text"] == "hi"
+
+def test_namespaces_are_isolated():
+    """Queries and deletes only touch the given namespace."""
+    store = NumpyVectorStore(DIMENSION)
+    record = {"id": "x#1", "values": make_vector(1), "metadata": {"agent_id": "x"}}
+    store.upsert([record], namespace="agent-x")
+    store.upsert([record], namespace="agent-y")
+
+    assert sorted(store.list_namespaces()) == ["agent-x", "agent-y"]
+    store.delete_namespace("agent-x")
+    assert store.query(make_vector(1), top_k=1, namespace="agent-x") == []
+    assert store.query(make_vector(1), top_k=1, namespace="agent-y")[0]["id"] == "x#1"
+
+@pytest.mark.asyncio
+async def test_delete_vectors_finds_agent_namespaces_from_ids():
+    """Deleting by ID without a namespace reaches each agent's namespace and legacy vectors."""
+    store = NumpyVectorStore(DIMENSION)
+    store.upsert([{"id": "x#1", "values": make_vector(1), "metadata": {"agent_id": "x"}}], namespace="agent-x")
+    store.upsert([{"id": "y#1", "values": make_vector(2), "metadata": {"agent_id": "y"}}], namespace="")
+    with patch('app.services.pinecone_service.store', store):
+        assert await delete_vectors(["x#1", "y#1"])
+    assert store.count() == 0
+
+def test_matches_filter_combinators():
+    """$and/$or/$in combinators follow Pinecone semantics."""
+    metadata = {"agent_id": "a", "views": 10}
+    assert matches_filter(metadata, {"$or": [{"views": {"$gt": 100}}, {"agent_id": {"$in": ["a"]}}]})
+    assert not matches_filter(metadata, {"$and": [{"agent_id": "a"}, {"views": {"$lt": 5}}]})